@@ -637,12 +637,14 @@ scale_dot_product_for_indirect_access_kv_cache(
                       false,
                       nullptr);
                 } else {
-                  kc_t_beam_start = kc_t_beam_start +
-                      new_beam_idx[bi][ti] * kv_head * head_size;
-                  if (cur_len > 1) {
+                  if (cur_len > 1) { // the past tokens of a chunk of the prompt
+                                     // are stored to the first beam
                     auto beam_size = beam_batch / bs;
                     kc_t_beam_start =
                         kc_t_beam_start + bi * beam_size * kv_head * head_size;
+                  } else {
+                    kc_t_beam_start = kc_t_beam_start +
+                        new_beam_idx[bi][ti] * kv_head * head_size;
                   }
                   auto kc_head_start =
                       k_cache_ptr + kc_t_beam_start + kv_hi * head_size;
@@ -796,12 +798,15 @@ scale_dot_product_for_indirect_access_kv_cache(
                       nullptr,
                       flag_access[thread_id][bi][hi]);
                 } else {
-                  auto vc_t_beam_start = vc_token_start +
-                      new_beam_idx[bi][vi] * kv_head * head_size;
-                  if (cur_len > 1) {
+                  auto vc_t_beam_start = vc_token_start;
+                  if (cur_len > 1) { // the past tokens of a chunk of the prompt
+                                     // are stored to the first beam
                     auto beam_size = beam_batch / bs;
                     vc_t_beam_start =
                         vc_t_beam_start + bi * beam_size * kv_head * head_size;
+                  } else {
+                    vc_t_beam_start = vc_t_beam_start +
+                        new_beam_idx[bi][vi] * kv_head * head_size;
                   }
                   auto v_cache_head_start =
                       v_cache_ptr + vc_t_beam_start + kv_hi * head_size;
@@ -978,12 +983,14 @@ scale_dot_product_for_indirect_access_kv_cache_half(
                     false,
                     nullptr);
               } else {
-                kc_t_beam_start = kc_t_beam_start +
-                    new_beam_idx[bi][ti] * kv_head * head_size;
-                if (cur_len > 1) {
+                if (cur_len > 1) { // the past tokens of a chunk of the prompt
+                                   // are stored to the first beam
                   auto beam_size = beam_batch / bs;
                   kc_t_beam_start =
                       kc_t_beam_start + bi * beam_size * kv_head * head_size;
+                } else {
+                  kc_t_beam_start = kc_t_beam_start +
+                      new_beam_idx[bi][ti] * kv_head * head_size;
                 }
                 auto kc_head_start =
                     k_cache_ptr + kc_t_beam_start + kv_hi * head_size;
@@ -1106,12 +1113,15 @@ scale_dot_product_for_indirect_access_kv_cache_half(
                     nullptr,
                     flag_access[thread_id][bi][hi]);
               } else {
-                auto vc_t_beam_start =
-                    vc_token_start + new_beam_idx[bi][vi] * kv_head * head_size;
-                if (cur_len > 1) {
+                auto vc_t_beam_start = vc_token_start;
+                if (cur_len > 1) { // the past tokens of a chunk of the prompt
+                                   // are stored to the first beam
                   auto beam_size = beam_batch / bs;
                   vc_t_beam_start =
                       vc_t_beam_start + bi * beam_size * kv_head * head_size;
+                } else {
+                  vc_t_beam_start = vc_t_beam_start +
+                      new_beam_idx[bi][vi] * kv_head * head_size;
                 }
                 auto v_cache_head_start =
                     v_cache_ptr + vc_t_beam_start + kv_hi * head_size;
@@ -1424,6 +1434,10 @@ masked_multihead_self_attention_kernel_impl(
     }
   } else if (offset > 0 && offset + cur_len > cache_size) {
     auto new_cache_size = cache_size * 2;
+    // a chunk of the prompt may need more than twice the cache
+    while (offset + cur_len > new_cache_size) {
+      new_cache_size *= 2;
+    }
     auto new_key_cache = at::empty(
         {new_cache_size, beam_batch, key.size(2), key.size(3)}, key.options());
     auto new_value_cache = at::empty(
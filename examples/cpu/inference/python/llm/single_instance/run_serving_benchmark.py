@@ -0,0 +1,293 @@
+import argparse
+import json
+import pathlib
+import random
+import time
+
+import torch
+from transformers import AutoConfig, AutoModelForCausalLM, LlamaConfig
+from transformers.generation.streamers import BaseStreamer
+
+# args
+parser = argparse.ArgumentParser(
+    "Serving benchmark replaying a request trace (fp32/bf16 path)", add_help=False
+)
+parser.add_argument(
+    "-m",
+    "--model-id",
+    type=str,
+    default=None,
+    help="the huggingface model id, by default a tiny random-weight llama model "
+    "is used so that the benchmark runs offline",
+)
+parser.add_argument(
+    "--config-file",
+    default=None,
+    type=str,
+    help="build a random-weight model from this configuration instead of "
+    "loading --model-id weights",
+)
+parser.add_argument(
+    "--dtype",
+    type=str,
+    choices=["float32", "bfloat16"],
+    default="bfloat16",
+    help="bfloat16, float32",
+)
+parser.add_argument("--ipex", action="store_true")
+parser.add_argument("--deployment-mode", action="store_true")
+parser.add_argument(
+    "--trace",
+    default=str(pathlib.Path(__file__).parent.resolve() / "serving_trace.json"),
+    type=str,
+    help="JSON (list) or JSON lines file of requests with 'input_len', "
+    "'output_len' and optionally 'arrival_time' (seconds). Without arrival "
+    "times, requests arrive as a Poisson process of --request-rate",
+)
+parser.add_argument(
+    "--num-requests",
+    default=None,
+    type=int,
+    help="number of requests to replay, sampled from the trace length "
+    "distribution, default is the whole trace",
+)
+parser.add_argument(
+    "--request-rate",
+    default=1.0,
+    type=float,
+    help="Poisson arrival rate in requests/s, inf sends all requests at once",
+)
+parser.add_argument(
+    "--max-batch-size", default=4, type=int, help="max requests per batch"
+)
+parser.add_argument(
+    "--slo-ttft", default=1000.0, type=float, help="TTFT SLO for goodput in ms"
+)
+parser.add_argument(
+    "--slo-tpot", default=200.0, type=float, help="TPOT SLO for goodput in ms"
+)
+parser.add_argument("--seed", default=0, type=int)
+parser.add_argument("--output", default=None, type=str, help="save results as JSON")
+args = parser.parse_args()
+print(args)
+
+if args.ipex:
+    import intel_extension_for_pytorch as ipex
+
+    torch._C._jit_set_texpr_fuser_enabled(False)
+    try:
+        ipex._C.disable_jit_linear_repack()
+    except Exception:
+        pass
+
+random.seed(args.seed)
+torch.manual_seed(args.seed)
+amp_enabled = True if args.dtype != "float32" else False
+amp_dtype = getattr(torch, args.dtype)
+
+
+def load_trace(path, num_requests, request_rate):
+    with open(path) as f:
+        content = f.read().strip()
+    if content.startswith("["):
+        records = json.loads(content)
+    else:
+        records = [json.loads(line) for line in content.splitlines() if line.strip()]
+    if num_requests is not None and num_requests != len(records):
+        # draw the prompt/output lengths from the trace distribution
+        records = [dict(random.choice(records)) for _ in range(num_requests)]
+        for r in records:
+            r.pop("arrival_time", None)
+    requests = []
+    arrival = 0.0
+    for r in records:
+        if "arrival_time" in r:
+            arrival = float(r["arrival_time"])
+        elif request_rate != float("inf"):
+            arrival += random.expovariate(request_rate)
+        requests.append(
+            {
+                "input_len": int(r["input_len"]),
+                "output_len": max(1, int(r["output_len"])),
+                "arrival": arrival,
+            }
+        )
+    return sorted(requests, key=lambda r: r["arrival"])
+
+
+requests = load_trace(args.trace, args.num_requests, args.request_rate)
+max_total_len = max(r["input_len"] + r["output_len"] for r in requests)
+
+# load model
+if args.model_id is not None and args.config_file is None:
+    config = AutoConfig.from_pretrained(args.model_id, trust_remote_code=True)
+elif args.config_file is not None:
+    config = AutoConfig.from_pretrained(args.config_file, trust_remote_code=True)
+else:
+    # tiny random-weight model for CI and offline runs
+    config = LlamaConfig(
+        vocab_size=1024,
+        hidden_size=128,
+        intermediate_size=256,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        max_position_embeddings=max(2048, max_total_len),
+    )
+if not hasattr(config, "text_max_length"):
+    config.text_max_length = max_total_len
+if args.model_id is not None and args.config_file is None:
+    model = AutoModelForCausalLM.from_pretrained(
+        args.model_id,
+        torch_dtype=amp_dtype,
+        config=config,
+        low_cpu_mem_usage=True,
+        trust_remote_code=True,
+    )
+else:
+    model = AutoModelForCausalLM.from_config(config, trust_remote_code=True).to(
+        amp_dtype
+    )
+model = model.eval()
+if args.ipex:
+    model = ipex.llm.optimize(
+        model,
+        dtype=amp_dtype,
+        inplace=True,
+        deployment_mode=args.deployment_mode,
+    )
+
+vocab_size = config.vocab_size
+pad_token_id = 0
+
+
+class TokenTimer(BaseStreamer):
+    # records the time every generation step emits tokens, the first put is
+    # the prompt
+    def __init__(self):
+        self.times = []
+        self.prompt_seen = False
+
+    def put(self, value):
+        if not self.prompt_seen:
+            self.prompt_seen = True
+            return
+        self.times.append(time.perf_counter())
+
+    def end(self):
+        pass
+
+
+def generate(batch):
+    # left-pad the prompts of the batch, every request runs until the
+    # longest output of the batch but finishes at its own output length
+    max_input_len = max(r["input_len"] for r in batch)
+    input_ids = torch.full((len(batch), max_input_len), pad_token_id)
+    attention_mask = torch.zeros((len(batch), max_input_len), dtype=torch.long)
+    for i, r in enumerate(batch):
+        input_ids[i, max_input_len - r["input_len"] :] = torch.randint(
+            1, vocab_size, (r["input_len"],)
+        )
+        attention_mask[i, max_input_len - r["input_len"] :] = 1
+    max_new_tokens = max(r["output_len"] for r in batch)
+    timer = TokenTimer()
+    model.generate(
+        input_ids,
+        attention_mask=attention_mask,
+        do_sample=False,
+        num_beams=1,
+        max_new_tokens=max_new_tokens,
+        min_new_tokens=max_new_tokens,
+        pad_token_id=pad_token_id,
+        streamer=timer,
+    )
+    return timer.times
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+
+def serve(requests):
+    # Replays the trace in real time: requests are queued at their arrival
+    # time and a batch of up to max_batch_size queued requests is generated
+    # whenever the model is idle.
+    pending = list(requests)
+    queue = []
+    start = time.perf_counter()
+    while pending or queue:
+        now = time.perf_counter() - start
+        while pending and pending[0]["arrival"] <= now:
+            queue.append(pending.pop(0))
+        if not queue:
+            time.sleep(max(0.0, pending[0]["arrival"] - now))
+            continue
+        batch, queue = queue[: args.max_batch_size], queue[args.max_batch_size :]
+        token_times = generate(batch)
+        for r in batch:
+            times = [t - start for t in token_times[: r["output_len"]]]
+            r["ttft"] = times[0] - r["arrival"]
+            r["latency"] = times[-1] - r["arrival"]
+            r["tpot"] = (
+                (times[-1] - times[0]) / (r["output_len"] - 1)
+                if r["output_len"] > 1
+                else 0.0
+            )
+            r["batch_size"] = len(batch)
+    return time.perf_counter() - start
+
+
+def report(requests, duration):
+    num_cores = torch.get_num_threads()
+    output_tokens = sum(r["output_len"] for r in requests)
+    input_tokens = sum(r["input_len"] for r in requests)
+    good = [
+        r
+        for r in requests
+        if r["ttft"] * 1e3 <= args.slo_ttft and r["tpot"] * 1e3 <= args.slo_tpot
+    ]
+    results = {
+        "num_requests": len(requests),
+        "duration_s": duration,
+        "request_rate": args.request_rate,
+        "max_batch_size": args.max_batch_size,
+        "num_cores": num_cores,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "throughput_requests_per_s": len(requests) / duration,
+        "output_tokens_per_s": output_tokens / duration,
+        "output_tokens_per_s_per_core": output_tokens / duration / num_cores,
+        "goodput_requests_per_s": len(good) / duration,
+        "slo_attainment": len(good) / len(requests),
+    }
+    for name in ["ttft", "tpot", "latency"]:
+        values = [r[name] * 1e3 for r in requests]
+        results[f"{name}_mean_ms"] = sum(values) / len(values)
+        results[f"{name}_p50_ms"] = percentile(values, 50)
+        results[f"{name}_p99_ms"] = percentile(values, 99)
+    print("---- Serving benchmark results")
+    for k, v in results.items():
+        print(f"{k:<32} {v:.4f}" if isinstance(v, float) else f"{k:<32} {v}")
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"args": vars(args), "results": results, "requests": requests}, f)
+    return results
+
+
+with torch.inference_mode(), torch.no_grad(), torch.cpu.amp.autocast(
+    enabled=amp_enabled
+):
+    # warmup the prefill and decode paths before replaying the trace
+    generate(
+        [
+            {"input_len": r["input_len"], "output_len": 2}
+            for r in requests[: args.max_batch_size]
+        ]
+    )
+    duration = serve(requests)
+report(requests, duration)
@@ -162,6 +162,8 @@ class TritonPythonModel:
         self.batches = []
         self.dynamic_shape = True
         self.bfloat16 = False
+        self.num_streams = 1
+        self.max_seq_length = 512
         parameters = self.model_config["parameters"]
 
         if "origin" in parameters:
@@ -178,6 +180,14 @@ class TritonPythonModel:
         if "bfloat16" in parameters:
             self.bfloat16 = json.loads(parameters["bfloat16"]["string_value"])
 
+        if "num_streams" in parameters:
+            self.num_streams = json.loads(parameters["num_streams"]["string_value"])
+
+        if "max_seq_length" in parameters:
+            self.max_seq_length = json.loads(
+                parameters["max_seq_length"]["string_value"]
+            )
+
         self.models_cpu = dict()
         # Dynamic shapes supported in fp32/bf6 mode for PyTorch+IPEX
         if self.dynamic_shape:
@@ -185,6 +195,20 @@ class TritonPythonModel:
             self.models_cpu[0] = make_model(
                 origin, input_shape, self.device, self.bfloat16
             )
+            # Requests are gathered into preallocated NUMA local buffers and
+            # run on a MultiStreamModule without per-request allocations.
+            self.adapter = ipex.cpu.runtime.ServingAdapter(
+                self.models_cpu[0],
+                {
+                    "INPUT0": (
+                        (seq_length if seq_length > 0 else self.max_seq_length,),
+                        torch.int64,
+                    )
+                },
+                max_batch_size=max(self.model_config.get("max_batch_size", 0), 1),
+                num_streams=self.num_streams,
+                cpu_pool=ipex.cpu.runtime.CPUPool(),
+            )
 
         else:
             if seq_length <= 0:
@@ -222,24 +246,39 @@ class TritonPythonModel:
           A list of pb_utils.InferenceResponse. The length of this list must
           be the same as `requests`
         """
-        # Make the list of inputs in form of torch.Tensor
-        inputs = []
-        for request in requests:
-            # Get INPUT0
-            in_0 = pb_utils.get_input_tensor_by_name(request, "INPUT0").to_dlpack()
-            in_0_cpu = dlpack.from_dlpack(in_0).to(self.device)
-            inputs.append(in_0_cpu)
-
-        outputs = execute_model(
-            self.models_cpu, inputs, self.batches, self.dynamic_shape, self.bfloat16
-        )
+        if self.dynamic_shape:
+            # The adapter reads the DLPack capsules without copies
+            with torch.cpu.amp.autocast(enabled=self.bfloat16):
+                outputs = self.adapter(
+                    [
+                        {
+                            "INPUT0": pb_utils.get_input_tensor_by_name(
+                                request, "INPUT0"
+                            ).to_dlpack()
+                        }
+                        for request in requests
+                    ]
+                )
+            outputs = [output[1] for output in outputs]
+        else:
+            # Make the list of inputs in form of torch.Tensor
+            inputs = []
+            for request in requests:
+                # Get INPUT0
+                in_0 = pb_utils.get_input_tensor_by_name(request, "INPUT0").to_dlpack()
+                in_0_cpu = dlpack.from_dlpack(in_0).to(self.device)
+                inputs.append(in_0_cpu)
+
+            outputs = execute_model(
+                self.models_cpu, inputs, self.batches, self.dynamic_shape, self.bfloat16
+            )
 
         # Convert model outputs to triton responses
         responses = []
         for cur_bert_output in outputs:
-            pooler_output = cur_bert_output.cpu().detach().numpy()
+            pooler_output = cur_bert_output.float().detach().numpy()
             out_tensor_0 = pb_utils.Tensor(
-                "OUTPUT0", pooler_output.astype(self.output0_dtype)
+                "OUTPUT0", pooler_output.astype(self.output0_dtype, copy=False)
             )
 
             inference_response = pb_utils.InferenceResponse(
@@ -254,4 +293,7 @@ class TritonPythonModel:
         Implementing `finalize` function is optional. This function allows
         the model to perform any necessary clean ups before exit.
         """
+        if self.dynamic_shape:
+            # Latency of the gather, compute and scatter stages in ms
+            print(self.adapter.get_timing())
         print("Cleaning up...")
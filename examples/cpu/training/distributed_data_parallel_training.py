@@ -8,6 +8,9 @@ import intel_extension_for_pytorch as ipex
 LR = 0.001
 DOWNLOAD = True
 DATA = "datasets/cifar10/"
+# reduce the gradients in buckets overlapped with backward, the last bucket
+# fused with the optimizer step, instead of DistributedDataParallel
+GRAD_BUCKETING = os.environ.get("GRAD_BUCKETING", "0") == "1"
 
 os.environ["MASTER_ADDR"] = "127.0.0.1"
 os.environ["MASTER_PORT"] = "29500"
@@ -40,7 +43,15 @@ optimizer = torch.optim.SGD(model.parameters(), lr=LR, momentum=0.9)
 model.train()
 model, optimizer = ipex.optimize(model, optimizer=optimizer)
 
-model = torch.nn.parallel.DistributedDataParallel(model)
+if GRAD_BUCKETING:
+    # broadcast the initial weights as DistributedDataParallel does
+    for param in model.parameters():
+        dist.broadcast(param.data, src=0)
+    reducer = ipex.cpu.comm.GradBucketReducer(
+        model, optimizer, compression=torch.bfloat16
+    )
+else:
+    model = torch.nn.parallel.DistributedDataParallel(model)
 
 for batch_idx, (data, target) in enumerate(train_loader):
     optimizer.zero_grad()
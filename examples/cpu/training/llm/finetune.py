@@ -59,6 +59,9 @@ def train(
     resume_from_checkpoint: str = None,  # either training checkpoint or final adapter
     prompt_template_name: str = "alpaca",  # The prompt template to use, will default to alpaca.
     disable_tqdm: bool = False,  # disable tqdm if needed to avoid split log failure when ddp training outputs multiple ranks.
+    # activation memory params
+    activation_memory_budget_mb: float = 0,  # if > 0, keep/compress/offload/recompute the activations of each decoder layer to fit it
+    activation_offload_dir: str = None,  # spill directory of the offloaded activations
 ):
     if int(os.environ.get("LOCAL_RANK", 0)) == 0:
         print(
@@ -87,6 +90,8 @@ def train(
             f"resume_from_checkpoint: {resume_from_checkpoint or False}\n"
             f"prompt template: {prompt_template_name}\n"
             f"disable tqdm: {disable_tqdm}\n"
+            f"activation_memory_budget_mb: {activation_memory_budget_mb}\n"
+            f"activation_offload_dir: {activation_offload_dir}\n"
         )
     assert (
         base_model
@@ -174,6 +179,18 @@ def train(
         return tokenized_full_prompt
 
     model = prepare_model_for_kbit_training(model)
+    if activation_memory_budget_mb > 0:
+        # patches gradient_checkpointing_enable of transformers
+        import intel_extension_for_pytorch.llm
+
+        model.gradient_checkpointing_enable(
+            gradient_checkpointing_kwargs={
+                "activation_policy": intel_extension_for_pytorch.llm.ActivationPolicy(
+                    memory_budget_mb=activation_memory_budget_mb,
+                    offload_dir=activation_offload_dir,
+                )
+            }
+        )
     config = LoraConfig(
         r=lora_r,
         lora_alpha=lora_alpha,
@@ -3,7 +3,6 @@ import re
 
 import torch
 
-
 try:
     import torchvision
 except ImportError:
@@ -40,6 +39,8 @@ import os
 import sys
 import glob
 import ctypes
+import importlib
+import importlib.util
 import platform
 
 ################################################################################
@@ -119,44 +120,74 @@ if sys.platform == "win32":
     kernel32.SetErrorMode(prev_error_mode)
 
 from . import cpu
-from . import xpu
-from . import quantization
-from . import nn
 from . import jit
-from . import optim
-from . import fx
-from . import _dynamo
 from . import _meta_registrations
+from . import _op_registrations
+from . import _tensor_method
 from ._init_on_device import OnDevice
 from .utils._logger import logger, WarningType
-
-try:
-    from .cpu import tpp
-except BaseException:
-    logger.warn(
-        "Please install transformers repo when you want to use fast_bert API.",
-        _type=WarningType.MissingArgument,
-    )
-
-from .frontend import optimize
-from .transformers import (
-    optimize_transformers,
-    _set_optimized_model_for_generation,
-)
-from . import llm
-from .frontend import enable_auto_channels_last, disable_auto_channels_last
-from .frontend import set_fp32_math_mode, get_fp32_math_mode, FP32MathMode
 from .cpu._auto_kernel_selection import _enable_dnnl, _disable_dnnl, _using_dnnl
 from .cpu.utils.verbose import verbose
-from .cpu.tpp.fused_bert import fast_bert
-from ._inductor.compiler import _set_compiler_backend, _get_compiler_backend, compile
+from .cpu.utils import profiler
 from .cpu.onednn_fusion import enable_onednn_fusion
 
 from . import _C
 
+if _C._has_xpu():
+    # registers the xpu device module and storage serialization to torch
+    from . import xpu
+
 # Path to folder containing CMake definitions for torch ipex package
 cmake_prefix_path = os.path.join(os.path.dirname(__file__), "share", "cmake")
 
+# The other subsystems (xpu on CPU builds, quantization, nn, optim, fx,
+# _dynamo, cpu.tpp, llm, transformers and _inductor) are imported on first
+# access through the module __getattr__ below (PEP 562), so that
+# `import intel_extension_for_pytorch` does not pay for them. The `ipex`
+# torch.compile backend is found through the `torch_dynamo_backends` entry
+# point, which imports `_dynamo` on first use. Everything with an import
+# side effect (op registrations, torch.Tensor patches) stays in the eager
+# imports above.
+_lazy_attributes = {
+    "optimize": "frontend",
+    "enable_auto_channels_last": "frontend",
+    "disable_auto_channels_last": "frontend",
+    "set_fp32_math_mode": "frontend",
+    "get_fp32_math_mode": "frontend",
+    "FP32MathMode": "frontend",
+    "save_kernel_decision_table": "nn.utils._auto_kernel_tuning",
+    "load_kernel_decision_table": "nn.utils._auto_kernel_tuning",
+    "optimize_transformers": "transformers",
+    "_set_optimized_model_for_generation": "transformers",
+    "fast_bert": "cpu.tpp.fused_bert",
+    "_set_compiler_backend": "_inductor.compiler",
+    "_get_compiler_backend": "_inductor.compiler",
+    "compile": "_inductor.compiler",
+}
+
+
+def __getattr__(name):
+    if name in _lazy_attributes:
+        try:
+            module = importlib.import_module("." + _lazy_attributes[name], __name__)
+        except ImportError:
+            if name == "fast_bert":
+                logger.warning(
+                    "Please install transformers repo when you want to use fast_bert API.",
+                    _type=WarningType.MissingDependency,
+                )
+            raise
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    if not name.startswith("__") and importlib.util.find_spec(__name__ + "." + name):
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_lazy_attributes))
+
 
 from .cpu.utils import _cpu_isa, _custom_fx_tracer
 
@@ -0,0 +1,77 @@
+import importlib.util
+
+import torch
+
+# Python ops referenced by the TorchScript graphs that ipex.llm traces. They
+# are registered when intel_extension_for_pytorch is imported, so that
+# torch.jit.load of a saved graph finds them without importing ipex.llm.
+
+
+@torch.library.impl("myops::longrope", "cpu")
+def longrope(
+    inv_freq,
+    max_seq_len_cached,
+    max_position_embeddings,
+    sin_cos,
+    sin_cached,
+    cos_cached,
+    sin_cos_long,
+    sin_cached_long,
+    cos_cached_long,
+    seq_len,
+    rope_type,
+):
+    if seq_len > max_seq_len_cached:
+        if rope_type == 1:  # Phi3ForCausalLM
+            return (
+                max_position_embeddings,
+                sin_cos_long,
+                sin_cached_long,
+                cos_cached_long,
+            )
+        elif rope_type == 2:  # Falcon
+            t = torch.arange(seq_len, dtype=inv_freq.dtype)
+            freqs = torch.einsum("i,j->ij", t, inv_freq)
+            sin_cos = torch.cat(
+                (freqs.sin().repeat(1, 2), freqs.cos().repeat(1, 2)), dim=-1
+            )
+            emb = torch.cat((freqs, freqs), dim=-1).float()
+            cos_cached = emb.cos()[None, :, :]
+            sin_cached = emb.sin()[None, :, :]
+            return seq_len, sin_cos, sin_cached, cos_cached
+        else:  # Default
+            t = torch.arange(seq_len, dtype=inv_freq.dtype)
+            freqs = torch.einsum("i,j->ij", t, inv_freq)
+            sin_cos = torch.cat((torch.sin(freqs), torch.cos(freqs)), dim=1)
+            emb = torch.cat((freqs, freqs), dim=-1)
+            cos_cached = emb.cos()[None, None, :, :]
+            sin_cached = emb.sin()[None, None, :, :]
+            return (
+                seq_len,
+                sin_cos,
+                sin_cached[:, :, :seq_len, ...],
+                cos_cached[:, :, :seq_len, ...],
+            )
+    return max_seq_len_cached, sin_cos, sin_cached, cos_cached
+
+
+torch.library.define(
+    "myops::longrope",
+    "(Tensor inv_freq, Tensor max_seq_len_cached, Tensor max_position_embeddings, Tensor sin_cos, "
+    + " Tensor sin_cached, Tensor cos_cached, Tensor? sin_cos_long, Tensor? sin_cached_long, "
+    + "Tensor? cos_cached_long,  Tensor seq_len, Tensor rope_type) -> (Tensor, Tensor, Tensor, Tensor)",
+)
+
+
+def _deepspeed_all_reduce(self):
+    from deepspeed import comm
+
+    comm.inference_all_reduce(self, async_op=False)
+    return self
+
+
+if importlib.util.find_spec("deepspeed") is not None:
+    ds_comm = torch.library.Library("deepspeed_comm", "DEF")
+    ds_comm.define("all_reduce(Tensor self) -> Tensor")
+    ds_comm_lib_cpu = torch.library.Library("deepspeed_comm", "IMPL", "CPU")
+    ds_comm_lib_cpu.impl("all_reduce", _deepspeed_all_reduce)
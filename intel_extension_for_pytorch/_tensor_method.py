@@ -1,6 +1,6 @@
 import torch
 from torch.overrides import has_torch_function_unary, handle_torch_function
-from ...utils._logger import logger
+from .utils._logger import logger
 
 
 def _numpy(x, force=False):
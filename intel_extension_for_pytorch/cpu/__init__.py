@@ -1,4 +1,14 @@
+import importlib
+import importlib.util
+
 from . import runtime
 from . import autocast
 from . import auto_ipex
 from . import comm
+
+
+def __getattr__(name):
+    # subpackages like tpp and hypertune are imported on first access
+    if not name.startswith("__") and importlib.util.find_spec(__name__ + "." + name):
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,5 +1,7 @@
 import torch
 import intel_extension_for_pytorch._C as torch_ipex_cpp
+from .grad_bucketing import GradBucketReducer
+from .sharded_optimizer import shard_optimizer_states, gather_master_weights
 
 
 def has_ccl():
@@ -0,0 +1,326 @@
+import contextlib
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+import torch.distributed as dist
+
+from ...utils._logger import logger, WarningType
+
+
+class _GradBucket(object):
+    def __init__(self, params, dtype, compression):
+        self.params = params
+        self.offsets = []
+        numel = 0
+        for p in params:
+            self.offsets.append(numel)
+            numel += p.numel()
+        self.buffer = torch.zeros(numel, dtype=dtype)
+        self.views = [
+            self.buffer[offset : offset + p.numel()].view(p.shape)
+            for offset, p in zip(self.offsets, params)
+        ]
+        # the buffer actually reduced, a bf16 copy with compression
+        self.comm_buffer = (
+            self.buffer.to(compression)
+            if compression is not None and compression != dtype
+            else self.buffer
+        )
+        # number of ranks with a grad of each param, reduced with the grads
+        self.has_grad = torch.zeros(len(params))
+        self.reset()
+
+    def reset(self):
+        self.pending = len(self.params)
+        self.handle = None
+
+    def pack(self):
+        for i, (p, view) in enumerate(zip(self.params, self.views)):
+            if p.grad is None:
+                view.zero_()
+                self.has_grad[i] = 0
+            else:
+                view.copy_(p.grad)
+                self.has_grad[i] = 1
+        if self.comm_buffer is not self.buffer:
+            self.comm_buffer.copy_(self.buffer)
+
+    def unpack(self, world_size):
+        if self.comm_buffer is not self.buffer:
+            self.buffer.copy_(self.comm_buffer)
+        self.buffer.div_(world_size)
+        for p, view, has_grad in zip(self.params, self.views, self.has_grad):
+            # a param with a grad on any rank gets the averaged grad, as with
+            # DistributedDataParallel, so that the replicas stay the same
+            if p.grad is not None:
+                p.grad.copy_(view)
+            elif has_grad > 0:
+                p.grad = view.clone()
+
+
+class GradBucketReducer(object):
+    r"""
+    GradBucketReducer averages the gradients of a model across ranks in
+    buckets reduced as soon as all gradients of a bucket are accumulated in
+    backward, so that the communication overlaps with the rest of backward.
+    The buckets follow the reverse order of ``model.parameters()``,
+    approximately the order gradients are produced, and are launched in the
+    same order on all ranks.
+
+    The gradients are reduced by ``ipex.cpu.comm.allreduce_add`` of oneCCL
+    on a communication thread if IPEX is built with oneCCL and runs with more
+    than one rank, otherwise by ``torch.distributed.all_reduce`` of the
+    initialized process group, e.g. gloo.
+
+    As with ``DistributedDataParallel``, a param with a gradient on some of
+    the ranks gets the averaged gradient on all ranks, the ranks without its
+    gradient contribute zeros.
+
+    If ``optimizer`` is given, its ``step`` waits for the reduction before
+    the update. For the fused optimizers of ``ipex.optimize`` the params of
+    each bucket are updated as soon as the bucket is reduced, so the update
+    of the first buckets overlaps with the reduction of the last ones. Call
+    :meth:`wait` before using the reduced gradients otherwise, e.g. to clip
+    them.
+
+    Args:
+        model (torch.nn.Module): The model, not wrapped by
+            ``DistributedDataParallel``.
+        optimizer (torch.optim.Optimizer): The optimizer of the model, after
+            ``ipex.optimize``. The default value is ``None``.
+        bucket_size_mb (float): Max size of a bucket in MB. The default value
+            is 25.
+        compression (torch.dtype): Dtype the float32 gradients are reduced
+            in, e.g. ``torch.bfloat16``. The default value is ``None``,
+            meaning no compression.
+        process_group (torch.distributed.ProcessGroup): The process group of
+            ``torch.distributed`` to reduce in. The default value is ``None``,
+            meaning the default group.
+
+    Examples:
+
+        >>> dist.init_process_group("gloo")
+        >>> model, optimizer = ipex.optimize(model, optimizer=optimizer)
+        >>> reducer = ipex.cpu.comm.GradBucketReducer(
+        ...     model, optimizer, compression=torch.bfloat16
+        ... )
+        >>> for data, target in train_loader:
+        ...     optimizer.zero_grad()
+        ...     criterion(model(data), target).backward()
+        ...     optimizer.step()
+    """
+
+    def __init__(
+        self,
+        model,
+        optimizer=None,
+        bucket_size_mb=25,
+        compression=None,
+        process_group=None,
+    ):
+        from . import has_ccl
+
+        if has_ccl() and process_group is None:
+            from . import allreduce_add, get_world_size
+
+            self.world_size = get_world_size()
+        else:
+            allreduce_add = None
+            self.world_size = 1
+        if self.world_size > 1:
+            self._allreduce_add = allreduce_add
+            # allreduce_add is blocking, run it off the backward thread
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        else:
+            assert (
+                dist.is_initialized()
+            ), "GradBucketReducer needs oneCCL or an initialized torch.distributed process group"
+            self._allreduce_add = None
+            self.process_group = process_group
+            self.world_size = dist.get_world_size(process_group)
+
+        params = [p for p in model.parameters() if p.requires_grad]
+        if compression is not None and any(p.dtype != torch.float for p in params):
+            logger.warning(
+                "Gradient compression only applies to float32 gradients.",
+                _type=WarningType.WrongArgument,
+            )
+        bucket_size = int(bucket_size_mb * 1024 * 1024)
+        # one bucket list per dtype, in reverse order of the params
+        self.buckets = []
+        current = {}
+        for p in reversed(params):
+            size = p.numel() * p.element_size()
+            params_of_dtype, bucket_bytes = current.get(p.dtype, ([], 0))
+            if params_of_dtype and bucket_bytes + size > bucket_size:
+                self._add_bucket(params_of_dtype, compression)
+                params_of_dtype, bucket_bytes = [], 0
+            params_of_dtype.append(p)
+            current[p.dtype] = (params_of_dtype, bucket_bytes + size)
+        for params_of_dtype, _ in current.values():
+            self._add_bucket(params_of_dtype, compression)
+        self._param_to_bucket = {
+            p: bucket for bucket in self.buckets for p in bucket.params
+        }
+        self._hooks = [
+            p.register_post_accumulate_grad_hook(self._grad_ready) for p in params
+        ]
+        self._next_bucket = 0
+        self._in_backward = False
+        self._enabled = True
+
+        self.optimizer = optimizer
+        if optimizer is not None:
+            self._patch_optimizer(optimizer)
+
+    def _add_bucket(self, params, compression):
+        self.buckets.append(
+            _GradBucket(
+                params,
+                params[0].dtype,
+                compression if params[0].dtype == torch.float else None,
+            )
+        )
+
+    @contextlib.contextmanager
+    def no_sync(self):
+        r"""
+        Context manager to accumulate gradients locally, e.g. for gradient
+        accumulation. The next backward outside of it reduces the accumulated
+        gradients.
+        """
+        self._enabled = False
+        try:
+            yield
+        finally:
+            self._enabled = True
+
+    def _grad_ready(self, param):
+        if not self._enabled:
+            return
+        if not self._in_backward:
+            self._in_backward = True
+            for bucket in self.buckets:
+                bucket.reset()
+            self._next_bucket = 0
+            torch.autograd.Variable._execution_engine.queue_callback(
+                self._finalize_backward
+            )
+        self._param_to_bucket[param].pending -= 1
+        self._launch_ready_buckets()
+
+    def _launch_ready_buckets(self, force=False):
+        # buckets are launched in order so that the collectives match on all ranks
+        while self._next_bucket < len(self.buckets):
+            bucket = self.buckets[self._next_bucket]
+            if bucket.pending > 0 and not force:
+                break
+            bucket.pack()
+            if self._allreduce_add is not None:
+                bucket.handle = [
+                    self._executor.submit(self._allreduce_add, buffer)
+                    for buffer in (bucket.has_grad, bucket.comm_buffer)
+                ]
+            else:
+                bucket.handle = [
+                    dist.all_reduce(buffer, group=self.process_group, async_op=True)
+                    for buffer in (bucket.has_grad, bucket.comm_buffer)
+                ]
+            self._next_bucket += 1
+
+    def _finalize_backward(self):
+        # buckets with params not used in this backward
+        self._launch_ready_buckets(force=True)
+        self._in_backward = False
+
+    def _wait_bucket(self, bucket):
+        if bucket.handle is None:
+            return False
+        for handle in bucket.handle:
+            if self._allreduce_add is not None:
+                handle.result()
+            else:
+                handle.wait()
+        bucket.handle = None
+        bucket.unpack(self.world_size)
+        return True
+
+    def wait(self):
+        r"""
+        Wait for the reduction of all buckets and write the averaged
+        gradients back to the params.
+        """
+        for bucket in self.buckets:
+            self._wait_bucket(bucket)
+
+    def _patch_optimizer(self, optimizer):
+        from ...optim._optimizer_utils import OPTIMIZER_FUSED_STEP_MAPPING_CPU
+        from ...optim._functional import is_master_weight
+
+        fused_step = None
+        if (
+            getattr(optimizer, "fused", False)
+            and not hasattr(optimizer, "_flat_groups")
+            and not hasattr(optimizer, "_low_precision_fused_step")
+            and type(optimizer) in OPTIMIZER_FUSED_STEP_MAPPING_CPU
+        ):
+            fused_step = OPTIMIZER_FUSED_STEP_MAPPING_CPU[type(optimizer)]
+        # the optimizer params of each bucket by param group, the master
+        # weight of a bf16 param is in the optimizer instead of the param
+        params_attr = getattr(optimizer, "params_attr", {})
+        owner_to_bucket = {}
+        for group_idx, group in enumerate(optimizer.param_groups):
+            for p in group["params"]:
+                owner = (
+                    params_attr[p].parameter if is_master_weight(p, params_attr) else p
+                )
+                owner_to_bucket[(group_idx, p)] = self._param_to_bucket.get(owner)
+        bucket_params = {}
+        for (group_idx, p), bucket in owner_to_bucket.items():
+            per_group = bucket_params.setdefault(
+                bucket, [[] for _ in optimizer.param_groups]
+            )
+            per_group[group_idx].append(p)
+
+        def step(opt, closure=None):
+            if fused_step is None or closure is not None:
+                self.wait()
+                return opt._pre_bucket_step(closure)
+            # update the params of each bucket once it is reduced, the params
+            # of no bucket at last
+            for bucket in self.buckets + [None]:
+                if bucket is not None:
+                    self._wait_bucket(bucket)
+                if bucket not in bucket_params:
+                    continue
+                fused_step(
+                    types.SimpleNamespace(
+                        param_groups=[
+                            dict(group, params=params)
+                            for group, params in zip(
+                                opt.param_groups, bucket_params[bucket]
+                            )
+                        ],
+                        state=opt.state,
+                        params_attr=params_attr,
+                        fused=opt.fused,
+                    )
+                )
+            return None
+
+        if not hasattr(optimizer, "_pre_bucket_step"):
+            setattr(optimizer, "_pre_bucket_step", optimizer.step)  # noqa: B010
+            optimizer.step = types.MethodType(step, optimizer)
+
+    def remove(self):
+        r"""
+        Remove the hooks from the params and restore the optimizer.
+        """
+        self.wait()
+        for hook in self._hooks:
+            hook.remove()
+        self._hooks = []
+        if self.optimizer is not None and hasattr(self.optimizer, "_pre_bucket_step"):
+            self.optimizer.step = self.optimizer._pre_bucket_step
+            del self.optimizer._pre_bucket_step
@@ -0,0 +1,575 @@
+import contextlib
+import types
+
+import torch
+import torch.distributed as dist
+
+from ...optim._flat_buffer import (
+    _FLAT_BUFFER_OPTIMIZERS,
+    _adagrad_update,
+    _adam_update,
+    _is_dense,
+    _per_tensor_view,
+    _sgd_update,
+)
+from ...optim._functional import is_master_weight
+from ...optim._lamb import Lamb
+
+
+def _adam_state_keys(group):
+    keys = ["exp_avg", "exp_avg_sq"]
+    if group["amsgrad"]:
+        keys.append("max_exp_avg_sq")
+    return keys
+
+
+def _lamb_shard_update(optimizer, group, bucket):
+    # Same as _lamb_impl, the norms of the params and their updates are
+    # summed over the shards of all ranks for the trust ratios.
+    bucket.step += 1
+    beta1, beta2 = group["betas"]
+    exp_avg = bucket.states["exp_avg"]
+    exp_avg_sq = bucket.states["exp_avg_sq"]
+    grad = bucket.grad.to(exp_avg.dtype)
+    exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+    exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+    adam_step = (exp_avg / (1 - beta1**bucket.step)) / (
+        (exp_avg_sq / (1 - beta2**bucket.step)).sqrt() + group["eps"]
+    )
+    param = bucket.master()
+    if group["weight_decay"] != 0:
+        adam_step.add_(param, alpha=group["weight_decay"])
+    # the last segment sums the padding
+    norms = torch.zeros(2, len(bucket.params) + 1).index_add_(
+        1, bucket.segment_ids, torch.stack([param * param, adam_step * adam_step])
+    )
+    dist.all_reduce(norms, group=bucket.process_group)
+    weight_norm, rtw_norm = norms.sqrt()
+    true_ratio = torch.where(
+        (weight_norm == 0) | (rtw_norm == 0), 1.0, weight_norm / rtw_norm
+    )
+    param.add_(adam_step * true_ratio[bucket.segment_ids], alpha=-group["lr"])
+    bucket.set_master(param)
+
+
+# optimizer: (states initialized as zeros, initial step, update of a shard)
+_SHARDED_OPTIMIZERS = {
+    torch.optim.SGD: (lambda group: [], None, _sgd_update),
+    torch.optim.Adagrad: (lambda group: [], None, _adagrad_update),
+    torch.optim.Adam: (_adam_state_keys, lambda: torch.tensor(0.0), _adam_update),
+    Lamb: (lambda group: ["exp_avg", "exp_avg_sq"], lambda: 0, _lamb_shard_update),
+}
+
+
+class _ShardBucket(object):
+    r"""
+    Params of a param group sharing the dtypes of param and master weight.
+    The params are laid out in a flat buffer padded to a multiple of the
+    world size, each rank keeps the master weights and the states of its
+    contiguous shard of it. Gradients are reduce-scattered to the shards
+    and the updated weights are all-gathered to the params of the model.
+    """
+
+    def __init__(self, optimizer, params, kind, state_keys, init_step, process_group):
+        self.params = params
+        self.kind = kind
+        self.process_group = process_group
+        self.world_size = dist.get_world_size(process_group)
+        params_attr = optimizer.params_attr
+        # the params of the model, holding the grads
+        self.owners = [
+            params_attr[p].parameter if kind == "master" else p for p in params
+        ]
+        self.offsets = []
+        numel = 0
+        for p in params:
+            self.offsets.append(numel)
+            numel += p.numel()
+        self.numel = numel
+        self.shard_numel = max(1, -(-numel // self.world_size))
+        self.lo = dist.get_rank(process_group) * self.shard_numel
+        self.hi = self.lo + self.shard_numel
+        self.segment_ids = torch.full((self.shard_numel,), len(params))
+        for idx, p in enumerate(params):
+            lo, hi = self._overlap(idx)
+            self.segment_ids[lo - self.lo : hi - self.lo] = idx
+
+        # fp32 weights, fp32 master weights and bf16 weights, or bf16 top and
+        # trail halves of the split master weights, as for the fused kernels
+        self.param = self._shard(params)
+        if kind == "master":
+            self.param2 = self._shard(self.owners)
+        elif kind == "split":
+            self.param2 = self._shard([params_attr[p].parameter_trail for p in params])
+        else:
+            self.param2 = torch.Tensor()
+        self.grad = torch.zeros(self.shard_numel, dtype=self.owners[0].dtype)
+
+        param_states = [optimizer.state[p] for p in params]
+        self.states = {}
+        for key in _FLAT_BUFFER_OPTIMIZERS[type(optimizer)][0]:
+            if key in param_states[0]:
+                self.states[key] = self._shard([s[key] for s in param_states])
+        for key in state_keys:
+            if key not in self.states:
+                self.states[key] = torch.zeros(self.shard_numel)
+        self.step = init_step() if init_step is not None else None
+        if "step" in param_states[0]:
+            step = param_states[0]["step"]
+            self.step = step.clone() if isinstance(step, torch.Tensor) else step
+        # the states of the full params are not kept, nor saved as empty
+        # states that e.g. Adagrad cannot load
+        for p in params:
+            optimizer.state.pop(p, None)
+        self.release_master(optimizer)
+
+    def _overlap(self, idx):
+        # range of param idx in the shard of this rank, in flat buffer offsets
+        offset = self.offsets[idx]
+        return (
+            max(self.lo, offset),
+            max(self.lo, min(self.hi, offset + self.params[idx].numel())),
+        )
+
+    def _flat(self, t, idx):
+        # elements of t in the memory order of the param of the model
+        like = self.owners[idx]
+        if t.stride() != like.stride():
+            t = torch.empty_strided(like.size(), like.stride(), dtype=t.dtype).copy_(t)
+        return t.as_strided((t.numel(),), (1,), t.storage_offset())
+
+    def _shard(self, tensors):
+        shard = torch.zeros(self.shard_numel, dtype=tensors[0].dtype)
+        for idx, t in enumerate(tensors):
+            lo, hi = self._overlap(idx)
+            offset = self.offsets[idx]
+            shard[lo - self.lo : hi - self.lo].copy_(
+                self._flat(t, idx)[lo - offset : hi - offset]
+            )
+        return shard
+
+    def _full_buffer(self, dtype, full=None):
+        # A full size buffer only lives during the step. The grads are
+        # reduce-scattered before the weights are all-gathered, so the buffer
+        # of the grads is reused for the weights if they have the same dtype.
+        if full is None or full.dtype != dtype:
+            full = torch.empty(self.shard_numel * self.world_size, dtype=dtype)
+        return full
+
+    def _views(self, full):
+        return [
+            full.as_strided(owner.size(), owner.stride(), offset)
+            for owner, offset in zip(self.owners, self.offsets)
+        ]
+
+    def set_state(self, optimizer, key, values):
+        # the momentum buffer of SGD is created by the first update
+        self.states[key] = values
+
+    def master(self):
+        r"""
+        The fp32 master weights of the shard.
+        """
+        if self.kind == "split":
+            return torch.ops.torch_ipex.cat_bfloat16_float(self.param, self.param2)
+        return self.param
+
+    def set_master(self, master):
+        if self.kind == "split":
+            top, trail = torch.ops.torch_ipex.split_float_bfloat16(master)
+            self.param.copy_(top)
+            self.param2.copy_(trail)
+        elif self.kind == "master":
+            self.param2.copy_(master)
+
+    def has_grad(self):
+        return torch.tensor(
+            [owner.grad is not None for owner in self.owners], dtype=torch.int32
+        )
+
+    def reduce_scatter_grads(self):
+        r"""
+        Launch the reduce-scatter of the grads, a param without grad on a rank
+        contributes zeros. Returns the full size buffer, to be kept until the
+        collective completes, and the async handle.
+        """
+        full = self._full_buffer(self.grad.dtype)
+        full[self.numel :].zero_()
+        for owner, view in zip(self.owners, self._views(full)):
+            if owner.grad is None:
+                view.zero_()
+            else:
+                view.copy_(
+                    owner.grad.to_dense() if owner.grad.is_sparse else owner.grad
+                )
+        return full, dist.reduce_scatter_tensor(
+            self.grad, full, group=self.process_group, async_op=True
+        )
+
+    def all_gather_params(self, full=None):
+        shard = self.param2 if self.kind == "master" else self.param
+        full = self._full_buffer(shard.dtype, full)
+        return full, dist.all_gather_into_tensor(
+            full,
+            shard,
+            group=self.process_group,
+            async_op=True,
+        )
+
+    def copy_params(self, full):
+        # in place, prepacked weights share the storage with the op context
+        for owner, view in zip(self.owners, self._views(full)):
+            owner.copy_(view)
+
+    def masked_update(self, optimizer, group, update, has_grad):
+        r"""
+        Update the shard, leaving the weights and states of the params
+        without grad on all ranks untouched. They still share the step of
+        the bucket.
+        """
+        if bool(has_grad.all()):
+            update(optimizer, group, self)
+            return
+        # the padding is zero and stays zero
+        keep = ~torch.cat([has_grad.bool(), torch.tensor([True])])[self.segment_ids]
+        idx = keep.nonzero().squeeze(1)
+        tensors = [self.param, self.param2] + list(self.states.values())
+        saved = [t[idx] if t.numel() > 0 else None for t in tensors]
+        keys = set(self.states)
+        update(optimizer, group, self)
+        for t, value in zip(tensors, saved):
+            if value is not None:
+                t[idx] = value
+        # e.g. the momentum buffer of SGD is created by the first update
+        for key in set(self.states) - keys:
+            self.states[key][idx] = 0
+
+    def gather_master(self, optimizer):
+        if self.kind == "plain":
+            return
+        shard = self.param if self.kind == "master" else self.param2
+        full = torch.empty(self.shard_numel * self.world_size, dtype=shard.dtype)
+        dist.all_gather_into_tensor(full, shard, group=self.process_group)
+        for p, view in zip(self.params, self._views(full)):
+            if self.kind == "master":
+                p.data = view
+            else:
+                optimizer.params_attr[p].parameter_trail = view
+
+    def release_master(self, optimizer):
+        for p in self.params:
+            if self.kind == "master":
+                p.data = torch.empty(0, dtype=p.dtype)
+            elif self.kind == "split":
+                optimizer.params_attr[p].parameter_trail = None
+
+    def state_dict(self):
+        return {
+            "numel": self.numel,
+            "param": self.param,
+            "param2": self.param2,
+            "states": self.states,
+            "step": self.step,
+        }
+
+    def load_state_dict(self, state_dict):
+        if state_dict["numel"] != self.numel:
+            raise ValueError(
+                f"The shard is of {state_dict['numel']} elements of params, "
+                + f"expected {self.numel}"
+            )
+        self.param.copy_(state_dict["param"])
+        self.param2.copy_(state_dict["param2"])
+        self.states = {
+            key: value.clone() for key, value in state_dict["states"].items()
+        }
+        step = state_dict["step"]
+        self.step = step.clone() if isinstance(step, torch.Tensor) else step
+
+
+def _shard_kind(optimizer, p):
+    if is_master_weight(p, optimizer.params_attr):
+        return "master"
+    if (
+        p in optimizer.params_attr
+        and optimizer.params_attr[p].parameter_trail is not None
+    ):
+        return "split"
+    return "plain"
+
+
+def _can_shard(optimizer, p, kind):
+    owner = optimizer.params_attr[p].parameter if kind == "master" else p
+    if not owner.requires_grad or p.device.type != "cpu":
+        return False
+    if not _is_dense(p) or p.size() != owner.size() or p.stride() != owner.stride():
+        return False
+    return kind != "split" or (
+        optimizer.params_attr[p].parameter_trail.stride() == p.stride()
+    )
+
+
+@torch.no_grad()
+def _build_shards(optimizer, process_group):
+    state_keys, init_step, _ = _SHARDED_OPTIMIZERS[type(optimizer)]
+    for group in optimizer.param_groups[len(optimizer._shard_groups) :]:
+        buckets = {}
+        others = []
+        for p in group["params"]:
+            kind = _shard_kind(optimizer, p)
+            if _can_shard(optimizer, p, kind):
+                step = optimizer.state[p].get("step")
+                key = (
+                    kind,
+                    p.dtype,
+                    float(step) if step is not None else None,
+                )
+                buckets.setdefault(key, []).append(p)
+            else:
+                others.append(p)
+        optimizer._shard_groups.append(
+            (
+                [
+                    _ShardBucket(
+                        optimizer,
+                        params,
+                        key[0],
+                        state_keys(group),
+                        init_step,
+                        process_group,
+                    )
+                    for key, params in buckets.items()
+                ],
+                others,
+            )
+        )
+
+
+@torch.no_grad()
+def _all_gather_params(optimizer):
+    handles = [
+        (bucket, *bucket.all_gather_params())
+        for buckets, _ in optimizer._shard_groups
+        for bucket in buckets
+    ]
+    for bucket, full, handle in handles:
+        handle.wait()
+        bucket.copy_params(full)
+
+
+def _grad_owner(optimizer, p):
+    if is_master_weight(p, optimizer.params_attr):
+        return optimizer.params_attr[p].parameter
+    return p
+
+
+@torch.no_grad()
+def sharded_step(self, closure=None):
+    """Performs a single optimization step.
+
+    Args:
+        closure (callable, optional): A closure that reevaluates the model
+            and returns the loss.
+    """
+    loss = None
+    if closure is not None:
+        with torch.enable_grad():
+            loss = closure()
+
+    if len(self._shard_groups) != len(self.param_groups):
+        # a param group is added
+        _build_shards(self, self._shard_process_group)
+    world_size = dist.get_world_size(self._shard_process_group)
+    per_tensor_step = _FLAT_BUFFER_OPTIMIZERS[type(self)][2]
+    update = _SHARDED_OPTIMIZERS[type(self)][2]
+    # launch all the collectives of the grads before the first update, a
+    # param is updated if it has a grad on any rank
+    all_buckets = [bucket for buckets, _ in self._shard_groups for bucket in buckets]
+    all_others = [
+        _grad_owner(self, p) for _, others in self._shard_groups for p in others
+    ]
+    has_grad = torch.cat(
+        [bucket.has_grad() for bucket in all_buckets]
+        + [
+            torch.tensor(
+                [owner.grad is not None for owner in all_others], dtype=torch.int32
+            )
+        ]
+    )
+    has_grad_handle = dist.all_reduce(
+        has_grad, group=self._shard_process_group, async_op=True
+    )
+    reduce_scatters = []
+    for group, (buckets, _) in zip(self.param_groups, self._shard_groups):
+        for bucket in buckets:
+            reduce_scatters.append((group, bucket, *bucket.reduce_scatter_grads()))
+    # the params which cannot be sharded are all-reduced on all ranks, with a
+    # zero grad on the ranks without grad, so that the collectives match
+    all_reduces = []
+    for owner in all_others:
+        if owner.grad is None:
+            owner.grad = torch.zeros_like(owner)
+        all_reduces.append(
+            dist.all_reduce(owner.grad, group=self._shard_process_group, async_op=True)
+        )
+    has_grad_handle.wait()
+    has_grad = has_grad.split(
+        [len(bucket.params) for bucket in all_buckets] + [len(all_others)]
+    )
+    others_has_grad = has_grad[-1].tolist()
+    for owner, handle, any_grad in zip(all_others, all_reduces, others_has_grad):
+        handle.wait()
+        owner.grad.div_(world_size)
+        if not any_grad:
+            # no rank had a grad, the param is not updated
+            owner.grad = None
+    # the params which cannot be sharded are updated by the fused step
+    for group, (_, others) in zip(self.param_groups, self._shard_groups):
+        others = [p for p in others if _grad_owner(self, p).grad is not None]
+        if others:
+            per_tensor_step(_per_tensor_view(self, group, others))
+    all_gathers = []
+    for (group, bucket, full, handle), bucket_has_grad in zip(
+        reduce_scatters, has_grad
+    ):
+        handle.wait()
+        bucket.grad.div_(world_size)
+        bucket.masked_update(self, group, update, bucket_has_grad > 0)
+        all_gathers.append((bucket, *bucket.all_gather_params(full)))
+    for bucket, full, handle in all_gathers:
+        handle.wait()
+        bucket.copy_params(full)
+    return loss
+
+
+def shard_optimizer_states(optimizer, process_group=None):
+    r"""
+    Shard the states and master weights of a fused optimizer of
+    ``ipex.optimize`` across the ranks of a process group, as ZeRO stage 2.
+    Each rank keeps the states (e.g. ``exp_avg`` and ``exp_avg_sq`` of Adam)
+    and the fp32 master weights (or the trail halves of the split master
+    weights of bf16 training) of a contiguous 1/N of the flat params of each
+    param group, so their memory is divided by the world size N. The step
+    reduce-scatters the gradients, averaged over the ranks, to the shards,
+    updates the shard of each rank with the fused kernels and all-gathers the
+    updated weights to the params of the model on all ranks.
+
+    SGD, Adagrad, Adam and Lamb are supported. Params which cannot be
+    sharded, e.g. with a different shape of the master weight, keep full
+    states and are updated after an all-reduce of their gradients. A param
+    with a gradient on some of the ranks gets zero gradients from the others,
+    a param without gradient on all ranks is not updated.
+
+    The gradients are reduced by the step, so do not wrap the model with
+    ``DistributedDataParallel`` or use ``GradBucketReducer`` with it. The
+    full master weights are released, save the model state dict within
+    :func:`gather_master_weights`.
+
+    ``optimizer.state_dict()`` returns the shard of the rank, to be saved
+    per rank and loaded by ``optimizer.load_state_dict`` with the same
+    world size.
+
+    Args:
+        optimizer (torch.optim.Optimizer): The fused optimizer returned by
+            ``ipex.optimize``.
+        process_group (torch.distributed.ProcessGroup): The process group
+            of ``torch.distributed`` to shard across. The default value is
+            ``None``, meaning the default group.
+
+    Returns:
+        The optimizer, updated in place.
+
+    Examples:
+
+        >>> model, optimizer = ipex.optimize(
+        ...     model, dtype=torch.bfloat16, optimizer=optimizer
+        ... )
+        >>> optimizer = ipex.cpu.comm.shard_optimizer_states(optimizer)
+        >>> for data, target in train_loader:
+        ...     optimizer.zero_grad()
+        ...     criterion(model(data), target).backward()
+        ...     optimizer.step()
+        >>> torch.save(optimizer.state_dict(), f"optimizer_rank{rank}.pt")
+        >>> with ipex.cpu.comm.gather_master_weights(optimizer):
+        ...     model_state_dict = model.state_dict()
+    """
+    assert (
+        getattr(optimizer, "fused", False)
+        and type(optimizer) in _SHARDED_OPTIMIZERS
+        and hasattr(optimizer, "params_attr")
+    ), (
+        "IPEX only supports sharding the states of the fused CPU optimizers "
+        + ", ".join(o.__name__ for o in _SHARDED_OPTIMIZERS)
+        + " returned by ipex.optimize"
+    )
+    assert not hasattr(
+        optimizer, "_flat_groups"
+    ), "Sharded optimizer states do not support flat_buffer_update"
+    assert not hasattr(
+        optimizer, "_low_precision_fused_step"
+    ), "Sharded optimizer states do not support optimizer_state_dtype"
+    if hasattr(optimizer, "_shard_groups"):
+        return optimizer
+    optimizer._shard_process_group = process_group
+    optimizer._shard_groups = []
+    _build_shards(optimizer, process_group)
+
+    def state_dict(self):
+        state_dict = self._pre_shard_state_dict()
+        state_dict["shards"] = [
+            [bucket.state_dict() for bucket in buckets]
+            for buckets, _ in self._shard_groups
+        ]
+        state_dict["world_size"] = dist.get_world_size(self._shard_process_group)
+        state_dict["rank"] = dist.get_rank(self._shard_process_group)
+        return state_dict
+
+    def load_state_dict(self, state_dict):
+        world_size = dist.get_world_size(self._shard_process_group)
+        rank = dist.get_rank(self._shard_process_group)
+        if state_dict["world_size"] != world_size or state_dict["rank"] != rank:
+            raise ValueError(
+                f"The shard of rank {state_dict['rank']} of world size "
+                + f"{state_dict['world_size']} cannot be loaded by rank {rank} "
+                + f"of world size {world_size}"
+            )
+        state_dict = dict(state_dict)
+        shards = state_dict.pop("shards")
+        del state_dict["world_size"], state_dict["rank"]
+        self._pre_shard_load_state_dict(state_dict)
+        for (buckets, _), bucket_state_dicts in zip(self._shard_groups, shards):
+            for bucket, bucket_state_dict in zip(buckets, bucket_state_dicts):
+                bucket.load_state_dict(bucket_state_dict)
+        # the weights of the model follow the loaded master weights
+        _all_gather_params(self)
+
+    setattr(optimizer, "_pre_shard_state_dict", optimizer.state_dict)  # noqa: B010
+    setattr(  # noqa: B010
+        optimizer, "_pre_shard_load_state_dict", optimizer.load_state_dict
+    )
+    optimizer.step = types.MethodType(sharded_step, optimizer)
+    optimizer.state_dict = types.MethodType(state_dict, optimizer)
+    optimizer.load_state_dict = types.MethodType(load_state_dict, optimizer)
+    return optimizer
+
+
+@contextlib.contextmanager
+def gather_master_weights(optimizer):
+    r"""
+    Context manager all-gathering the full master weights of an optimizer
+    sharded by :func:`shard_optimizer_states`, so that the model state dict
+    saved within it holds the fp32 weights of bf16 training. It must be
+    entered by all ranks.
+
+    Args:
+        optimizer (torch.optim.Optimizer): The sharded optimizer.
+    """
+    buckets = [bucket for buckets, _ in optimizer._shard_groups for bucket in buckets]
+    with torch.no_grad():
+        for bucket in buckets:
+            bucket.gather_master(optimizer)
+    try:
+        yield
+    finally:
+        for bucket in buckets:
+            bucket.release_master(optimizer)
@@ -0,0 +1 @@
+from .inprocess import tune, apply_recipe, load_recipe, recipe_autocast
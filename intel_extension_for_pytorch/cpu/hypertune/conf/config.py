@@ -146,10 +146,148 @@ launcher_schema = Schema(
     }
 )
 
+# ### optimize ###
+# hyperparameters of ipex.optimize, tuned in process only
+
+# default values if not tuning, None keeps the ipex.optimize default
+optimize_hyperparam_default_val = {
+    "dtype": ["float32"],
+    "level": ["O1"],
+    "weights_prepack": [None],
+    "auto_kernel_selection": [None],
+    "concat_linear": [None],
+    "graph_mode": [None],
+}
+
+# default search spaces if not user-specified
+optimize_hyperparam_default_search_space = {
+    "hp": [
+        "dtype",
+        "level",
+        "weights_prepack",
+        "auto_kernel_selection",
+        "concat_linear",
+        "graph_mode",
+    ],
+    "dtype": ["float32", "bfloat16"],
+    "level": ["O0", "O1"],
+    "weights_prepack": [True, False],
+    "auto_kernel_selection": [True, False],
+    "concat_linear": [True, False],
+    "graph_mode": [True, False],
+}
+
+
+def _list_of(choices):
+    return And(list, lambda s: all(i in choices for i in s))
+
+
+optimize_schema = Schema(
+    {
+        "hp": And(list, lambda s: all(isinstance(i, str) for i in s)),
+        Optional("dtype", default=["float32", "bfloat16"]): _list_of(
+            ["float32", "bfloat16"]
+        ),
+        Optional("level", default=["O0", "O1"]): _list_of(["O0", "O1"]),
+        Optional("weights_prepack", default=[True, False]): _list_of(
+            [True, False, None]
+        ),
+        Optional("auto_kernel_selection", default=[True, False]): _list_of(
+            [True, False, None]
+        ),
+        Optional("concat_linear", default=[True, False]): _list_of([True, False, None]),
+        Optional("graph_mode", default=[True, False]): _list_of([True, False, None]),
+    }
+)
+
+# ### llm ###
+# hyperparameters of ipex.llm.optimize, tuned in process only
+
+# default values if not tuning
+llm_hyperparam_default_val = {
+    "dtype": ["float32"],
+    "deployment_mode": [True],
+    "weight_only_quant": ["none"],
+}
+
+# default search spaces if not user-specified
+llm_hyperparam_default_search_space = {
+    "hp": ["dtype", "deployment_mode", "weight_only_quant"],
+    "dtype": ["float32", "bfloat16"],
+    "deployment_mode": [True, False],
+    "weight_only_quant": ["none", "int8"],
+}
+
+llm_schema = Schema(
+    {
+        "hp": And(list, lambda s: all(isinstance(i, str) for i in s)),
+        Optional("dtype", default=["float32", "bfloat16"]): _list_of(
+            ["float32", "bfloat16"]
+        ),
+        Optional("deployment_mode", default=[True, False]): _list_of([True, False]),
+        Optional("weight_only_quant", default=["none", "int8"]): _list_of(
+            ["none", "int8", "int4"]
+        ),
+    }
+)
+
+# ### runtime ###
+# number of streams of ipex.cpu.runtime.MultiStreamModule, tuned in process only
+# 1 runs the model without MultiStreamModule
+
+# default values if not tuning
+runtime_hyperparam_default_val = {
+    "num_streams": [1],
+}
+
+# default search spaces if not user-specified
+num_physical_cores_per_node = len(
+    [c for c in cpuinfo if c.is_physical_core and c.node == cpuinfo[0].node]
+)
+runtime_hyperparam_default_search_space = {
+    "hp": ["num_streams"],
+    "num_streams": [
+        2**i
+        for i in range(num_physical_cores_per_node.bit_length())
+        if 2**i <= num_physical_cores_per_node
+    ],
+}
+
+runtime_schema = Schema(
+    {
+        "hp": And(list, lambda s: all(isinstance(i, str) for i in s)),
+        Optional(
+            "num_streams",
+            default=runtime_hyperparam_default_search_space["num_streams"],
+        ): And(list, lambda s: all(isinstance(i, int) and i > 0 for i in s)),
+    }
+)
+
+# hyperparameter families that are applied to a model loaded in the tuning
+# process instead of being passed to ipexrun
+inprocess_hyperparams = ["optimize", "llm", "runtime"]
+
+hyperparam_default_val = {
+    "launcher": launcher_hyperparam_default_val,
+    "optimize": optimize_hyperparam_default_val,
+    "llm": llm_hyperparam_default_val,
+    "runtime": runtime_hyperparam_default_val,
+}
+
+hyperparam_default_search_space = {
+    "launcher": launcher_hyperparam_default_search_space,
+    "optimize": optimize_hyperparam_default_search_space,
+    "llm": llm_hyperparam_default_search_space,
+    "runtime": runtime_hyperparam_default_search_space,
+}
+
 hyperparams_default = {"launcher": launcher_hyperparam_default_search_space}
 hyperparams_schema = Schema(
     {
         Optional("launcher"): launcher_schema,
+        Optional("optimize"): optimize_schema,
+        Optional("llm"): llm_schema,
+        Optional("runtime"): runtime_schema,
     }
 )
 
@@ -168,8 +306,10 @@ schema = Schema(
 # reference: https://github.com/intel/neural-compressor/blob/15477100cef756\
 #            e430c8ef8ef79729f0c80c8ce6/neural_compressor/conf/config.py
 class Conf(object):
-    def __init__(self, conf_fpath, program_fpath, program_args):
-        assert Path(conf_fpath).exists(), f"{conf_fpath} does not exist"
+    def __init__(self, conf_fpath, program_fpath, program_args, usr_objectives=None):
+        # conf_fpath is either the path of a yaml file or the equivalent dict
+        if not isinstance(conf_fpath, dict):
+            assert Path(conf_fpath).exists(), f"{conf_fpath} does not exist"
         self.execution_conf = DotDict(
             schema.validate(
                 self._convert_conf(
@@ -178,6 +318,18 @@ class Conf(object):
             )
         )
 
+        if usr_objectives is not None:
+            # tuning in process, objectives are measured by a python callback
+            self.program = None
+            self.program_args = []
+            self.usr_objectives = [objective_schema.validate(o) for o in usr_objectives]
+            return
+
+        for tune_x in self.execution_conf.hyperparams:
+            assert (
+                tune_x not in inprocess_hyperparams
+            ), f"Hyperparameters of {tune_x} can only be tuned in process, \
+                please use intel_extension_for_pytorch.cpu.hypertune.tune."
         assert Path(program_fpath).exists(), f"{program_fpath} does not exist"
         self.program = program_fpath
         self.program_args = program_args
@@ -185,6 +337,8 @@ class Conf(object):
 
     def _read_conf(self, conf_fpath):
         try:
+            if isinstance(conf_fpath, dict):
+                return schema.validate(copy.deepcopy(conf_fpath))
             with open(conf_fpath, "r") as f:
                 content = f.read()
                 conf = yaml.safe_load(content)
@@ -197,13 +351,16 @@ class Conf(object):
             )
 
     def _convert_conf(self, src, dst):
-        hyperparam_default_val = {"launcher": launcher_hyperparam_default_val}
-
         for k in dst:
             if k == "hyperparams":
+                for tune_x in src["hyperparams"]:
+                    if tune_x not in dst["hyperparams"]:
+                        dst["hyperparams"][tune_x] = copy.deepcopy(
+                            hyperparam_default_search_space[tune_x]
+                        )
                 dst_hps = set(dst["hyperparams"])
                 for tune_x in dst_hps:
-                    # case 1: tune {launcher}
+                    # case 1: tune {launcher, optimize, llm, runtime}
                     if tune_x in src["hyperparams"]:
                         for hp in dst["hyperparams"][tune_x]["hp"]:
                             # case 1.1: not tune hp, use hp default val
@@ -216,7 +373,7 @@ class Conf(object):
                                 dst["hyperparams"][tune_x][hp] = src["hyperparams"][
                                     tune_x
                                 ][hp]
-                    # case 2: not tune {launcher}
+                    # case 2: not tune {launcher, optimize, llm, runtime}
                     else:
                         del dst["hyperparams"][tune_x]
 
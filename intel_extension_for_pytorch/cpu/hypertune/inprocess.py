@@ -0,0 +1,172 @@
+import contextlib
+import os
+import click
+import torch
+import yaml
+from .conf.config import Conf, hyperparam_default_val, inprocess_hyperparams
+from .objective import InProcessObjective
+from .strategy import STRATEGIES
+
+_DTYPES = {"float32": torch.float32, "bfloat16": torch.bfloat16}
+
+
+def _recipe_dtype(recipe):
+    for tune_x in ["optimize", "llm"]:
+        if tune_x in recipe:
+            return _DTYPES[recipe[tune_x]["dtype"]]
+    return torch.float32
+
+
+def recipe_autocast(recipe):
+    r"""
+    Autocast context a model optimized with ``recipe`` should run under,
+    bfloat16 recipes need ``torch.cpu.amp.autocast``.
+    """
+    if _recipe_dtype(recipe) == torch.bfloat16:
+        return torch.cpu.amp.autocast(dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def apply_recipe(model, recipe):
+    r"""
+    Apply a tuned recipe to ``model`` and return the optimized model. The
+    original model is left untouched so that it can be reused by other trials.
+
+    Args:
+        model (torch.nn.Module): The model to optimize, in eval mode.
+        recipe (dict): Configurations of the ``optimize`` (``ipex.optimize``),
+            ``llm`` (``ipex.llm.optimize``) and ``runtime``
+            (``ipex.cpu.runtime.MultiStreamModule``) families, e.g.
+            ``{"optimize": {"dtype": "bfloat16", "concat_linear": True},
+            "runtime": {"num_streams": 2}}``. Options absent from a family
+            keep their default values.
+
+    Returns:
+        The optimized model. Run it under :func:`recipe_autocast`.
+    """
+    import intel_extension_for_pytorch as ipex
+
+    for tune_x in recipe:
+        assert (
+            tune_x in inprocess_hyperparams
+        ), f"Unknown hyperparameter family {tune_x} in the recipe."
+        for hp in recipe[tune_x]:
+            assert (
+                hp in hyperparam_default_val[tune_x]
+            ), f"Unknown hyperparameter {hp} of {tune_x} in the recipe."
+    if "llm" in recipe:
+        llm_cfg = recipe["llm"]
+        qconfig = None
+        weight_only_quant = llm_cfg.get("weight_only_quant", "none")
+        if weight_only_quant != "none":
+            from ...quantization import WoqWeightDtype
+
+            qconfig = ipex.quantization.get_weight_only_quant_qconfig_mapping(
+                weight_dtype=getattr(WoqWeightDtype, weight_only_quant.upper())
+            )
+        model = ipex.llm.optimize(
+            model,
+            dtype=_DTYPES[llm_cfg.get("dtype", "float32")],
+            inplace=False,
+            quantization_config=qconfig,
+            deployment_mode=llm_cfg.get("deployment_mode", True),
+        )
+    if "optimize" in recipe:
+        optimize_cfg = dict(recipe["optimize"])
+        dtype = _DTYPES[optimize_cfg.pop("dtype", "float32")]
+        model = ipex.optimize(model, dtype=dtype, inplace=False, **optimize_cfg)
+    num_streams = recipe.get("runtime", {}).get("num_streams", 1)
+    if num_streams > 1:
+        model = ipex.cpu.runtime.MultiStreamModule(model, num_streams=num_streams)
+    return model
+
+
+def load_recipe(model, recipe_file):
+    r"""
+    Apply the recipe saved by :func:`tune` to ``model``.
+
+    Args:
+        model (torch.nn.Module): The model to optimize, in eval mode.
+        recipe_file (str): Path of the yaml recipe written by :func:`tune`.
+
+    Returns:
+        The optimized model. Run it under :func:`recipe_autocast`.
+    """
+    with open(recipe_file, "r") as f:
+        recipe = yaml.safe_load(f)["recipe"]
+    return apply_recipe(model, recipe)
+
+
+def tune(model, objective_fn, conf, objectives, recipe_file="recipe.yaml"):
+    r"""
+    Tune the ``ipex.optimize`` options, the ``ipex.llm.optimize`` deployment
+    options and the number of ``MultiStreamModule`` streams of a model in the
+    current process. Unlike ``python -m intel_extension_for_pytorch.cpu.hypertune``,
+    which launches the program with ``ipexrun`` for every trial, the model is
+    loaded once and every trial optimizes a copy of it.
+
+    Args:
+        model (torch.nn.Module): The model to tune, in eval mode.
+        objective_fn (callable): Called with the optimized model of a trial,
+            returns the objective value, or a list of values in the order of
+            ``objectives``. It runs under the autocast context of the trial.
+        conf (str or dict): Path of a yaml configuration file or the
+            equivalent dict, with hyperparameter families ``optimize``,
+            ``llm`` and ``runtime``. ``optimize`` and ``llm`` are exclusive.
+        objectives (list): One dict per objective, ``{'name': str,
+            'higher_is_better': bool, 'target_val': int or float}``.
+        recipe_file (str): Name of the yaml recipe of the best configuration,
+            written to ``output_dir`` of the configuration.
+
+    Returns:
+        The recipe of the best configuration, loadable with
+        :func:`apply_recipe` or from ``recipe_file`` with :func:`load_recipe`.
+
+    Examples:
+
+        >>> def latency(model):
+        ...     with torch.no_grad():
+        ...         for _ in range(10):
+        ...             model(data)
+        ...         start = time.time()
+        ...         for _ in range(100):
+        ...             model(data)
+        ...     return (time.time() - start) * 10
+        >>> conf = {"hyperparams": {"optimize": {"hp": ["dtype", "concat_linear"]}}}
+        >>> recipe = hypertune.tune(model, latency, conf, [{"name": "latency (ms)"}])
+        >>> model = hypertune.load_recipe(model, "recipe.yaml")
+    """
+    conf = Conf(conf, None, [], usr_objectives=objectives)
+    hyperparams = conf.execution_conf.hyperparams
+    assert (
+        "launcher" not in hyperparams
+    ), "Launcher hyperparameters cannot be tuned in process, please use \
+        python -m intel_extension_for_pytorch.cpu.hypertune."
+    assert not (
+        "optimize" in hyperparams and "llm" in hyperparams
+    ), "Hyperparameters of optimize and llm cannot be tuned at the same time."
+
+    objective = InProcessObjective(
+        model, objective_fn, hyperparams, conf.usr_objectives
+    )
+    strategy = STRATEGIES[conf.execution_conf.tuning.strategy](conf, objective)
+    strategy.traverse()
+
+    recipe = objective.decode_inprocess_cfg(strategy.best_tune_cfg)
+    recipe_path = os.path.join(conf.execution_conf.output_dir, recipe_file)
+    with open(recipe_path, "w") as f:
+        yaml.safe_dump(
+            {
+                "recipe": recipe,
+                "objectives": {
+                    usr_objective["name"]: val
+                    for usr_objective, val in zip(
+                        conf.usr_objectives, strategy.best_tune_result
+                    )
+                },
+            },
+            f,
+        )
+    click.secho("Recipe of the best configuration is saved to ", fg="green", nl=False)
+    click.secho(f"{recipe_path}", fg="blue")
+    return recipe
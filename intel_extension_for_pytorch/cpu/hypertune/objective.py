@@ -1,5 +1,6 @@
 # reference: https://github.com/intel/neural-compressor/blob/\
 #            15477100cef756e430c8ef8ef79729f0c80c8ce6/neural_compressor/objective.py
+import gc
 import subprocess
 from ...utils._logger import logger, WarningType
 
@@ -115,3 +116,52 @@ class MultiObjective(object):
                             the objective value to be minimized or maximized."
                     )
         return objectives
+
+
+class InProcessObjective(object):
+    r"""
+    Objective evaluated in the tuning process. Every trial applies the
+    configuration of the ``optimize``, ``llm`` and ``runtime`` hyperparameter
+    families to the model loaded once by the user and measures it with a python
+    callback, which returns the objective value or a list of objective values.
+    """
+
+    def __init__(self, model, objective_fn, hyperparams, usr_objectives):
+        self.model = model
+        self.objective_fn = objective_fn
+        self.hyperparams = hyperparams
+        self.usr_objectives = usr_objectives
+
+    def evaluate(self, cfg):
+        from .inprocess import apply_recipe, recipe_autocast
+
+        recipe = self.decode_inprocess_cfg(cfg)
+        try:
+            model = apply_recipe(self.model, recipe)
+            with recipe_autocast(recipe):
+                vals = self.objective_fn(model)
+        except Exception as e:
+            logger.warning(
+                f"Trial of configuration {cfg} failed: {e}",
+                _type=WarningType.NotSupported,
+            )
+            # the worst value for every objective, never picked as the best
+            vals = [
+                -float("inf") if objective["higher_is_better"] else float("inf")
+                for objective in self.usr_objectives
+            ]
+        model = None
+        gc.collect()
+
+        if not isinstance(vals, (list, tuple)):
+            vals = [vals]
+        assert len(vals) == len(
+            self.usr_objectives
+        ), f"The objective callback returned {len(vals)} values for {len(self.usr_objectives)} objectives."
+        return [float(v) for v in vals]
+
+    def decode_inprocess_cfg(self, cfg):
+        return {
+            tune_x: {hp: cfg[hp] for hp in self.hyperparams[tune_x]["hp"]}
+            for tune_x in self.hyperparams
+        }
@@ -5,8 +5,8 @@ from .strategy import strategy_registry, TuneStrategy
 
 @strategy_registry
 class RandomTuneStrategy(TuneStrategy):
-    def __init__(self, conf):
-        super().__init__(conf)
+    def __init__(self, conf, objective=None):
+        super().__init__(conf, objective)
         self.combinations = list(
             itertools.product(
                 *(self.hyperparam2searchspace[hp] for hp in self.hyperparams)
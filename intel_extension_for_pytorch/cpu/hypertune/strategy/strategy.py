@@ -21,7 +21,7 @@ def strategy_registry(cls):
 
 
 class TuneStrategy(object):
-    def __init__(self, conf):
+    def __init__(self, conf, objective=None):
         self.conf = conf.execution_conf
         self.program = conf.program
         self.program_args = conf.program_args
@@ -38,9 +38,9 @@ class TuneStrategy(object):
         tune_launcher = "launcher" in self.conf.hyperparams
 
         # objective #
-        self.multiobjective = MultiObjective(
-            self.program, self.program_args, tune_launcher
-        )
+        if objective is None:
+            objective = MultiObjective(self.program, self.program_args, tune_launcher)
+        self.multiobjective = objective
 
         # output #
         output_name = "record.csv"
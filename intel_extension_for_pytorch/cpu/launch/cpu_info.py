@@ -1,3 +1,6 @@
+import collections
+import functools
+import glob
 import itertools
 import os
 import platform
@@ -54,6 +57,130 @@ from ...utils._logger import WarningType
 #  11    0      0    7 0:0:0:0          yes 3800.0000 800.0000 2400.000
 
 
+# sysfs layout read by read_sysfs_topology, relative to the root
+# (/sys/devices/system by default)
+# cpu/online                                    0-7
+# cpu/cpu0/topology/physical_package_id         0
+# cpu/cpu0/topology/core_id                     0
+# cpu/cpu0/topology/thread_siblings_list        0,4
+# cpu/cpu0/cpufreq/cpuinfo_max_freq             5000000 (kHz)
+# cpu/cpu0/cache/index2/{level,type,id,size}    2 Unified 0 2048K
+# cpu/cpu0/cache/index2/shared_cpu_list         0,4
+# node/node0/cpulist                            0-3
+
+
+def _parse_cpu_list(txt):
+    # "0-3,8,10-11" -> [0, 1, 2, 3, 8, 10, 11]
+    ret = []
+    for item in txt.strip().split(","):
+        if item == "":
+            continue
+        if "-" in item:
+            start, end = item.split("-")
+            ret.extend(range(int(start), int(end) + 1))
+        else:
+            ret.append(int(item))
+    return ret
+
+
+def _parse_cache_size(txt):
+    # "48K" -> 48, "2M" -> 2048, in KB
+    m = re.match(r"^(\d+)\s*([KMG]?)", txt.strip().upper())
+    if m is None:
+        return 0
+    return int(m.group(1)) * {"": 1, "K": 1, "M": 1024, "G": 1024 * 1024}[m.group(2)]
+
+
+def _read_sysfs_file(path, default=None):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+@functools.lru_cache(maxsize=None)
+def read_sysfs_topology(root="/sys/devices/system"):
+    """
+    Read the CPU topology of all online CPUs from sysfs, without spawning lscpu.
+    Results are memoized per process and per root. Returns a tuple of dicts with
+    keys cpu, core, socket, node, maxmhz, l2, l3, l2_size and l3_size, or None
+    when the topology is not available under root.
+    - core ids are renumbered system-wide in the order of the first CPU of each
+      core, like the CORE column of lscpu.
+    - l2/l3 are ids of the L2/L3 cache domains, CPUs with the same id share the
+      cache. l2_size/l3_size are in KB.
+    - node falls back to the socket id when NUMA information is not exposed.
+    """
+    cpu_root = os.path.join(root, "cpu")
+    online = _read_sysfs_file(os.path.join(cpu_root, "online"))
+    if online is None:
+        return None
+    cpu_to_node = {}
+    for node_dir in glob.glob(os.path.join(root, "node", "node[0-9]*")):
+        cpulist = _read_sysfs_file(os.path.join(node_dir, "cpulist"), "")
+        node = int(os.path.basename(node_dir)[len("node") :])
+        for cpu in _parse_cpu_list(cpulist):
+            cpu_to_node[cpu] = node
+
+    records = []
+    core_ids = {}
+    for cpu in sorted(_parse_cpu_list(online)):
+        cpu_dir = os.path.join(cpu_root, f"cpu{cpu}")
+        socket = _read_sysfs_file(
+            os.path.join(cpu_dir, "topology", "physical_package_id")
+        )
+        core_id = _read_sysfs_file(os.path.join(cpu_dir, "topology", "core_id"))
+        if socket is None or core_id is None:
+            return None
+        siblings = _read_sysfs_file(
+            os.path.join(cpu_dir, "topology", "thread_siblings_list")
+        )
+        # hyperthreads of a core list the same siblings, the ids in core_id
+        # are only unique within a package
+        if siblings:
+            core_key = ("siblings", min(_parse_cpu_list(siblings)))
+        else:
+            core_key = ("core_id", int(socket), int(core_id))
+        if core_key not in core_ids:
+            core_ids[core_key] = len(core_ids)
+        max_freq = _read_sysfs_file(
+            os.path.join(cpu_dir, "cpufreq", "cpuinfo_max_freq"), "0"
+        )
+        record = {
+            "cpu": cpu,
+            "core": core_ids[core_key],
+            "socket": int(socket),
+            "node": cpu_to_node.get(cpu, int(socket)),
+            "maxmhz": int(max_freq) / 1000.0,
+            "l2": -1,
+            "l3": -1,
+            "l2_size": 0,
+            "l3_size": 0,
+        }
+        for cache_dir in glob.glob(os.path.join(cpu_dir, "cache", "index[0-9]*")):
+            level = _read_sysfs_file(os.path.join(cache_dir, "level"))
+            cache_type = _read_sysfs_file(os.path.join(cache_dir, "type"), "")
+            if level not in ["2", "3"] or cache_type == "Instruction":
+                continue
+            cache_id = _read_sysfs_file(os.path.join(cache_dir, "id"))
+            if cache_id is None:
+                # identify the domain by its first CPU, ids are only compared
+                # within a level
+                shared = _read_sysfs_file(
+                    os.path.join(cache_dir, "shared_cpu_list"), str(cpu)
+                )
+                cache_id = min(_parse_cpu_list(shared))
+            record[f"l{level}"] = int(cache_id)
+            record[f"l{level}_size"] = _parse_cache_size(
+                _read_sysfs_file(os.path.join(cache_dir, "size"), "0")
+            )
+        records.append(record)
+    if len(records) == 0:
+        return None
+    return tuple(records)
+
+
 class CoreInfo:
     """
     Class to store core-specific information, including:
@@ -64,6 +191,8 @@ class CoreInfo:
     - [bool] is a physical core or not
     - [float] maxmhz
     - [bool] is a performance core
+    - [int] L2 and L3 cache domain index, -1 if unknown
+    - [int] L2 and L3 cache size in KB, 0 if unknown
     """
 
     def __init__(self, lscpu_txt="", headers=None):
@@ -76,9 +205,18 @@ class CoreInfo:
         self.is_physical_core = True
         self.maxmhz = 0
         self.is_p_core = True
+        self.l2 = -1
+        self.l3 = -1
+        self.l2_size = 0
+        self.l3_size = 0
         if lscpu_txt != "" and len(headers) > 0:
             self.parse_raw(lscpu_txt, headers)
 
+    def parse_sysfs(self, record):
+        for k, v in record.items():
+            setattr(self, k, v)
+        return self
+
     def parse_raw(self, cols, headers):
         self.cpu = int(cols[headers["cpu"]])
         self.core = int(cols[headers["core"]])
@@ -90,6 +228,11 @@ class CoreInfo:
             self.socket = int(cols[headers["socket"]])
         if "maxmhz" in headers:
             self.maxmhz = float(cols[headers["maxmhz"]])
+        if "l1d:l1i:l2:l3" in headers:
+            caches = cols[headers["l1d:l1i:l2:l3"]].split(":")
+            if len(caches) == 4 and caches[2].isdigit() and caches[3].isdigit():
+                self.l2 = int(caches[2])
+                self.l3 = int(caches[3])
 
     def __str__(self):
         return f"{self.cpu}\t{self.core}\t{self.socket}\t{self.node}\t{self.is_physical_core}\t{self.maxmhz}\t{self.is_p_core}"
@@ -128,13 +271,31 @@ class CPUPool(list):
                 ret["cores"] = cpu_ranges_txt
         return ret
 
+    def get_locality(self):
+        """
+        Locality report of the pool:
+        - nodes [int]: number of NUMA nodes (sub-NUMA clusters) the pool spans.
+        - l3_domains [int]: number of shared-L3 domains the pool spans. Without
+          cache information, each NUMA node counts as one domain.
+        - score [float]: fraction of the cores on the pool's largest shared-L3
+          domain, 1.0 when the pool stays within a single domain.
+        """
+        if len(self) == 0:
+            return {"nodes": 0, "l3_domains": 0, "score": 0.0}
+        domains = collections.Counter([(c.node, c.l3) for c in self])
+        return {
+            "nodes": len(set([c.node for c in self])),
+            "l3_domains": len(domains),
+            "score": max(domains.values()) / len(self),
+        }
+
 
 class CPUPoolList:
     """
     Get a CPU pool with all available CPUs and CPU pools filtered with designated criterias.
     """
 
-    def __init__(self, logger=None, lscpu_txt=""):
+    def __init__(self, logger=None, lscpu_txt="", sysfs_root="/sys/devices/system"):
         self.pool_all = CPUPool()
         self.pools_ondemand = []
 
@@ -143,9 +304,16 @@ class CPUPoolList:
             raise RuntimeError("Windows platform is not supported!!!")
         elif platform.system() == "Linux":
             """
-            Retrieve CPU information from lscpu.
+            Retrieve CPU information from sysfs, or from lscpu when lscpu_txt is
+            given or sysfs is not available.
             """
+            sysfs_topology = None
             if lscpu_txt.strip() == "":
+                sysfs_topology = read_sysfs_topology(sysfs_root)
+            if sysfs_topology is not None:
+                for record in sysfs_topology:
+                    self.pool_all.append(CoreInfo().parse_sysfs(record))
+            elif lscpu_txt.strip() == "":
                 args = ["lscpu", "--all", "--extended"]
                 my_env = os.environ.copy()
                 my_env["LC_ALL"] = "C"
@@ -155,29 +323,8 @@ class CPUPoolList:
             else:
                 lscpu_info = lscpu_txt
 
-            """
-            Filter out lines that are really useful.
-            """
-            lscpu_info = lscpu_info.strip().split("\n")
-            headers = {}
-            num_cols = 0
-            for line in lscpu_info:
-                line = re.sub(" +", " ", line.lower().strip())
-                if "cpu" in line and "socket" in line and "core" in line:
-                    t = line.split(" ")
-                    num_cols = len(t)
-                    for i in range(num_cols):
-                        if t[i] in ["cpu", "core", "socket", "node", "maxmhz"]:
-                            headers[t[i]] = i
-                else:
-                    t = line.split(" ")
-                    if (
-                        len(t) == num_cols
-                        and t[headers["cpu"]].isdigit()
-                        and t[headers["core"]].isdigit()
-                        and t[headers["socket"]].isdigit()
-                    ):
-                        self.pool_all.append(CoreInfo(t, headers))
+            if sysfs_topology is None:
+                self.parse_lscpu(lscpu_info)
             assert len(self.pool_all) > 0, "cpuinfo is empty"
 
         # Determine logical cores
@@ -207,6 +354,38 @@ class CPUPoolList:
                     if c.maxmhz in e_core_mhzs:
                         c.is_p_core = False
 
+    def parse_lscpu(self, lscpu_info):
+        """
+        Filter out lines that are really useful.
+        """
+        lscpu_info = lscpu_info.strip().split("\n")
+        headers = {}
+        num_cols = 0
+        for line in lscpu_info:
+            line = re.sub(" +", " ", line.lower().strip())
+            if "cpu" in line and "socket" in line and "core" in line:
+                t = line.split(" ")
+                num_cols = len(t)
+                for i in range(num_cols):
+                    if t[i] in [
+                        "cpu",
+                        "core",
+                        "socket",
+                        "node",
+                        "maxmhz",
+                        "l1d:l1i:l2:l3",
+                    ]:
+                        headers[t[i]] = i
+            else:
+                t = line.split(" ")
+                if (
+                    len(t) == num_cols
+                    and t[headers["cpu"]].isdigit()
+                    and t[headers["core"]].isdigit()
+                    and t[headers["socket"]].isdigit()
+                ):
+                    self.pool_all.append(CoreInfo(t, headers))
+
     def verbose(self, level, msg, warning_type=None):
         if self.logger:
             logging_fn = {
@@ -241,6 +420,9 @@ class CPUPoolList:
         When set to 'auto', a 'list' or a 'range' whoever has less number of elements that are separated by \
         comma is returned. I.e. for a list '0,1,2,6,7,8' and a range '0-2,6-8', both reflect the same cpu \
         configuration, the range '0-2,6-8' is returned.
+    - locality_aware [bool]: Pack each instance within a NUMA node (sub-NUMA cluster) and a shared-L3 domain \
+        whenever a domain has enough cores left, False by default. When set to False, cores are assigned to \
+        instances in core id order.
     """
 
     def gen_pools_ondemand(
@@ -253,6 +435,7 @@ class CPUPoolList:
         nodes_list=None,
         cores_list=None,
         return_mode="auto",
+        locality_aware=False,
     ):
         if nodes_list is None:
             nodes_list = []
@@ -375,6 +558,8 @@ class CPUPoolList:
         # Split the aggregated pool into individual pools
         self.pools_ondemand.clear()
         pool.sort(key=lambda x: (x.core, 1 - int(x.is_physical_core)))
+        if locality_aware:
+            pool = self.pack_by_locality(pool, ninstances, ncores_per_instance)
         for i in range(ninstances):
             # Generate individual raw pool
             pool_local = CPUPool()
@@ -383,6 +568,35 @@ class CPUPoolList:
             pool_local.sort(key=lambda x: x.cpu)
             self.pools_ondemand.append(pool_local)
 
+    def pack_by_locality(self, pool, ninstances, ncores_per_instance):
+        """
+        Reorder the pool so that every consecutive chunk of ncores_per_instance
+        cores is taken from the first shared-L3 domain of a NUMA node with enough
+        cores left, then from the first NUMA node with enough cores left, and
+        only then across NUMA nodes. Sub-NUMA clusters are exposed as NUMA nodes,
+        so instances on SNC hosts are kept within a cluster as well.
+        """
+        domain_keys = [
+            lambda c: (c.node, c.l3),
+            lambda c: c.node,
+            lambda c: 0,
+        ]
+        remaining = list(pool)
+        ret = []
+        for _ in range(ninstances):
+            for domain_key in domain_keys:
+                domains = {}
+                for c in remaining:
+                    domains.setdefault(domain_key(c), []).append(c)
+                fit = [d for d in domains.values() if len(d) >= ncores_per_instance]
+                if len(fit) > 0:
+                    chosen = fit[0][:ncores_per_instance]
+                    break
+            chosen_cpus = set([c.cpu for c in chosen])
+            remaining = [c for c in remaining if c.cpu not in chosen_cpus]
+            ret.extend(chosen)
+        return ret + remaining
+
 
 if __name__ == "__main__":
     lscpu_txt = """
@@ -46,6 +46,16 @@ class MultiInstancesLauncher(Launcher):
             default=False,
             help="Allow instances to be executed on cores across NUMA nodes.",
         )
+        group.add_argument(
+            "--pool-policy",
+            "--pool_policy",
+            default="locality",
+            type=str,
+            choices=["locality", "default"],
+            help="Policy to group cores into instances. 'locality' packs each instance within a NUMA node \
+                (sub-NUMA cluster) and a shared-L3 domain whenever possible, 'default' assigns cores to \
+                instances in core id order.",
+        )
         group.add_argument(
             "--multi-task-manager",
             "--multi_task_manager",
@@ -171,11 +181,22 @@ class MultiInstancesLauncher(Launcher):
         if args.log_dir:
             cmd_s = f"{cmd_s} 2>&1 | tee {log_name}"
         self.verbose("info", f"cmd: {cmd_s}")
+        locality = pool.get_locality()
+        self.verbose(
+            "info",
+            f"locality: cores [{cores_list_local}] span {locality['nodes']} NUMA node(s) and "
+            + f"{locality['l3_domains']} L3 domain(s), score {locality['score']:.2f}",
+        )
         if len(set([c.node for c in pool])) > 1:
             self.verbose(
                 "warning",
                 f"Cross NUMA nodes execution detected: cores [{cores_list_local}] are on different NUMA nodes [{nodes_list_local}]",
             )
+        elif locality["l3_domains"] > 1:
+            self.verbose(
+                "warning",
+                f"Cross L3 domains execution detected: cores [{cores_list_local}] do not share a last level cache",
+            )
         process = subprocess.Popen(cmd_s, env=environ_local, shell=True)
         return {"process": process, "cmd": cmd_s}
 
@@ -228,6 +249,7 @@ class MultiInstancesLauncher(Launcher):
             skip_cross_node_cores=args.skip_cross_node_cores,
             nodes_list=nodes_list,
             cores_list=cores_list,
+            locality_aware=args.pool_policy == "locality",
         )
         args.ninstances = len(self.cpuinfo.pools_ondemand)
         args.ncores_per_instance = len(self.cpuinfo.pools_ondemand[0])
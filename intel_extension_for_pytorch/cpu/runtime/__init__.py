@@ -7,3 +7,4 @@ from .multi_stream import (
     _MultiStreamBenchmarkModule,
 )
 from .runtime_utils import get_core_list_of_node_id
+from .serving import ServingAdapter
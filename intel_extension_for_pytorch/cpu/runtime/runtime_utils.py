@@ -1,20 +1,17 @@
-import subprocess
+def _get_cpu_pool():
+    from ..launch.cpu_info import CPUPoolList
+
+    return CPUPoolList().pool_all
 
 
 def get_num_nodes():
-    return int(
-        subprocess.check_output(
-            "LANG=C; lscpu | grep Socket | awk '{print $2}'", shell=True
-        )
-    )
+    return len(set([c.socket for c in _get_cpu_pool()]))
 
 
 def get_num_cores_per_node():
-    return int(
-        subprocess.check_output(
-            "LANG=C; lscpu | grep Core'.* per socket' | awk '{print $4}'", shell=True
-        )
-    )
+    pool = _get_cpu_pool()
+    sockets = set([c.socket for c in pool])
+    return len([c for c in pool if c.is_physical_core]) // len(sockets)
 
 
 def get_core_list_of_node_id(node_id):
@@ -0,0 +1,308 @@
+import contextlib
+import math
+import statistics
+import threading
+import time
+from collections import OrderedDict, deque
+from multiprocessing import shared_memory
+
+import numpy as np
+import torch
+from torch.utils import dlpack
+
+from .cpupool import CPUPool, pin, is_runtime_ext_enabled
+from .multi_stream import MultiStreamModule, MultiStreamModuleHint
+from ...utils._logger import logger, WarningType
+
+_STAGES = ("gather", "compute", "scatter")
+
+
+def _numel(shape):
+    return int(math.prod(shape))
+
+
+class _BufferSlot(object):
+    # Flat input and output buffers of one in-flight batch. Each buffer holds
+    # max_batch_size samples of the max per-sample shape, a batch of any
+    # smaller sample shape is a contiguous view at the front of it.
+    def __init__(self, input_spec, max_batch_size, pinned):
+        self.max_batch_size = max_batch_size
+        self.pinned = pinned
+        self.inputs = OrderedDict(
+            (name, torch.zeros(max_batch_size * _numel(shape), dtype=dtype))
+            for name, (shape, dtype) in input_spec.items()
+        )
+        self.outputs = []
+
+    def input_view(self, name, batch_size, sample_shape):
+        buffer = self.inputs[name]
+        numel = batch_size * _numel(sample_shape)
+        assert numel <= buffer.numel(), (
+            f"Input {name} of shape {(batch_size, *sample_shape)} exceeds "
+            + "the preallocated buffer."
+        )
+        return buffer[:numel].view(batch_size, *sample_shape)
+
+    def output_view(self, idx, batch_size, sample_shape, dtype):
+        numel = batch_size * _numel(sample_shape)
+        while len(self.outputs) <= idx:
+            self.outputs.append(None)
+        buffer = self.outputs[idx]
+        if buffer is None or buffer.dtype != dtype or buffer.numel() < numel:
+            # sized by the first output seen, only grows afterwards
+            with self.pinned():
+                buffer = torch.zeros(
+                    max(numel, self.max_batch_size * _numel(sample_shape)),
+                    dtype=dtype,
+                )
+            self.outputs[idx] = buffer
+        return buffer[:numel].view(batch_size, *sample_shape)
+
+
+class ServingAdapter(object):
+    r"""
+    ServingAdapter runs batched inference requests of a serving backend, e.g.
+    a Triton Python backend or a TorchServe handler, on a
+    :class:`MultiStreamModule` without per-request allocations.
+
+    Request tensors are accepted as ``torch.Tensor``, numpy arrays, DLPack
+    capsules or objects implementing ``__dlpack__``, and as
+    ``multiprocessing.shared_memory`` blocks through
+    :meth:`from_shared_memory`, all without copies. The requests of one batch
+    are gathered into input buffers preallocated per model instance, a single
+    contiguous request is passed to the model as is. Outputs computed by
+    several streams are concatenated into preallocated output buffers, and
+    the per-request outputs are returned as views of them. The buffers are
+    first touched by threads pinned to ``cpu_pool`` so that they are local to
+    its NUMA node.
+
+    The buffers form a ring of ``num_buffers`` slots, so the outputs of a
+    call are overwritten by the ``num_buffers``-th call after it. Copy them,
+    or convert them to the responses of the serving backend, before that.
+
+    Args:
+        model (torch.jit.ScriptModule or torch.nn.Module): The input model. It
+            is called with the inputs in the order of ``input_spec`` and
+            returns a tensor or a tuple or list of tensors, all batched along
+            dim 0.
+        input_spec (dict): Maps the name of each input to its max per-sample
+            shape and its dtype, e.g. ``{"input_ids": ((384,), torch.int64)}``.
+        max_batch_size (int): Max number of samples of one call.
+        num_streams (Union[int, str]): Number of streams of the
+            :class:`MultiStreamModule`, or "AUTO". The default value is 1.
+        cpu_pool (intel_extension_for_pytorch.cpu.runtime.CPUPool): CPU cores
+            of this model instance.
+        num_buffers (int): Number of buffer slots. The default value is 2.
+        max_timing_records (int): Number of calls kept to compute the stage
+            timing statistics. The default value is 10000.
+
+    Examples:
+
+        >>> adapter = ipex.cpu.runtime.ServingAdapter(
+        ...     traced_model,
+        ...     {"input_ids": ((384,), torch.int64)},
+        ...     max_batch_size=64,
+        ...     num_streams=2,
+        ...     cpu_pool=ipex.cpu.runtime.CPUPool(node_id=0),
+        ... )
+        >>> outputs = adapter([{"input_ids": capsule} for capsule in requests])
+        >>> adapter.get_timing()["compute"]["p99"]
+
+    :meta public:
+    """
+
+    def __init__(
+        self,
+        model,
+        input_spec,
+        max_batch_size,
+        num_streams=1,
+        cpu_pool: CPUPool = None,
+        num_buffers=2,
+        max_timing_records=10000,
+    ):
+        assert max_batch_size > 0, "max_batch_size must be positive"
+        assert num_buffers > 0, "num_buffers must be positive"
+        if cpu_pool is None:
+            cpu_pool = CPUPool()
+        self.cpu_pool = cpu_pool
+        self.input_spec = OrderedDict(
+            (name, (tuple(shape), dtype)) for name, (shape, dtype) in input_spec.items()
+        )
+        self.max_batch_size = max_batch_size
+        # The outputs of the streams are gathered and concatenated here into
+        # the preallocated output buffers.
+        self.module = MultiStreamModule(
+            model,
+            num_streams=num_streams,
+            cpu_pool=cpu_pool,
+            concat_output=False,
+            input_split_hint=MultiStreamModuleHint(*([0] * len(self.input_spec))),
+        )
+        self._shared_memory = {}
+        with self._pinned():
+            self._slots = [
+                _BufferSlot(self.input_spec, max_batch_size, self._pinned)
+                for _ in range(num_buffers)
+            ]
+        self._next_slot = 0
+        # MultiStreamModule keeps per call state, so calls are serialized
+        self._lock = threading.Lock()
+        self._timing = {stage: deque(maxlen=max_timing_records) for stage in _STAGES}
+
+    def _pinned(self):
+        # pinning needs the runtime extension, i.e. Intel OpenMP
+        if is_runtime_ext_enabled():
+            return pin(self.cpu_pool)
+        return contextlib.nullcontext()
+
+    @staticmethod
+    def as_tensor(data):
+        r"""
+        Wrap a tensor, a numpy array, a DLPack capsule or an object
+        implementing ``__dlpack__`` into a ``torch.Tensor`` sharing its memory.
+        """
+        if isinstance(data, torch.Tensor):
+            return data
+        if isinstance(data, np.ndarray):
+            return torch.from_numpy(data)
+        return dlpack.from_dlpack(data)
+
+    def from_shared_memory(self, name, shape, dtype, offset=0):
+        r"""
+        Map a tensor stored in a ``multiprocessing.shared_memory`` block, e.g.
+        written by the client or the frontend process, without copying it.
+        The block is attached once and kept open until :meth:`close`.
+
+        Args:
+            name (str): Name of the shared memory block.
+            shape (tuple): Shape of the tensor.
+            dtype (torch.dtype): Dtype of the tensor.
+            offset (int): Byte offset of the tensor in the block.
+
+        Returns:
+            torch.Tensor: A tensor backed by the shared memory block.
+        """
+        if name not in self._shared_memory:
+            self._shared_memory[name] = shared_memory.SharedMemory(name=name)
+        return torch.frombuffer(
+            self._shared_memory[name].buf,
+            dtype=dtype,
+            count=_numel(shape),
+            offset=offset,
+        ).view(shape)
+
+    def _gather(self, slot, requests):
+        requests = [
+            {name: self.as_tensor(request[name]) for name in self.input_spec}
+            for request in requests
+        ]
+        batch_sizes = [next(iter(request.values())).shape[0] for request in requests]
+        batch_size = sum(batch_sizes)
+        assert (
+            batch_size <= self.max_batch_size
+        ), f"Batch size {batch_size} exceeds max_batch_size {self.max_batch_size}"
+        if len(requests) == 1 and all(x.is_contiguous() for x in requests[0].values()):
+            return list(requests[0].values()), batch_sizes
+        inputs = []
+        for name in self.input_spec:
+            sample_shape = requests[0][name].shape[1:]
+            batch = slot.input_view(name, batch_size, sample_shape)
+            start = 0
+            for request, size in zip(requests, batch_sizes):
+                batch[start : start + size].copy_(request[name])
+                start += size
+            inputs.append(batch)
+        return inputs, batch_sizes
+
+    def _scatter(self, slot, outputs, batch_sizes):
+        # outputs holds the output of each used stream
+        single = isinstance(outputs[0], torch.Tensor)
+        if single:
+            outputs = [(out,) for out in outputs]
+        batched = []
+        for idx, chunks in enumerate(zip(*outputs)):
+            if len(chunks) == 1:
+                batched.append(chunks[0])
+                continue
+            batch_size = sum(chunk.shape[0] for chunk in chunks)
+            out = slot.output_view(
+                idx, batch_size, chunks[0].shape[1:], chunks[0].dtype
+            )
+            torch.cat(chunks, out=out)
+            batched.append(out)
+        split = [torch.split(out, batch_sizes) for out in batched]
+        if single:
+            return list(split[0])
+        return [tuple(request_outputs) for request_outputs in zip(*split)]
+
+    def __call__(self, requests):
+        r"""
+        Run a batch of requests.
+
+        Args:
+            requests (list): One dict per request mapping the name of each
+                input of ``input_spec`` to its data, batched along dim 0.
+
+        Returns:
+            list: The output of each request, a tensor or a tuple of tensors
+            following the output of the model.
+        """
+        with self._lock:
+            slot = self._slots[self._next_slot]
+            self._next_slot = (self._next_slot + 1) % len(self._slots)
+            start = time.perf_counter()
+            inputs, batch_sizes = self._gather(slot, requests)
+            gathered = time.perf_counter()
+            with torch.no_grad():
+                outputs = self.module(*inputs)
+            computed = time.perf_counter()
+            results = self._scatter(slot, outputs, batch_sizes)
+            scattered = time.perf_counter()
+        self._timing["gather"].append(gathered - start)
+        self._timing["compute"].append(computed - gathered)
+        self._timing["scatter"].append(scattered - computed)
+        return results
+
+    def get_timing(self):
+        r"""
+        Get the latency statistics of the gather, compute and scatter stages
+        of the recorded calls, in milliseconds.
+
+        Returns:
+            dict: ``{stage: {"count", "mean", "p50", "p99"}}``.
+        """
+        timing = {}
+        for stage, records in self._timing.items():
+            if not records:
+                continue
+            records = sorted(records)
+            timing[stage] = {
+                "count": len(records),
+                "mean": statistics.mean(records) * 1e3,
+                "p50": records[int(0.5 * (len(records) - 1))] * 1e3,
+                "p99": records[int(0.99 * (len(records) - 1))] * 1e3,
+            }
+        return timing
+
+    def reset_timing(self):
+        r"""
+        Clear the recorded stage latencies.
+        """
+        for records in self._timing.values():
+            records.clear()
+
+    def close(self):
+        r"""
+        Detach the shared memory blocks mapped by :meth:`from_shared_memory`.
+        Tensors returned by it must not be used afterwards.
+        """
+        for shm in self._shared_memory.values():
+            try:
+                shm.close()
+            except BufferError:
+                logger.warning(
+                    f"Shared memory {shm.name} is still referenced and not closed.",
+                    _type=WarningType.WrongArgument,
+                )
+        self._shared_memory.clear()
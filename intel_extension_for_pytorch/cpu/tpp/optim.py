@@ -4,6 +4,11 @@ import torch
 from torch.optim import Optimizer
 from torch.optim.optimizer import required
 import intel_extension_for_pytorch._C as ipex_cpp
+from ...optim._low_precision_state import (
+    dequantize_state,
+    is_low_precision_state,
+    quantize_state_,
+)
 
 
 class SGD(Optimizer):
@@ -117,6 +122,9 @@ class AdamW(Optimizer):
             Decoupled weight decay to apply.
         correct_bias (:obj:`bool`, `optional`, defaults to `True`):
             Whether ot not to correct bias in Adam (for instance, in Bert TF repository they use :obj:`False`).
+        state_dtype (:obj:`torch.dtype`, `optional`, defaults to `None`):
+            Dtype to keep the moments in between the steps, :obj:`torch.bfloat16` with stochastic rounding or
+            :obj:`torch.int8` quantized block-wise. They are updated in the dtype of the param.
     """
 
     def __init__(
@@ -127,6 +135,7 @@ class AdamW(Optimizer):
         eps: float = 1e-6,
         weight_decay: float = 0.0,
         correct_bias: bool = True,
+        state_dtype: torch.dtype = None,
     ):
         if lr < 0.0:
             raise ValueError("Invalid learning rate: {} - should be >= 0.0".format(lr))
@@ -146,7 +155,9 @@ class AdamW(Optimizer):
             eps=eps,
             weight_decay=weight_decay,
             correct_bias=correct_bias,
+            state_dtype=state_dtype,
         )
+        is_low_precision_state(state_dtype)
         super().__init__(params, defaults)
 
     def step(self, closure: Callable = None):
@@ -192,7 +203,12 @@ class AdamW(Optimizer):
                 if hasattr(torch, "bfloat8") and p.data.dtype == torch.bfloat8:
                     data = state["master_copy"]
 
-                exp_avg, exp_avg_sq = state["exp_avg"], state["exp_avg_sq"]
+                state_dtype = group.get("state_dtype")
+                if is_low_precision_state(state_dtype):
+                    exp_avg = dequantize_state(state, "exp_avg", data, data.dtype)
+                    exp_avg_sq = dequantize_state(state, "exp_avg_sq", data, data.dtype)
+                else:
+                    exp_avg, exp_avg_sq = state["exp_avg"], state["exp_avg_sq"]
                 if data.dtype == torch.bfloat16:
                     low_bits = state["low_bits"]
                 beta1, beta2 = group["betas"]
@@ -255,6 +271,9 @@ class AdamW(Optimizer):
                     )
                     if hasattr(torch, "bfloat8") and p.data.dtype == torch.bfloat8:
                         p.data.copy_(state["master_copy"].to(torch.bfloat8))
+                if is_low_precision_state(state_dtype):
+                    quantize_state_(state, "exp_avg", exp_avg, state_dtype)
+                    quantize_state_(state, "exp_avg_sq", exp_avg_sq, state_dtype)
 
         return loss
 
@@ -324,6 +343,9 @@ class Lamb(Optimizer):
         weight_decay (float, optional): weight decay (L2 penalty) (default: 0)
         adam (bool, optional): always use trust ratio = 1, which turns this into
             Adam. Useful for comparison purposes.
+        state_dtype (torch.dtype, optional): dtype to keep the moments in
+            between the steps, torch.bfloat16 with stochastic rounding or
+            torch.int8 quantized block-wise (default: None)
 
     .. _Large Batch Optimization for Deep Learning: Training BERT in 76 minutes:
         https://arxiv.org/abs/1904.00962
@@ -338,6 +360,7 @@ class Lamb(Optimizer):
         weight_decay: float = 0.0,
         adam: bool = False,
         correct_bias: bool = True,
+        state_dtype: torch.dtype = None,
     ):
         if not 0.0 <= lr:
             raise ValueError("Invalid learning rate: {}".format(lr))
@@ -353,7 +376,9 @@ class Lamb(Optimizer):
             eps=eps,
             weight_decay=weight_decay,
             correct_bias=correct_bias,
+            state_dtype=state_dtype,
         )
+        is_low_precision_state(state_dtype)
         self.adam = adam
         super(Lamb, self).__init__(params, defaults)
 
@@ -392,7 +417,12 @@ class Lamb(Optimizer):
                         state["low_bits"] = torch.zeros_like(p.data)
                     state["weight_norm"] = -1.0
 
-                exp_avg, exp_avg_sq = state["exp_avg"], state["exp_avg_sq"]
+                state_dtype = group.get("state_dtype")
+                if is_low_precision_state(state_dtype):
+                    exp_avg = dequantize_state(state, "exp_avg", p.data, p.dtype)
+                    exp_avg_sq = dequantize_state(state, "exp_avg_sq", p.data, p.dtype)
+                else:
+                    exp_avg, exp_avg_sq = state["exp_avg"], state["exp_avg_sq"]
                 if p.data.dtype == torch.bfloat16:
                     low_bits = state["low_bits"]
                 beta1, beta2 = group["betas"]
@@ -428,6 +458,9 @@ class Lamb(Optimizer):
                         group["weight_decay"],
                         group["eps"],
                     )
+                if is_low_precision_state(state_dtype):
+                    quantize_state_(state, "exp_avg", exp_avg, state_dtype)
+                    quantize_state_(state, "exp_avg_sq", exp_avg_sq, state_dtype)
 
                 #  # Decay the first and second moment running average coefficient
                 #  if self.bf16:
@@ -0,0 +1,513 @@
+import inspect
+import json
+import os
+from collections import OrderedDict
+
+import torch
+
+_MODULE_RANGE_PREFIX = "ipex::module::"
+
+# element sizes of the dtype names recorded by the profiler
+_DTYPE_BYTES = {
+    "double": 8,
+    "float": 4,
+    "c10::BFloat16": 2,
+    "c10::Half": 2,
+    "c10::Float8_e4m3fn": 1,
+    "c10::Float8_e5m2": 1,
+    "long int": 8,
+    "int": 4,
+    "short int": 2,
+    "signed char": 1,
+    "unsigned char": 1,
+    "bool": 1,
+    "c10::qint8": 1,
+    "c10::quint8": 1,
+    "c10::qint32": 4,
+    "c10::complex<float>": 8,
+    "c10::complex<double>": 16,
+}
+
+
+def _numel(shape):
+    n = 1
+    for s in shape:
+        n *= s
+    return n
+
+
+def _is_shape(shape):
+    return isinstance(shape, (list, tuple)) and all(isinstance(s, int) for s in shape)
+
+
+def _gemm_info(name, input_shapes, concrete_inputs):
+    # Returns the GEMM problem (M, K, N) of a profiled op, or None if the op
+    # is not a GEMM or its shapes were not recorded.
+    shapes = [s if _is_shape(s) else [] for s in (input_shapes or [])]
+    if name in ["aten::mm", "aten::addmm", "aten::bmm", "aten::baddbmm"]:
+        if len(shapes) < (3 if "add" in name else 2):
+            return None
+        a, b = (shapes[1], shapes[2]) if "add" in name else (shapes[0], shapes[1])
+        if len(a) < 2 or len(b) < 2:
+            return None
+        batch = _numel(a[:-2])
+        return (batch * a[-2], a[-1], b[-1])
+    if name == "aten::matmul":
+        if len(shapes) < 2:
+            return None
+        a, b = shapes[0], shapes[1]
+        if len(a) < 1 or len(b) < 2:
+            return None
+        return (_numel(a[:-1]), a[-1], b[-1])
+    short_name = name.split("::")[-1]
+    if name.startswith("aten::linear") or (
+        name.startswith("torch_ipex::")
+        and ("linear" in short_name or "gemm" in short_name.lower())
+    ):
+        if not shapes or len(shapes[0]) < 1:
+            return None
+        m, k = _numel(shapes[0][:-1]), shapes[0][-1]
+        n = None
+        if concrete_inputs:
+            # prepacked kernels get out_features as the last int argument
+            for value in reversed(concrete_inputs):
+                if isinstance(value, int) and not isinstance(value, bool):
+                    n = value
+                    break
+        if n is None and len(shapes) > 1 and len(shapes[1]) == 2:
+            n = shapes[1][0] if shapes[1][1] == k else shapes[1][1]
+        if n is None:
+            return None
+        return (m, k, n)
+    return None
+
+
+def _op_bytes(input_shapes, dtypes, gemm):
+    # Bytes read from the tensor inputs of a profiled op, plus the output of
+    # a GEMM, or 0 if the shapes or dtypes were not recorded.
+    if not input_shapes or not dtypes:
+        return 0
+    total = 0
+    for shape, dtype in zip(input_shapes, dtypes):
+        if _is_shape(shape) and shape and dtype in _DTYPE_BYTES:
+            total += _numel(shape) * _DTYPE_BYTES[dtype]
+    if gemm is not None and total and dtypes[0] in _DTYPE_BYTES:
+        total += gemm[0] * gemm[2] * _DTYPE_BYTES[dtypes[0]]
+    return total
+
+
+def _source_ranges(classes):
+    # (file, first line, last line, class name) of the forward methods of
+    # `classes`, used to map TorchScript/python stack frames back to modules
+    ranges = []
+    for cls in classes:
+        try:
+            lines, start = inspect.getsourcelines(cls.forward)
+            ranges.append(
+                (
+                    os.path.realpath(inspect.getsourcefile(cls.forward)),
+                    start,
+                    start + len(lines) - 1,
+                    cls.__name__,
+                )
+            )
+        except (OSError, TypeError):
+            continue
+    return ranges
+
+
+def _default_annotated_classes():
+    classes = []
+    try:
+        from ...transformers.models.cpu.modules.attentions import _IPEXAttentionCPU
+        from ...transformers.models.cpu.modules.decoder import _IPEXDecoderLayerCPU
+
+        classes += [_IPEXAttentionCPU, _IPEXDecoderLayerCPU]
+    except ImportError:
+        pass
+    return classes
+
+
+class _OpRecord(object):
+    def __init__(self, event, module, block, dtypes=None):
+        self.name = event.name
+        self.thread = event.thread
+        self.start_us = event.time_range.start
+        self.duration_us = event.time_range.elapsed_us()
+        self.self_us = event.self_cpu_time_total
+        self.input_shapes = event.input_shapes
+        self.module = module
+        self.block = block
+        self.gemm = _gemm_info(
+            event.name, event.input_shapes, getattr(event, "concrete_inputs", None)
+        )
+        self.flops = 2 * _numel(self.gemm) if self.gemm is not None else 0
+        self.bytes = _op_bytes(event.input_shapes, dtypes, self.gemm)
+
+
+class _ModuleRecord(object):
+    def __init__(self, event, name, module_type, call):
+        self.name = name
+        self.type = module_type
+        self.thread = event.thread
+        self.start_us = event.time_range.start
+        self.duration_us = event.time_range.elapsed_us()
+        # the time of the child modules is subtracted in profile._collect
+        self.self_us = self.duration_us
+        self.gemm = call.get("gemm", None)
+        self.flops = 2 * _numel(self.gemm) if self.gemm is not None else 0
+        self.bytes = call.get("bytes", 0)
+
+
+def _tensor_bytes(t):
+    if isinstance(t, torch.Tensor) and t.layout == torch.strided:
+        return t.numel() * t.element_size()
+    return 0
+
+
+def _first_tensor(value):
+    if isinstance(value, torch.Tensor):
+        return value
+    if isinstance(value, (list, tuple)):
+        for v in value:
+            t = _first_tensor(v)
+            if t is not None:
+                return t
+    return None
+
+
+class profile(object):
+    """
+    Per-module and per-op latency profiler for optimized models.
+
+    It is built on ``torch.profiler`` and records the wall time of every
+    operator, including the ``torch.ops.torch_ipex.*`` custom ops. For eager
+    models, every submodule call is recorded too, with the GEMM shape
+    (M, K, N), achieved GFLOPS and memory bandwidth of linear-like modules
+    (modules having ``in_features`` and ``out_features``). Operators are
+    annotated with the innermost module running them and with the innermost
+    annotated block, by default ``_IPEXAttentionCPU`` and
+    ``_IPEXDecoderLayerCPU``. For TorchScript (traced and frozen) models the
+    blocks are found from the recorded source frames of the ops.
+
+    .. highlight:: python
+    .. code-block:: python
+
+        import intel_extension_for_pytorch as ipex
+        model(data)
+        with ipex.profiler.profile(model) as prof:
+            model(data)
+        print(prof.table(group_by="op"))
+        print(prof.table(group_by="module"))
+        prof.export_chrome_trace("trace.json")
+
+    Args:
+        model (torch.nn.Module): The profiled model, eager or TorchScript.
+            Modules are only recorded for eager models. Default is ``None``,
+            which records operators only.
+        annotated_classes (list): Module classes used to annotate operators.
+            Default is ``None``, meaning the IPEX LLM attention and decoder
+            layer classes plus, for eager models, every ``_IPEX*`` module.
+        record_shapes (bool): Record input shapes of the operators, needed
+            for GEMM shapes and GFLOPS of operators. Default is ``True``.
+
+    :meta public:
+    """
+
+    def __init__(self, model=None, annotated_classes=None, record_shapes=True):
+        self.model = model
+        self.record_shapes = record_shapes
+        self.is_script = isinstance(model, torch.jit.ScriptModule)
+        if annotated_classes is None:
+            annotated_classes = _default_annotated_classes()
+            if model is not None and not self.is_script:
+                for m in model.modules():
+                    if type(m).__name__.startswith("_IPEX"):
+                        annotated_classes.append(type(m))
+        self.annotated_classes = list(OrderedDict.fromkeys(annotated_classes))
+        self.ops = []
+        self.modules = []
+        self._handles = []
+        self._calls = {}
+        self._profiler = None
+
+    def _pre_hook(self, name):
+        def hook(module, args):
+            record = torch.autograd.profiler.record_function(
+                _MODULE_RANGE_PREFIX + name
+            )
+            record.__enter__()
+            self._calls.setdefault(name, []).append({"record": record, "args": args})
+
+        return hook
+
+    def _post_hook(self, name):
+        def hook(module, args, output):
+            call = self._calls[name][-1]
+            call.pop("record").__exit__(None, None, None)
+            call.pop("args")
+            if not (hasattr(module, "in_features") and hasattr(module, "out_features")):
+                return
+            x, y = _first_tensor(args), _first_tensor(output)
+            if x is None or y is None or x.dim() == 0:
+                return
+            call["gemm"] = (x.numel() // x.size(-1), x.size(-1), y.size(-1))
+            weight_bytes = sum(
+                _tensor_bytes(p) for p in module.parameters(recurse=False)
+            )
+            call["bytes"] = _tensor_bytes(x) + _tensor_bytes(y) + weight_bytes
+
+        return hook
+
+    def __enter__(self):
+        if self.model is not None and not self.is_script:
+            for name, module in self.model.named_modules():
+                self._handles.append(
+                    module.register_forward_pre_hook(self._pre_hook(name))
+                )
+                self._handles.append(
+                    module.register_forward_hook(self._post_hook(name))
+                )
+        self._profiler = torch.profiler.profile(
+            activities=[torch.profiler.ProfilerActivity.CPU],
+            record_shapes=self.record_shapes,
+            with_stack=self.is_script,
+        )
+        self._profiler.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._profiler.__exit__(exc_type, exc_val, exc_tb)
+        for handle in self._handles:
+            handle.remove()
+        self._handles = []
+        self._collect(self._profiler.events(), self._event_dtypes())
+        self._calls = {}
+        return False
+
+    def _event_dtypes(self):
+        # FunctionEvent does not keep the input dtypes, take them from the
+        # kineto events sharing its id
+        results = getattr(
+            getattr(self._profiler, "profiler", None), "kineto_results", None
+        )
+        if not self.record_shapes or results is None:
+            return {}
+        return {e.correlation_id(): e.dtypes() for e in results.events()}
+
+    def _collect(self, events, event_dtypes=None):
+        event_dtypes = event_dtypes or {}
+        module_types = {}
+        if self.model is not None and not self.is_script:
+            module_types = {name: type(m) for name, m in self.model.named_modules()}
+        annotated = tuple(self.annotated_classes)
+        source_ranges = _source_ranges(self.annotated_classes)
+        call_index = {}
+        module_records = {}
+        for event in sorted(events, key=lambda e: e.time_range.start):
+            if event.name.startswith(_MODULE_RANGE_PREFIX):
+                name = event.name[len(_MODULE_RANGE_PREFIX) :]
+                calls = self._calls.get(name, [])
+                index = call_index.get(name, 0)
+                call_index[name] = index + 1
+                call = calls[index] if index < len(calls) else {}
+                module_type = module_types.get(name, None)
+                record = _ModuleRecord(
+                    event,
+                    name,
+                    module_type.__name__ if module_type is not None else "",
+                    call,
+                )
+                self.modules.append(record)
+                module_records[id(event)] = (event, record)
+                continue
+            if event.name.startswith("ProfilerStep"):
+                continue
+            module, block = "", ""
+            parent = event.cpu_parent
+            while parent is not None:
+                if parent.name.startswith(_MODULE_RANGE_PREFIX):
+                    parent_name = parent.name[len(_MODULE_RANGE_PREFIX) :]
+                    if not module:
+                        module = parent_name
+                    if issubclass(module_types.get(parent_name, type(None)), annotated):
+                        block = parent_name
+                        break
+                parent = parent.cpu_parent
+            if not block and event.stack:
+                block = self._block_from_stack(event.stack, source_ranges)
+            self.ops.append(
+                _OpRecord(event, module, block, event_dtypes.get(event.id, None))
+            )
+        # the self time of a module excludes the calls of its child modules
+        for event, record in module_records.values():
+            parent = event.cpu_parent
+            while parent is not None:
+                if id(parent) in module_records:
+                    module_records[id(parent)][1].self_us -= record.duration_us
+                    break
+                parent = parent.cpu_parent
+
+    @staticmethod
+    def _block_from_stack(stack, source_ranges):
+        # stack frames look like "<file>(<line>): <function>", innermost first
+        for frame in stack:
+            location = frame.rsplit(": ", 1)[0]
+            if not location.endswith(")") or "(" not in location:
+                continue
+            path, line = location[:-1].rsplit("(", 1)
+            if not line.isdigit():
+                continue
+            path, line = os.path.realpath(path), int(line)
+            for file, start, end, class_name in source_ranges:
+                if path == file and start <= line <= end:
+                    return class_name
+        return ""
+
+    def key_averages(self, group_by="op"):
+        r"""
+        Aggregate the records. ``group_by`` is ``"op"`` (operator name),
+        ``"op_block"`` (operator name and annotated block), ``"module"``
+        (module name) or ``"module_type"`` (module class).
+
+        Returns:
+            A list of dicts with ``name``, ``calls``, ``total_us``,
+            ``self_us``, ``flops``, ``bytes``, ``gemm`` (set of shapes),
+            ``gflops`` and ``gbps``, sorted by total time. The bytes of an
+            operator are those of its tensor inputs, plus the output of a
+            GEMM, and need ``record_shapes``.
+        """
+        if group_by in ["op", "op_block"]:
+            records = self.ops
+        elif group_by in ["module", "module_type"]:
+            records = self.modules
+        else:
+            raise ValueError(
+                f"Unexpected group_by {group_by}. Options are 'op', 'op_block', "
+                + "'module', 'module_type'."
+            )
+        stats = OrderedDict()
+        for r in records:
+            if group_by == "op":
+                key = r.name
+            elif group_by == "op_block":
+                key = f"{r.name} [{r.block}]" if r.block else r.name
+            elif group_by == "module":
+                key = r.name or r.type
+            else:
+                key = r.type
+            s = stats.setdefault(
+                key,
+                {
+                    "name": key,
+                    "calls": 0,
+                    "total_us": 0.0,
+                    "self_us": 0.0,
+                    "flops": 0,
+                    "bytes": 0,
+                    "gemm": set(),
+                },
+            )
+            s["calls"] += 1
+            s["total_us"] += r.duration_us
+            s["self_us"] += getattr(r, "self_us", r.duration_us)
+            s["flops"] += r.flops
+            s["bytes"] += getattr(r, "bytes", 0)
+            if r.gemm is not None:
+                s["gemm"].add(r.gemm)
+        for s in stats.values():
+            seconds = s["total_us"] / 1e6
+            s["gflops"] = s["flops"] / seconds / 1e9 if seconds > 0 else 0.0
+            s["gbps"] = s["bytes"] / seconds / 1e9 if seconds > 0 else 0.0
+        return sorted(stats.values(), key=lambda s: s["total_us"], reverse=True)
+
+    def table(self, group_by="op", row_limit=-1):
+        r"""
+        Return the aggregated records of :meth:`key_averages` as a text table.
+        """
+        stats = self.key_averages(group_by)
+        if row_limit >= 0:
+            stats = stats[:row_limit]
+        header = [
+            "Name",
+            "Calls",
+            "Total ms",
+            "Self ms",
+            "Avg us",
+            "GFLOPS",
+            "GB/s",
+            "GEMM (M, K, N)",
+        ]
+        rows = []
+        for s in stats:
+            gemm = sorted(s["gemm"])
+            rows.append(
+                [
+                    s["name"],
+                    str(s["calls"]),
+                    f"{s['total_us'] / 1e3:.3f}",
+                    f"{s['self_us'] / 1e3:.3f}",
+                    f"{s['total_us'] / s['calls']:.1f}",
+                    f"{s['gflops']:.1f}" if s["flops"] else "-",
+                    f"{s['gbps']:.1f}" if s["bytes"] else "-",
+                    ", ".join(str(g) for g in gemm[:3])
+                    + (" ..." if len(gemm) > 3 else ""),
+                ]
+            )
+        widths = [
+            max([len(header[i])] + [len(row[i]) for row in rows])
+            for i in range(len(header))
+        ]
+        lines = ["  ".join(h.ljust(w) for h, w in zip(header, widths))]
+        lines.append("  ".join("-" * w for w in widths))
+        for row in rows:
+            lines.append("  ".join(c.ljust(w) for c, w in zip(row, widths)))
+        return "\n".join(lines)
+
+    def export_chrome_trace(self, path):
+        r"""
+        Export modules and operators as a chrome trace JSON file, which can
+        be opened by ``chrome://tracing`` or Perfetto.
+        """
+        trace_events = []
+        for r in self.modules:
+            args = {"type": r.type}
+            if r.gemm is not None:
+                args["gemm"] = list(r.gemm)
+                args["gflops"] = r.flops / r.duration_us / 1e3 if r.duration_us else 0
+                args["gbps"] = r.bytes / r.duration_us / 1e3 if r.duration_us else 0
+            trace_events.append(
+                {
+                    "name": r.name or r.type,
+                    "cat": "module",
+                    "ph": "X",
+                    "ts": r.start_us,
+                    "dur": r.duration_us,
+                    "pid": 0,
+                    "tid": r.thread,
+                    "args": args,
+                }
+            )
+        for r in self.ops:
+            args = {"module": r.module, "block": r.block}
+            if r.input_shapes:
+                args["input_shapes"] = str(r.input_shapes)
+            if r.gemm is not None:
+                args["gemm"] = list(r.gemm)
+                args["gflops"] = r.flops / r.duration_us / 1e3 if r.duration_us else 0
+            if r.bytes:
+                args["gbps"] = r.bytes / r.duration_us / 1e3 if r.duration_us else 0
+            trace_events.append(
+                {
+                    "name": r.name,
+                    "cat": "op",
+                    "ph": "X",
+                    "ts": r.start_us,
+                    "dur": r.duration_us,
+                    "pid": 0,
+                    "tid": r.thread,
+                    "args": args,
+                }
+            )
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace_events}, f)
@@ -12,10 +12,14 @@ from .optim._optimizer_utils import (
     IPEX_FUSED_OPTIMIZER_LIST_CPU,
     IPEX_FUSED_OPTIMIZER_LIST_XPU,
 )
+from .optim._flat_buffer import optimizer_flat_buffer
+from .optim._low_precision_state import optimizer_low_precision_state
 from .utils.channels_last_1d import to_channels_last_1d
 from .cpu.utils.linear_bn_folding import linear_bn_fuse
 from .cpu.graph_capture import GraphCapture
 from .nn.utils._lstm_convert import _LSTM, replace_lstm_with_ipex_lstm
+from .nn.utils._varlen_encoder import replace_encoder_with_varlen_encoder
+from .nn.utils._auto_kernel_tuning import auto_select_kernels
 from .nn.utils._weight_prepack import (
     _IPEXConv1d,
     _IPEXConv2d,
@@ -125,6 +129,7 @@ class _Properties(object):
         # optimizer opt conig
         self.split_master_weight_for_bf16 = None
         self.fuse_update_step = None
+        self.flat_buffer_update = None
         self.auto_kernel_selection = None
         self.graph_mode = None
 
@@ -140,9 +145,11 @@ class _O0:
         properties.optimize_lstm = False
         properties.split_master_weight_for_bf16 = False
         properties.fuse_update_step = False
+        properties.flat_buffer_update = False
         properties.auto_kernel_selection = False
         properties.graph_mode = False
         properties.concat_linear = False
+        properties.unpad = False
         return properties
 
 
@@ -157,13 +164,23 @@ class _O1:
         properties.optimize_lstm = True
         properties.split_master_weight_for_bf16 = True
         properties.fuse_update_step = True
+        properties.flat_buffer_update = False
         properties.auto_kernel_selection = False
         properties.graph_mode = False
         properties.concat_linear = False
+        properties.unpad = False
         return properties
 
 
-opt_levels = {"O0": _O0(), "O1": _O1()}
+# auto properties, O1 with kernels chosen per layer by benchmarking sample_input
+class _Auto(_O1):
+    def __call__(self, properties):
+        properties = super(_Auto, self).__call__(properties)
+        properties.opt_level = "auto"
+        return properties
+
+
+opt_levels = {"O0": _O0(), "O1": _O1(), "auto": _Auto()}
 
 
 def optimize(
@@ -179,10 +196,13 @@ def optimize(
     optimize_lstm=None,
     split_master_weight_for_bf16=None,
     fuse_update_step=None,
+    flat_buffer_update=None,
+    optimizer_state_dtype=None,
     auto_kernel_selection=None,
     sample_input=None,
     graph_mode=None,
     concat_linear=None,
+    unpad=None,
 ):
     r"""
     Apply optimizations at Python frontend to the given model (nn.Module), as
@@ -223,6 +243,13 @@ def optimize(
             optimizer. With ``"O1"``, the following optimizations are applied:
             conv+bn folding, weights prepack, dropout removal (inferenc model),
             master weight split and fused optimizer update step (training model).
+            ``"auto"`` [prototype] applies the ``"O1"`` optimizations to an
+            inference model and benchmarks ``sample_input`` to choose, per
+            Linear and Conv layer, the fastest of the plain, oneDNN, MKL and
+            TPP kernels and of channels_last and contiguous weights. Decisions
+            are cached per layer shape and ISA, and can be reused across
+            processes with ``ipex.save_kernel_decision_table`` and
+            ``ipex.load_kernel_decision_table``.
             The optimization options can be further overridden by setting the
             following options explicitly. The default value is ``"O1"``.
         inplace (bool): Whether to perform inplace optimization. Default value is
@@ -257,6 +284,28 @@ def optimize(
             which have better performance. It doesn't support all optimizers.
             The default value is ``None``. Explicitly setting this knob
             overwrites the configuration set by ``level`` knob.
+        flat_buffer_update (bool) [prototype]: Whether to store the params,
+            master weights or their trails, grads and states of the fused
+            optimizer in block aligned flat buffers, one per param group and
+            dtype, and update each of them with one fused kernel instead of
+            one kernel per param. It works for the fused SGD, Adagrad, Adam,
+            Lamb and Lars on CPU, prepacked weights keep the per param update.
+            A param without grad in a step is left untouched, as with the
+            per param update.
+            ``state_dict`` returns per param states as before. The default
+            value is ``None``. Explicitly setting this knob overwrites the
+            configuration set by ``level`` knob.
+        optimizer_state_dtype (torch.dtype) [prototype]: Dtype to keep the
+            moments of the fused Adam, AdamW and Lamb in, to save the memory
+            of the optimizer states. ``torch.bfloat16`` keeps them in
+            bfloat16 with stochastic rounding, ``torch.int8`` quantizes them
+            block-wise to 8 bits with a float scale per block of 256
+            elements. The moments of each param are updated in float by the
+            fused step and quantized back right after. It is set to the
+            ``"state_dtype"`` of each param group, which can be changed per
+            param group later. It requires ``fuse_update_step`` and doesn't
+            work with ``flat_buffer_update``. The default value is ``None``,
+            meaning float states.
         sample_input (tuple or torch.Tensor): Whether to feed sample input data to ipex.optimize. The shape of
             input data will impact the block format of packed weight. If not feed a sample
             input, Intel® Extension for PyTorch* will pack the weight per some predefined heuristics.
@@ -274,6 +323,12 @@ def optimize(
         concat_linear (bool): Whether to perform ``concat_linear``. It only
             works for inference model. The default value is ``None``. Explicitly
             setting this knob overwrites the configuration set by ``level`` knob.
+        unpad (bool) [prototype]: Whether to run BERT-family encoders on the valid
+            tokens of a padded batch only. The sequences are packed into one token
+            stream, linears run on the packed tokens and attention uses
+            ``ipex.llm.modules.VarlenAttention``. It only works for inference model
+            in eager mode. The default value is ``None``. Explicitly setting this
+            knob overwrites the configuration set by ``level`` knob.
 
     Returns:
         Model and optimizer (if given) modified according to the ``level`` knob
@@ -341,7 +396,7 @@ def optimize(
     opt_properties = _Properties()
     if level not in opt_levels:
         raise RuntimeError(
-            f"Unexpected optimization level {level}. Options are 'O0', 'O1'."
+            f"Unexpected optimization level {level}. Options are 'O0', 'O1', 'auto'."
         )
     else:
         opt_properties = opt_levels[level](opt_properties)
@@ -391,12 +446,25 @@ def optimize(
         opt_properties.split_master_weight_for_bf16 = split_master_weight_for_bf16
     if fuse_update_step is not None:
         opt_properties.fuse_update_step = fuse_update_step
+    if flat_buffer_update is not None:
+        opt_properties.flat_buffer_update = flat_buffer_update
     if auto_kernel_selection is not None:
         opt_properties.auto_kernel_selection = auto_kernel_selection
     if graph_mode is not None:
         opt_properties.graph_mode = graph_mode
     if concat_linear is not None:
         opt_properties.concat_linear = concat_linear
+    if unpad is not None:
+        opt_properties.unpad = unpad
+    if opt_properties.opt_level == "auto" and (
+        sample_input is None or model.training or device_type != "cpu"
+    ):
+        opt_properties.opt_level = "O1"
+        logger.warning(
+            "Optimization level 'auto' needs sample_input and only works for CPU inference "
+            + "model, falls back to 'O1'.",
+            _type=WarningType.MissingArgument,
+        )
 
     _disable_dnnl()
     if opt_properties.auto_kernel_selection:
@@ -473,6 +541,8 @@ def optimize(
             utils._model_convert.replace_dropout_with_identity(optimized_model)
         if opt_properties.concat_linear:
             optimized_model = _concat_linear(optimized_model, inplace=True)
+        if opt_properties.unpad:
+            replace_encoder_with_varlen_encoder(optimized_model)
         if dtype in (
             torch.bfloat16,
             torch.float16,
@@ -550,6 +620,9 @@ def optimize(
                 dtype,
             )
 
+    if opt_properties.opt_level == "auto" and opt_properties.weights_prepack:
+        auto_select_kernels(optimized_model)
+
     # Since TorchDynamo cannot handle custom operations yet, for the case of inference graph mode,
     # the weights prepacking here is temporarily cancelled, and it will be completed on the graph.
     if opt_properties.weights_prepack and device_type == "cpu":
@@ -599,6 +672,19 @@ def optimize(
             device_type,
             fuse_update_step,
         )
+        if opt_properties.flat_buffer_update:
+            optimized_optimizer = optimizer_flat_buffer(
+                optimized_optimizer,
+                device_type,
+                flat_buffer_update,
+            )
+    if optimizer_state_dtype is not None:
+        optimized_optimizer = optimizer_low_precision_state(
+            optimized_optimizer,
+            optimizer_state_dtype,
+            device_type,
+            optimizer_state_dtype,
+        )
     return optimized_model, optimized_optimizer
 
 
@@ -2,6 +2,7 @@ import warnings
 from .frontend import optimize
 from . import modules
 from . import functional
+from .activation_policy import ActivationPolicy
 
 try:
     from . import generation
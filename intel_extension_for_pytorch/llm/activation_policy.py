@@ -0,0 +1,383 @@
+import math
+import os
+import shutil
+import tempfile
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from torch.utils.checkpoint import checkpoint
+
+from ..utils._logger import logger, WarningType
+
+_MODES = ("keep", "bf16", "fp8", "offload", "recompute")
+# max magnitude of torch.float8_e4m3fn
+_FP8_MAX = 448.0
+
+
+class _LayerProfile(object):
+    def __init__(self):
+        # bytes of the saved float tensors by dtype, of the other saved
+        # tensors and of the tensor inputs of the layer
+        self.float_bytes = {}
+        self.other_bytes = 0
+        self.input_bytes = 0
+
+    def estimate(self, mode):
+        r"""Bytes of the activations the layer keeps in RAM with ``mode``."""
+        if mode == "recompute":
+            return self.input_bytes
+        float_bytes = sum(self.float_bytes.values())
+        if mode == "keep":
+            return float_bytes + self.other_bytes
+        if mode == "offload":
+            return self.other_bytes
+        itemsize = 2 if mode == "bf16" else 1
+        compressed = 0
+        for dtype, nbytes in self.float_bytes.items():
+            element_size = torch.finfo(dtype).bits // 8
+            compressed += nbytes // element_size * min(itemsize, element_size)
+        return compressed + self.other_bytes
+
+
+class _SpilledTensor(object):
+    r"""A saved tensor written to a file of the spill directory."""
+
+    def __init__(self, path, tensor):
+        self.path = path
+        self.shape = tensor.shape
+        self.dtype = tensor.dtype
+        self.future = None
+        with open(path, "wb") as f:
+            f.truncate(tensor.numel() * tensor.element_size())
+        if tensor.numel() > 0:
+            torch.from_file(
+                path, shared=True, size=tensor.numel(), dtype=tensor.dtype
+            ).copy_(tensor.reshape(-1))
+
+    def load(self):
+        numel = math.prod(self.shape)
+        if numel == 0:
+            return torch.empty(self.shape, dtype=self.dtype)
+        # read into RAM, the file is deleted with the handle
+        return (
+            torch.from_file(self.path, shared=True, size=numel, dtype=self.dtype)
+            .view(self.shape)
+            .clone()
+        )
+
+    def __del__(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class _StorageKeyedDict(object):
+    r"""
+    Values keyed by a view of a storage. The storage is held by a weak
+    reference, an entry of a freed storage is not returned for a new storage
+    allocated at the same address.
+    """
+
+    def __init__(self):
+        self._entries = {}
+
+    def get(self, tensor, key):
+        storage = tensor.untyped_storage()
+        entry = self._entries.get((storage.data_ptr(),) + key)
+        if entry is None or entry[0]() is not storage:
+            return None
+        return entry[1]
+
+    def set(self, tensor, key, value):
+        storage = tensor.untyped_storage()
+        self._entries[(storage.data_ptr(),) + key] = (weakref.ref(storage), value)
+
+
+class ActivationPolicy(object):
+    r"""
+    Per decoder layer policy for the activations saved for backward in LLM
+    fine-tuning. Each decoder layer either keeps its activations, compresses
+    the saved float tensors to bf16 or fp8 (``torch.float8_e4m3fn`` with a
+    scale per tensor), offloads them to memory-mapped files of a spill
+    directory, or recomputes them in backward as gradient checkpointing.
+
+    The offloaded activations of a layer are read back by a background thread
+    as soon as backward reaches the layer after it, so the reads overlap with
+    the backward of that layer. The weights of the layer saved for backward
+    are never compressed or offloaded.
+
+    The modes are either given per layer, or chosen from ``memory_budget_mb``
+    after profiling the bytes saved by each layer in the first forward, which
+    keeps all activations. Layers are moved to the next mode of
+    ``escalation`` in forward order, the first layers first, until the
+    estimated activation memory fits the budget.
+
+    The policy is used as the gradient checkpointing function of a
+    ``transformers`` model, by passing it in ``gradient_checkpointing_kwargs``
+    to ``gradient_checkpointing_enable`` after ``import
+    intel_extension_for_pytorch.llm``. It can also be called directly as
+    ``policy(layer, *args, **kwargs)`` in a custom training loop.
+
+    Args:
+        memory_budget_mb (float): Memory budget in MB of the activations of
+            the decoder layers. The default value is ``None``, meaning all
+            layers use ``layer_modes`` or keep their activations.
+        layer_modes (list of str): Mode of each decoder layer in forward
+            order, one of ``"keep"``, ``"bf16"``, ``"fp8"``, ``"offload"`` and
+            ``"recompute"``. The default value is ``None``.
+        escalation (tuple of str): Modes tried in order for the layers which
+            do not fit ``memory_budget_mb``. The default value is
+            ``("bf16", "fp8", "offload", "recompute")``.
+        offload_dir (str): Directory of the spill files of ``"offload"``. The
+            default value is ``None``, meaning the temporary directory.
+        prefetch_layers (int): Number of layers to read back ahead of
+            backward. The default value is 1.
+        min_tensor_bytes (int): Saved tensors smaller than this are always
+            kept. The default value is 1MB.
+        checkpoint_kwargs (dict): Keyword arguments of
+            ``torch.utils.checkpoint.checkpoint`` for ``"recompute"``. The
+            default value is ``None``, meaning ``{"use_reentrant": False}``.
+
+    Examples:
+
+        >>> import intel_extension_for_pytorch.llm
+        >>> policy = ipex.llm.ActivationPolicy(memory_budget_mb=8192)
+        >>> model.gradient_checkpointing_enable(
+        ...     gradient_checkpointing_kwargs={"activation_policy": policy}
+        ... )
+    """
+
+    def __init__(
+        self,
+        memory_budget_mb=None,
+        layer_modes=None,
+        escalation=("bf16", "fp8", "offload", "recompute"),
+        offload_dir=None,
+        prefetch_layers=1,
+        min_tensor_bytes=1 << 20,
+        checkpoint_kwargs=None,
+    ):
+        for mode in list(layer_modes or []) + list(escalation):
+            if mode not in _MODES:
+                raise ValueError(
+                    f"Unknown activation mode {mode}, expected one of {_MODES}"
+                )
+        if not hasattr(torch, "float8_e4m3fn"):
+            if "fp8" in (layer_modes or []):
+                raise ValueError("fp8 activations need torch.float8_e4m3fn")
+            escalation = tuple(mode for mode in escalation if mode != "fp8")
+        self.memory_budget = (
+            None if memory_budget_mb is None else int(memory_budget_mb * 1024 * 1024)
+        )
+        self.layer_modes = list(layer_modes) if layer_modes is not None else None
+        self.escalation = tuple(escalation)
+        self.prefetch_layers = prefetch_layers
+        self.min_tensor_bytes = min_tensor_bytes
+        self.checkpoint_kwargs = (
+            {"use_reentrant": False} if checkpoint_kwargs is None else checkpoint_kwargs
+        )
+        self.offload_dir = offload_dir
+        self._spill_dir = None
+        self._num_spilled = 0
+        self._executor = None
+        # layers in the order of their first forward
+        self._layer_index = {}
+        self._profiles = None
+        self._spilled = {}
+
+    def _get_layer_index(self, layer):
+        if layer not in self._layer_index:
+            self._layer_index[layer] = len(self._layer_index)
+        elif self._layer_index[layer] == 0 and self._profiles is not None:
+            # a new forward, the profile of the first one is complete
+            self._plan_from_profiles()
+        return self._layer_index[layer]
+
+    def mode(self, layer_idx):
+        r"""Mode of the decoder layer ``layer_idx`` in forward order."""
+        if self.layer_modes is None or layer_idx >= len(self.layer_modes):
+            return "keep"
+        return self.layer_modes[layer_idx]
+
+    def _plan(self, profiles):
+        r"""
+        Choose the mode of each layer from the bytes it saves for backward,
+        so that the estimated activation memory fits ``memory_budget_mb``.
+        """
+        modes = ["keep"] * len(profiles)
+        total = sum(profile.estimate("keep") for profile in profiles)
+        for mode in self.escalation:
+            for idx, profile in enumerate(profiles):
+                if total <= self.memory_budget:
+                    break
+                saved = profile.estimate(modes[idx]) - profile.estimate(mode)
+                if saved > 0:
+                    total -= saved
+                    modes[idx] = mode
+        if total > self.memory_budget:
+            logger.warning(
+                "The activations of the decoder layers take an estimated "
+                + f"{total / 1024 / 1024:.0f}MB with all layers in the last mode, "
+                + "more than the memory budget.",
+                _type=WarningType.NotSupported,
+            )
+        self.layer_modes = modes
+        return modes
+
+    def _plan_from_profiles(self):
+        profiles = [self._profiles[idx] for idx in sorted(self._profiles)]
+        self._profiles = None
+        self._plan(profiles)
+        logger.info(f"Activation modes of the decoder layers: {self.layer_modes}")
+
+    def _is_kept(self, tensor, weights):
+        return (
+            not tensor.is_floating_point()
+            or tensor.device.type != "cpu"
+            or tensor.numel() * tensor.element_size() < self.min_tensor_bytes
+            or tensor.untyped_storage().data_ptr() in weights
+        )
+
+    def _profile_hooks(self, layer_idx, weights):
+        profile = self._profiles.setdefault(layer_idx, _LayerProfile())
+        seen = _StorageKeyedDict()
+
+        def pack(tensor):
+            key = (tensor.storage_offset(),)
+            if (
+                tensor.untyped_storage().data_ptr() not in weights
+                and seen.get(tensor, key) is None
+            ):
+                seen.set(tensor, key, True)
+                nbytes = tensor.numel() * tensor.element_size()
+                if self._is_kept(tensor, weights):
+                    profile.other_bytes += nbytes
+                else:
+                    profile.float_bytes[tensor.dtype] = (
+                        profile.float_bytes.get(tensor.dtype, 0) + nbytes
+                    )
+            return tensor
+
+        return pack, lambda tensor: tensor
+
+    def _spill(self, tensor):
+        if self._spill_dir is None:
+            base_dir = self.offload_dir or tempfile.gettempdir()
+            os.makedirs(base_dir, exist_ok=True)
+            self._spill_dir = tempfile.mkdtemp(prefix="ipex_activations_", dir=base_dir)
+            self._executor = ThreadPoolExecutor(max_workers=1)
+        path = os.path.join(self._spill_dir, f"{self._num_spilled}.bin")
+        self._num_spilled += 1
+        return _SpilledTensor(path, tensor.detach())
+
+    def _prefetch(self, layer_idx):
+        for idx in range(layer_idx, layer_idx - self.prefetch_layers - 1, -1):
+            for handle in self._spilled.get(idx, []):
+                if handle.future is None:
+                    handle.future = self._executor.submit(handle.load)
+
+    def _compress_hooks(self, layer_idx, mode, weights):
+        # the same tensor saved by several ops is packed once
+        packed = _StorageKeyedDict()
+        if mode == "offload":
+            self._spilled[layer_idx] = []
+
+        def pack(tensor):
+            if self._is_kept(tensor, weights):
+                return tensor
+            key = (
+                tensor.storage_offset(),
+                tuple(tensor.shape),
+                tuple(tensor.stride()),
+                tensor._version,
+            )
+            result = packed.get(tensor, key)
+            if result is not None:
+                return result
+            if mode == "bf16":
+                if tensor.dtype == torch.bfloat16:
+                    return tensor
+                result = (mode, tensor.dtype, tensor.to(torch.bfloat16))
+            elif mode == "fp8":
+                scale = tensor.detach().abs().amax().float().clamp(min=1e-12) / _FP8_MAX
+                result = (
+                    mode,
+                    tensor.dtype,
+                    (tensor.detach() / scale).to(torch.float8_e4m3fn),
+                    scale,
+                )
+            else:
+                handle = self._spill(tensor)
+                self._spilled[layer_idx].append(handle)
+                result = (mode, layer_idx, handle)
+            packed.set(tensor, key, result)
+            return result
+
+        def unpack(packed_tensor):
+            if isinstance(packed_tensor, torch.Tensor):
+                return packed_tensor
+            if packed_tensor[0] == "bf16":
+                return packed_tensor[2].to(packed_tensor[1])
+            if packed_tensor[0] == "fp8":
+                _, dtype, tensor, scale = packed_tensor
+                return (tensor.float() * scale).to(dtype)
+            _, idx, handle = packed_tensor
+            self._prefetch(idx)
+            tensor = handle.load() if handle.future is None else handle.future.result()
+            # read again if unpacked once more, e.g. with retain_graph, the
+            # file is deleted with the handle once autograd frees it
+            handle.future = None
+            if handle in self._spilled.get(idx, []):
+                self._spilled[idx].remove(handle)
+            return tensor
+
+        return pack, unpack
+
+    def __call__(self, function, *args, **kwargs):
+        r"""
+        Run ``function``, the ``__call__`` of a decoder layer or a function
+        of it, with the activation mode of the layer.
+        """
+        layer = getattr(function, "__self__", function)
+        layer_idx = self._get_layer_index(layer)
+        weights = (
+            {p.untyped_storage().data_ptr() for p in layer.parameters()}
+            if isinstance(layer, torch.nn.Module)
+            else set()
+        )
+        if self.layer_modes is None and self.memory_budget is not None:
+            if self._profiles is None:
+                self._profiles = {}
+            self._profiles.setdefault(layer_idx, _LayerProfile()).input_bytes = sum(
+                a.numel() * a.element_size()
+                for a in list(args) + list(kwargs.values())
+                if isinstance(a, torch.Tensor)
+            )
+            with torch.autograd.graph.saved_tensors_hooks(
+                *self._profile_hooks(layer_idx, weights)
+            ):
+                return function(*args, **kwargs)
+
+        mode = self.mode(layer_idx)
+        if mode == "keep":
+            return function(*args, **kwargs)
+        if mode == "recompute":
+            return checkpoint(function, *args, **self.checkpoint_kwargs, **kwargs)
+        with torch.autograd.graph.saved_tensors_hooks(
+            *self._compress_hooks(layer_idx, mode, weights)
+        ):
+            return function(*args, **kwargs)
+
+    def close(self):
+        r"""
+        Remove the spill directory of ``"offload"``.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._spilled = {}
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
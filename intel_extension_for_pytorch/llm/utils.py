@@ -57,6 +57,8 @@ def _gradient_checkpointing_enable(self, gradient_checkpointing_kwargs=None):
     Args:
         gradient_checkpointing_kwargs (dict, *optional*):
             Additional keyword arguments passed along to the `torch.utils.checkpoint.checkpoint` function.
+            An `ipex.llm.ActivationPolicy` under the key "activation_policy" chooses per decoder layer
+            between keeping, compressing, offloading and recomputing the activations.
     """
     if not self.supports_gradient_checkpointing:
         raise ValueError(
@@ -65,10 +67,18 @@ def _gradient_checkpointing_enable(self, gradient_checkpointing_kwargs=None):
 
     if gradient_checkpointing_kwargs is None:
         gradient_checkpointing_kwargs = {}
+    gradient_checkpointing_kwargs = dict(gradient_checkpointing_kwargs)
+    activation_policy = gradient_checkpointing_kwargs.pop("activation_policy", None)
 
-    gradient_checkpointing_func = functools.partial(
-        checkpoint, **gradient_checkpointing_kwargs
-    )
+    if activation_policy is not None:
+        activation_policy.checkpoint_kwargs = dict(
+            activation_policy.checkpoint_kwargs, **gradient_checkpointing_kwargs
+        )
+        gradient_checkpointing_func = activation_policy
+    else:
+        gradient_checkpointing_func = functools.partial(
+            checkpoint, **gradient_checkpointing_kwargs
+        )
 
     # For old GC format (transformers < 4.35.0) for models that live on the Hub
     # we will fall back to the overwritten `_set_gradient_checkpointing` methid
@@ -81,6 +91,12 @@ def _gradient_checkpointing_enable(self, gradient_checkpointing_kwargs=None):
             enable=True, gradient_checkpointing_func=gradient_checkpointing_func
         )
     else:
+        if activation_policy is not None:
+            logger.warning(
+                "The activation policy is not supported by the old gradient checkpointing format "
+                + "of transformers < 4.35.0, will recompute all decoder layers.",
+                _type=WarningType.NotSupported,
+            )
         self.apply(partial(self._set_gradient_checkpointing, value=True))
 
     if getattr(self, "_hf_peft_config_loaded", False):
@@ -1,4 +1,4 @@
 from ...cpu.nn import _embeddingbag
-from . import _tensor_method
+from ... import _tensor_method
 from ...cpu.nn.interaction import interaction, InteractionFunc
 from ...cpu.nn import _roi_align_helper
@@ -3,7 +3,12 @@ from ...cpu.nn import _roi_align
 from .merged_embeddingbag import MergedEmbeddingBagWithSGD
 from .merged_embeddingbag import MergedEmbeddingBag
 from .merged_embeddingbag import MergedEmbeddingBagWithCat
+from .merged_embeddingbag import MergedEmbeddingBagWithInteraction
 from .merged_embeddingbag import MergedEmbeddingBagWithAdaGrad
 from .merged_embeddingbag import DistMergeEmbeddingBagWithAdaGrad
+from .embedding_sharding import ShardingPlan
+from .embedding_sharding import EmbeddingShardingPlanner
+from .embedding_sharding import simulate_sharding
+from .sparse_input_pipeline import SparseInputPipeline
 from ...cpu.nn.linear_fuse_eltwise import IPEXLinearEltwise
 from .weight_only_quantization import WeightOnlyQuantizedLinear
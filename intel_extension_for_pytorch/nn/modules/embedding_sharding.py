@@ -0,0 +1,418 @@
+from typing import List, Optional
+
+import torch
+
+TABLE_WISE = "table"
+ROW_WISE = "row"
+
+
+def _index_bytes(dtype):
+    return torch.empty(0, dtype=dtype).element_size()
+
+
+def _row_bytes(embedding_dim, dtype):
+    # weight, bf16 trail and AdaGrad hessian of a row of
+    # DistMergeEmbeddingBagWithAdaGrad
+    if dtype == torch.bfloat16:
+        return embedding_dim * (2 + 2 + 4)
+    return embedding_dim * 2 * _index_bytes(dtype)
+
+
+class ShardingPlan(object):
+    r"""
+    The placement of the rows of all tables of a
+    :class:`DistMergeEmbeddingBagWithAdaGrad` on the ranks, made by
+    :class:`EmbeddingShardingPlanner`.
+
+    A table is placed table-wise, i.e. all its rows on one rank, or row-wise,
+    i.e. its rows spread over all ranks. The distributed kernels place the
+    row ``r`` of the merged table on the rank ``r % world_size`` at its local
+    row ``r // world_size``. The plan maps every merged row to such a
+    position on its rank, the module remaps the indices through it.
+
+    Args:
+        world_size (int): The number of ranks.
+        num_embeddings (List[int]): The number of rows of each table.
+        strategies (List[str]): ``"table"`` or ``"row"`` for each table.
+        row_ranks (Tensor): The rank of each row of the merged table.
+    """
+
+    def __init__(
+        self,
+        world_size: int,
+        num_embeddings: List[int],
+        strategies: List[str],
+        row_ranks: torch.Tensor,
+    ):
+        assert len(strategies) == len(num_embeddings), "expect a strategy per table"
+        assert row_ranks.numel() == sum(
+            num_embeddings
+        ), "expect a rank for every row of the merged table"
+        self.world_size = world_size
+        self.num_embeddings = list(num_embeddings)
+        self.strategies = list(strategies)
+        self.row_ranks = row_ranks.to(torch.int64)
+        self.row_offsets = [0]
+        for n in self.num_embeddings:
+            self.row_offsets.append(self.row_offsets[-1] + n)
+        # the rows of a rank keep their order in the merged table
+        order = torch.sort(self.row_ranks, stable=True).indices
+        counts = torch.bincount(self.row_ranks, minlength=world_size)
+        starts = torch.cumsum(counts, 0) - counts
+        local = torch.empty_like(order)
+        local[order] = torch.arange(order.numel()) - starts[self.row_ranks[order]]
+        self.row_positions = local * world_size + self.row_ranks
+        self._order = order
+        self._counts = counts
+
+    @classmethod
+    def round_robin(cls, num_embeddings: List[int], world_size: int):
+        r"""
+        The default placement of :class:`DistMergeEmbeddingBagWithAdaGrad`,
+        the rows of the merged table are dealt to the ranks in turn.
+        """
+        row_ranks = torch.arange(sum(num_embeddings)) % world_size
+        return cls(
+            world_size, num_embeddings, [ROW_WISE] * len(num_embeddings), row_ranks
+        )
+
+    def table_rank(self, table):
+        r"""
+        The rank of a table-wise table, ``None`` for a row-wise one.
+        """
+        if self.strategies[table] != TABLE_WISE:
+            return None
+        return int(self.row_ranks[self.row_offsets[table]])
+
+    def local_rows(self, rank):
+        r"""
+        The rows of the merged table kept by ``rank``, in their local order.
+        """
+        start = int(self._counts[:rank].sum())
+        return self._order[start : start + int(self._counts[rank])]
+
+    def lookup_shares(self, table, row_frequencies=None):
+        r"""
+        The fraction of the lookups of ``table`` served by each rank, with
+        uniformly accessed rows if ``row_frequencies`` is not given.
+        """
+        ranks = self.row_ranks[self.row_offsets[table] : self.row_offsets[table + 1]]
+        weights = None if row_frequencies is None else row_frequencies.double()
+        shares = torch.bincount(ranks, weights=weights, minlength=self.world_size)
+        return shares.double() / shares.sum().clamp(min=1e-12)
+
+    def state_dict(self):
+        return {
+            "world_size": self.world_size,
+            "num_embeddings": self.num_embeddings,
+            "strategies": self.strategies,
+            "row_ranks": self.row_ranks,
+        }
+
+    @classmethod
+    def from_state_dict(cls, state_dict):
+        return cls(**state_dict)
+
+    def __repr__(self):
+        tables = []
+        for table, strategy in enumerate(self.strategies):
+            if strategy == TABLE_WISE:
+                tables.append(
+                    "table{}: table-wise on rank {}".format(
+                        table, self.table_rank(table)
+                    )
+                )
+            else:
+                tables.append("table{}: row-wise".format(table))
+        return "ShardingPlan(world_size={}\n  {}\n)".format(
+            self.world_size, "\n  ".join(tables)
+        )
+
+
+class EmbeddingShardingPlanner(object):
+    r"""
+    Plan the placement of the tables of a
+    :class:`DistMergeEmbeddingBagWithAdaGrad` from their sizes and an access
+    profile, to balance the memory and the lookups of the ranks with as few
+    all-to-all bytes as possible.
+
+    A table-wise table sends one partially pooled row per sample to the rank
+    owning the sample, the fewest bytes possible, but its memory and lookups
+    all land on one rank. A row-wise table spreads them over all ranks, but
+    a bag of it is pooled partially on every rank owning one of its rows. The
+    planner places all tables table-wise, the heaviest first on the least
+    loaded rank, and turns the tables of the most loaded rank row-wise, the
+    heaviest first, while the memory or the lookups of a rank exceed the mean
+    by more than ``imbalance_tolerance`` or the memory exceeds
+    ``memory_budget``. The rows of a row-wise table are dealt to the ranks
+    from the hottest one on, so that the lookups of its hot rows are spread
+    as well.
+
+        >>> planner = EmbeddingShardingPlanner(world_size, embedding_dim, batch_size=global_batch_size)
+        >>> plan = planner.plan(num_embeddings, pooling_factors=multi_hot)
+        >>> print(planner.estimate(plan, pooling_factors=multi_hot))
+        >>> emb = DistMergeEmbeddingBagWithAdaGrad.from_embeddingbag_list(EmbLists, sharding_plan=plan)
+
+    Args:
+        world_size (int): The number of ranks.
+        embedding_dim (int): The embedding dim of the tables.
+        batch_size (int): The global batch size.
+        dtype (torch.dtype): The dtype of the weights. Default: ``torch.float``.
+        index_dtype (torch.dtype): The dtype of the indices. Default:
+            ``torch.int64``.
+        memory_budget (int, optional): The bytes of weights and optimizer
+            states a rank can keep. Default: ``None``.
+        imbalance_tolerance (float): The tolerated excess of a rank over the
+            mean. Default: 0.1.
+    """
+
+    def __init__(
+        self,
+        world_size: int,
+        embedding_dim: int,
+        batch_size: int,
+        dtype: torch.dtype = torch.float,
+        index_dtype: torch.dtype = torch.int64,
+        memory_budget: Optional[int] = None,
+        imbalance_tolerance: float = 0.1,
+    ):
+        assert world_size > 0, "world_size should be positive"
+        assert batch_size % world_size == 0, "expect batch_size % world_size == 0"
+        self.world_size = world_size
+        self.embedding_dim = embedding_dim
+        self.batch_size = batch_size
+        self.dtype = dtype
+        self.index_dtype = index_dtype
+        self.memory_budget = memory_budget
+        self.imbalance_tolerance = imbalance_tolerance
+
+    def _row_wise_ranks(self, num_embeddings, row_frequencies):
+        # deal the rows from the hottest one on in a snake order, every rank
+        # gets the same number of rows and about the same lookups
+        if row_frequencies is None:
+            return torch.arange(num_embeddings) % self.world_size
+        order = torch.argsort(row_frequencies.double(), descending=True, stable=True)
+        turn = torch.arange(num_embeddings)
+        snake = turn % self.world_size
+        reverse = (turn // self.world_size) % 2 == 1
+        snake[reverse] = self.world_size - 1 - snake[reverse]
+        ranks = torch.empty(num_embeddings, dtype=torch.int64)
+        ranks[order] = snake
+        return ranks
+
+    def plan(
+        self,
+        num_embeddings: List[int],
+        pooling_factors: Optional[List[float]] = None,
+        row_frequencies: Optional[List[Optional[torch.Tensor]]] = None,
+        strategy: str = "auto",
+    ) -> ShardingPlan:
+        r"""
+        Args:
+            num_embeddings (List[int]): The number of rows of each table.
+            pooling_factors (List[float], optional): The mean number of
+                lookups of each table in a sample. Default: 1 for all tables.
+            row_frequencies (List[Tensor], optional): The access count of
+                each row of a table, ``None`` for uniformly accessed tables.
+            strategy (str): ``"auto"`` for the hybrid placement, ``"table"``
+                or ``"row"`` to place all tables table-wise or row-wise.
+                Default: ``"auto"``.
+        """
+        assert strategy in (
+            "auto",
+            TABLE_WISE,
+            ROW_WISE,
+        ), "strategy should be 'auto', 'table' or 'row'"
+        n_tables = len(num_embeddings)
+        if pooling_factors is None:
+            pooling_factors = [1.0] * n_tables
+        if row_frequencies is None:
+            row_frequencies = [None] * n_tables
+        ws = self.world_size
+        row_bytes = _row_bytes(self.embedding_dim, self.dtype)
+        memory = [n * row_bytes for n in num_embeddings]
+        lookups = [self.batch_size * h for h in pooling_factors]
+
+        row_wise = [strategy == ROW_WISE] * n_tables
+        while True:
+            # memory and lookups of the ranks from the row-wise tables
+            rank_memory = [0.0] * ws
+            rank_lookups = [0.0] * ws
+            for t in range(n_tables):
+                if row_wise[t]:
+                    ranks = self._row_wise_ranks(num_embeddings[t], row_frequencies[t])
+                    counts = torch.bincount(ranks, minlength=ws)
+                    weights = row_frequencies[t]
+                    shares = torch.bincount(
+                        ranks,
+                        weights=None if weights is None else weights.double(),
+                        minlength=ws,
+                    ).double()
+                    shares /= shares.sum().clamp(min=1e-12)
+                    for r in range(ws):
+                        rank_memory[r] += float(counts[r]) * row_bytes
+                        rank_lookups[r] += float(shares[r]) * lookups[t]
+            # longest processing time first for the table-wise tables
+            table_ranks = [None] * n_tables
+            mean_memory = sum(memory) / ws
+            mean_lookups = max(sum(lookups) / ws, 1e-12)
+            for t in sorted(
+                (t for t in range(n_tables) if not row_wise[t]),
+                key=lambda t: (lookups[t] / mean_lookups + memory[t] / mean_memory),
+                reverse=True,
+            ):
+                r = min(
+                    range(ws),
+                    key=lambda r: (rank_lookups[r] + lookups[t]) / mean_lookups
+                    + (rank_memory[r] + memory[t]) / mean_memory,
+                )
+                table_ranks[t] = r
+                rank_memory[r] += memory[t]
+                rank_lookups[r] += lookups[t]
+            if strategy != "auto":
+                break
+            limit = 1 + self.imbalance_tolerance
+            over_memory = max(rank_memory) > limit * mean_memory or (
+                self.memory_budget is not None and max(rank_memory) > self.memory_budget
+            )
+            over_lookups = max(rank_lookups) > limit * mean_lookups
+            if not over_memory and not over_lookups:
+                break
+            if self.memory_budget is not None and max(rank_memory) > self.memory_budget:
+                worst = max(range(ws), key=lambda r: rank_memory[r])
+            else:
+                worst = max(
+                    range(ws),
+                    key=lambda r: max(
+                        rank_memory[r] / mean_memory, rank_lookups[r] / mean_lookups
+                    ),
+                )
+            candidates = [t for t in range(n_tables) if table_ranks[t] == worst]
+            if not candidates:
+                break
+            heaviest = max(
+                candidates,
+                key=lambda t: lookups[t] / mean_lookups + memory[t] / mean_memory,
+            )
+            row_wise[heaviest] = True
+
+        row_ranks = []
+        strategies = []
+        for t in range(n_tables):
+            if row_wise[t]:
+                strategies.append(ROW_WISE)
+                row_ranks.append(
+                    self._row_wise_ranks(num_embeddings[t], row_frequencies[t])
+                )
+            else:
+                strategies.append(TABLE_WISE)
+                row_ranks.append(
+                    torch.full((num_embeddings[t],), table_ranks[t], dtype=torch.int64)
+                )
+        return ShardingPlan(ws, num_embeddings, strategies, torch.cat(row_ranks))
+
+    def estimate(
+        self,
+        plan: ShardingPlan,
+        pooling_factors: Optional[List[float]] = None,
+        row_frequencies: Optional[List[Optional[torch.Tensor]]] = None,
+    ):
+        r"""
+        Estimate the memory and the lookups of each rank and the all-to-all
+        bytes of a step of ``plan``. A bag of ``h`` lookups is pooled on a
+        rank serving a share ``p`` of the lookups of its table with the
+        probability ``1 - (1 - p) ^ h``, and the partially pooled row is sent
+        unless the rank owns the sample, i.e. with the probability
+        ``(world_size - 1) / world_size``. The backward sends as many bytes
+        back.
+
+        Returns:
+            A dict of the ``"memory_bytes"`` and ``"lookups"`` of each rank,
+            the ``"sent_bytes"`` of the forward of each rank and the total
+            ``"all_to_all_bytes"`` of the forward and the backward.
+        """
+        n_tables = len(plan.num_embeddings)
+        if pooling_factors is None:
+            pooling_factors = [1.0] * n_tables
+        if row_frequencies is None:
+            row_frequencies = [None] * n_tables
+        ws = plan.world_size
+        row_bytes = _row_bytes(self.embedding_dim, self.dtype)
+        partial_bytes = self.embedding_dim * _index_bytes(self.dtype) + _index_bytes(
+            self.index_dtype
+        )
+        memory = (torch.bincount(plan.row_ranks, minlength=ws) * row_bytes).tolist()
+        lookups = torch.zeros(ws, dtype=torch.double)
+        sent = torch.zeros(ws, dtype=torch.double)
+        for t in range(n_tables):
+            shares = plan.lookup_shares(t, row_frequencies[t])
+            h = pooling_factors[t]
+            lookups += shares * self.batch_size * h
+            hit = 1 - (1 - shares).pow(h)
+            sent += hit * self.batch_size * (ws - 1) / ws * partial_bytes
+        return {
+            "memory_bytes": memory,
+            "lookups": lookups.tolist(),
+            "sent_bytes": sent.tolist(),
+            "all_to_all_bytes": 2 * float(sent.sum()),
+        }
+
+
+def simulate_sharding(
+    plan: ShardingPlan,
+    batches,
+    embedding_dim: int,
+    dtype: torch.dtype = torch.float,
+    include_last_offset: bool = False,
+):
+    r"""
+    Replay ``batches`` of ``(indices, offsets)`` of the global batch on
+    ``plan`` offline and count the lookups of each rank and the bytes sent and
+    received in the all-to-all of the forward, as the distributed kernels do:
+    a rank sends one partially pooled row for every bag with a row on it to
+    the rank owning the sample, the samples being split evenly over the ranks.
+    The backward sends the same bytes back.
+
+    Returns:
+        A dict of the ``"memory_bytes"`` of each rank and the ``"lookups"``,
+        ``"sent_bytes"`` and ``"received_bytes"`` of each rank, and the total
+        ``"all_to_all_bytes"`` of the forward and the backward, per batch.
+    """
+    ws = plan.world_size
+    row_bytes = _row_bytes(embedding_dim, dtype)
+    lookups = torch.zeros(ws, dtype=torch.double)
+    sent = torch.zeros(ws, dtype=torch.double)
+    received = torch.zeros(ws, dtype=torch.double)
+    n_batches = 0
+    for indices, offsets in batches:
+        n_batches += 1
+        partial_bytes = embedding_dim * _index_bytes(dtype) + _index_bytes(
+            indices[0].dtype
+        )
+        for t, (index, offset) in enumerate(zip(indices, offsets)):
+            index = index.to(torch.int64)
+            offset = offset.to(torch.int64)
+            if include_last_offset:
+                offset = offset[:-1]
+            batch_size = offset.numel()
+            local_batch = batch_size // ws
+            lengths = torch.diff(offset, append=offset.new_tensor([index.numel()]))
+            samples = torch.repeat_interleave(torch.arange(batch_size), lengths)
+            ranks = plan.row_ranks[index + plan.row_offsets[t]]
+            lookups += torch.bincount(ranks, minlength=ws)
+            pooled = torch.unique(samples * ws + ranks)
+            src = pooled % ws
+            dst = pooled // ws // local_batch
+            remote = src != dst
+            sent += torch.bincount(src[remote], minlength=ws) * partial_bytes
+            received += torch.bincount(dst[remote], minlength=ws) * partial_bytes
+    n_batches = max(n_batches, 1)
+    return {
+        "memory_bytes": (
+            torch.bincount(plan.row_ranks, minlength=ws) * row_bytes
+        ).tolist(),
+        "lookups": (lookups / n_batches).tolist(),
+        "sent_bytes": (sent / n_batches).tolist(),
+        "received_bytes": (received / n_batches).tolist(),
+        "all_to_all_bytes": 2 * float(sent.sum()) / n_batches,
+    }
@@ -33,6 +33,52 @@ class EmbeddingSpec(NamedTuple):
     include_last_offset: bool
 
 
+def dedup_indices(indices, num_embeddings=None):
+    r"""
+    Deduplicate the indices of each table. Returns the sorted unique rows of
+    each table, as int64, and the indices remapped to their positions in the
+    unique rows, in the dtype of the indices. The remapped indices keep the
+    length of the original ones, so the offsets stay valid for them.
+
+    With the numbers of rows of the tables in ``num_embeddings``, a table
+    which has no more rows than indices in the batch is deduplicated by
+    marking its hit rows, which is linear in the indices, instead of sorting
+    them with ``torch.unique``.
+    """
+    unique = []
+    remapped = []
+    for i, index in enumerate(indices):
+        num_rows = num_embeddings[i] if num_embeddings is not None else None
+        if num_rows is not None and num_rows <= index.numel():
+            hit = torch.zeros(num_rows, dtype=torch.bool)
+            hit[index] = True
+            rows = hit.nonzero().squeeze(1)
+            # only the positions of the hit rows are read
+            position = torch.empty(num_rows, dtype=index.dtype)
+            position[rows] = torch.arange(rows.numel(), dtype=index.dtype)
+            inverse = position[index]
+        else:
+            rows, inverse = torch.unique(index, sorted=True, return_inverse=True)
+            rows = rows.long()
+        unique.append(rows)
+        remapped.append(inverse.to(index.dtype))
+    return unique, remapped
+
+
+def _gather_rows(tables, unique):
+    # empty tables (e.g. the bf16 trail of a float weight) are kept as they are
+    return [
+        table if table.numel() == 0 else table.index_select(0, rows)
+        for table, rows in zip(tables, unique)
+    ]
+
+
+def _scatter_rows_(tables, unique, compact_tables):
+    for table, rows, compact_table in zip(tables, unique, compact_tables):
+        if table.numel() != 0:
+            table.index_copy_(0, rows, compact_table)
+
+
 def merged_embeddingbag(weights, indices, offsets, pooling_mode, include_last_offset):
     if torch.is_grad_enabled():
         return MergedEmbeddingBagFunc.apply(
@@ -59,7 +105,7 @@ def merged_embeddingbag_with_cat(
 
 
 def merged_embeddingbag_sgd(
-    weights, indices, offsets, pooling_mode, include_last_offset, sgd_args
+    weights, indices, offsets, pooling_mode, include_last_offset, sgd_args, unique=None
 ):
     if torch.is_grad_enabled():
         return MergedEmbeddingBagSGDFunc.apply(
@@ -68,15 +114,24 @@ def merged_embeddingbag_sgd(
             pooling_mode,
             include_last_offset,
             sgd_args,
+            unique,
             *weights,
         )
+    if unique is not None:
+        weights = _gather_rows(weights, unique)
     return torch.ops.torch_ipex.merged_embeddingbag_forward(
         weights, indices, offsets, pooling_mode, include_last_offset
     )
 
 
 def merged_embeddingbag_adagrad(
-    weights, indices, offsets, pooling_mode, include_last_offset, adagrad_args
+    weights,
+    indices,
+    offsets,
+    pooling_mode,
+    include_last_offset,
+    adagrad_args,
+    unique=None,
 ):
     if torch.is_grad_enabled():
         return MergedEmbeddingBagAdaGradFunc.apply(
@@ -85,8 +140,11 @@ def merged_embeddingbag_adagrad(
             pooling_mode,
             include_last_offset,
             adagrad_args,
+            unique,
             *weights,
         )
+    if unique is not None:
+        weights = _gather_rows(weights, unique)
     return torch.ops.torch_ipex.merged_embeddingbag_forward(
         weights, indices, offsets, pooling_mode, include_last_offset
     )
@@ -133,8 +191,13 @@ class MergedEmbeddingBagSGDFunc(Function):
         pooling_mode,
         include_last_offset,
         sgd_args,
+        unique,
         *weights,
     ):
+        ctx.full_weights = weights
+        if unique is not None:
+            # run the lookup and the fused update on the unique rows only
+            weights = _gather_rows(weights, unique)
         output = torch.ops.torch_ipex.merged_embeddingbag_forward(
             weights, indices, offsets, pooling_mode, include_last_offset
         )
@@ -144,6 +207,7 @@ class MergedEmbeddingBagSGDFunc(Function):
         ctx.pooling_mode = pooling_mode
         ctx.include_last_offset = include_last_offset
         ctx.sgd_args = sgd_args
+        ctx.unique = unique
         return tuple(output)
 
     @staticmethod
@@ -154,7 +218,10 @@ class MergedEmbeddingBagSGDFunc(Function):
         pooling_mode = ctx.pooling_mode
         include_last_offset = ctx.include_last_offset
         sgd_args = ctx.sgd_args
+        unique = ctx.unique
         bf16_trail = sgd_args.bf16_trail
+        if unique is not None:
+            bf16_trail = _gather_rows(bf16_trail, unique)
         weight_decay = sgd_args.weight_decay
         lr = sgd_args.lr
         grad_list = torch.ops.torch_ipex.merged_embeddingbag_backward_sgd(
@@ -168,7 +235,10 @@ class MergedEmbeddingBagSGDFunc(Function):
             weight_decay,
             lr,
         )
-        output = [None] * (5 + len(weights))
+        if unique is not None:
+            _scatter_rows_(ctx.full_weights, unique, weights)
+            _scatter_rows_(sgd_args.bf16_trail, unique, bf16_trail)
+        output = [None] * (6 + len(weights))
         return tuple(output)
 
 
@@ -181,8 +251,13 @@ class MergedEmbeddingBagAdaGradFunc(Function):
         pooling_mode,
         include_last_offset,
         adagrad_args,
+        unique,
         *weights,
     ):
+        ctx.full_weights = weights
+        if unique is not None:
+            # run the lookup and the fused update on the unique rows only
+            weights = _gather_rows(weights, unique)
         output = torch.ops.torch_ipex.merged_embeddingbag_forward(
             weights, indices, offsets, pooling_mode, include_last_offset
         )
@@ -192,6 +267,7 @@ class MergedEmbeddingBagAdaGradFunc(Function):
         ctx.pooling_mode = pooling_mode
         ctx.include_last_offset = include_last_offset
         ctx.adagrad_args = adagrad_args
+        ctx.unique = unique
         return tuple(output)
 
     @staticmethod
@@ -202,8 +278,12 @@ class MergedEmbeddingBagAdaGradFunc(Function):
         pooling_mode = ctx.pooling_mode
         include_last_offset = ctx.include_last_offset
         adagrad_args = ctx.adagrad_args
+        unique = ctx.unique
         bf16_trail = adagrad_args.bf16_trail
         hessian = adagrad_args.hessian
+        if unique is not None:
+            bf16_trail = _gather_rows(bf16_trail, unique)
+            hessian = _gather_rows(hessian, unique)
         eps = adagrad_args.eps
         lr = adagrad_args.lr
         grad_list = torch.ops.torch_ipex.merged_embeddingbag_backward_adagrad(
@@ -218,7 +298,11 @@ class MergedEmbeddingBagAdaGradFunc(Function):
             eps,
             lr,
         )
-        output = [None] * (5 + len(weights))
+        if unique is not None:
+            _scatter_rows_(ctx.full_weights, unique, weights)
+            _scatter_rows_(adagrad_args.bf16_trail, unique, bf16_trail)
+            _scatter_rows_(adagrad_args.hessian, unique, hessian)
+        output = [None] * (6 + len(weights))
         return tuple(output)
 
 
@@ -258,6 +342,17 @@ class MergedEmbeddingBag(nn.Module):
 
     Now `MergedEmbeddingBagWithSGD` is the only option running with an optimizer. We plan to add more optimizer support
     in the future. Visit `MergedEmbeddingBagWithSGD` for introduction of `MergedEmbeddingBagWith[Optimizer]`.
+
+    Batches of real click logs repeat popular ids many times. With `index_dedup` set, the indices of each table are
+    deduplicated and sorted before the lookup (see `dedup_indices`), the unique rows are gathered once in sequential
+    order and the pooling reads the gathered rows. `MergedEmbeddingBagWithSGD` and `MergedEmbeddingBagWithAdaGrad`
+    then run their fused update on the unique rows as well and write each row back once:
+
+        >>> merged_emb.index_dedup = True
+
+    The deduplication is an extra pass over the indices and the unique rows, so it is off by default. It only pays off
+    for the fused updates of batches repeating most of their indices (above ~95% duplicates), the lookups alone do not
+    get faster. Measure it with `--index-dedup` of the merged embedding benchmark on the hit pattern of your data.
     """
 
     embedding_specs: List[EmbeddingSpec]
@@ -297,6 +392,8 @@ class MergedEmbeddingBag(nn.Module):
 
         # Currently MergedEmbeddingBag only support all dense
         self.dense = all(not specs.sparse for specs in embedding_specs)
+        # lookup and update the deduplicated rows of each table
+        self.index_dedup = False
 
         self.weights = torch.nn.ParameterList(
             [nn.Parameter(torch.Tensor()) for _ in range(len(embedding_specs))]
@@ -354,8 +451,14 @@ class MergedEmbeddingBag(nn.Module):
             List[Tensor] output shape of `(batch_size, embedding_dim)` which length = num of tables.
         """
         assert self.dense
+        weights = self.weights
+        if self.index_dedup:
+            unique, indices = dedup_indices(
+                indices, [weight.size(0) for weight in self.weights]
+            )
+            weights = _gather_rows(weights, unique)
         return merged_embeddingbag(
-            self.weights, indices, offsets, self.pooling_mode, self.include_last_offset
+            weights, indices, offsets, self.pooling_mode, self.include_last_offset
         )
 
 
@@ -467,6 +570,11 @@ class MergedEmbeddingBagWithSGD(MergedEmbeddingBag):
         Returns:
             List[Tensor] output shape of `(batch_size, embedding_dim)` which length = num of tables.
         """
+        unique = None
+        if self.index_dedup:
+            unique, indices = dedup_indices(
+                indices, [weight.size(0) for weight in self.weights]
+            )
         return merged_embeddingbag_sgd(
             self.weights,
             indices,
@@ -474,6 +582,7 @@ class MergedEmbeddingBagWithSGD(MergedEmbeddingBag):
             self.pooling_mode,
             self.include_last_offset,
             self.sgd_args,
+            unique,
         )
 
     @classmethod
@@ -572,6 +681,11 @@ class MergedEmbeddingBagWithAdaGrad(MergedEmbeddingBag):
         Returns:
             List[Tensor] output shape of `(batch_size, embedding_dim)` which length = num of tables.
         """
+        unique = None
+        if self.index_dedup:
+            unique, indices = dedup_indices(
+                indices, [weight.size(0) for weight in self.weights]
+            )
         return merged_embeddingbag_adagrad(
             self.weights,
             indices,
@@ -579,6 +693,7 @@ class MergedEmbeddingBagWithAdaGrad(MergedEmbeddingBag):
             self.pooling_mode,
             self.include_last_offset,
             self.adagrad_args,
+            unique,
         )
 
     @classmethod
@@ -653,6 +768,206 @@ class MergedEmbeddingBagWithCat(MergedEmbeddingBag):
         )
 
 
+class MergedEmbeddingBagWithInteraction(MergedEmbeddingBag):
+    r"""
+    Inference block of DLRM which fuses the embedding lookups, the "dot"
+    interaction and optionally the top MLP. It takes the raw indices and
+    offsets of all tables together with the dense feature (the output of the
+    bottom MLP), and returns the input of the top MLP, or the output of the
+    top MLP if ``top_mlp`` is given.
+
+    Native usage is:
+
+        >>> EmbLists = torch.nn.Modulist(emb1, emb2, emb3, ..., emb_m)
+        >>> outputs = [EmbLists[i](indices[i], offsets[i]) for i in range(m)]
+        >>> z = ipex.nn.functional.interaction(dense_feature, *outputs)
+        >>> out = top_mlp(z)
+
+    The optimized path is:
+
+        >>> block = MergedEmbeddingBagWithInteraction.from_embeddingbag_list(EmbLists, top_mlp=top_mlp)
+        >>> # optional: int8 tables with a per row scale and bias
+        >>> # block.to_int8()
+        >>> with torch.no_grad():
+        >>>     out = block(indices, offsets, dense_feature)
+
+    The tables are pooled directly into one packed ``(batch_size, m + 1,
+    embedding_dim)`` buffer with the dense feature as its first feature,
+    which is the layout the interaction reads, so no per table output or
+    concatenation is materialized. The dot products of all features are one
+    batched GEMM over the packed buffer and their lower triangle is gathered
+    straight into the output next to the dense feature. The interaction
+    buffers are kept across calls and only reallocated when the batch size or
+    dtype changes.
+
+    The interaction runs in the dtype of ``dense_feature``: pass a bfloat16
+    dense feature with bfloat16 tables. Mean pooling scales the fused sums in
+    place. int8 tables (see :meth:`to_int8`), or tables in another dtype than
+    ``dense_feature``, are not fused: each table is pooled (and dequantized)
+    on its own and copied into the packed buffer, which costs one extra pass
+    over the pooled features.
+
+    Args:
+        embedding_specs (List[EmbeddingSpec]): specs of the tables.
+        top_mlp (torch.nn.Module, optional): the top MLP applied to the
+            interaction output. Default: ``None``.
+        reuse_buffers (bool): keep the interaction buffers across calls. The
+            interaction output returned without ``top_mlp`` is then
+            overwritten by the next call, and the module must not be called
+            from several threads at once. Default: ``True``.
+    """
+
+    embedding_specs: List[EmbeddingSpec]
+
+    def __init__(
+        self,
+        embedding_specs: List[EmbeddingSpec],
+        top_mlp: Optional[nn.Module] = None,
+        reuse_buffers: bool = True,
+    ):
+        super(MergedEmbeddingBagWithInteraction, self).__init__(embedding_specs)
+        self.top_mlp = top_mlp
+        self.reuse_buffers = reuse_buffers
+        self.int8 = False
+        n_features = self.n_tables + 1
+        li, lj = torch.tril_indices(n_features, n_features, offset=-1)
+        # index of the lower triangle in the flattened dot products
+        self.register_buffer("tril_index", li * n_features + lj, persistent=False)
+        self.interaction_buffers = {}
+
+    @classmethod
+    def from_embeddingbag_list(
+        cls,
+        tables: List[torch.nn.EmbeddingBag],
+        top_mlp: Optional[nn.Module] = None,
+        reuse_buffers: bool = True,
+    ):
+        module = super(MergedEmbeddingBagWithInteraction, cls).from_embeddingbag_list(
+            tables
+        )
+        module.top_mlp = top_mlp
+        module.reuse_buffers = reuse_buffers
+        return module
+
+    def to_int8(self):
+        r"""
+        Quantize the tables to 8 bits with a float scale and bias per row,
+        packed as `torch.ops.quantized.embedding_bag_byte_prepack` does.
+        """
+        if self.int8:
+            return self
+        for i in range(self.n_tables):
+            self.weights[i] = nn.Parameter(
+                torch.ops.quantized.embedding_bag_byte_prepack(
+                    self.weights[i].detach().float().contiguous()
+                ),
+                requires_grad=False,
+            )
+        self.int8 = True
+        return self
+
+    def _buffer(self, name, shape, dtype):
+        buffer = self.interaction_buffers.get(name) if self.reuse_buffers else None
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = torch.empty(shape, dtype=dtype)
+            if self.reuse_buffers:
+                self.interaction_buffers[name] = buffer
+        return buffer
+
+    def _bag_lengths(self, index, offset):
+        if self.include_last_offset:
+            return offset.diff()
+        return offset.diff(append=offset.new_tensor([index.numel()]))
+
+    def _pool(self, indices, offsets, dense_feature):
+        batch_size, embedding_dim = dense_feature.shape
+        shape = (batch_size, self.n_tables + 1, embedding_dim)
+        if not self.int8 and self.weights[0].dtype == dense_feature.dtype:
+            # the fused kernel pools all tables into the cat layout at once
+            packed = merged_embeddingbag_with_cat(
+                self.weights, indices, offsets, dense_feature.contiguous()
+            ).view(shape)
+            if self.pooling_mode == PoolingMode.MEAN:
+                # the kernel sums the rows of a bag, scale the sums in place
+                lengths = torch.stack(
+                    [
+                        self._bag_lengths(index, offset)
+                        for index, offset in zip(indices, offsets)
+                    ],
+                    dim=1,
+                )
+                packed[:, 1:].div_(lengths.clamp(min=1).unsqueeze(2))
+            return packed
+        packed = self._buffer("packed", shape, dense_feature.dtype)
+        packed[:, 0].copy_(dense_feature)
+        if self.int8:
+            for i in range(self.n_tables):
+                # the quantized op only sums the rows of a bag
+                pooled = torch.ops.quantized.embedding_bag_byte_rowwise_offsets(
+                    self.weights[i],
+                    indices[i],
+                    offsets[i],
+                    False,
+                    int(PoolingMode.SUM),
+                    False,
+                    None,
+                    None,
+                    self.include_last_offset,
+                )
+                if self.pooling_mode == PoolingMode.MEAN:
+                    lengths = self._bag_lengths(indices[i], offsets[i])
+                    pooled.div_(lengths.clamp(min=1).unsqueeze(1))
+                packed[:, i + 1].copy_(pooled)
+        else:
+            outputs = torch.ops.torch_ipex.merged_embeddingbag_forward(
+                self.weights,
+                indices,
+                offsets,
+                self.pooling_mode,
+                self.include_last_offset,
+            )
+            for i, output in enumerate(outputs):
+                packed[:, i + 1].copy_(output)
+        return packed
+
+    def forward(self, indices, offsets, dense_feature):
+        r"""
+        Args:
+            indices (List[Tensor]): a list of indices for all tables
+            offsets (List[Tensor]): a list of offsets for all tables
+            dense_feature (Tensor): the dense feature of shape
+                `(batch_size, embedding_dim)`
+        Returns:
+            The output of ``top_mlp`` if given, else the interaction output of
+            shape `(batch_size, embedding_dim + (num of tables + 1) * (num of tables) / 2)`.
+        """
+        if torch.is_grad_enabled():
+            raise RuntimeError(
+                "MergedEmbeddingBagWithInteraction only supports inference, "
+                + "call it under torch.no_grad() or torch.inference_mode()"
+            )
+        assert self.dense
+        batch_size, embedding_dim = dense_feature.shape
+        dtype = dense_feature.dtype
+        n_features = self.n_tables + 1
+        packed = self._pool(indices, offsets, dense_feature)
+        dots = self._buffer("dots", (batch_size, n_features, n_features), dtype)
+        torch.bmm(packed, packed.transpose(1, 2), out=dots)
+        output = self._buffer(
+            "output", (batch_size, embedding_dim + self.tril_index.numel()), dtype
+        )
+        output[:, :embedding_dim].copy_(packed[:, 0])
+        torch.index_select(
+            dots.view(batch_size, -1),
+            1,
+            self.tril_index,
+            out=output[:, embedding_dim:],
+        )
+        if self.top_mlp is not None:
+            return self.top_mlp(output)
+        return output
+
+
 import torch.distributed as dist
 
 
@@ -775,6 +1090,14 @@ class DistMergeEmbeddingBagWithAdaGrad(MergedEmbeddingBagWithAdaGrad):
         >>> dist.init_process_group("ccl", world_size=world_size, rank=rank)
         >>> distributed_emb = DistMergeEmbeddingBagWithAdaGrad.from_embeddingbag_list(EmbLists)
         >>> out = distributed_emb(indices, offsets)
+
+    By default the rows of all tables are dealt to the ranks in turn. A
+    :class:`ShardingPlan` made by :class:`EmbeddingShardingPlanner` can be
+    passed by ``sharding_plan`` to keep a table on one rank instead, which
+    sends less bytes in the all to all.
+
+        >>> plan = EmbeddingShardingPlanner(world_size, emb_dim, batch_size).plan(num_embeddings)
+        >>> distributed_emb = DistMergeEmbeddingBagWithAdaGrad.from_embeddingbag_list(EmbLists, sharding_plan=plan)
     """
 
     def __init__(
@@ -782,6 +1105,7 @@ class DistMergeEmbeddingBagWithAdaGrad(MergedEmbeddingBagWithAdaGrad):
         embedding_specs: List[EmbeddingSpec],
         lr: float = 0.01,
         eps: float = 1e-10,
+        sharding_plan=None,
     ):
         super(MergedEmbeddingBagWithAdaGrad, self).__init__(embedding_specs)
         assert (
@@ -798,9 +1122,26 @@ class DistMergeEmbeddingBagWithAdaGrad(MergedEmbeddingBagWithAdaGrad):
         # We may able to optimize here to:
         #     1. Require (1 + 1 / world_size) PEAK memory if always load all table first
         #     2. Require (1 / world_size) memory with loading optimizations like using "meta" device
-        weight_allin1 = torch.cat([w.data for w in self.weights])[
-            self._rank :: self._size, :
-        ].clone()
+        if sharding_plan is None:
+            weight_allin1 = torch.cat([w.data for w in self.weights])[
+                self._rank :: self._size, :
+            ].clone()
+            self._row_positions = None
+        else:
+            assert (
+                sharding_plan.world_size == self._size
+            ), "the sharding plan is made for another world size"
+            assert sharding_plan.num_embeddings == [
+                w.shape[0] for w in self.weights
+            ], "the sharding plan is made for other tables"
+            # the kernels keep the row r on the rank r % world_size at its
+            # local row r // world_size, the indices are remapped to the
+            # position of their rows in the plan
+            weight_allin1 = torch.cat([w.data for w in self.weights])[
+                sharding_plan.local_rows(self._rank)
+            ]
+            self._row_positions = sharding_plan.row_positions
+        self.sharding_plan = sharding_plan
         # drop the oringal weighs
         self.weights = nn.ParameterList([nn.parameter.Parameter(weight_allin1)])
         self.n_tables = 1
@@ -816,10 +1157,41 @@ class DistMergeEmbeddingBagWithAdaGrad(MergedEmbeddingBagWithAdaGrad):
             self.adagrad_args.bf16_trail.append(torch.empty(0, dtype=torch.bfloat16))
             self.adagrad_args.hessian.append(torch.zeros_like(weight_allin1))
 
+    @classmethod
+    def from_embeddingbag_list(
+        cls,
+        tables: List[torch.nn.EmbeddingBag],
+        lr: float = 0.01,
+        eps: float = 1e-10,
+        sharding_plan=None,
+    ):
+        embedding_specs = []
+        for emb in tables:
+            emb_shape = emb.weight.shape
+            embedding_specs.append(
+                EmbeddingSpec(
+                    num_embeddings=emb_shape[0],
+                    embedding_dim=emb_shape[1],
+                    pooling_mode=emb.mode,
+                    dtype=emb.weight.dtype,
+                    weight=emb.weight.detach(),
+                    sparse=emb.sparse,
+                    include_last_offset=emb.include_last_offset,
+                )
+            )
+        return cls(embedding_specs, lr, eps, sharding_plan)
+
     def forward(self, indices: List[torch.Tensor], offset: List[torch.Tensor]):
+        row_offset = self._row_offset
+        if self._row_positions is not None:
+            indices = [
+                self._row_positions[index.long() + row_offset[i]].to(index.dtype)
+                for i, index in enumerate(indices)
+            ]
+            row_offset = [0 for i in range(len(self._row_offset))]
         out = DistMergeEmbeddingBagFunc.apply(
             self.weights[0],
-            self._row_offset,
+            row_offset,
             indices,
             offset,
             self._rank,
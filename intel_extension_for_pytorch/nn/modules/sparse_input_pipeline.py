@@ -0,0 +1,390 @@
+import contextlib
+import itertools
+import os
+import threading
+from typing import List, Optional
+
+import numpy as np
+import torch
+
+# odd 64 bit constant of the multiplicative hash, as a wrapping int64
+_HASH_MULTIPLIER = 0x9E3779B97F4A7C15 - (1 << 64)
+_SCALAR_TYPES = (int, np.integer)
+
+
+class _BatchSlot(object):
+    # Index and offset buffers of one in-flight batch. They only grow, a batch
+    # is a view at the front of them.
+    def __init__(self, n_tables, index_dtype):
+        self.index_dtype = index_dtype
+        self.indices = [torch.empty(0, dtype=index_dtype) for _ in range(n_tables)]
+        self.offsets = [torch.empty(0, dtype=index_dtype) for _ in range(n_tables)]
+        self.rows = None
+
+    def _view(self, buffers, table, numel):
+        if buffers[table].numel() < numel:
+            buffers[table] = torch.empty(numel, dtype=self.index_dtype)
+        return buffers[table][:numel]
+
+    def indices_view(self, table, numel):
+        return self._view(self.indices, table, numel)
+
+    def offsets_view(self, table, numel):
+        return self._view(self.offsets, table, numel)
+
+    def rows_view(self, rows):
+        # the rows of a binary dataset, copied out of e.g. a read-only memmap
+        if (
+            self.rows is None
+            or self.rows.dtype != rows.dtype
+            or self.rows.size < rows.size
+        ):
+            self.rows = np.empty(rows.size, dtype=rows.dtype)
+        view = self.rows[: rows.size].reshape(rows.shape)
+        np.copyto(view, rows)
+        return torch.from_numpy(view)
+
+
+class SparseInputPipeline(object):
+    r"""
+    Convert the raw categorical ids of the samples into the per table
+    ``indices`` and ``offsets`` taken by :class:`MergedEmbeddingBag` and its
+    variants, in background worker threads.
+
+    The ids come either from an iterable of samples, each a sequence with the
+    ids of every table (an int or a sequence of ints for multi-hot tables), or
+    from a binary dataset of fixed multi-hot samples: a 2D numpy array, e.g. a
+    ``numpy.memmap``, or the path of a raw file of ``id_dtype`` ids, with the
+    ``multi_hot`` ids of all tables of a sample in a row. The ids are mapped
+    into the tables with ``hashing``: ``"modulo"`` takes them modulo the table
+    size, ``"hash"`` mixes them with a multiplicative hash first, so that
+    neighbouring raw ids spread over the table, and ``None`` uses them as
+    they are.
+
+    The batches are yielded in the order of the samples as ``(indices,
+    offsets)``. For :class:`DistMergeEmbeddingBagWithAdaGrad`, which takes
+    the global batch on every rank, use the global batch size. The batches
+    are built into a ring of ``num_buffers`` preallocated buffer slots,
+    double buffered by default: the workers prepare the next batches while
+    the current one is used, and the buffers of a batch are overwritten by
+    the ``num_buffers``-th batch after it. With ``cpu_pool``, the workers are
+    pinned to its cores, so that the buffers they first touch are local to the
+    NUMA node of the compute.
+
+        >>> pipeline = SparseInputPipeline(dataset, num_embeddings=[e.num_embeddings for e in EmbLists], batch_size=B)
+        >>> for indices, offsets in pipeline:
+        >>>     outputs = merged_emb(indices, offsets)
+
+    Args:
+        dataset: An iterable of samples, a 2D numpy array or the path of a
+            raw binary file.
+        num_embeddings (List[int]): The number of rows of each table.
+        batch_size (int): The number of samples of a batch.
+        multi_hot (List[int], optional): The number of ids of each table in
+            a sample of a binary dataset. Default: ``[1] * len(num_embeddings)``.
+        id_dtype (numpy.dtype): The dtype of the ids in a binary file.
+            Default: ``numpy.int32``.
+        hashing (str, optional): ``"modulo"``, ``"hash"`` or ``None``.
+            Default: ``"modulo"``.
+        index_dtype (torch.dtype): The dtype of ``indices`` and ``offsets``.
+            Default: ``torch.int64``.
+        include_last_offset (bool): Append the number of indices to the
+            offsets, as `EmbeddingBag` with ``include_last_offset``.
+            Default: ``False``.
+        drop_last (bool): Drop the last batch if it is smaller than
+            ``batch_size``. Default: ``False``.
+        num_workers (int): The number of worker threads. Default: 1.
+        num_buffers (int): The number of buffer slots, at least 2.
+            Default: 2.
+        cpu_pool (intel_extension_for_pytorch.cpu.runtime.CPUPool, optional):
+            The cores to run the workers on. Default: ``None``.
+    """
+
+    def __init__(
+        self,
+        dataset,
+        num_embeddings: List[int],
+        batch_size: int,
+        multi_hot: Optional[List[int]] = None,
+        id_dtype=np.int32,
+        hashing: Optional[str] = "modulo",
+        index_dtype: torch.dtype = torch.int64,
+        include_last_offset: bool = False,
+        drop_last: bool = False,
+        num_workers: int = 1,
+        num_buffers: int = 2,
+        cpu_pool=None,
+    ):
+        assert hashing in (
+            "modulo",
+            "hash",
+            None,
+        ), "hashing should be 'modulo', 'hash' or None"
+        assert batch_size > 0, "batch_size should be positive"
+        assert num_workers > 0, "num_workers should be positive"
+        assert num_buffers >= 2, "at least 2 buffers are needed"
+        self.num_embeddings = list(num_embeddings)
+        self.n_tables = len(self.num_embeddings)
+        self.batch_size = batch_size
+        self.multi_hot = [1] * self.n_tables if multi_hot is None else list(multi_hot)
+        assert len(self.multi_hot) == self.n_tables, "expect multi_hot for every table"
+        if isinstance(dataset, (str, os.PathLike)):
+            dataset = np.memmap(dataset, dtype=id_dtype, mode="r").reshape(
+                -1, sum(self.multi_hot)
+            )
+        if isinstance(dataset, np.ndarray):
+            assert dataset.ndim == 2 and dataset.shape[1] == sum(
+                self.multi_hot
+            ), "expect a binary dataset of shape (num_samples, sum(multi_hot))"
+        self.dataset = dataset
+        self.hashing = hashing
+        self.index_dtype = index_dtype
+        self.include_last_offset = include_last_offset
+        self.drop_last = drop_last
+        self.num_workers = num_workers
+        self.num_buffers = num_buffers
+        self.cpu_pool = cpu_pool
+
+    def __len__(self):
+        if not isinstance(self.dataset, np.ndarray):
+            raise TypeError("the length of an iterable dataset is unknown")
+        num_samples = self.dataset.shape[0]
+        if self.drop_last:
+            return num_samples // self.batch_size
+        return (num_samples + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        return _SparseInputIterator(self)
+
+    def _pinned(self):
+        if self.cpu_pool is None:
+            return contextlib.nullcontext()
+        from ...cpu.runtime.cpupool import pin, is_runtime_ext_enabled
+
+        # pinning the OpenMP threads needs the runtime extension, i.e. Intel
+        # OpenMP, the worker thread itself can always be pinned
+        os.sched_setaffinity(0, self.cpu_pool.core_ids)
+        if is_runtime_ext_enabled():
+            return pin(self.cpu_pool)
+        return contextlib.nullcontext()
+
+    def _map_ids_(self, ids, table, out):
+        num_embeddings = self.num_embeddings[table]
+        if self.hashing == "hash":
+            # wrapping int64 multiply, the high bits are folded in before the
+            # modulo as they are the best mixed ones
+            ids = ids.to(torch.int64).mul(_HASH_MULTIPLIER)
+            ids = ids.bitwise_xor(ids.bitwise_right_shift(32))
+        if self.hashing is None:
+            out.copy_(ids)
+        else:
+            out.copy_(torch.remainder(ids, num_embeddings))
+
+    def _fill_offsets(self, offsets, lengths):
+        offsets[0] = 0
+        if not self.include_last_offset:
+            lengths = lengths[:-1]
+        torch.cumsum(lengths, 0, out=offsets[1:])
+
+    def _build_from_array(self, slot, start, end):
+        # slicing a memmap reads the rows from the file here, in the worker
+        rows = slot.rows_view(self.dataset[start:end])
+        batch_size = end - start
+        n_offsets = batch_size + 1 if self.include_last_offset else batch_size
+        indices = []
+        offsets = []
+        column = 0
+        for table, hot in enumerate(self.multi_hot):
+            index = slot.indices_view(table, batch_size * hot)
+            self._map_ids_(
+                rows[:, column : column + hot], table, index.view(batch_size, hot)
+            )
+            column += hot
+            offset = slot.offsets_view(table, n_offsets)
+            torch.arange(0, n_offsets * hot, hot, out=offset)
+            indices.append(index)
+            offsets.append(offset)
+        return indices, offsets
+
+    def _build_from_samples(self, slot, samples):
+        batch_size = len(samples)
+        n_offsets = batch_size + 1 if self.include_last_offset else batch_size
+        indices = []
+        offsets = []
+        for table in range(self.n_tables):
+            ids = [sample[table] for sample in samples]
+            if all(isinstance(i, _SCALAR_TYPES) for i in ids):
+                flat = ids
+                lengths = torch.ones(batch_size, dtype=self.index_dtype)
+            else:
+                ids = [(i,) if isinstance(i, _SCALAR_TYPES) else i for i in ids]
+                flat = list(itertools.chain.from_iterable(ids))
+                lengths = torch.tensor([len(i) for i in ids], dtype=self.index_dtype)
+            index = slot.indices_view(table, len(flat))
+            self._map_ids_(torch.tensor(flat, dtype=torch.int64), table, index)
+            offset = slot.offsets_view(table, n_offsets)
+            self._fill_offsets(offset, lengths)
+            indices.append(index)
+            offsets.append(offset)
+        return indices, offsets
+
+
+class _BatchProducer(object):
+    # The workers claim the batches in order, batch k is built into slot
+    # k % num_buffers once the consumer released the batch using it before.
+    # The batches are handed over in order whatever worker finishes first, and
+    # so are the errors of the batches that failed.
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.is_array = isinstance(pipeline.dataset, np.ndarray)
+        self.source = None if self.is_array else iter(pipeline.dataset)
+        self.num_batches = len(pipeline) if self.is_array else None
+        self.cond = threading.Condition()
+        self.source_lock = threading.Lock()
+        self.next_batch = 0
+        self.released = 0
+        self.expected = 0
+        self.ready = {}
+        self.exhausted = False
+        self.stopped = False
+        # errors of the batches, and an error of a worker outside of a batch
+        self.errors = {}
+        self.error = None
+        self.slots = [None] * pipeline.num_buffers
+        self.workers = [
+            threading.Thread(target=self.work, daemon=True)
+            for _ in range(pipeline.num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def claim(self):
+        # returns the index of the next batch and its samples or row range
+        with self.source_lock:
+            with self.cond:
+                while not self.stopped and (
+                    self.next_batch >= self.released + self.pipeline.num_buffers
+                ):
+                    self.cond.wait()
+                if self.stopped or self.exhausted:
+                    return None
+                batch = self.next_batch
+                if self.is_array:
+                    if batch >= self.num_batches:
+                        self.exhausted = True
+                        self.cond.notify_all()
+                        return None
+                    start = batch * self.pipeline.batch_size
+                    end = min(
+                        start + self.pipeline.batch_size,
+                        self.pipeline.dataset.shape[0],
+                    )
+                    self.next_batch += 1
+                    return batch, (start, end)
+            # the samples are read in the order of the batches, but without
+            # blocking the consumer
+            try:
+                samples = list(itertools.islice(self.source, self.pipeline.batch_size))
+            except BaseException as e:
+                # no batch can be read after a failed one
+                with self.cond:
+                    self.errors[batch] = e
+                    self.exhausted = True
+                    self.next_batch += 1
+                    self.cond.notify_all()
+                return None
+            with self.cond:
+                if not samples or (
+                    self.pipeline.drop_last and len(samples) < self.pipeline.batch_size
+                ):
+                    self.exhausted = True
+                    self.cond.notify_all()
+                    return None
+                self.next_batch += 1
+                return batch, samples
+
+    def work(self):
+        try:
+            with self.pipeline._pinned():
+                while True:
+                    claimed = self.claim()
+                    if claimed is None:
+                        return
+                    batch, job = claimed
+                    slot_id = batch % self.pipeline.num_buffers
+                    if self.slots[slot_id] is None:
+                        # first touched by the pinned worker
+                        self.slots[slot_id] = _BatchSlot(
+                            self.pipeline.n_tables, self.pipeline.index_dtype
+                        )
+                    slot = self.slots[slot_id]
+                    try:
+                        if self.is_array:
+                            out = self.pipeline._build_from_array(slot, *job)
+                        else:
+                            out = self.pipeline._build_from_samples(slot, job)
+                    except BaseException as e:
+                        # raised when the consumer gets to this batch, the
+                        # batches before it are still handed over
+                        with self.cond:
+                            self.errors[batch] = e
+                            self.cond.notify_all()
+                        return
+                    with self.cond:
+                        self.ready[batch] = out
+                        self.cond.notify_all()
+        except BaseException as e:
+            with self.cond:
+                self.error = e
+                self.cond.notify_all()
+
+    def next(self):
+        with self.cond:
+            # the batch handed over before is not used anymore
+            self.released = self.expected
+            self.cond.notify_all()
+            while (
+                self.expected not in self.ready
+                and self.expected not in self.errors
+                and self.error is None
+                and not (self.exhausted and self.expected >= self.next_batch)
+            ):
+                self.cond.wait()
+            out = self.ready.pop(self.expected, None)
+            error = self.errors.pop(self.expected, None)
+            if out is None and error is None:
+                error = self.error
+            self.expected += 1
+        if error is not None:
+            self.close()
+            raise error
+        if out is None:
+            self.close()
+            raise StopIteration
+        return out
+
+    def close(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+        for worker in self.workers:
+            worker.join()
+
+
+class _SparseInputIterator(object):
+    # The workers only reference the producer, so that an iterator dropped
+    # before its end is collected and stops them.
+    def __init__(self, pipeline):
+        self.producer = _BatchProducer(pipeline)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.producer.next()
+
+    def close(self):
+        self.producer.close()
+
+    def __del__(self):
+        self.producer.close()
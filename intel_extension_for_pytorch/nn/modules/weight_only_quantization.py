@@ -5,11 +5,10 @@ from intel_extension_for_pytorch.nn.utils._weight_prepack import (
     _all_reduce_and_bias_add,
     _pre_ipex_gemm,
 )
-from intel_extension_for_pytorch.quantization import (
-    QConfigWoq,
+from intel_extension_for_pytorch.quantization._qconfig import QConfigWoq, WoqWeightDtype
+from intel_extension_for_pytorch.quantization._quantize_utils import (
     quantize_per_channel,
     quantize_per_block,
-    WoqWeightDtype,
 )
 from ...utils._logger import logger, WarningType
 
@@ -0,0 +1,178 @@
+import copy
+import json
+import statistics
+import time
+
+import torch
+import torch.nn as nn
+
+from ...utils._logger import logger, WarningType
+
+# Decision table of ``ipex.optimize(level="auto")``, shared by all models of
+# the process. Keys are "<isa>|<layer signature>", values are the chosen kernel,
+# the name of the winning candidate and the measured latency of every candidate
+# in microseconds, keyed by candidate name.
+_kernel_decision_table = {}
+
+_TUNABLE_MODULES = (nn.Linear, nn.Conv1d, nn.Conv2d, nn.Conv3d)
+
+
+def _current_isa():
+    import intel_extension_for_pytorch._C as core
+
+    return core._get_current_isa_level()
+
+
+def _layer_signature(module):
+    signature = [
+        type(module).__name__,
+        f"w{tuple(module.weight.shape)}",
+        f"b{module.bias is not None}",
+        f"x{tuple(module.input_shape)}",
+        str(module.weight.dtype),
+    ]
+    if not isinstance(module, nn.Linear):
+        signature.append(
+            f"s{tuple(module.stride)}p{module.padding}d{tuple(module.dilation)}"
+            + f"g{module.groups}{module.padding_mode}"
+        )
+    return "|".join(signature)
+
+
+def _channels_last_format(module):
+    return {4: torch.channels_last, 5: torch.channels_last_3d}.get(module.weight.dim())
+
+
+def _candidates(module):
+    # "plain" keeps the PyTorch module, the others are weight prepacked
+    if isinstance(module, nn.Linear):
+        from ...frontend import get_fp32_math_mode, FP32MathMode
+
+        candidates = [{"kernel": "plain"}, {"kernel": "dnnl"}]
+        if (
+            module.weight.dtype == torch.float32
+            and get_fp32_math_mode(device="cpu") == FP32MathMode.FP32
+        ):
+            candidates.append({"kernel": "mkl"})
+        out_features, in_features = module.weight.shape
+        if (
+            module.weight.dtype in (torch.float32, torch.bfloat16)
+            and out_features % 16 == 0
+            and in_features % 64 == 0
+        ):
+            candidates.append({"kernel": "tpp"})
+        return candidates
+    channels_last = [False]
+    if _channels_last_format(module) is not None:
+        channels_last.append(True)
+    return [
+        {"kernel": kernel, "channels_last": cl}
+        for kernel in ["plain", "dnnl"]
+        for cl in channels_last
+    ]
+
+
+def _candidate_name(candidate):
+    if candidate.get("channels_last"):
+        return candidate["kernel"] + "_channels_last"
+    return candidate["kernel"]
+
+
+def _apply_decision(module, decision):
+    # the kernel is picked up by weight_prepack_with_ipex
+    module._ipex_kernel = decision["kernel"]
+    if "channels_last" in decision and _channels_last_format(module) is not None:
+        memory_format = (
+            _channels_last_format(module)
+            if decision["channels_last"]
+            else torch.contiguous_format
+        )
+        weight_data = (
+            module.weight.detach().clone().contiguous(memory_format=memory_format)
+        )
+        module.weight.data = weight_data.resize_(
+            weight_data.size(), memory_format=memory_format
+        )
+
+
+def _benchmark(module, candidate, warmup, iterations):
+    from ._weight_prepack import weight_prepack_with_ipex
+
+    layer = copy.deepcopy(module)
+    _apply_decision(layer, candidate)
+    if candidate["kernel"] != "plain":
+        layer, _, _ = weight_prepack_with_ipex(layer, None, {}, "cpu")
+    x = torch.randn(module.input_shape).to(module.weight.dtype)
+    if candidate.get("channels_last"):
+        x = x.contiguous(memory_format=_channels_last_format(module))
+    elapsed = []
+    with torch.no_grad():
+        for _ in range(warmup):
+            layer(x)
+        for _ in range(iterations):
+            start = time.perf_counter()
+            layer(x)
+            elapsed.append(time.perf_counter() - start)
+    return statistics.median(elapsed) * 1e6
+
+
+def auto_select_kernels(model, warmup=3, iterations=10):
+    r"""
+    Choose the fastest kernel for every Linear and Conv layer of an inference
+    model whose input shape was recorded with ``sample_input``. Candidates are
+    the plain PyTorch module and the oneDNN, MKL and TPP prepacked kernels for
+    Linear, and the plain or oneDNN prepacked kernel with channels_last or
+    contiguous weights for Conv. Each layer signature (shapes, dtype, conv
+    parameters) is benchmarked once per ISA, later layers and models with the
+    same signature reuse the decision table.
+    """
+    isa = _current_isa()
+    for module in model.modules():
+        if type(module) not in _TUNABLE_MODULES or not hasattr(module, "input_shape"):
+            continue
+        key = f"{isa}|{_layer_signature(module)}"
+        if key not in _kernel_decision_table:
+            latency = {}
+            for candidate in _candidates(module):
+                try:
+                    latency[_candidate_name(candidate)] = _benchmark(
+                        module, candidate, warmup, iterations
+                    )
+                except Exception as e:
+                    logger.warning(
+                        f"Kernel {_candidate_name(candidate)} is skipped for {key}: {e}",
+                        _type=WarningType.NotSupported,
+                    )
+                    latency[_candidate_name(candidate)] = float("inf")
+            best = min(_candidates(module), key=lambda c: latency[_candidate_name(c)])
+            _kernel_decision_table[key] = dict(
+                best, candidate=_candidate_name(best), latency_us=latency
+            )
+        _apply_decision(module, _kernel_decision_table[key])
+    return model
+
+
+def save_kernel_decision_table(f):
+    r"""
+    Save the per-layer kernel decisions made by ``ipex.optimize(level="auto")``
+    in this process to a json file.
+
+    Args:
+        f (str): Path of the json file.
+    """
+    with open(f, "w") as fp:
+        json.dump(_kernel_decision_table, fp, indent=2)
+
+
+def load_kernel_decision_table(f):
+    r"""
+    Load per-layer kernel decisions saved by ``save_kernel_decision_table``.
+    Layers found in the table are not benchmarked again by
+    ``ipex.optimize(level="auto")``. Decisions are keyed by the ISA level, so
+    a table tuned on another machine only applies to machines of the same ISA.
+
+    Args:
+        f (str): Path of the json file.
+    """
+    with open(f, "r") as fp:
+        _kernel_decision_table.update(json.load(fp))
@@ -67,6 +67,7 @@ def IPEX_WEIGHT_CONVERT_MODULE_CPU(inference: bool, dtype: torch.bfloat16):
     from intel_extension_for_pytorch.nn.modules import (
         MergedEmbeddingBag,
         MergedEmbeddingBagWithCat,
+        MergedEmbeddingBagWithInteraction,
     )
 
     module_convert_list_bf16_inference = [
@@ -78,6 +79,7 @@ def IPEX_WEIGHT_CONVERT_MODULE_CPU(inference: bool, dtype: torch.bfloat16):
         torch.nn.Embedding,
         torch.nn.LSTM,
         MergedEmbeddingBagWithCat,
+        MergedEmbeddingBagWithInteraction,
         torch.nn.ParameterList,
     ]
 
@@ -112,6 +114,7 @@ def IPEX_WEIGHT_CONVERT_MODULE_CPU(inference: bool, dtype: torch.bfloat16):
         torch.nn.Linear,
         torch.nn.Embedding,
         MergedEmbeddingBagWithCat,
+        MergedEmbeddingBagWithInteraction,
         torch.nn.ParameterList,
     ]
 
@@ -583,7 +586,13 @@ class ParameterWrapper(object):
                 ], "Only float, bf16 and fp16 are supported"
                 use_dnnl = True
 
-        module.use_tpp = _using_tpp()
+        # per-layer kernel chosen by ipex.optimize(level="auto")
+        kernel = getattr(module, "_ipex_kernel", None)
+        if kernel == "dnnl":
+            use_dnnl = True
+        elif kernel == "mkl" and module.weight.dtype == torch.float32:
+            use_dnnl = False
+        module.use_tpp = _using_tpp() if kernel is None else kernel == "tpp"
         if not hasattr(module, "out_features"):
             setattr(module, "out_features", module.weight.shape[0])  # noqa: B010
 
@@ -0,0 +1,212 @@
+import math
+
+import torch
+import torch.nn as nn
+
+try:
+    from transformers.modeling_outputs import BaseModelOutputWithPastAndCrossAttentions
+except ImportError:
+    pass
+
+
+def _is_bert_like_encoder(module):
+    # BERT-family encoders (Bert, Roberta, XLM-Roberta, Electra, ...) share
+    # the same layer structure: attention.self.{query,key,value},
+    # attention.output, intermediate and output
+    layers = getattr(module, "layer", None)
+    if not isinstance(layers, nn.ModuleList) or len(layers) == 0:
+        return False
+    if not hasattr(module, "config"):
+        return False
+    for layer in layers:
+        attention = getattr(layer, "attention", None)
+        attn_self = getattr(attention, "self", None)
+        if attn_self is None or not all(
+            isinstance(getattr(attn_self, name, None), nn.Linear)
+            for name in ["query", "key", "value"]
+        ):
+            return False
+        if not all(hasattr(layer, name) for name in ["intermediate", "output"]):
+            return False
+    return True
+
+
+class _UnpadInfo(object):
+    r"""
+    Packing information of a padded batch: the flattened indices of the valid
+    tokens, the cumulative sequence lengths ``cu_seqlens`` expected by
+    ``VarlenAttention`` and the longest sequence of the batch.
+    """
+
+    def __init__(self, attention_mask, batch_size, seq_len):
+        if attention_mask is None:
+            valid = torch.ones(batch_size, seq_len, dtype=torch.bool)
+        else:
+            # extended additive mask, 0 for tokens to attend and a large
+            # negative value for padding
+            valid = attention_mask.reshape(batch_size, seq_len) == 0
+        seqlens = valid.sum(dim=-1, dtype=torch.int32)
+        self.indices = torch.nonzero(valid.flatten()).flatten()
+        self.cu_seqlens = torch.nn.functional.pad(
+            torch.cumsum(seqlens, dim=0, dtype=torch.int32), (1, 0)
+        )
+        self.max_seqlen = int(seqlens.max())
+        self.padded_shape = None
+
+    def unpad(self, hidden_states):
+        self.padded_shape = hidden_states.shape
+        return hidden_states.reshape(-1, hidden_states.size(-1))[self.indices]
+
+    def pad(self, hidden_states):
+        batch_size, seq_len, hidden_size = self.padded_shape
+        output = hidden_states.new_zeros(batch_size * seq_len, hidden_size)
+        output[self.indices] = hidden_states
+        return output.view(batch_size, seq_len, hidden_size)
+
+
+class _IPEXVarlenEncoder(nn.Module):
+    r"""
+    Unpadded inference for BERT-family encoders. The valid tokens of the
+    padded batch are packed into a single token stream described by
+    ``cu_seqlens``, all linears and layer norms run on the packed tokens,
+    attention runs with ``ipex.llm.modules.VarlenAttention`` and the hidden
+    states are scattered back to the padded layout only at the output. Calls
+    needing per-layer attention probabilities, head masks, cross attention or
+    key/value cache fall back to the original padded forward.
+    """
+
+    def __init__(self, module):
+        super().__init__()
+        from ...llm.modules import VarlenAttention
+
+        self.config = module.config
+        self.layer = module.layer
+        self.gradient_checkpointing = False
+        self.padded_forward = type(module).forward
+        self.varlen_attention = VarlenAttention()
+        self.train(module.training)
+
+    def _can_unpad(
+        self,
+        attention_mask,
+        head_mask,
+        encoder_hidden_states,
+        past_key_values,
+        use_cache,
+        output_attentions,
+    ):
+        if self.training or output_attentions or use_cache:
+            return False
+        if head_mask is not None and any(m is not None for m in head_mask):
+            return False
+        if encoder_hidden_states is not None:
+            return False
+        if past_key_values is not None or getattr(self.config, "is_decoder", False):
+            return False
+        if getattr(self.config, "position_embedding_type", "absolute") != "absolute":
+            return False
+        if attention_mask is None:
+            return True
+        # padding masks expanded to [batch, 1, seq_len, seq_len] repeat the
+        # same row, any other mask needs the padded path
+        return attention_mask.dim() == 4 and torch.equal(
+            attention_mask, attention_mask[:, :, :1].expand_as(attention_mask)
+        )
+
+    def _self_attention(self, attn_self, hidden_states, unpad_info):
+        num_heads = attn_self.num_attention_heads
+        head_size = attn_self.attention_head_size
+        query = attn_self.query(hidden_states).view(-1, num_heads, head_size)
+        key = attn_self.key(hidden_states).view(-1, num_heads, head_size)
+        value = attn_self.value(hidden_states).view(-1, num_heads, head_size)
+        context = torch.empty_like(query)
+        self.varlen_attention(
+            query,
+            key,
+            value,
+            context,
+            unpad_info.cu_seqlens,
+            unpad_info.cu_seqlens,
+            unpad_info.max_seqlen,
+            unpad_info.max_seqlen,
+            0.0,
+            1.0 / math.sqrt(head_size),
+            False,
+            False,
+            False,
+            None,
+        )
+        return context.view(-1, num_heads * head_size)
+
+    def forward(
+        self,
+        hidden_states,
+        attention_mask=None,
+        head_mask=None,
+        encoder_hidden_states=None,
+        encoder_attention_mask=None,
+        past_key_values=None,
+        use_cache=None,
+        output_attentions=False,
+        output_hidden_states=False,
+        return_dict=True,
+    ):
+        if not self._can_unpad(
+            attention_mask,
+            head_mask,
+            encoder_hidden_states,
+            past_key_values,
+            use_cache,
+            output_attentions,
+        ):
+            return self.padded_forward(
+                self,
+                hidden_states,
+                attention_mask,
+                head_mask,
+                encoder_hidden_states,
+                encoder_attention_mask,
+                past_key_values,
+                use_cache,
+                output_attentions,
+                output_hidden_states,
+                return_dict,
+            )
+
+        batch_size, seq_len, _ = hidden_states.shape
+        if attention_mask is not None:
+            attention_mask = attention_mask[:, :, :1]
+        unpad_info = _UnpadInfo(attention_mask, batch_size, seq_len)
+        all_hidden_states = (hidden_states,) if output_hidden_states else None
+        hidden_states = unpad_info.unpad(hidden_states)
+        for layer_module in self.layer:
+            context = self._self_attention(
+                layer_module.attention.self, hidden_states, unpad_info
+            )
+            attention_output = layer_module.attention.output(context, hidden_states)
+            intermediate_output = layer_module.intermediate(attention_output)
+            hidden_states = layer_module.output(intermediate_output, attention_output)
+            if output_hidden_states:
+                all_hidden_states = all_hidden_states + (unpad_info.pad(hidden_states),)
+        hidden_states = unpad_info.pad(hidden_states)
+
+        if not return_dict:
+            return tuple(v for v in [hidden_states, all_hidden_states] if v is not None)
+        return BaseModelOutputWithPastAndCrossAttentions(
+            last_hidden_state=hidden_states,
+            hidden_states=all_hidden_states,
+        )
+
+
+def replace_encoder_with_varlen_encoder(model):
+    # run BERT-family encoders on packed (unpadded) tokens during inference
+    if isinstance(model, torch.jit.ScriptModule):
+        return
+    if not model.training:
+        for child_name, child in model.named_children():
+            if isinstance(child, _IPEXVarlenEncoder):
+                continue
+            if _is_bert_like_encoder(child):
+                setattr(model, child_name, _IPEXVarlenEncoder(child))
+            else:
+                replace_encoder_with_varlen_encoder(child)
@@ -90,17 +90,6 @@ def may_import_deepspeed_modules():
 
 
 installed_pkg = {pkg.key for pkg in pkg_resources.working_set}
-if "deepspeed" in installed_pkg:
-    from deepspeed import comm
-
-    def _all_reduce(self):
-        comm.inference_all_reduce(self, async_op=False)
-        return self
-
-    ds_comm = torch.library.Library("deepspeed_comm", "DEF")
-    ds_comm.define("all_reduce(Tensor self) -> Tensor")
-    ds_comm_lib_cpu = torch.library.Library("deepspeed_comm", "IMPL", "CPU")
-    ds_comm_lib_cpu.impl("all_reduce", _all_reduce)
 
 
 def _all_reduce_and_bias_add(mp_group, original_bias, output):
@@ -455,6 +444,9 @@ def weight_prepack_with_ipex(model, optimizer, params_attr, device_type="cpu"):
             return m
         if is_with_hook_on_weight_or_bias(m):
             return m
+        # kept as plain module by ipex.optimize(level="auto")
+        if getattr(m, "_ipex_kernel", None) == "plain":
+            return m
         if hasattr(m, "bias") and m.bias is not None:
             if m.bias in params_attr:
                 param_wrapper = params_attr[m.bias]
@@ -0,0 +1,550 @@
+import types
+
+import torch
+
+from ._functional import (
+    adagrad_step,
+    adam_step,
+    get_param2,
+    is_master_weight,
+    lamb_step,
+    lars_step,
+    sgd_step,
+    _lamb_fused_impl,
+    _single_tensor_lars,
+    _single_tensor_sgd,
+)
+from ._lamb import Lamb
+from ._lars import Lars
+from ..utils._logger import warn_if_user_explicitly_set
+
+# Every param starts at a multiple of this number of elements in the flat
+# buffers, the padding is kept zero and so is never changed by the update.
+_FLAT_BUFFER_ALIGNMENT = 64
+
+
+def _mark_grad_ready(owner):
+    owner._ipex_grad_ready = True
+
+
+def _track_grad(owner):
+    # The grads of the flat buffers are kept as views and zeroed in place
+    # instead of being set to None, _ipex_grad_ready tells whether backward
+    # produced a grad since the last zero_grad(set_to_none=True).
+    if not hasattr(owner, "_ipex_grad_ready"):
+        owner._ipex_grad_ready = owner.grad is not None
+        owner.register_post_accumulate_grad_hook(_mark_grad_ready)
+
+
+def _is_dense(t):
+    return (
+        t.is_contiguous()
+        or (t.dim() == 4 and t.is_contiguous(memory_format=torch.channels_last))
+        or (t.dim() == 5 and t.is_contiguous(memory_format=torch.channels_last_3d))
+    )
+
+
+def _buffer_dtype(p):
+    return p.dtype if p.dtype is torch.float64 else torch.float
+
+
+def _init_adam_state(group, p, state):
+    # same as the lazy initialization of adam_step
+    state["step"] = torch.tensor(0.0)
+    state["exp_avg"] = torch.zeros_like(
+        p, memory_format=torch.preserve_format, dtype=_buffer_dtype(p)
+    )
+    state["exp_avg_sq"] = torch.zeros_like(
+        p, memory_format=torch.preserve_format, dtype=_buffer_dtype(p)
+    )
+    if group["amsgrad"]:
+        state["max_exp_avg_sq"] = torch.zeros_like(
+            p, memory_format=torch.preserve_format, dtype=_buffer_dtype(p)
+        )
+
+
+def _init_lamb_state(group, p, state):
+    # same as the lazy initialization of lamb_step
+    state["step"] = 0
+    state["exp_avg"] = torch.zeros(p.shape, dtype=_buffer_dtype(p), device=p.device)
+    state["exp_avg_sq"] = torch.zeros(p.shape, dtype=_buffer_dtype(p), device=p.device)
+
+
+class _FlatBucket(object):
+    r"""
+    Params of a param group sharing the dtypes of param, param2, grad and
+    states and the optimizer step. The params, their param2 (bf16 copy of
+    the master weight or trail of the split master weight), grads and states
+    are views of block aligned flat buffers, so one fused update kernel
+    updates the bucket.
+    """
+
+    def __init__(self, optimizer, params, state_keys):
+        self.params = params
+        self.params_attr = optimizer.params_attr
+        self.grad_owners = [
+            (
+                self.params_attr[p].parameter
+                if is_master_weight(p, self.params_attr)
+                else p
+            )
+            for p in params
+        ]
+        self.offsets = []
+        numel = 0
+        for p in params:
+            self.offsets.append(numel)
+            numel += (
+                (p.numel() + _FLAT_BUFFER_ALIGNMENT - 1)
+                // _FLAT_BUFFER_ALIGNMENT
+                * _FLAT_BUFFER_ALIGNMENT
+            )
+        self.numel = numel
+
+        self.param, self.param_views = self._flatten(params)
+        for p, view in zip(params, self.param_views):
+            p.data = view
+        params2 = [get_param2(p, self.params_attr) for p in params]
+        if params2[0].numel() > 0:
+            self.param2, self.param2_views = self._flatten(params2)
+            for p, view in zip(params, self.param2_views):
+                self._set_param2(p, view)
+        else:
+            self.param2, self.param2_views = torch.Tensor(), None
+        for owner in self.grad_owners:
+            _track_grad(owner)
+        grads = [
+            (
+                owner.grad
+                if owner.grad is not None
+                else torch.zeros_like(owner, memory_format=torch.preserve_format)
+            )
+            for owner in self.grad_owners
+        ]
+        self.grad, self.grad_views = self._flatten(grads)
+        for owner, view in zip(self.grad_owners, self.grad_views):
+            owner.grad = view
+
+        param_states = [optimizer.state[p] for p in params]
+        self.states = {}
+        self.state_views = {}
+        for key in state_keys:
+            if key in param_states[0]:
+                self.set_state(optimizer, key, [s[key] for s in param_states])
+        # the step of the params is shared by the bucket, a tensor for Adam and
+        # Adagrad and an int for Lamb
+        self.step = None
+        self.share_step(optimizer)
+
+    def share_step(self, optimizer):
+        param_states = [optimizer.state[p] for p in self.params]
+        if "step" in param_states[0] and isinstance(
+            param_states[0]["step"], torch.Tensor
+        ):
+            self.step = param_states[0]["step"].clone()
+            for state in param_states:
+                state["step"] = self.step
+
+    def unshare_step(self, optimizer):
+        # the per tensor steps increment the step tensor of every param
+        if self.step is not None:
+            for p in self.params:
+                optimizer.state[p]["step"] = self.step.clone()
+
+    def _view(self, flat, idx, like):
+        # keep the strides of the param, e.g. channels_last weights of Conv
+        return flat.as_strided(
+            like.size(), self.params[idx].stride(), self.offsets[idx]
+        )
+
+    def _flatten(self, tensors):
+        flat = torch.zeros(self.numel, dtype=tensors[0].dtype)
+        views = []
+        for idx, t in enumerate(tensors):
+            view = self._view(flat, idx, t)
+            view.copy_(t)
+            views.append(view)
+        return flat, views
+
+    def _get_param2(self, p):
+        attr = self.params_attr[p]
+        if attr.parameter_trail is not None:
+            return attr.parameter_trail
+        return attr.parameter
+
+    def _set_param2(self, p, view):
+        attr = self.params_attr[p]
+        if attr.parameter_trail is not None:
+            attr.parameter_trail = view
+        else:
+            attr.parameter.data = view
+
+    def set_state(self, optimizer, key, values):
+        r"""
+        Store a state of all params, given as a flat buffer or per param, in
+        the bucket and make the state of each param a view of it.
+        """
+        if isinstance(values, torch.Tensor):
+            flat = values
+            views = [self._view(flat, idx, p) for idx, p in enumerate(self.params)]
+        else:
+            flat, views = self._flatten(values)
+        self.states[key] = flat
+        self.state_views[key] = views
+        for p, view in zip(self.params, views):
+            optimizer.state[p][key] = view
+
+    def sync(self):
+        r"""
+        Bring params and grads rebound outside of the optimizer, e.g. grads set
+        to ``None`` by ``model.zero_grad()`` or params recast when saving the
+        model, back to the flat buffers. Returns whether each param has a grad,
+        the params without grad must not be updated.
+        """
+        has_grad = []
+        for idx, p in enumerate(self.params):
+            view = self.param_views[idx]
+            if p.data_ptr() != view.data_ptr():
+                view.copy_(p.data)
+                p.data = view
+            if self.param2_views is not None:
+                view = self.param2_views[idx]
+                param2 = self._get_param2(p)
+                if param2.data_ptr() != view.data_ptr():
+                    view.copy_(param2.data)
+                    self._set_param2(p, view)
+            owner = self.grad_owners[idx]
+            view = self.grad_views[idx]
+            if owner.grad is not view:
+                if owner.grad is None:
+                    view.zero_()
+                    owner._ipex_grad_ready = False
+                else:
+                    view.copy_(
+                        owner.grad.to_dense() if owner.grad.is_sparse else owner.grad
+                    )
+                    owner._ipex_grad_ready = True
+                owner.grad = view
+            has_grad.append(owner._ipex_grad_ready)
+        return has_grad
+
+    def zero_grad(self, set_to_none):
+        self.grad.zero_()
+        for owner, view in zip(self.grad_owners, self.grad_views):
+            owner.grad = view
+            # as in PyTorch, a zeroed grad still updates the param
+            if set_to_none:
+                owner._ipex_grad_ready = False
+
+
+def _maybe_negate(grad, group):
+    return -grad if group.get("maximize", False) else grad
+
+
+def _sgd_update(optimizer, group, bucket):
+    momentum_buffer = torch.ops.torch_ipex.sgd_fused_step(
+        bucket.param,
+        _maybe_negate(bucket.grad, group),
+        bucket.states.get("momentum_buffer"),
+        bucket.param2,
+        group["momentum"],
+        group["lr"],
+        group["weight_decay"],
+        group["dampening"],
+        group["nesterov"],
+    )
+    if group["momentum"] != 0 and "momentum_buffer" not in bucket.states:
+        # the first step initializes the momentum buffer from the grad
+        bucket.set_state(optimizer, "momentum_buffer", momentum_buffer)
+
+
+def _adagrad_update(optimizer, group, bucket):
+    bucket.step += 1
+    torch.ops.torch_ipex.adagrad_fused_step(
+        bucket.param,
+        _maybe_negate(bucket.grad, group),
+        bucket.states["sum"],
+        bucket.param2,
+        bucket.step.item(),
+        group["lr"],
+        group["weight_decay"],
+        group["lr_decay"],
+        group["eps"],
+    )
+
+
+def _adam_update(optimizer, group, bucket):
+    bucket.step += 1
+    beta1, beta2 = group["betas"]
+    torch.ops.torch_ipex.adam_fused_step(
+        bucket.param,
+        bucket.states["exp_avg"],
+        bucket.states["exp_avg_sq"],
+        bucket.states.get("max_exp_avg_sq", torch.Tensor()),
+        _maybe_negate(bucket.grad, group),
+        bucket.param2,
+        group["amsgrad"],
+        bucket.step.item(),
+        beta1,
+        beta2,
+        group["lr"],
+        group["weight_decay"],
+        group["eps"],
+    )
+
+
+def _lamb_update(optimizer, group, bucket):
+    # The trust ratio of Lamb needs the norms of each param, so the params
+    # are updated one by one on the views of the flat buffers.
+    steps = []
+    for p in bucket.params:
+        state = optimizer.state[p]
+        state["step"] += 1
+        steps.append(state["step"])
+    beta1, beta2 = group["betas"]
+    _lamb_fused_impl(
+        bucket.params,
+        bucket.grad_views,
+        bucket.state_views["exp_avg"],
+        bucket.state_views["exp_avg_sq"],
+        bucket.params_attr,
+        steps,
+        beta1,
+        beta2,
+        group["lr"],
+        group["weight_decay"],
+        group["eps"],
+    )
+
+
+def _lars_update(optimizer, group, bucket):
+    # as Lamb, the update of Lars needs the norms of each param
+    momentum_buffers = bucket.state_views.get(
+        "momentum_buffer", [None] * len(bucket.params)
+    )
+    momentum_buffers = list(momentum_buffers)
+    params2 = (
+        bucket.param2_views
+        if bucket.param2_views is not None
+        else [torch.Tensor()] * len(bucket.params)
+    )
+    kwargs = dict(
+        weight_decay=group["weight_decay"],
+        momentum=group["momentum"],
+        lr=group["lr"],
+        dampening=0,
+        nesterov=0,
+        maximize=0,
+        has_sparse_grad=False,
+        fused=optimizer.fused,
+    )
+    if group["lars"]:
+        _single_tensor_lars(
+            bucket.params,
+            params2,
+            bucket.grad_views,
+            momentum_buffers,
+            eeta=group["eeta"],
+            eps=group["epsilon"],
+            **kwargs,
+        )
+    else:
+        _single_tensor_sgd(
+            bucket.params, params2, bucket.grad_views, momentum_buffers, **kwargs
+        )
+    if "momentum_buffer" not in bucket.states and momentum_buffers[0] is not None:
+        bucket.set_state(optimizer, "momentum_buffer", momentum_buffers)
+
+
+# optimizer: (states with the shape of the param, state initialization,
+# per tensor fused step, update of a bucket)
+_FLAT_BUFFER_OPTIMIZERS = {
+    torch.optim.SGD: (["momentum_buffer"], None, sgd_step, _sgd_update),
+    torch.optim.Adagrad: (["sum"], None, adagrad_step, _adagrad_update),
+    torch.optim.Adam: (
+        ["exp_avg", "exp_avg_sq", "max_exp_avg_sq"],
+        _init_adam_state,
+        adam_step,
+        _adam_update,
+    ),
+    Lamb: (["exp_avg", "exp_avg_sq"], _init_lamb_state, lamb_step, _lamb_update),
+    Lars: (["momentum_buffer"], None, lars_step, _lars_update),
+}
+
+
+def _can_flatten(optimizer, p, state_keys):
+    attr = optimizer.params_attr.get(p)
+    if not p.requires_grad or p.device.type != "cpu" or not _is_dense(p):
+        return False
+    # prepacked weights share the storage with the op context
+    if attr is not None and attr.op_ctx is not None:
+        return False
+    param2 = get_param2(p, optimizer.params_attr)
+    if param2.numel() > 0 and param2.stride() != p.stride():
+        return False
+    state = optimizer.state[p]
+    return all(
+        isinstance(state[key], torch.Tensor)
+        and state[key].size() == p.size()
+        and _is_dense(state[key])
+        for key in state_keys
+        if key in state
+    )
+
+
+def _bucket_key(optimizer, p, state_keys):
+    state = optimizer.state[p]
+    owner = (
+        optimizer.params_attr[p].parameter
+        if is_master_weight(p, optimizer.params_attr)
+        else p
+    )
+    param2 = get_param2(p, optimizer.params_attr)
+    step = state.get("step")
+    return (
+        p.dtype,
+        param2.dtype if param2.numel() > 0 else None,
+        owner.dtype,
+        tuple((key, state[key].dtype) for key in state_keys if key in state),
+        float(step) if step is not None else None,
+    )
+
+
+@torch.no_grad()
+def _build_flat_buffers(optimizer):
+    state_keys, init_state, _, _ = _FLAT_BUFFER_OPTIMIZERS[type(optimizer)]
+    flat_groups = []
+    for group in optimizer.param_groups:
+        buckets = {}
+        others = []
+        for p in group["params"]:
+            if init_state is not None and len(optimizer.state[p]) == 0:
+                init_state(group, p, optimizer.state[p])
+            if _can_flatten(optimizer, p, state_keys):
+                buckets.setdefault(_bucket_key(optimizer, p, state_keys), []).append(p)
+            else:
+                others.append(p)
+        flat_groups.append(
+            (
+                [
+                    _FlatBucket(optimizer, params, state_keys)
+                    for params in buckets.values()
+                ],
+                others,
+            )
+        )
+    optimizer._flat_groups = flat_groups
+
+
+def _per_tensor_view(optimizer, group, params):
+    # the per tensor fused steps only use these attributes of the optimizer
+    return types.SimpleNamespace(
+        param_groups=[dict(group, params=params)],
+        state=optimizer.state,
+        params_attr=optimizer.params_attr,
+        fused=optimizer.fused,
+    )
+
+
+@torch.no_grad()
+def flat_buffer_step(self, closure=None):
+    """Performs a single optimization step.
+
+    Args:
+        closure (callable, optional): A closure that reevaluates the model
+            and returns the loss.
+    """
+    loss = None
+    if closure is not None:
+        with torch.enable_grad():
+            loss = closure()
+
+    if len(self._flat_groups) != len(self.param_groups):
+        # a param group is added
+        _build_flat_buffers(self)
+    state_keys, _, per_tensor_step, update = _FLAT_BUFFER_OPTIMIZERS[type(self)]
+    regroup = False
+    for group, (buckets, others) in zip(self.param_groups, self._flat_groups):
+        if others:
+            per_tensor_step(_per_tensor_view(self, group, others))
+        for bucket in buckets:
+            has_grad = bucket.sync()
+            if all(has_grad):
+                update(self, group, bucket)
+            elif any(has_grad):
+                # the params without grad are left untouched, the others take
+                # the per tensor step on the views of the flat buffers
+                bucket.unshare_step(self)
+                params = [p for p, g in zip(bucket.params, has_grad) if g]
+                per_tensor_step(_per_tensor_view(self, group, params))
+                keys = set(_bucket_key(self, p, state_keys) for p in bucket.params)
+                if len(keys) > 1:
+                    # e.g. the steps or the lazily initialized states differ
+                    regroup = True
+                else:
+                    bucket.share_step(self)
+    if regroup:
+        _build_flat_buffers(self)
+    return loss
+
+
+def optimizer_flat_buffer(optimizer, device_type, user_explicit_flat_buffer):
+    r"""
+    Store the params, param2, grads and states of a fused optimizer in flat
+    buffers and patch "step", "zero_grad", "state_dict" and "load_state_dict"
+    to work on them. Prepacked weights and params which cannot be flattened
+    keep the per tensor fused step.
+    """
+    if (
+        device_type != "cpu"
+        or not getattr(optimizer, "fused", False)
+        or type(optimizer) not in _FLAT_BUFFER_OPTIMIZERS
+    ):
+        msg = (
+            "IPEX only supports flat buffer update for the fused CPU optimizers "
+            + ", ".join(o.__name__ for o in _FLAT_BUFFER_OPTIMIZERS)
+            + ", will use per tensor update for "
+            + str(type(optimizer))
+        )
+        warn_if_user_explicitly_set(user_explicit_flat_buffer, msg)
+        return optimizer
+    if hasattr(optimizer, "_flat_groups"):
+        return optimizer
+    _build_flat_buffers(optimizer)
+
+    def zero_grad(self, set_to_none: bool = True):
+        # grads of the flat buffers are kept and zeroed in place
+        self._pre_flat_buffer_zero_grad(set_to_none)
+        for buckets, _ in self._flat_groups:
+            for bucket in buckets:
+                bucket.zero_grad(set_to_none)
+
+    def state_dict(self):
+        # the states of a bucket are views of its flat buffers and share the
+        # step tensor, clone them so that the saved states are per param
+        state_dict = self._pre_flat_buffer_state_dict()
+        state_dict["state"] = {
+            k: {
+                key: value.clone() if isinstance(value, torch.Tensor) else value
+                for key, value in v.items()
+            }
+            for k, v in state_dict["state"].items()
+        }
+        return state_dict
+
+    def load_state_dict(self, state_dict):
+        self._pre_flat_buffer_load_state_dict(state_dict)
+        _build_flat_buffers(self)
+
+    setattr(optimizer, "_pre_flat_buffer_zero_grad", optimizer.zero_grad)  # noqa: B010
+    setattr(  # noqa: B010
+        optimizer, "_pre_flat_buffer_state_dict", optimizer.state_dict
+    )
+    setattr(  # noqa: B010
+        optimizer, "_pre_flat_buffer_load_state_dict", optimizer.load_state_dict
+    )
+    optimizer.step = types.MethodType(flat_buffer_step, optimizer)
+    optimizer.zero_grad = types.MethodType(zero_grad, optimizer)
+    optimizer.state_dict = types.MethodType(state_dict, optimizer)
+    optimizer.load_state_dict = types.MethodType(load_state_dict, optimizer)
+    return optimizer
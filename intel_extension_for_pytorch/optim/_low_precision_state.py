@@ -0,0 +1,225 @@
+import types
+
+import torch
+
+from ._functional import get_bf16_grad, is_master_weight
+from ._lamb import Lamb
+from ..utils._logger import warn_if_user_explicitly_set
+
+# Number of elements sharing one scale of the 8-bit states.
+QUANT_BLOCK_SIZE = 256
+
+# The moments kept in low precision, the other states (e.g. step) are kept
+# as they are.
+_MOMENT_KEYS = ("exp_avg", "exp_avg_sq", "max_exp_avg_sq")
+# The moments which are never negative, they are quantized unsigned.
+_UNSIGNED_MOMENT_KEYS = ("exp_avg_sq", "max_exp_avg_sq")
+
+_LOW_PRECISION_STATE_OPTIMIZERS = (torch.optim.Adam, torch.optim.AdamW, Lamb)
+
+
+def is_low_precision_state(state_dtype):
+    if state_dtype is None or state_dtype == torch.float:
+        return False
+    if state_dtype not in (torch.bfloat16, torch.int8):
+        raise ValueError(
+            "IPEX only supports optimizer states in torch.float, torch.bfloat16 "
+            "or torch.int8, but got " + str(state_dtype)
+        )
+    return True
+
+
+def _round_to_bfloat16(value):
+    r"""
+    Round a float32 tensor to bfloat16 stochastically: add uniform noise to
+    the 16 bits dropped by bfloat16 before truncating them, so that small
+    updates of a moment are kept in expectation instead of rounded away.
+    """
+    bits = value.view(torch.int32)
+    noise = torch.randint_like(bits, 0, 1 << 16)
+    return ((bits + noise) & -65536).view(torch.float).to(torch.bfloat16)
+
+
+def _to_blocks(value):
+    flat = value.reshape(-1).float()
+    padding = -flat.numel() % QUANT_BLOCK_SIZE
+    if padding:
+        flat = torch.nn.functional.pad(flat, (0, padding))
+    return flat.view(-1, QUANT_BLOCK_SIZE)
+
+
+def quantize_8bit(value, signed):
+    r"""
+    Quantize a tensor block-wise to 8 bits with the absmax of each block of
+    ``QUANT_BLOCK_SIZE`` elements as its scale. The normalized values are
+    companded before the stochastic rounding, by the square root for signed
+    ones and by the fourth root for unsigned ones, to keep the relative
+    precision of the small moments of a block.
+
+    Returns:
+        A tuple of the flat quantized tensor (``torch.int8`` if ``signed``
+        else ``torch.uint8``) and the ``torch.float`` absmax per block.
+    """
+    blocks = _to_blocks(value)
+    absmax = blocks.abs().amax(dim=1)
+    normalized = blocks / absmax.clamp(min=torch.finfo(torch.float).tiny).unsqueeze(1)
+    if signed:
+        companded = normalized.abs().sqrt_().mul_(127)
+    else:
+        companded = normalized.clamp_(min=0).sqrt_().sqrt_().mul_(255)
+    companded.add_(torch.rand_like(companded)).floor_()
+    if signed:
+        quantized = companded.clamp_(max=127).mul_(normalized.sign()).to(torch.int8)
+    else:
+        quantized = companded.clamp_(max=255).to(torch.uint8)
+    return quantized.view(-1)[: value.numel()], absmax
+
+
+def dequantize_8bit(quantized, absmax):
+    r"""
+    Dequantize the flat output of :func:`quantize_8bit` to ``torch.float``.
+    """
+    blocks = _to_blocks(quantized)
+    if quantized.dtype == torch.int8:
+        companded = blocks / 127
+        normalized = companded.abs() * companded
+    else:
+        normalized = (blocks / 255).square_().square_()
+    return normalized.mul_(absmax.unsqueeze(1)).view(-1)[: quantized.numel()]
+
+
+def dequantize_state(state, key, param, dtype):
+    r"""
+    Return the moment ``state[key]`` of ``param`` in ``dtype`` with the
+    shape and memory format of ``param``.
+    """
+    value = state[key]
+    if value.dtype in (torch.int8, torch.uint8):
+        dequantized = torch.empty_like(
+            param, dtype=dtype, memory_format=torch.preserve_format
+        )
+        dequantized.copy_(
+            dequantize_8bit(value, state[key + "_absmax"]).view(param.shape)
+        )
+        return dequantized
+    return value.to(dtype)
+
+
+def quantize_state_(state, key, value, state_dtype):
+    r"""
+    Store the moment ``value`` to ``state[key]`` in ``state_dtype``. 8-bit
+    moments are stored flat with their per block absmax in
+    ``state[key + "_absmax"]``.
+    """
+    state.pop(key + "_absmax", None)
+    if state_dtype == torch.int8:
+        state[key], state[key + "_absmax"] = quantize_8bit(
+            value, key not in _UNSIGNED_MOMENT_KEYS
+        )
+    elif state_dtype == torch.bfloat16 and value.dtype == torch.float:
+        state[key] = _round_to_bfloat16(value)
+    else:
+        state[key] = value.to(state_dtype)
+
+
+@torch.no_grad()
+def low_precision_state_step(self, closure=None):
+    r"""
+    Fused step of the optimizers with low precision states. The moments of
+    a param are dequantized to float, updated by the fused step of the
+    param and quantized back before the next param, so that only the float
+    moments of one param are alive at a time.
+    """
+    loss = None
+    if closure is not None:
+        with torch.enable_grad():
+            loss = closure()
+
+    fused_step = self._low_precision_fused_step
+    for group in self.param_groups:
+        state_dtype = group.get("state_dtype")
+        if not is_low_precision_state(state_dtype):
+            fused_step(
+                types.SimpleNamespace(
+                    param_groups=[group],
+                    state=self.state,
+                    params_attr=self.params_attr,
+                    fused=self.fused,
+                )
+            )
+            continue
+        for p in group["params"]:
+            grad = (
+                get_bf16_grad(p, self.params_attr)
+                if is_master_weight(p, self.params_attr)
+                else p.grad
+            )
+            if grad is None:
+                continue
+            state = self.state[p]
+            float_state = {}
+            for key, value in state.items():
+                if key in _MOMENT_KEYS:
+                    float_state[key] = dequantize_state(state, key, p, torch.float)
+                elif not key.endswith("_absmax"):
+                    float_state[key] = value
+            fused_step(
+                types.SimpleNamespace(
+                    param_groups=[dict(group, params=[p])],
+                    state={p: float_state},
+                    params_attr=self.params_attr,
+                    fused=self.fused,
+                )
+            )
+            for key, value in float_state.items():
+                if key in _MOMENT_KEYS:
+                    quantize_state_(state, key, value, state_dtype)
+                else:
+                    state[key] = value
+    return loss
+
+
+def optimizer_low_precision_state(
+    optimizer, state_dtype, device_type, user_explicit_state_dtype
+):
+    r"""
+    Keep the moments of a fused Adam, AdamW or Lamb in ``state_dtype`` and
+    patch "step" to update them in float.
+    """
+    from ._optimizer_utils import (
+        OPTIMIZER_FUSED_STEP_MAPPING_CPU,
+        OPTIMIZER_FUSED_STEP_MAPPING_XPU,
+        patch_load_state_dict,
+    )
+
+    if not is_low_precision_state(state_dtype):
+        return optimizer
+    mapping = (
+        OPTIMIZER_FUSED_STEP_MAPPING_CPU
+        if device_type == "cpu"
+        else OPTIMIZER_FUSED_STEP_MAPPING_XPU
+    )
+    if (
+        not getattr(optimizer, "fused", False)
+        or hasattr(optimizer, "_flat_groups")
+        or type(optimizer) not in _LOW_PRECISION_STATE_OPTIMIZERS
+        or type(optimizer) not in mapping
+    ):
+        msg = (
+            "IPEX only supports low precision states for the fused "
+            + ", ".join(o.__name__ for o in _LOW_PRECISION_STATE_OPTIMIZERS)
+            + " without flat buffer update, will keep float states for "
+            + str(type(optimizer))
+        )
+        warn_if_user_explicitly_set(user_explicit_state_dtype, msg)
+        return optimizer
+    for group in optimizer.param_groups:
+        group["state_dtype"] = state_dtype
+    if not hasattr(optimizer, "_low_precision_fused_step"):
+        setattr(  # noqa: B010
+            optimizer, "_low_precision_fused_step", mapping[type(optimizer)]
+        )
+        optimizer.step = types.MethodType(low_precision_state_step, optimizer)
+    # the loaded states are not casted to the dtype of the params
+    patch_load_state_dict(optimizer)
+    return optimizer
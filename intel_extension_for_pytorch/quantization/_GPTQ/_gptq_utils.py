@@ -18,6 +18,9 @@ def gptq_quantize(
     device=torch.device("cpu"),
     layer_wise=False,
     model_path=None,
+    cpu_pools=None,
+    checkpoint_dir=None,
+    offload_dir=None,
 ):
     """Run weight-only quantization with weight configs.
 
@@ -43,6 +46,9 @@ def gptq_quantize(
         device: set to torch.device("cpu").
         layer_wise (bool): whether to do LWQ.
         model_path (str): path to register LWQ weight hooks.
+        cpu_pools (list): ipex.cpu.runtime.CPUPool list to quantize the layers of a block concurrently.
+        checkpoint_dir (str): directory to save quantized blocks to and resume them from.
+        offload_dir (str): scratch directory to keep calibration activations in instead of RAM.
     """
     assert isinstance(model, torch.nn.Module), "only support torch module"
     if layer_wise:
@@ -64,6 +70,9 @@ def gptq_quantize(
         pad_max_length,
         device,
         layer_wise=layer_wise,
+        cpu_pools=cpu_pools,
+        checkpoint_dir=checkpoint_dir,
+        offload_dir=offload_dir,
     )
     fp32_modified_model, gptq_config = gptq_quantizer.execute_quantization(
         model_path=model_path
@@ -22,6 +22,9 @@ def gptq(
     compression_dim=1,
     scale_dtype=torch.float16,
     save_dir="saved_results",
+    cpu_pools=None,
+    checkpoint_dir=None,
+    offload_dir=None,
 ):
     """User API to run GPTQ; quantize and save checkpoint to designated path.
 
@@ -43,6 +46,13 @@ def gptq(
         compression_dim (int): 0 means output channel while 1 means input channel.
         scale_dtype: data type for scale and bias.
         save_dir (str): path to save checkpoint.
+        cpu_pools (list): ipex.cpu.runtime.CPUPool list, the independent layers of a transformer block
+                        (e.g. q/k/v, gate/up) are quantized concurrently, one on each pool.
+        checkpoint_dir (str): directory to save every quantized transformer block to. If it contains
+                        blocks of an interrupted run, they are restored instead of quantized again.
+        offload_dir (str): scratch directory to keep the transformer blocks' inputs and outputs of all
+                        calibration samples in memory-mapped files instead of RAM. They are read back
+                        with prefetch and deleted once the next block has consumed them.
     """
     logger.info("quantizing with GPTQ algorithm")
     from ._gptq_utils import gptq_quantize, gptq_export
@@ -78,6 +88,9 @@ def gptq(
         pad_max_length,
         layer_wise,
         model_path,
+        cpu_pools=cpu_pools,
+        checkpoint_dir=checkpoint_dir,
+        offload_dir=offload_dir,
     )
     compressed_model = gptq_export(
         model,
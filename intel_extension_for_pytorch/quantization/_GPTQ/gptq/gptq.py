@@ -1,11 +1,16 @@
 from ....utils._logger import logger, WarningType
 import math
+import os
+import queue
 import random
 import re
+import shutil
+import tempfile
 import time
 import torch
 import torch.nn as nn
 import transformers
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 from .model_utils import (
     find_layers,
@@ -18,6 +23,61 @@ from .model_utils import (
 DEBUG = False
 
 
+class OffloadedTensorList(object):
+    """A list of tensors kept in memory-mapped files under a scratch directory instead of RAM.
+
+    Items are read back lazily; reading item i prefetches the next items in a background
+    thread, so a sequential pass over the list overlaps disk reads with computation.
+    """
+
+    def __init__(self, offload_dir, prefetch=2):
+        os.makedirs(offload_dir, exist_ok=True)
+        self.dir = tempfile.mkdtemp(prefix="gptq_", dir=offload_dir)
+        self.prefetch = prefetch
+        self.items = []  # (path, shape, dtype)
+        self.pending = {}
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def append(self, tensor):
+        path = os.path.join(self.dir, f"{len(self.items)}.bin")
+        tensor = tensor.detach().contiguous()
+        with open(path, "wb") as f:
+            f.truncate(tensor.numel() * tensor.element_size())
+        if tensor.numel() > 0:
+            torch.from_file(
+                path, shared=True, size=tensor.numel(), dtype=tensor.dtype
+            ).copy_(tensor.flatten())
+        self.items.append((path, tensor.shape, tensor.dtype))
+
+    def load(self, idx):
+        path, shape, dtype = self.items[idx]
+        if math.prod(shape) == 0:
+            return torch.empty(shape, dtype=dtype)
+        # read into RAM, the file may be deleted while the tensor is in use
+        return (
+            torch.from_file(path, shared=True, size=math.prod(shape), dtype=dtype)
+            .view(shape)
+            .clone()
+        )
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, idx):
+        for i in range(idx + 1, min(idx + 1 + self.prefetch, len(self.items))):
+            if i not in self.pending:
+                self.pending[i] = self.executor.submit(self.load, i)
+        if idx in self.pending:
+            return self.pending.pop(idx).result()
+        return self.load(idx)
+
+    def release(self):
+        """Delete the files, the list can not be used anymore."""
+        self.executor.shutdown(wait=True)
+        self.pending.clear()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
 class GPTQuantizer(object):
     """Main API for GPTQ algorithm."""
 
@@ -32,6 +92,9 @@ class GPTQuantizer(object):
         device=torch.device("cpu"),
         layer_wise=False,
         cache_positional_arguments=None,
+        cpu_pools=None,
+        checkpoint_dir=None,
+        offload_dir=None,
     ):
         """
         Args:
@@ -55,6 +118,12 @@ class GPTQuantizer(object):
             pad_max_length (int): whether to align calibration data to a fixed length.
             device: set to torch.device("cpu").
             layer_wise (bool): whether to do LWQ.
+            cpu_pools (list): ipex.cpu.runtime.CPUPool list to quantize the layers of a
+                block concurrently, one layer per pool at a time. Defaults to sequential.
+            checkpoint_dir (str): directory to save every quantized block to, and to resume
+                the quantized blocks from if they exist.
+            offload_dir (str): scratch directory to keep the inputs and outputs of the
+                transformer blocks for all calibration samples in, instead of RAM.
         """
         self.model = model
         self.gptq_related_blocks = trace_gptq_target_blocks(self.model)
@@ -78,6 +147,11 @@ class GPTQuantizer(object):
         self.layer_wise = layer_wise
         self.is_ready = False
         self.cache_positional_arguments = cache_positional_arguments
+        self.cpu_pools = cpu_pools
+        self.checkpoint_dir = checkpoint_dir
+        self.offload_dir = offload_dir
+        self.offload_scratch_dir = None
+        self.offloaded_lists = []
 
         # dataloader
         self.use_max_length = use_max_length
@@ -333,7 +407,11 @@ class GPTQuantizer(object):
                 # each outputs can be different shape, hence also use list to store
                 if isinstance(kwargs[arg], torch.Tensor) or arg == "alibi":
                     if self.cache_key_arguments.get(arg, None) is None:
-                        self.cache_key_arguments[arg] = []
+                        self.cache_key_arguments[arg] = (
+                            self.new_hidden_states_list()
+                            if arg == "hidden_states"
+                            else []
+                        )
                     self.cache_key_arguments[arg].append(kwargs[arg])
                 continue
             # copy positional arguments, positional arguments are sensitive for their order, be cautious!
@@ -342,7 +420,9 @@ class GPTQuantizer(object):
             for idx, item in enumerate(args):
                 if (idx + 1) > len(self.cache_positional_arguments):
                     # initialize
-                    self.cache_positional_arguments.append([])
+                    self.cache_positional_arguments.append(
+                        self.new_hidden_states_list() if idx == 0 else []
+                    )
                 self.cache_positional_arguments[idx].append(item)
             raise ValueError
 
@@ -415,142 +495,289 @@ class GPTQuantizer(object):
             single_batch.append(data_item[idx])
         return single_batch
 
+    def new_hidden_states_list(self):
+        if self.offload_dir is None:
+            return []
+        hidden_states = OffloadedTensorList(self.offload_scratch_dir)
+        self.offloaded_lists.append(hidden_states)
+        return hidden_states
+
     def update_blockwise_hidden_states(self, outs):
+        if isinstance(outs, list):
+            outs = outs[:]
         if "hidden_states" in self.cache_key_arguments:
-            self.cache_key_arguments["hidden_states"] = outs[:]
+            consumed = self.cache_key_arguments["hidden_states"]
+            self.cache_key_arguments["hidden_states"] = outs
+        else:
+            consumed = self.cache_positional_arguments[0]
+            self.cache_positional_arguments[0] = outs
+        # the inputs of the block are not used anymore
+        if isinstance(consumed, OffloadedTensorList):
+            consumed.release()
+
+    def gather_block_inputs(self, idx):
+        # obtain the inputs of one calibration sample
+        # "i" counts the collected samples, it is not an argument
+        cache_keyword_batch = self.gather_single_batch_from_dict(
+            {k: v for k, v in self.cache_key_arguments.items() if k != "i"}, idx
+        )
+        cache_positional_batch = self.gather_single_batch_from_list(
+            self.cache_positional_arguments, idx
+        )
+        return cache_positional_batch, cache_keyword_batch
+
+    def replace_hidden_states(self, args, kwargs, hidden_states):
+        # reuse gathered block inputs with the hidden_states replaced, e.g. by the
+        # outputs of the previous block, without reading the offloaded ones again
+        args, kwargs = list(args), dict(kwargs)
+        if "hidden_states" in kwargs:
+            kwargs["hidden_states"] = hidden_states
+        else:
+            args[0] = hidden_states
+        return args, kwargs
+
+    def get_transformer_block(self, block_idx):
+        if not self.layer_wise:
+            # if we do not apply layer-wise feature, we still place the entire block on the GPU
+            return self.gptq_related_blocks["transformers"][block_idx].to(self.device)
+        return self.gptq_related_blocks["transformers"][block_idx]
+
+    def release_transformer_block(self, block_idx, transformer_block):
+        if self.layer_wise:
+            self.gptq_related_blocks["transformers"][block_idx] = transformer_block
+        else:
+            self.gptq_related_blocks["transformers"][
+                block_idx
+            ] = transformer_block.cpu()
+
+    def prepare_block_quantization(self, transformer_block, block_idx):
+        """Create GPTQ objects for the quantizable layers of a block and register the hooks
+        accumulating their Hessians."""
+        # obtain all layers (Linear, Conv2d, etc) in the block which can be quantized.
+        sub_layers = find_layers(transformer_block)
+        sub_layers_to_quant = {}
+        for layer_name, layer_obj in sub_layers.items():
+            # filter sub_layers with included layer_names in self.weight_config
+            full_layer_name = self.get_full_layer_name(layer_name, block_idx)
+            if self.get_layer_config(full_layer_name) is None:
+                logger.warning(
+                    f"{full_layer_name} can be quantized "
+                    + "but excluded from quantization configs."
+                )
+            else:
+                sub_layers_to_quant[layer_name] = layer_obj
+        del sub_layers
+        sub_layers = sub_layers_to_quant
+        # initialize gptq quantizer for every layer in a transformer block
+        gptq_for_this_block = {}
+        for layer_name in sub_layers:
+            full_layer_name = self.get_full_layer_name(layer_name, block_idx)
+            weight_config_this_layer = self.get_layer_config(full_layer_name)
+            W = sub_layers[layer_name].weight.data.clone()
+
+            gptq_for_this_block[layer_name] = GPTQ(
+                sub_layers[layer_name], W, self.device
+            )
+            gptq_for_this_block[layer_name].quantizer.configure(
+                weight_config_this_layer["wbits"],
+                weight_config_this_layer["perchannel"],
+                weight_config_this_layer["sym"],
+                weight_config_this_layer["mse"],
+            )
+
+        # modify forward functions to hook inputs data (used in gptq execution)
+        def add_batch(_name):
+            def tmp(_, inp, out):
+                gptq_for_this_block[_name].add_batch(
+                    inp[0].data, out.data
+                )  # noqa: F821
+
+            return tmp
+
+        handles = []  # register handles which add inputs and outputs to gptq object
+        for layer_name in sub_layers:
+            handles.append(
+                sub_layers[layer_name].register_forward_hook(add_batch(layer_name))
+            )
+        return sub_layers, gptq_for_this_block, handles
+
+    def quantize_block(self, block_idx, sub_layers, gptq_for_this_block, gptq_config):
+        """Run fasterquant for the layers of a block. Their Hessians are all collected from
+        the same forward, so the layers are independent and run concurrently if cpu_pools
+        is set."""
+
+        def quantize_layer(layer_name):
+            weight_config_this_layer = self.get_layer_config(
+                self.get_full_layer_name(layer_name, block_idx)
+            )
+            logger.info(f"Quantizing layer {layer_name}")
+            W = sub_layers[layer_name].weight.data.clone()
+            return gptq_for_this_block[layer_name].fasterquant(
+                W,
+                blocksize=weight_config_this_layer["block_size"],
+                percdamp=weight_config_this_layer["percdamp"],
+                groupsize=weight_config_this_layer["group_size"],
+                act_order=weight_config_this_layer["act_order"],
+            )
+
+        if self.cpu_pools is None or len(sub_layers) < 2:
+            results = [quantize_layer(layer_name) for layer_name in sub_layers]
         else:
-            self.cache_positional_arguments[0] = outs[:]
+            from ....cpu.runtime import pin, is_runtime_ext_enabled
+
+            free_pools = queue.Queue()
+            for cpu_pool in self.cpu_pools:
+                free_pools.put(cpu_pool)
+
+            def quantize_layer_on_free_pool(layer_name):
+                cpu_pool = free_pools.get()
+                try:
+                    if is_runtime_ext_enabled():
+                        with pin(cpu_pool):
+                            return quantize_layer(layer_name)
+                    return quantize_layer(layer_name)
+                finally:
+                    free_pools.put(cpu_pool)
+
+            with ThreadPoolExecutor(max_workers=len(self.cpu_pools)) as executor:
+                results = list(executor.map(quantize_layer_on_free_pool, sub_layers))
+
+        for layer_name, (scale, zp, Q) in zip(sub_layers, results):
+            full_layer_name = self.get_full_layer_name(layer_name, block_idx)
+            weight_config_this_layer = self.get_layer_config(full_layer_name)
+            sub_layers[layer_name].weight.data = Q
+            gptq_config[full_layer_name] = {"scale": scale}
+            if not weight_config_this_layer["sym"]:
+                gptq_config[full_layer_name]["zero"] = zp
+            if weight_config_this_layer[
+                "act_order"
+            ]:  # save perm for restoring the weights
+                gptq_config[full_layer_name]["perm"] = gptq_for_this_block[
+                    layer_name
+                ].perm
+            gptq_for_this_block[layer_name].free()
+
+    def get_checkpoint_path(self, block_idx):
+        return os.path.join(self.checkpoint_dir, f"gptq_block_{block_idx}.pt")
+
+    def save_block_checkpoint(self, block_idx, transformer_block, gptq_config):
+        prefix = self.get_full_layer_name("", block_idx)
+        checkpoint = {
+            "state_dict": transformer_block.state_dict(),
+            "gptq_config": {
+                k: v for k, v in gptq_config.items() if k.startswith(prefix)
+            },
+        }
+        # write then rename, so that an interrupted save is not resumed from
+        path = self.get_checkpoint_path(block_idx)
+        torch.save(checkpoint, path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+    def load_block_checkpoints(self, gptq_config):
+        """Restore the quantized blocks saved in checkpoint_dir, returns the number of
+        leading blocks restored."""
+        if self.checkpoint_dir is None:
+            return 0
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        num_blocks = 0
+        while num_blocks < len(self.gptq_related_blocks["transformers"]):
+            path = self.get_checkpoint_path(num_blocks)
+            if not os.path.exists(path):
+                break
+            checkpoint = torch.load(path)
+            self.gptq_related_blocks["transformers"][num_blocks].load_state_dict(
+                checkpoint["state_dict"]
+            )
+            gptq_config.update(checkpoint["gptq_config"])
+            num_blocks += 1
+        if num_blocks > 0:
+            logger.info(
+                f"Resume from {num_blocks} quantized blocks in {self.checkpoint_dir}."
+            )
+        return num_blocks
 
     @torch.no_grad()
     def execute_quantization(self, means=None, stds=None, model_path=None):
         """Run quantization."""
+        if self.offload_dir is None:
+            return self.run_quantization(means, stds, model_path)
+        # the offloaded activations are removed even if the quantization fails
+        os.makedirs(self.offload_dir, exist_ok=True)
+        with tempfile.TemporaryDirectory(prefix="gptq_", dir=self.offload_dir) as d:
+            self.offload_scratch_dir = d
+            self.offloaded_lists = []
+            try:
+                return self.run_quantization(means, stds, model_path)
+            finally:
+                for hidden_states in self.offloaded_lists:
+                    hidden_states.release()
+                self.offloaded_lists = []
+
+    def run_quantization(self, means=None, stds=None, model_path=None):
         # Step1: prepare quantization (calibration datasets)
         logger.info("Begin ====>")
         self.pre_quantization()
 
-        # Step2: run gptq quantization in a transformer block-wise manner.
+        # Step2: restore the blocks quantized by a previous run and compute their outputs.
         gptq_config = {}
         tblock_length = len(self.gptq_related_blocks["transformers"])
-        for block_idx in range(tblock_length):
-            logger.info(f"Quantizing layer {block_idx + 1} / {tblock_length}..")
-            if not self.layer_wise:
-                # if we do not apply layer-wise feature, we still place the entire block on the GPU
-                transformer_block = self.gptq_related_blocks["transformers"][
-                    block_idx
-                ].to(self.device)
-            else:
-                transformer_block = self.gptq_related_blocks["transformers"][block_idx]
-            # Step2.1: obtain all layers (Linear, Conv2d, etc) in the block which can be quantized.
-            sub_layers = find_layers(transformer_block)
-            sub_layers_to_quant = {}
-            for layer_name, layer_obj in sub_layers.items():
-                # filter sub_layers with included layer_names in self.weight_config
-                full_layer_name = self.get_full_layer_name(layer_name, block_idx)
-                if self.get_layer_config(full_layer_name) is None:
-                    logger.warning(
-                        f"{full_layer_name} can be quantized "
-                        + "but excluded from quantization configs."
-                    )
-                else:
-                    sub_layers_to_quant[layer_name] = layer_obj
-            del sub_layers
-            sub_layers = sub_layers_to_quant
-            # Step 2.2: Initialize GPTQ quantizers for collected layers.
-            gptq_for_this_block = {}
-            # initialize gptq quantizer for every layer in a transformer block
-            for layer_name in sub_layers:
-                full_layer_name = self.get_full_layer_name(layer_name, block_idx)
-                weight_config_this_layer = self.get_layer_config(full_layer_name)
-                W = sub_layers[layer_name].weight.data.clone()
-
-                gptq_for_this_block[layer_name] = GPTQ(
-                    sub_layers[layer_name], W, self.device
-                )
-                gptq_for_this_block[layer_name].quantizer.configure(
-                    weight_config_this_layer["wbits"],
-                    weight_config_this_layer["perchannel"],
-                    weight_config_this_layer["sym"],
-                    weight_config_this_layer["mse"],
+        start_idx = self.load_block_checkpoints(gptq_config)
+        for block_idx in range(start_idx):
+            transformer_block = self.get_transformer_block(block_idx)
+            outs = self.new_hidden_states_list()
+            for j in range(len(self.dataloader)):
+                args, kwargs = self.gather_block_inputs(j)
+                outs.append(
+                    self.track_hidden_states(transformer_block(*args, **kwargs))
                 )
+            self.release_transformer_block(block_idx, transformer_block)
+            self.update_blockwise_hidden_states(outs)
 
-            # Step 2.3: modify forward functions to hook inputs data (used in gptq execution)
-            def add_batch(_name):
-                def tmp(_, inp, out):
-                    gptq_for_this_block[_name].add_batch(
-                        inp[0].data, out.data
-                    )  # noqa: F821
-
-                return tmp
-
-            handles = []  # register handles which add inputs and outputs to gptq object
-            for layer_name in sub_layers:
-                handles.append(
-                    sub_layers[layer_name].register_forward_hook(add_batch(layer_name))
-                )
-            idx = self.cache_key_arguments.pop("i")
+        # Step3: run gptq quantization in a transformer block-wise manner. The forward
+        # producing the outputs of a quantized block also feeds them to the next block,
+        # whose Hessians are accumulated on the way, so the calibration inputs of each
+        # block are only run once.
+        if start_idx < tblock_length:
+            transformer_block = self.get_transformer_block(start_idx)
+            sub_layers, gptq_for_this_block, handles = self.prepare_block_quantization(
+                transformer_block, start_idx
+            )
             for j in range(len(self.dataloader)):
-                cache_keyword_batch = self.gather_single_batch_from_dict(
-                    self.cache_key_arguments, j
-                )
-                cache_positional_batch = self.gather_single_batch_from_list(
-                    self.cache_positional_arguments, j
-                )
-                out = transformer_block(*cache_positional_batch, **cache_keyword_batch)
-                out = self.track_hidden_states(out)
-            self.cache_key_arguments["i"] = idx
+                args, kwargs = self.gather_block_inputs(j)
+                transformer_block(*args, **kwargs)
             for h in handles:
                 h.remove()
-            # Step 2.4: everything is prepared, so start quantization!
-            for layer_name in sub_layers:
-                weight_config_this_layer = self.get_layer_config(
-                    self.get_full_layer_name(layer_name, block_idx)
-                )
-                logger.info(f"Quantizing layer {layer_name}")
-                W = sub_layers[layer_name].weight.data.clone()
-                scale, zp, Q = gptq_for_this_block[layer_name].fasterquant(
-                    W,
-                    blocksize=weight_config_this_layer["block_size"],
-                    percdamp=weight_config_this_layer["percdamp"],
-                    groupsize=weight_config_this_layer["group_size"],
-                    act_order=weight_config_this_layer["act_order"],
+        for block_idx in range(start_idx, tblock_length):
+            logger.info(f"Quantizing layer {block_idx + 1} / {tblock_length}..")
+            # Step 3.1: everything is prepared, so start quantization!
+            self.quantize_block(block_idx, sub_layers, gptq_for_this_block, gptq_config)
+            del gptq_for_this_block
+            if self.checkpoint_dir is not None:
+                self.save_block_checkpoint(block_idx, transformer_block, gptq_config)
+
+            # Step 3.2: replace output data with quantized weights, and collect the
+            # Hessians of the next block
+            next_block = None
+            if block_idx + 1 < tblock_length:
+                next_block = self.get_transformer_block(block_idx + 1)
+                next_sub_layers, next_gptq_for_this_block, handles = (
+                    self.prepare_block_quantization(next_block, block_idx + 1)
                 )
-                sub_layers[layer_name].weight.data = Q
-                gptq_config[self.get_full_layer_name(layer_name, block_idx)] = {
-                    "scale": scale
-                }
-                if not weight_config_this_layer["sym"]:
-                    gptq_config[self.get_full_layer_name(layer_name, block_idx)][
-                        "zero"
-                    ] = zp
-                if weight_config_this_layer[
-                    "act_order"
-                ]:  # save perm for restoring the weights
-                    gptq_config[self.get_full_layer_name(layer_name, block_idx)][
-                        "perm"
-                    ] = gptq_for_this_block[layer_name].perm
-                gptq_for_this_block[layer_name].free()
-
-            # Step 2.5: replace output data with quantized weights
-            outs = []
-            idx = self.cache_key_arguments.pop("i")
+            outs = self.new_hidden_states_list()
             for j in range(len(self.dataloader)):
-                cache_keyword_batch = self.gather_single_batch_from_dict(
-                    self.cache_key_arguments, j
-                )
-                cache_positional_batch = self.gather_single_batch_from_list(
-                    self.cache_positional_arguments, j
-                )
-                out = transformer_block(*cache_positional_batch, **cache_keyword_batch)
-                out = self.track_hidden_states(out)
+                args, kwargs = self.gather_block_inputs(j)
+                out = self.track_hidden_states(transformer_block(*args, **kwargs))
                 outs.append(out)
-            self.cache_key_arguments["i"] = idx
-            if self.layer_wise:
-                self.gptq_related_blocks["transformers"][block_idx] = transformer_block
-            else:
-                self.gptq_related_blocks["transformers"][
-                    block_idx
-                ] = transformer_block.cpu()
-            del gptq_for_this_block
+                if next_block is not None:
+                    args, kwargs = self.replace_hidden_states(args, kwargs, out)
+                    next_block(*args, **kwargs)
+            self.release_transformer_block(block_idx, transformer_block)
+            if next_block is not None:
+                for h in handles:
+                    h.remove()
+                transformer_block = next_block
+                sub_layers = next_sub_layers
+                gptq_for_this_block = next_gptq_for_this_block
             torch.cuda.empty_cache()
             # iteratively replace the input with output, thus layerwise quantization can continue.
             self.update_blockwise_hidden_states(outs)
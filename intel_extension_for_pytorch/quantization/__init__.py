@@ -12,6 +12,12 @@ from ._qconfig import (
     WoqWeightDtype,
 )
 from ._autotune import autotune
+from ._calibration import (
+    calibrate_in_parallel,
+    get_observer_state,
+    merge_observer_state,
+)
+from ._smooth_quant_tuning import tune_smooth_quant_alpha
 from ._quantize_utils import (
     quantize_per_channel,
     dequantize_per_channel,
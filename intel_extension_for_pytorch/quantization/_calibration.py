@@ -0,0 +1,266 @@
+import contextlib
+import multiprocessing
+import os
+import tempfile
+
+import torch
+from torch.ao.quantization import (
+    HistogramObserver,
+    MinMaxObserver,
+    PerChannelMinMaxObserver,
+    PlaceholderObserver,
+)
+
+from ._smooth_quant import SmoothQuantActivationObserver, SmoothQuantWeightObserver
+from ..utils._logger import logger, WarningType
+
+
+def _is_observed(min_val, max_val):
+    return min_val.numel() > 0 and bool(torch.all(min_val <= max_val))
+
+
+def _merge_min_max(observer, state, prefix):
+    min_val, max_val = state[prefix + "min_val"], state[prefix + "max_val"]
+    if not _is_observed(min_val, max_val):
+        return
+    if not _is_observed(observer.min_val, observer.max_val):
+        # in-place so that references to the buffers, e.g. min_val of the
+        # SmoothQuant observers, stay valid
+        observer.min_val.resize_(min_val.shape).copy_(min_val)
+        observer.max_val.resize_(max_val.shape).copy_(max_val)
+    else:
+        observer.min_val.copy_(torch.min(observer.min_val, min_val))
+        observer.max_val.copy_(torch.max(observer.max_val, max_val))
+
+
+def _rebin_histogram(histogram, min_val, max_val, new_min, new_max):
+    # Spread the counts of a uniform histogram over [min_val, max_val] to the
+    # bins of [new_min, new_max] by linear interpolation of its CDF.
+    bins = histogram.numel()
+    min_val, max_val = float(min_val), float(max_val)
+    new_min, new_max = float(new_min), float(new_max)
+    new_edges = torch.linspace(new_min, new_max, bins + 1)
+    if max_val == min_val:
+        idx = torch.bucketize(torch.tensor(min_val), new_edges[1:-1])
+        rebinned = torch.zeros_like(histogram)
+        rebinned[idx] = histogram.sum()
+        return rebinned
+    edges = torch.linspace(min_val, max_val, bins + 1)
+    cdf = torch.cat([histogram.new_zeros(1), histogram.cumsum(0)])
+    new_edges = new_edges.clamp(min_val, max_val)
+    idx = torch.searchsorted(edges, new_edges).clamp(1, bins)
+    x0, x1 = edges[idx - 1], edges[idx]
+    y0, y1 = cdf[idx - 1], cdf[idx]
+    new_cdf = y0 + (y1 - y0) * (new_edges - x0) / (x1 - x0)
+    return new_cdf[1:] - new_cdf[:-1]
+
+
+def _merge_histogram(observer, state, prefix):
+    histogram = state[prefix + "histogram"]
+    min_val, max_val = state[prefix + "min_val"], state[prefix + "max_val"]
+    if not _is_observed(min_val, max_val):
+        return
+    if not _is_observed(observer.min_val, observer.max_val):
+        observer.histogram.copy_(histogram)
+        observer.min_val.copy_(min_val)
+        observer.max_val.copy_(max_val)
+        return
+    new_min = torch.min(observer.min_val, min_val)
+    new_max = torch.max(observer.max_val, max_val)
+    merged = _rebin_histogram(
+        observer.histogram, observer.min_val, observer.max_val, new_min, new_max
+    ) + _rebin_histogram(histogram, min_val, max_val, new_min, new_max)
+    observer.histogram.copy_(merged)
+    observer.min_val.copy_(new_min)
+    observer.max_val.copy_(new_max)
+
+
+def _merge_observer(observer, state, prefix=""):
+    if isinstance(observer, SmoothQuantActivationObserver):
+        _merge_observer(observer.act_obs, state, prefix + "act_obs.")
+        _merge_observer(observer.ic_obs, state, prefix + "ic_obs.")
+    elif isinstance(observer, SmoothQuantWeightObserver):
+        # act_obs is the ic_obs of the activation observer, merged there
+        _merge_observer(observer.oc_obs, state, prefix + "oc_obs.")
+        _merge_observer(observer.ic_obs, state, prefix + "ic_obs.")
+    elif isinstance(observer, HistogramObserver):
+        _merge_histogram(observer, state, prefix)
+    elif isinstance(observer, (MinMaxObserver, PerChannelMinMaxObserver)):
+        # the moving average observers are merged as plain min/max observers
+        _merge_min_max(observer, state, prefix)
+    elif not isinstance(observer, PlaceholderObserver):
+        logger.warning(
+            f"Statistics of {type(observer).__name__} cannot be merged, "
+            + "the observer keeps its own statistics.",
+            _type=WarningType.NotSupported,
+        )
+
+
+def _quant_state_observers(prepared_model):
+    for fqn, quant_state in prepared_model._fqn_to_auto_quant_state_map.items():
+        for kind, observers in [
+            ("act", quant_state.tensor_id_to_observer),
+            ("weight", quant_state.weight_tensor_id_to_observer),
+        ]:
+            for tensor_id, observer in observers.items():
+                yield fqn, kind, tensor_id, observer
+
+
+def get_observer_state(prepared_model):
+    r"""
+    Get the calibration statistics of a model prepared by
+    ``ipex.quantization.prepare`` for static or SmoothQuant quantization, as
+    a dict of tensors that can be saved with ``torch.save`` and merged into
+    another instance of the prepared model by :func:`merge_observer_state`.
+
+    Args:
+        prepared_model (torch.nn.Module): The prepared model after calibration.
+
+    Returns:
+        dict: Observer states keyed by ``(fqn, kind, tensor_id)``, where kind
+        is ``"act"`` or ``"weight"``.
+    """
+    state = {}
+    for fqn, kind, tensor_id, observer in _quant_state_observers(prepared_model):
+        observer_state = {"state_dict": observer.state_dict()}
+        # SmoothQuant weight observers keep the original weight seen in
+        # calibration to recompute the per-OC qparams after smoothing
+        if isinstance(observer, SmoothQuantWeightObserver) and hasattr(
+            observer, "w_orig"
+        ):
+            observer_state["w_orig"] = observer.w_orig
+        state[(fqn, kind, tensor_id)] = observer_state
+    return state
+
+
+def merge_observer_state(prepared_model, state):
+    r"""
+    Reduce calibration statistics collected by other instances of a prepared
+    model into ``prepared_model``. Min/max and per input channel statistics
+    are reduced by element-wise min and max, histograms are re-binned to the
+    union of their ranges and summed.
+
+    Args:
+        prepared_model (torch.nn.Module): The prepared model to merge into.
+        state (dict or str): Observer states from :func:`get_observer_state`,
+            or a file they were saved to with ``torch.save``.
+    """
+    if isinstance(state, str):
+        state = torch.load(state)
+    for fqn, kind, tensor_id, observer in _quant_state_observers(prepared_model):
+        if (fqn, kind, tensor_id) not in state:
+            continue
+        observer_state = state[(fqn, kind, tensor_id)]
+        _merge_observer(observer, observer_state["state_dict"])
+        if "w_orig" in observer_state and not hasattr(observer, "w_orig"):
+            observer.w_orig = observer_state["w_orig"]
+
+
+def _default_calib_func(model, data):
+    if isinstance(data, dict):
+        model(**data)
+    elif isinstance(data, (tuple, list)):
+        model(*data)
+    else:
+        model(data)
+
+
+def _calibrate_shard(
+    prepared_model, calib_dataloader, calib_func, cpu_pool, rank, world_size, path
+):
+    from ..cpu.runtime import pin, is_runtime_ext_enabled
+
+    torch.set_num_threads(len(cpu_pool.core_ids))
+    # pinning needs the runtime extension, i.e. Intel OpenMP
+    pin_ctx = pin(cpu_pool) if is_runtime_ext_enabled() else contextlib.nullcontext()
+    with torch.no_grad(), pin_ctx:
+        for i, data in enumerate(calib_dataloader):
+            if i % world_size == rank:
+                calib_func(prepared_model, data)
+    torch.save(get_observer_state(prepared_model), path)
+
+
+def _numa_node_core_ids(cpuinfo=None):
+    # physical cores of every NUMA node, sub-NUMA clusters of a socket are
+    # separate nodes
+    from ..cpu.launch.cpu_info import CPUPoolList
+
+    if cpuinfo is None:
+        cpuinfo = CPUPoolList()
+    core_ids = {}
+    for c in cpuinfo.pool_all:
+        if c.is_physical_core:
+            core_ids.setdefault(c.node, []).append(c.cpu)
+    return [core_ids[node] for node in sorted(core_ids)]
+
+
+def calibrate_in_parallel(
+    prepared_model, calib_dataloader, calib_func=None, cpu_pools=None
+):
+    r"""
+    Calibrate a prepared model with worker processes pinned to separate CPU
+    pools, e.g. one per NUMA node, and reduce their statistics into
+    ``prepared_model``. Batches of ``calib_dataloader`` are assigned to the
+    workers round-robin. Call ``save_qconf_summary`` or
+    ``ipex.quantization.convert`` on ``prepared_model`` afterwards as after a
+    single process calibration.
+
+    Workers are forked from the current process, so the model is not copied
+    or pickled, and each worker iterates ``calib_dataloader`` skipping the
+    batches of other workers. Only Linux is supported.
+
+    Args:
+        prepared_model (torch.nn.Module): The model prepared by
+            ``ipex.quantization.prepare`` for static or SmoothQuant quantization.
+        calib_dataloader (iterable): Calibration data.
+        calib_func (function): Called with the model and one batch. By default
+            the model is called with the batch, unpacked if it is a tuple,
+            list or dict.
+        cpu_pools (list): ``ipex.cpu.runtime.CPUPool`` of each worker. The
+            default value is one pool of the physical cores of every NUMA
+            node, as reported by sysfs, so sub-NUMA clusters get a worker each.
+
+    Returns:
+        The calibrated ``prepared_model``.
+
+    Examples:
+
+        >>> prepared_model = ipex.quantization.prepare(model, qconfig, example_inputs)
+        >>> ipex.quantization.calibrate_in_parallel(prepared_model, calib_dataloader)
+        >>> prepared_model.save_qconf_summary(qconf_summary="qconf.json")
+    """
+    from ..cpu.runtime import CPUPool
+
+    if calib_func is None:
+        calib_func = _default_calib_func
+    if cpu_pools is None:
+        cpu_pools = [CPUPool(core_ids=core_ids) for core_ids in _numa_node_core_ids()]
+    world_size = len(cpu_pools)
+    ctx = multiprocessing.get_context("fork")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = [os.path.join(tmp_dir, f"rank{rank}.pt") for rank in range(world_size)]
+        workers = [
+            ctx.Process(
+                target=_calibrate_shard,
+                args=(
+                    prepared_model,
+                    calib_dataloader,
+                    calib_func,
+                    cpu_pool,
+                    rank,
+                    world_size,
+                    paths[rank],
+                ),
+            )
+            for rank, cpu_pool in enumerate(cpu_pools)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        failed = [rank for rank, worker in enumerate(workers) if worker.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"Calibration workers {failed} failed.")
+        for path in paths:
+            merge_observer_state(prepared_model, path)
+    return prepared_model
@@ -0,0 +1,236 @@
+import copy
+
+import torch
+
+from ._calibration import merge_observer_state, _default_calib_func
+from ._smooth_quant import SmoothQuantActivationObserver, SmoothQuantWeightObserver
+from ..utils._logger import logger, WarningType
+
+
+def _smooth_quant_layers(prepared_model):
+    # Group the SmoothQuant weight observers by the activation observer whose
+    # per-IC statistics they use, the layers of a group (e.g. QKV) share
+    # the activation scaling factors and so the alpha.
+    layers = {}
+    for fqn, quant_state in prepared_model._fqn_to_auto_quant_state_map.items():
+        act_observers = [
+            (tensor_id, obs)
+            for tensor_id, obs in quant_state.tensor_id_to_observer.items()
+            if isinstance(obs, SmoothQuantActivationObserver)
+            and obs.smooth_quant_enabled
+        ]
+        for tensor_id, x_obs in act_observers:
+            w_obs_list = [
+                (w_id, w_obs)
+                for w_id, w_obs in quant_state.weight_tensor_id_to_observer.items()
+                if isinstance(w_obs, SmoothQuantWeightObserver)
+                and w_obs.smooth_quant_enabled
+                and w_obs.act_obs is x_obs.ic_obs
+            ]
+            if w_obs_list:
+                layers[f"{fqn}:{tensor_id}"] = (x_obs, w_obs_list)
+    return layers
+
+
+def _set_alpha(layer, alpha):
+    x_obs, w_obs_list = layer
+    x_obs.alpha = alpha
+    for _, w_obs in w_obs_list:
+        w_obs.alpha = alpha
+
+
+def _collect_activations(prepared_model, layers, proxy_inputs, max_rows):
+    # Run proxy_inputs through the prepared model and keep up to max_rows
+    # input rows of every SmoothQuant layer. The calibration statistics are
+    # restored afterwards.
+    samples = {name: [] for name in layers}
+    observers = {}
+    for quant_state in prepared_model._fqn_to_auto_quant_state_map.values():
+        for obs in list(quant_state.tensor_id_to_observer.values()) + list(
+            quant_state.weight_tensor_id_to_observer.values()
+        ):
+            observers[id(obs)] = obs
+    backup = {k: copy.deepcopy(obs.state_dict()) for k, obs in observers.items()}
+
+    def make_hook(name):
+        def hook(obs, inputs):
+            rows = inputs[0].detach().reshape(-1, inputs[0].shape[-1]).float()
+            collected = sum(s.shape[0] for s in samples[name])
+            if collected < max_rows:
+                samples[name].append(rows[: max_rows - collected])
+
+        return hook
+
+    handles = [
+        x_obs.register_forward_pre_hook(make_hook(name))
+        for name, (x_obs, _) in layers.items()
+    ]
+    try:
+        with torch.no_grad():
+            for data in proxy_inputs:
+                _default_calib_func(prepared_model, data)
+    finally:
+        for handle in handles:
+            handle.remove()
+        for k, obs in observers.items():
+            obs.load_state_dict(backup[k])
+    return {name: torch.cat(rows) for name, rows in samples.items() if rows}
+
+
+def _layer_loss(layer, x, alpha):
+    # Relative MSE between the fp32 output and the output with smoothed and
+    # fake quantized activation and weights, for the qparams the observers
+    # derive with alpha.
+    x_obs, w_obs_list = layer
+    _set_alpha(layer, alpha)
+    act_scales, act_zero_points = x_obs.calculate_qparams()
+    loss = 0.0
+    for w_id, w_obs in w_obs_list:
+        # weights sharing the per-IC observer share the activation qparams
+        key = w_id if w_id in act_scales else next(iter(act_scales))
+        act_factor = x_obs.get_scaling_factors()[key]
+        w_scales, w_zero_points = w_obs.calculate_qparams()
+        w_orig = w_obs.w_orig.float()
+        x_q = torch.fake_quantize_per_tensor_affine(
+            x * act_factor,
+            float(act_scales[key]),
+            int(act_zero_points[key]),
+            x_obs.quant_min,
+            x_obs.quant_max,
+        )
+        w_q = torch.fake_quantize_per_channel_affine(
+            w_orig * w_obs.get_scaling_factors(),
+            w_scales.float(),
+            w_zero_points.int(),
+            0,
+            w_obs.oc_obs.quant_min,
+            w_obs.oc_obs.quant_max,
+        )
+        y = torch.matmul(x, w_orig.t())
+        y_q = torch.matmul(x_q, w_q.t())
+        loss += float(((y - y_q) ** 2).mean() / ((y**2).mean() + 1e-12))
+    return loss / len(w_obs_list)
+
+
+def tune_smooth_quant_alpha(
+    prepared_model,
+    proxy_inputs,
+    alphas=None,
+    statistics=None,
+    per_layer=True,
+    eval_func=None,
+    top_k=3,
+    max_rows=1024,
+):
+    r"""
+    Search the SmoothQuant alpha of a calibrated model without calibrating
+    again. The scaling factors and qparams are recomputed from the per input
+    channel statistics of the observers for every candidate alpha and scored
+    by the relative MSE of each Linear layer output on the inputs the layers
+    see for ``proxy_inputs``. Optionally the best candidates are re-scored
+    by ``eval_func``.
+
+    The statistics can be calibrated once and reused across tuning sessions
+    by saving ``ipex.quantization.get_observer_state(prepared_model)`` with
+    ``torch.save`` and passing the file as ``statistics`` to a freshly
+    prepared model.
+
+    Args:
+        prepared_model (torch.nn.Module): The model prepared by
+            ``ipex.quantization.prepare`` with a SmoothQuant qconfig.
+        proxy_inputs (iterable): A few batches of calibration data used to
+            collect layer inputs for the proxy loss.
+        alphas (list): Candidate alphas. The default value is ``0.0`` to
+            ``1.0`` with step ``0.05``.
+        statistics (str or dict): Calibration statistics saved from
+            ``ipex.quantization.get_observer_state``. If ``None``,
+            ``prepared_model`` must have been calibrated.
+        per_layer (bool): Whether to also search the best alpha of each
+            layer. The default value is ``True``.
+        eval_func (function): Takes a converted model and returns an accuracy,
+            the higher the better. If given, the per-layer recipe and the
+            ``top_k`` global alphas by proxy loss are evaluated and the most
+            accurate is chosen.
+        top_k (int): Number of global alphas evaluated by ``eval_func``.
+        max_rows (int): Max number of input rows kept per layer.
+
+    Returns:
+        dict: ``{"alpha": float or {layer: float}, "global_alpha": float,
+        "proxy_loss": {alpha: float}, "layer_alpha": {layer: float}}``.
+        ``global_alpha`` is the single alpha with the lowest total proxy loss,
+        also used by the layers not run by ``proxy_inputs`` when a per-layer
+        recipe is chosen. The chosen alpha is applied to ``prepared_model``,
+        call ``save_qconf_summary`` or ``ipex.quantization.convert`` on it
+        afterwards.
+
+    Examples:
+
+        >>> prepared_model = ipex.quantization.prepare(model, sq_qconfig, example_inputs)
+        >>> for data in calib_dataloader:
+        ...     prepared_model(data)
+        >>> torch.save(ipex.quantization.get_observer_state(prepared_model), "stats.pt")
+        >>> # later, without calibration
+        >>> prepared_model = ipex.quantization.prepare(model, sq_qconfig, example_inputs)
+        >>> ipex.quantization.tune_smooth_quant_alpha(
+        ...     prepared_model, proxy_inputs, statistics="stats.pt")
+        >>> converted_model = ipex.quantization.convert(prepared_model)
+    """
+    if alphas is None:
+        alphas = [round(0.05 * i, 2) for i in range(21)]
+    if statistics is not None:
+        merge_observer_state(prepared_model, statistics)
+    layers = _smooth_quant_layers(prepared_model)
+    assert layers, "No SmoothQuant Linear layer is found in the prepared model."
+    activations = _collect_activations(prepared_model, layers, proxy_inputs, max_rows)
+    for name in layers:
+        if name not in activations:
+            logger.warning(
+                f"Layer {name} is not run by proxy_inputs, its alpha is not tuned.",
+                _type=WarningType.WrongArgument,
+            )
+
+    with torch.no_grad():
+        layer_loss = {
+            name: {alpha: _layer_loss(layers[name], x, alpha) for alpha in alphas}
+            for name, x in activations.items()
+        }
+    proxy_loss = {
+        alpha: sum(losses[alpha] for losses in layer_loss.values()) for alpha in alphas
+    }
+    layer_alpha = {
+        name: min(alphas, key=lambda alpha: losses[alpha])
+        for name, losses in layer_loss.items()
+    }
+    global_alpha = min(alphas, key=lambda alpha: proxy_loss[alpha])
+
+    def apply(recipe):
+        for name, layer in layers.items():
+            if isinstance(recipe, dict):
+                _set_alpha(layer, recipe.get(name, global_alpha))
+            else:
+                _set_alpha(layer, recipe)
+
+    candidates = [global_alpha]
+    if eval_func is not None:
+        candidates = sorted(alphas, key=lambda alpha: proxy_loss[alpha])[:top_k]
+    if per_layer:
+        candidates.append(layer_alpha)
+    if len(candidates) > 1 and eval_func is not None:
+        from ._quantize import convert
+
+        accuracy = []
+        for recipe in candidates:
+            apply(recipe)
+            accuracy.append(eval_func(convert(prepared_model)))
+        best = candidates[accuracy.index(max(accuracy))]
+    elif per_layer:
+        best = layer_alpha
+    else:
+        best = global_alpha
+    apply(best)
+    return {
+        "alpha": best,
+        "global_alpha": global_alpha,
+        "proxy_loss": proxy_loss,
+        "layer_alpha": layer_alpha,
+    }
@@ -12,3 +12,9 @@ from .tensor_parallel import (
     TensorParallelLMhead,
     TensorParallelConv2d,
 )
+from .sharding_plan import (
+    ShardingPlan,
+    ShardSpec,
+    ShardStyle,
+    infer_sharding_plan,
+)
@@ -10,6 +10,7 @@ from transformers.generation.logits_process import LogitsProcessorList
 from transformers.generation.streamers import BaseStreamer
 from transformers.utils import ModelOutput
 import time
+from .utils import _prefill_chunk_size, _prepare_prefill_chunk_inputs
 
 
 class GreedySearchDecoderOnlyOutput(ModelOutput):
@@ -133,6 +134,13 @@ def _greedy_search(
     )
 
     this_peer_finished = False  # used by synced_gpus only
+    # a long prompt but its last token is fed in chunks to bound the
+    # activations and the latency of a forward, the last token is fed as
+    # the first decode step
+    prefill_chunk_size = _prefill_chunk_size(self, input_ids, model_kwargs)
+    prefill_start = 0
+    prefill_end = input_ids.shape[1] - 1 if prefill_chunk_size else 0
+    prefill_latency = 0.0
     while True:
         tic = time.time()
         if synced_gpus:
@@ -148,7 +156,17 @@ def _greedy_search(
                 break
 
         # prepare model inputs
-        model_inputs = self.prepare_inputs_for_generation(input_ids, **model_kwargs)
+        prefilling = prefill_start < prefill_end
+        if prefilling:
+            model_inputs = _prepare_prefill_chunk_inputs(
+                self,
+                input_ids,
+                prefill_start,
+                min(prefill_start + prefill_chunk_size, prefill_end),
+                **model_kwargs,
+            )
+        else:
+            model_inputs = self.prepare_inputs_for_generation(input_ids, **model_kwargs)
 
         self.model_backbone = self.config.architectures[0]
         if self.model_backbone in [
@@ -317,6 +335,15 @@ def _greedy_search(
 
         if synced_gpus and this_peer_finished:
             continue  # don't waste resources running the code we don't need
+        if prefilling:
+            # keep the kv cache of the chunk, the next token only depends on
+            # the logits of the last token of the prompt
+            model_kwargs["past_key_values"] = self._extract_past_from_model_output(
+                outputs
+            )
+            prefill_start = min(prefill_start + prefill_chunk_size, prefill_end)
+            prefill_latency += time.time() - tic
+            continue
         if isinstance(outputs, dict):
             next_token_logits = outputs.logits[:, -1, :]
         else:
@@ -375,7 +402,8 @@ def _greedy_search(
             )
 
         # stop when each sentence is finished, or if we exceed the maximum length
-        latency_list.append(time.time() - tic)
+        latency_list.append(time.time() - tic + prefill_latency)
+        prefill_latency = 0.0
         if unfinished_sequences.max() == 0 or stopping_criteria(input_ids, scores):
             if not synced_gpus:
                 break
@@ -1,3 +1,4 @@
+import torch
 from transformers.utils import ModelOutput
 
 
@@ -22,3 +23,50 @@ def _extract_past_from_model_output(
             past_key_values, batch_size=batch_size
         )
     return past_key_values
+
+
+def _prefill_chunk_size(self, input_ids, model_kwargs):
+    r"""
+    The chunk size to feed the prompt with, set by ``config.prefill_chunk_size``,
+    or 0 to feed the whole prompt in the first forward.
+    """
+    chunk_size = (
+        self.config.prefill_chunk_size
+        if hasattr(self.config, "prefill_chunk_size")
+        else None
+    )
+    if (
+        not chunk_size
+        or self.config.is_encoder_decoder
+        or model_kwargs.get("past_key_values", None) is not None
+        or model_kwargs.get("inputs_embeds", None) is not None
+        or self.config.architectures[0]
+        in ["GitForCausalLM", "LlavaLlamaForCausalLM", "YuanForCausalLM"]
+        or input_ids.shape[1] <= chunk_size
+    ):
+        return 0
+    return chunk_size
+
+
+def _prepare_prefill_chunk_inputs(self, input_ids, start, end, **model_kwargs):
+    r"""
+    The model inputs to append the prompt tokens ``[start, end)`` to the kv cache
+    of the prompt tokens before ``start``.
+    """
+    attention_mask = model_kwargs.get("attention_mask", None)
+    if attention_mask is not None:
+        model_kwargs["attention_mask"] = attention_mask[:, :end]
+    model_inputs = self.prepare_inputs_for_generation(
+        input_ids[:, :end], **model_kwargs
+    )
+    # some models only keep the last token once there is a kv cache
+    model_inputs["input_ids"] = input_ids[:, start:end]
+    position_ids = model_inputs.get("position_ids", None)
+    if position_ids is not None and position_ids.shape[-1] != end - start:
+        if attention_mask is not None:
+            position_ids = attention_mask[:, :end].long().cumsum(-1) - 1
+            position_ids.masked_fill_(attention_mask[:, :end] == 0, 1)
+        else:
+            position_ids = torch.arange(end).unsqueeze(0).expand(input_ids.shape[0], -1)
+        model_inputs["position_ids"] = position_ids[:, start:end]
+    return model_inputs
@@ -376,7 +376,7 @@ class _IPEXVarlenScaledDotProductCPU(nn.Module):
         super().__init__()
 
     @classmethod
-    def apply_functions(
+    def apply_function(
         cls,
         query,  # [total_q, num_head, head_size]
         key,  # [total_k, num_head_k, head_size]
@@ -450,8 +450,9 @@ class _IPEXVarlenScaledDotProductCPU(nn.Module):
             pad_v,
             attn_mask=attn_mask if not is_causal else None,
             is_causal=is_causal,
+            scale=softmax_scale,
         )
-        out.copy_(out_.transpose(1, 2).reshape(-1, out.shape[-2], out.shape[-1]))
+        out.copy_(out_.transpose(1, 2)[q_mask])
 
         return out
 
@@ -5,62 +5,6 @@ import math
 from torch.nn import functional as F
 
 
-@torch.library.impl("myops::longrope", "cpu")
-def longrope(
-    inv_freq,
-    max_seq_len_cached,
-    max_position_embeddings,
-    sin_cos,
-    sin_cached,
-    cos_cached,
-    sin_cos_long,
-    sin_cached_long,
-    cos_cached_long,
-    seq_len,
-    rope_type,
-):
-    if seq_len > max_seq_len_cached:
-        if rope_type == 1:  # Phi3ForCausalLM
-            return (
-                max_position_embeddings,
-                sin_cos_long,
-                sin_cached_long,
-                cos_cached_long,
-            )
-        elif rope_type == 2:  # Falcon
-            t = torch.arange(seq_len, dtype=inv_freq.dtype)
-            freqs = torch.einsum("i,j->ij", t, inv_freq)
-            sin_cos = torch.cat(
-                (freqs.sin().repeat(1, 2), freqs.cos().repeat(1, 2)), dim=-1
-            )
-            emb = torch.cat((freqs, freqs), dim=-1).float()
-            cos_cached = emb.cos()[None, :, :]
-            sin_cached = emb.sin()[None, :, :]
-            return seq_len, sin_cos, sin_cached, cos_cached
-        else:  # Default
-            t = torch.arange(seq_len, dtype=inv_freq.dtype)
-            freqs = torch.einsum("i,j->ij", t, inv_freq)
-            sin_cos = torch.cat((torch.sin(freqs), torch.cos(freqs)), dim=1)
-            emb = torch.cat((freqs, freqs), dim=-1)
-            cos_cached = emb.cos()[None, None, :, :]
-            sin_cached = emb.sin()[None, None, :, :]
-            return (
-                seq_len,
-                sin_cos,
-                sin_cached[:, :, :seq_len, ...],
-                cos_cached[:, :, :seq_len, ...],
-            )
-    return max_seq_len_cached, sin_cos, sin_cached, cos_cached
-
-
-torch.library.define(
-    "myops::longrope",
-    "(Tensor inv_freq, Tensor max_seq_len_cached, Tensor max_position_embeddings, Tensor sin_cos, "
-    + " Tensor sin_cached, Tensor cos_cached, Tensor? sin_cos_long, Tensor? sin_cached_long, "
-    + "Tensor? cos_cached_long,  Tensor seq_len, Tensor rope_type) -> (Tensor, Tensor, Tensor, Tensor)",
-)
-
-
 class RotaryEmbedding(torch.nn.Module):
     def __init__(self, max_position_embeddings, dim, backbone, base=10000, kwargs=None):
         super().__init__()
@@ -19,6 +19,7 @@ from .tensor_parallel import (
     shard_mlp_weights,
     update_heads_info,
 )
+from .sharding_plan import infer_sharding_plan
 
 
 def convert_functions(m, target_m, new_function_name, new_function):
@@ -388,6 +389,35 @@ def model_convert_reference(_model):
         ipex_tp_supported_mha_classes.append(type(_model.model.layers[0].self_attn))
         ipex_tp_supported_mlp_classes.append(type(_model.model.layers[0].mlp))
         ipex_tp_supported_model_classes.append(type(_model))
+    if need_ipex_tp and not isinstance(_model, tuple(ipex_tp_supported_model_classes)):
+        # models without a dedicated sharding recipe get one inferred
+        # from their linear module names and shapes
+        reason = None
+        if _model.config.architectures[0] in [
+            # interleaved qkv projection
+            "CodeGenForCausalLM",
+            # alibi slopes of all heads
+            "MptForCausalLM",
+            # vision attention with its own number of heads
+            "GitForCausalLM",
+        ]:
+            reason = "Its attention layout can not be inferred."
+        else:
+            sharding_plan = infer_sharding_plan(_model, rank, world_size)
+            try:
+                sharding_plan.validate(_model)
+            except ValueError as e:
+                reason = str(e)
+        if reason is None:
+            sharding_plan.apply(_model)
+        else:
+            logger.warning(
+                f"Cannot shard {type(_model).__name__} across {world_size} ranks, "
+                + f"run it without tensor parallel. {reason}",
+                _type=WarningType.NotSupported,
+            )
+            distributed = False
+        need_ipex_tp = False
     # model-wise optimizations - MHA module
     for supported_mha_class in supported_mha_classes:
         if need_ipex_tp and supported_mha_class in ipex_tp_supported_mha_classes:
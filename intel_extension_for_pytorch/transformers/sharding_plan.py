@@ -0,0 +1,572 @@
+import os
+from contextlib import nullcontext
+from dataclasses import dataclass
+from enum import Enum
+from typing import Dict, List, Optional, Tuple
+
+import torch
+import torch.nn as nn
+
+from ..utils._logger import logger, WarningType
+from .tensor_parallel import (
+    _shard_boundaries,
+    TensorParallelColumnLinear,
+    TensorParallelRowLinear,
+    TensorParallelLMhead,
+    update_heads_info,
+)
+
+try:
+    from safetensors import safe_open
+except ImportError:
+    safe_open = None
+
+
+# Linear names of the attention projections split by (kv) head groups.
+_HEAD_COLUMN_NAMES = ["q_proj", "k_proj", "v_proj", "qkv_proj", "Wqkv"]
+_HEAD_ROW_NAMES = ["o_proj", "out_proj", "dense", "out_fc"]
+# Linear names of the feed-forward projections split by blocks.
+_MLP_COLUMN_NAMES = [
+    "gate_proj",
+    "up_proj",
+    "fc_in",
+    "fc1",
+    "w1",
+    "w3",
+    "c_fc",
+    "dense_h_to_4h",
+]
+_MLP_ROW_NAMES = ["down_proj", "fc_out", "fc2", "w2", "c_proj", "dense_4h_to_h"]
+# Attributes of attention modules holding their number of heads, number of
+# key/value heads and width, e.g. used to reshape the attention output.
+_HEAD_ATTRIBUTES = ["num_heads", "num_attention_heads", "n_heads", "n_head"]
+_KV_HEAD_ATTRIBUTES = ["num_key_value_heads", "num_kv_heads", "n_head_kv"]
+_WIDTH_ATTRIBUTES = [
+    "hidden_size",
+    "embed_dim",
+    "inner_dim",
+    "all_head_size",
+    "d_model",
+]
+
+
+class ShardStyle(Enum):
+    # split output features, every rank produces a slice of the output
+    COLUMN = "column"
+    # split input features, partial outputs are summed with allreduce
+    ROW = "row"
+
+
+@dataclass
+class ShardSpec:
+    r"""
+    How a single ``nn.Linear`` is split across ranks.
+
+    Args:
+        name (str): Fully qualified module name inside the model.
+        style (ShardStyle): Column (output features) or row (input features) split.
+        in_features (int): Input features of the unsharded linear.
+        out_features (int): Output features of the unsharded linear.
+        by_head (bool): Split at attention head boundaries instead of blocks.
+        num_heads (int): Number of heads this linear projects to. For k/v
+            projections of GQA models this equals ``num_kv_heads``.
+        num_kv_heads (int): Number of key/value heads of the attention.
+        head_dim (int): Size of each attention head.
+        lm_head (bool): Whether the linear is the language model head.
+    """
+
+    name: str
+    style: ShardStyle
+    in_features: int
+    out_features: int
+    by_head: bool = False
+    num_heads: int = 1
+    num_kv_heads: int = 1
+    head_dim: int = 1
+    lm_head: bool = False
+
+    @property
+    def shard_dim(self):
+        return 0 if self.style == ShardStyle.COLUMN else 1
+
+    @property
+    def wrapped(self):
+        # column splits of feed-forward layers are replaced by the plain
+        # sharded nn.Linear, the others keep the TensorParallel* wrapper
+        return self.lm_head or self.by_head or self.style == ShardStyle.ROW
+
+    def ranges(self, rank, world_size) -> List[Tuple[int, int]]:
+        r"""
+        The [start, end) ranges of ``shard_dim`` owned by ``rank``. They are
+        the same slices the ``TensorParallel*`` modules take from a full weight.
+        """
+        if not self.by_head:
+            total_size = self.out_features if self.shard_dim == 0 else self.in_features
+            boundaries = _shard_boundaries(total_size, world_size, 64)
+            return [(boundaries[rank], boundaries[rank + 1])]
+        kv_head_range = _shard_boundaries(self.num_kv_heads, world_size)
+        kv_group_size = self.num_heads // self.num_kv_heads
+        head_dim = self.head_dim
+        q_start = kv_head_range[rank] * kv_group_size * head_dim
+        q_end = kv_head_range[rank + 1] * kv_group_size * head_dim
+        ranges = [(q_start, q_end)]
+        total_size = self.out_features if self.shard_dim == 0 else self.in_features
+        if self.shard_dim == 0 and total_size > self.num_heads * head_dim:
+            # concatenated q/k/v projection
+            for offset in [self.num_heads, self.num_heads + self.num_kv_heads]:
+                ranges.append(
+                    (
+                        (offset + kv_head_range[rank]) * head_dim,
+                        (offset + kv_head_range[rank + 1]) * head_dim,
+                    )
+                )
+        return ranges
+
+    def shard_size(self, rank, world_size):
+        return sum(end - start for start, end in self.ranges(rank, world_size))
+
+
+def _take(tensor, dim, ranges):
+    # `tensor` is either a torch.Tensor or a lazily loaded safetensors slice,
+    # only the requested ranges are read.
+    parts = []
+    for start, end in ranges:
+        if dim == 0:
+            parts.append(tensor[start:end])
+        else:
+            parts.append(tensor[:, start:end])
+    if len(parts) == 1:
+        return parts[0].clone()
+    return torch.cat(parts, dim=dim)
+
+
+class ShardingPlan:
+    r"""
+    A declarative tensor parallel sharding plan, mapping linear module names
+    to the way they are split across ``world_size`` ranks. A plan is usually
+    created with :func:`infer_sharding_plan`, checked with :meth:`validate`
+    on a model built on the ``meta`` device, applied with :meth:`apply`, and
+    finally populated from disk with :meth:`load_checkpoint` which only reads
+    the slices owned by ``rank``.
+
+    Args:
+        specs (dict): Module name to :class:`ShardSpec`.
+        rank (int): Rank of the current process.
+        world_size (int): Number of ranks.
+    """
+
+    def __init__(self, specs: Dict[str, ShardSpec], rank: int, world_size: int):
+        self.specs = specs
+        self.rank = rank
+        self.world_size = world_size
+
+    def __repr__(self):
+        lines = [f"ShardingPlan(rank={self.rank}, world_size={self.world_size})"]
+        for name, spec in self.specs.items():
+            head_info = (
+                f", heads={spec.num_heads}/{spec.num_kv_heads}" if spec.by_head else ""
+            )
+            lines.append(f"  {name}: {spec.style.value}{head_info}")
+        return "\n".join(lines)
+
+    def _groups(self):
+        groups = {}
+        for name, spec in self.specs.items():
+            parent = name.rpartition(".")[0]
+            groups.setdefault(parent, []).append(spec)
+        return groups
+
+    def validate(self, model: nn.Module):
+        r"""
+        Check the plan against ``model`` using shapes only, so ``model`` may
+        live on the ``meta`` device. Every rank's shards are checked, so all
+        ranks agree on the plan before any weight is loaded.
+
+        Raises:
+            ValueError: Listing every inconsistency found in the plan.
+        """
+        errors = []
+        modules = dict(model.named_modules())
+        for name, spec in self.specs.items():
+            module = modules.get(name, None)
+            if module is None:
+                errors.append(f"{name}: module not found in model")
+                continue
+            if not isinstance(module, nn.Linear):
+                errors.append(f"{name}: expected nn.Linear, got {type(module)}")
+                continue
+            if (module.in_features, module.out_features) != (
+                spec.in_features,
+                spec.out_features,
+            ):
+                errors.append(
+                    f"{name}: shape ({module.out_features}, {module.in_features}) "
+                    f"does not match plan ({spec.out_features}, {spec.in_features})"
+                )
+            if spec.by_head:
+                if spec.num_heads % spec.num_kv_heads != 0:
+                    errors.append(
+                        f"{name}: num_heads {spec.num_heads} is not a multiple of "
+                        f"num_kv_heads {spec.num_kv_heads}"
+                    )
+                if self.world_size > spec.num_kv_heads:
+                    errors.append(
+                        f"{name}: world_size {self.world_size} is larger than "
+                        f"num_kv_heads {spec.num_kv_heads}"
+                    )
+        for parent, specs in self._groups().items():
+            column = [
+                s for s in specs if s.style == ShardStyle.COLUMN and not s.lm_head
+            ]
+            row = [s for s in specs if s.style == ShardStyle.ROW and not s.lm_head]
+            if bool(column) != bool(row):
+                errors.append(
+                    f"{parent or 'model'}: column and row shards must be paired, "
+                    f"got {[s.name for s in specs]}"
+                )
+                continue
+            if not column:
+                continue
+            for rank in range(self.world_size):
+                if any(s.by_head for s in column):
+                    # attention output consumes the query heads of this rank
+                    q = [
+                        s
+                        for s in column
+                        if s.num_heads == max(c.num_heads for c in column)
+                    ]
+                    produced = q[0].ranges(rank, self.world_size)[0]
+                    produced = produced[1] - produced[0]
+                else:
+                    produced = column[0].shard_size(rank, self.world_size)
+                    for s in column[1:]:
+                        if s.shard_size(rank, self.world_size) != produced:
+                            errors.append(
+                                f"{s.name}: shard size differs from {column[0].name} "
+                                f"on rank {rank}"
+                            )
+                for s in row:
+                    consumed = s.shard_size(rank, self.world_size)
+                    if consumed != produced:
+                        errors.append(
+                            f"{s.name}: consumes {consumed} features on rank {rank} "
+                            f"but {produced} are produced"
+                        )
+        if errors:
+            raise ValueError("Invalid sharding plan:\n" + "\n".join(errors))
+
+    def apply(self, model: nn.Module):
+        r"""
+        Replace the planned linears of ``model`` in place with their
+        ``TensorParallel*`` counterparts for ``rank``. The number of heads and
+        the width attributes of the sharded attentions, e.g. ``embed_dim``,
+        are set to the ones of the shards. Meta linears stay on the ``meta``
+        device, so the shards can be filled by :meth:`load_checkpoint`
+        afterwards.
+        """
+        if self.world_size == 1:
+            return model
+        modules = dict(model.named_modules())
+        for name, spec in self.specs.items():
+            parent_name, _, child_name = name.rpartition(".")
+            parent = modules[parent_name] if parent_name else model
+            linear = getattr(parent, child_name)
+            device = linear.weight.device
+            with torch.device("meta") if device.type == "meta" else nullcontext():
+                tp_module = self._tp_module(spec, linear)
+            setattr(parent, child_name, tp_module if spec.wrapped else tp_module.linear)
+        if hasattr(model, "config") and any(s.by_head for s in self.specs.values()):
+            if hasattr(model.config, "num_attention_heads"):
+                update_heads_info(model, self.rank, self.world_size)
+        for parent_name, specs in self._groups().items():
+            row = [s for s in specs if s.by_head and s.style == ShardStyle.ROW]
+            if row:
+                attention = modules[parent_name] if parent_name else model
+                self._shard_attention_attributes(attention, row[0])
+        return model
+
+    def _shard_attention_attributes(self, attention, spec):
+        # the attention of a rank only runs the heads of its shard, the
+        # attributes still holding the unsharded values are updated
+        start, end = spec.ranges(self.rank, self.world_size)[0]
+        num_heads = (end - start) // spec.head_dim
+        num_kv_heads = num_heads // (spec.num_heads // spec.num_kv_heads)
+        for names, full_value, value in [
+            (_HEAD_ATTRIBUTES, spec.num_heads, num_heads),
+            (_KV_HEAD_ATTRIBUTES, spec.num_kv_heads, num_kv_heads),
+            (_WIDTH_ATTRIBUTES, spec.num_heads * spec.head_dim, end - start),
+        ]:
+            for name in names:
+                if getattr(attention, name, None) == full_value:
+                    setattr(attention, name, value)
+
+    def _tp_module(self, spec, linear):
+        if spec.lm_head:
+            return TensorParallelLMhead(
+                linear,
+                spec.num_kv_heads,
+                spec.num_heads,
+                spec.head_dim,
+                self.rank,
+                self.world_size,
+                shard_by_col=spec.style == ShardStyle.COLUMN,
+            )
+        tp_class = (
+            TensorParallelColumnLinear
+            if spec.style == ShardStyle.COLUMN
+            else TensorParallelRowLinear
+        )
+        return tp_class(
+            linear,
+            spec.num_kv_heads,
+            spec.num_heads,
+            spec.head_dim,
+            self.rank,
+            self.world_size,
+            shard_by_head=spec.by_head,
+        )
+
+    def shard_tensor(self, key, tensor):
+        r"""
+        Return the part of checkpoint entry ``key`` owned by ``rank`` and the
+        key it has in the sharded model. ``tensor`` may be a torch.Tensor or a
+        safetensors slice, in which case only the owned slices are read.
+        """
+        module_name, _, param_name = key.rpartition(".")
+        spec = self.specs.get(module_name, None)
+        if spec is None or self.world_size == 1:
+            return key, tensor[:]
+        new_key = f"{module_name}.linear.{param_name}" if spec.wrapped else key
+        ranges = spec.ranges(self.rank, self.world_size)
+        if param_name == "weight":
+            return new_key, _take(tensor, spec.shard_dim, ranges)
+        if spec.style == ShardStyle.COLUMN:
+            return new_key, _take(tensor, 0, ranges)
+        # row split bias is added once per rank before the allreduce
+        return new_key, tensor[:] / float(self.world_size)
+
+    def load_checkpoint(self, model: nn.Module, checkpoint_files, strict=False):
+        r"""
+        Load the shards owned by ``rank`` from ``checkpoint_files`` into a
+        model already transformed by :meth:`apply`. ``.safetensors`` files are
+        read slice by slice, other files are memory mapped with ``torch.load``,
+        so a rank never materializes weights of other ranks.
+
+        Returns:
+            The ``(missing_keys, unexpected_keys)`` of ``load_state_dict``.
+        """
+        if isinstance(checkpoint_files, str):
+            checkpoint_files = [checkpoint_files]
+        state_dict = {}
+        for checkpoint_file in checkpoint_files:
+            if checkpoint_file.endswith(".safetensors"):
+                if safe_open is None:
+                    raise RuntimeError(
+                        "Please install safetensors to load .safetensors checkpoints"
+                    )
+                with safe_open(checkpoint_file, framework="pt", device="cpu") as f:
+                    for key in f.keys():
+                        if (
+                            self.world_size == 1
+                            or key.rpartition(".")[0] not in self.specs
+                        ):
+                            state_dict[key] = f.get_tensor(key)
+                            continue
+                        new_key, value = self.shard_tensor(key, f.get_slice(key))
+                        state_dict[new_key] = value
+            else:
+                checkpoint = torch.load(
+                    checkpoint_file, map_location="cpu", mmap=True, weights_only=True
+                )
+                for key, tensor in checkpoint.items():
+                    new_key, value = self.shard_tensor(key, tensor)
+                    state_dict[new_key] = value
+                del checkpoint
+        return model.load_state_dict(state_dict, strict=strict, assign=True)
+
+
+def _get_heads_info(config, num_heads=None, num_kv_heads=None, head_dim=None):
+    if num_heads is None:
+        for name in ["num_attention_heads", "n_head", "num_heads"]:
+            if hasattr(config, name):
+                num_heads = getattr(config, name)
+                break
+    if num_kv_heads is None:
+        for name in ["num_key_value_heads", "n_head_kv", "num_kv_heads"]:
+            if getattr(config, name, None) is not None:
+                num_kv_heads = getattr(config, name)
+                break
+        else:
+            num_kv_heads = num_heads
+    if head_dim is None and num_heads is not None:
+        head_dim = getattr(config, "head_dim", None) or (
+            config.hidden_size // num_heads
+        )
+    return num_heads, num_kv_heads, head_dim
+
+
+def infer_sharding_plan(
+    model: nn.Module,
+    rank: int,
+    world_size: int,
+    num_heads: Optional[int] = None,
+    num_kv_heads: Optional[int] = None,
+    head_dim: Optional[int] = None,
+):
+    r"""
+    Infer a :class:`ShardingPlan` for an arbitrary transformer model from its
+    linear module names and shapes. Attention projections (q/k/v/qkv) are
+    split by kv head groups and their output projection by rows, balancing
+    query heads of GQA models the same way as ``shard_mha_weights``.
+    Feed-forward projections (gate/up, down) are split by column/row blocks.
+    A group of linears is sharded only when both its column and row halves
+    are found with consistent shapes, anything else stays replicated.
+    Only shapes are read, so ``model`` may be built on the ``meta`` device.
+
+    Args:
+        model (torch.nn.Module): The model, usually a huggingface model.
+        rank (int): Rank of the current process.
+        world_size (int): Number of ranks.
+        num_heads (int): Number of attention heads. Read from ``model.config``
+            by default.
+        num_kv_heads (int): Number of key/value heads. Read from
+            ``model.config`` by default.
+        head_dim (int): Size of each attention head. Read from
+            ``model.config`` by default.
+
+    Returns:
+        A :class:`ShardingPlan` for ``rank``.
+
+    Examples:
+
+        >>> # xdoctest: +SKIP
+        >>> with torch.device("meta"):
+        >>>     model = AutoModelForCausalLM.from_config(config)
+        >>> plan = infer_sharding_plan(model, rank, world_size)
+        >>> plan.validate(model)
+        >>> plan.apply(model)
+        >>> plan.load_checkpoint(model, checkpoint_files)
+    """
+    config = getattr(model, "config", None)
+    if config is not None:
+        num_heads, num_kv_heads, head_dim = _get_heads_info(
+            config, num_heads, num_kv_heads, head_dim
+        )
+    specs = {}
+    for parent_name, parent in model.named_modules():
+        linears = {
+            name: m for name, m in parent.named_children() if isinstance(m, nn.Linear)
+        }
+        if not linears:
+            continue
+        prefix = f"{parent_name}." if parent_name else ""
+        head_column = [n for n in _HEAD_COLUMN_NAMES if n in linears]
+        if head_column:
+            group = _infer_attention_group(
+                linears, head_column, num_heads, num_kv_heads, head_dim, prefix
+            )
+        else:
+            group = _infer_mlp_group(linears, prefix)
+        if group is None:
+            continue
+        for spec in group:
+            specs[spec.name] = spec
+
+    lm_head = getattr(model, "lm_head", None)
+    tied = config is not None and getattr(config, "tie_word_embeddings", False)
+    if isinstance(lm_head, nn.Linear) and not tied:
+        lm_head_shard_policy = os.getenv("LM_HEAD_SHARD_POLICY", "row")
+        specs["lm_head"] = ShardSpec(
+            "lm_head",
+            ShardStyle.COLUMN if lm_head_shard_policy == "col" else ShardStyle.ROW,
+            lm_head.in_features,
+            lm_head.out_features,
+            num_heads=num_heads or 1,
+            num_kv_heads=num_kv_heads or 1,
+            head_dim=head_dim or 1,
+            lm_head=True,
+        )
+    return ShardingPlan(specs, rank, world_size)
+
+
+def _infer_attention_group(
+    linears, head_column, num_heads, num_kv_heads, head_dim, prefix
+):
+    row = [n for n in _HEAD_ROW_NAMES if n in linears]
+    if num_heads is None or len(row) != 1:
+        return None
+    group = []
+    for name in head_column:
+        linear = linears[name]
+        out_features = linear.out_features
+        if out_features == (num_heads + 2 * num_kv_heads) * head_dim:
+            heads = num_heads
+        elif out_features == num_heads * head_dim and name not in ["k_proj", "v_proj"]:
+            heads = num_heads
+        elif out_features == num_kv_heads * head_dim:
+            heads = num_kv_heads
+        else:
+            logger.warning(
+                f"Cannot infer heads of {prefix}{name} with shape "
+                f"({out_features}, {linear.in_features}), keep it replicated",
+                _type=WarningType.NotSupported,
+            )
+            return None
+        group.append(
+            ShardSpec(
+                prefix + name,
+                ShardStyle.COLUMN,
+                linear.in_features,
+                out_features,
+                by_head=True,
+                num_heads=heads,
+                num_kv_heads=num_kv_heads,
+                head_dim=head_dim,
+            )
+        )
+    out_proj = linears[row[0]]
+    if out_proj.in_features != num_heads * head_dim:
+        return None
+    group.append(
+        ShardSpec(
+            prefix + row[0],
+            ShardStyle.ROW,
+            out_proj.in_features,
+            out_proj.out_features,
+            by_head=True,
+            num_heads=num_heads,
+            num_kv_heads=num_kv_heads,
+            head_dim=head_dim,
+        )
+    )
+    return group
+
+
+def _infer_mlp_group(linears, prefix):
+    column = [n for n in _MLP_COLUMN_NAMES if n in linears]
+    row = [n for n in _MLP_ROW_NAMES if n in linears]
+    if not column or len(row) != 1:
+        return None
+    intermediate_size = linears[column[0]].out_features
+    if any(linears[n].out_features != intermediate_size for n in column):
+        return None
+    if linears[row[0]].in_features != intermediate_size:
+        return None
+    group = [
+        ShardSpec(
+            prefix + n,
+            ShardStyle.COLUMN,
+            linears[n].in_features,
+            linears[n].out_features,
+        )
+        for n in column
+    ]
+    group.append(
+        ShardSpec(
+            prefix + row[0],
+            ShardStyle.ROW,
+            linears[row[0]].in_features,
+            linears[row[0]].out_features,
+        )
+    )
+    return group
@@ -4,6 +4,22 @@ from ..cpu import comm as ipex_comm
 import os
 
 
+def _shard_boundaries(total_size, world_size, block_size=1):
+    # [start, end) boundaries of every rank's shard of `total_size` units.
+    # Shards are aligned to `block_size` when possible and the remainder
+    # goes to the last ranks.
+    if total_size % block_size != 0:
+        block_size = 1
+    block_count = total_size // block_size
+    boundaries = [0]
+    for i in range(world_size - 1, -1, -1):
+        blocks_this_rank = block_count // world_size
+        if i < block_count % world_size:
+            blocks_this_rank += 1
+        boundaries.append(boundaries[-1] + blocks_this_rank * block_size)
+    return boundaries
+
+
 class TensorParallelConv2d(nn.Module):
     def __init__(self, conv, rank, world_size, shard_by_oc):
         super().__init__()
@@ -143,19 +159,13 @@ class TensorParallellLinear(nn.Module):
         bias_data = None
         concat_qkv = total_size > num_heads * head_dim
         kv_group_size = num_heads // num_kv_heads
-        kv_head_per_rank = num_kv_heads // world_size
         if world_size == 1:
             return
         if world_size > num_kv_heads:
             RuntimeError(
                 f"world_size {world_size} is larger than num_kv_heads {num_kv_heads}"
             )
-        kv_head_range = [0]  # [)
-        for i in range(world_size - 1, -1, -1):
-            kv_head_this_rank = kv_head_per_rank
-            if i < num_kv_heads % world_size:
-                kv_head_this_rank += 1
-            kv_head_range.append(kv_head_range[-1] + kv_head_this_rank)
+        kv_head_range = _shard_boundaries(num_kv_heads, world_size)  # [)
         cols_per_rank = [0]
         for i in range(world_size):
             q_head_start = kv_head_range[i] * kv_group_size
@@ -219,19 +229,7 @@ class TensorParallellLinear(nn.Module):
         else:
             total_size = linear.weight.shape[1]
         bias_data = None
-        cols_per_rank = [0]
-        for i in range(world_size - 1, -1, -1):
-            if total_size % block_size == 0:
-                block_count = total_size // block_size
-                block_per_rank = block_count // world_size
-                if i < block_count % world_size:
-                    block_per_rank += 1
-                cols_per_rank.append(cols_per_rank[-1] + block_per_rank * block_size)
-            else:
-                cols = total_size // world_size
-                if i < total_size % world_size:
-                    cols += 1
-                cols_per_rank.append(cols_per_rank[-1] + cols)
+        cols_per_rank = _shard_boundaries(total_size, world_size, block_size)
         weight_data = linear.weight.data
         if shard_by_col:
             weight_data = weight_data[cols_per_rank[rank] : cols_per_rank[rank + 1]]
@@ -1272,7 +1272,11 @@ with open(os.path.join(this_directory, "README.md"), encoding="utf-8") as f:
 entry_points = {
     "console_scripts": [
         "ipexrun = {}.launcher:main".format(PACKAGE_NAME),
-    ]
+    ],
+    # torch.compile(backend="ipex") imports the backend on first use
+    "torch_dynamo_backends": [
+        "ipex = {}._dynamo:ipex".format(PACKAGE_NAME),
+    ],
 }
 
 setup(
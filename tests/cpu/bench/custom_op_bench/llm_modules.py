@@ -0,0 +1,563 @@
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import sys
+import time
+import types
+from collections import OrderedDict
+
+import torch
+import intel_extension_for_pytorch as ipex
+from intel_extension_for_pytorch.transformers.models.reference.fusions.linear_fusion import (
+    _IPEXlinearAddAddRef,
+    _IPEXlinearAddRef,
+    _IPEXlinearGeluRef,
+    _IPEXlinearMulRef,
+    _IPEXlinearNewGeluRef,
+    _IPEXlinearReluRef,
+    _IPEXlinearSiluMulRef,
+    _IPEXlinearSiluRef,
+)
+from intel_extension_for_pytorch.transformers.models.reference.fusions.mha_fusion import (
+    _IPEXRMSNormRef,
+    _IPEXRopeRef,
+)
+
+DTYPES = {
+    "float32": torch.float32,
+    "bfloat16": torch.bfloat16,
+    "float16": torch.float16,
+}
+
+# the max abs difference reported as a mismatch between ipex and reference
+TOLERANCE = {
+    torch.float32: 1e-3,
+    torch.bfloat16: 5e-2,
+    torch.float16: 1e-2,
+}
+
+
+class Config(object):
+    def __init__(self, batch_size, seq_len, num_heads, head_dim, dtype):
+        self.batch_size = batch_size
+        self.seq_len = seq_len
+        self.num_heads = num_heads
+        self.head_dim = head_dim
+        self.hidden_size = num_heads * head_dim
+        self.dtype = dtype
+
+    def key(self, op):
+        return "{}|bs={}|seq={}|heads={}|head_dim={}|{}".format(
+            op,
+            self.batch_size,
+            self.seq_len,
+            self.num_heads,
+            self.head_dim,
+            str(self.dtype).split(".")[-1],
+        )
+
+
+# Every benchmark returns (inputs, ipex_fn, ref_fn). Both functions take
+# `*inputs` and return the output tensor, the inputs are reused for all
+# timed iterations and cloned for the accuracy check.
+
+
+def bench_rotary_embedding(cfg):
+    max_positions = max(2048, cfg.seq_len)
+    backbone = "LlamaForCausalLM"
+    x = torch.randn(
+        cfg.batch_size, cfg.seq_len, cfg.num_heads, cfg.head_dim, dtype=cfg.dtype
+    )
+    position_ids = torch.arange(cfg.seq_len).unsqueeze(0).repeat(cfg.batch_size, 1)
+    rope = ipex.llm.modules.RotaryEmbedding(
+        max_positions, cfg.head_dim, backbone=backbone
+    )
+    ref_rope = _IPEXRopeRef(max_positions, cfg.head_dim, backbone=backbone)
+    args = (cfg.num_heads, cfg.head_dim, cfg.head_dim // 2, cfg.head_dim, cfg.seq_len)
+
+    def ipex_fn(x, position_ids):
+        return rope(x, position_ids, *args)
+
+    def ref_fn(x, position_ids):
+        # the llama reference returns [batch, num_head, seq_len, head_dim]
+        return ref_rope(x, position_ids, *args).transpose(1, 2)
+
+    return (x, position_ids), ipex_fn, ref_fn
+
+
+def bench_rmsnorm(cfg):
+    x = torch.randn(cfg.batch_size, cfg.seq_len, cfg.hidden_size, dtype=cfg.dtype)
+    weight = torch.nn.Parameter(torch.randn(cfg.hidden_size, dtype=cfg.dtype))
+    rmsnorm = ipex.llm.modules.RMSNorm(cfg.hidden_size, 1e-6, weight)
+    ref_rmsnorm = _IPEXRMSNormRef(
+        types.SimpleNamespace(weight=weight, variance_epsilon=1e-6)
+    )
+    return (x,), rmsnorm, ref_rmsnorm
+
+
+def bench_fast_layernorm(cfg):
+    x = torch.randn(cfg.batch_size, cfg.seq_len, cfg.hidden_size, dtype=cfg.dtype)
+    weight = torch.nn.Parameter(torch.randn(cfg.hidden_size, dtype=cfg.dtype))
+    bias = torch.nn.Parameter(torch.randn(cfg.hidden_size, dtype=cfg.dtype))
+    layernorm = ipex.llm.modules.FastLayerNorm((cfg.hidden_size,), 1e-5, weight, bias)
+
+    def ref_fn(x):
+        return torch.nn.functional.layer_norm(
+            x, (cfg.hidden_size,), weight=weight, bias=bias, eps=1e-5
+        )
+
+    return (x,), layernorm, ref_fn
+
+
+def bench_varlen_attention(cfg):
+    # sequences of the batch have decreasing lengths down to seq_len / 2
+    seqlens = [
+        max(1, cfg.seq_len - i * cfg.seq_len // (2 * cfg.batch_size))
+        for i in range(cfg.batch_size)
+    ]
+    total = sum(seqlens)
+    cu_seqlens = torch.tensor([0] + list(itertools.accumulate(seqlens))).int()
+    max_seqlen = max(seqlens)
+    scale = 1.0 / math.sqrt(cfg.head_dim)
+    query, key, value = [
+        torch.randn(total, cfg.num_heads, cfg.head_dim, dtype=cfg.dtype)
+        for _ in range(3)
+    ]
+    out = torch.empty_like(query)
+    varlen_attention = ipex.llm.modules.VarlenAttention()
+
+    def ipex_fn(query, key, value, out):
+        varlen_attention(
+            query,
+            key,
+            value,
+            out,
+            cu_seqlens,
+            cu_seqlens,
+            max_seqlen,
+            max_seqlen,
+            0.0,
+            scale,
+            False,
+            True,
+            False,
+            None,
+        )
+        return out
+
+    def ref_fn(query, key, value, out):
+        outputs = []
+        for i in range(cfg.batch_size):
+            start, end = int(cu_seqlens[i]), int(cu_seqlens[i + 1])
+            q, k, v = [
+                t[start:end].transpose(0, 1).unsqueeze(0) for t in [query, key, value]
+            ]
+            o = torch.nn.functional.scaled_dot_product_attention(
+                q, k, v, is_causal=True, scale=scale
+            )
+            outputs.append(o.squeeze(0).transpose(0, 1))
+        return torch.cat(outputs, dim=0)
+
+    return (query, key, value, out), ipex_fn, ref_fn
+
+
+def bench_paged_attention(cfg):
+    # one decode step: cache the new token, then attend over seq_len tokens
+    block_size = 16
+    blocks_per_seq = (cfg.seq_len + block_size - 1) // block_size
+    num_blocks = cfg.batch_size * blocks_per_seq
+    scale = 1.0 / math.sqrt(cfg.head_dim)
+    cache_shape = (num_blocks, block_size, cfg.num_heads, cfg.head_dim)
+    key_cache = torch.randn(cache_shape, dtype=cfg.dtype)
+    value_cache = torch.randn(cache_shape, dtype=cfg.dtype)
+    query, key, value = [
+        torch.randn(cfg.batch_size, cfg.num_heads, cfg.head_dim, dtype=cfg.dtype)
+        for _ in range(3)
+    ]
+    block_tables = torch.arange(num_blocks, dtype=torch.int32).view(
+        cfg.batch_size, blocks_per_seq
+    )
+    context_lens = torch.full((cfg.batch_size,), cfg.seq_len, dtype=torch.int32)
+    last = cfg.seq_len - 1
+    slot_mapping = (
+        block_tables[:, last // block_size].long() * block_size + last % block_size
+    )
+    head_mapping = torch.arange(cfg.num_heads, dtype=torch.int32)
+    out = torch.empty_like(query)
+
+    def ipex_fn(query, key, value, key_cache, value_cache, out):
+        ipex.llm.modules.PagedAttention.reshape_and_cache(
+            key, value, key_cache, value_cache, slot_mapping
+        )
+        ipex.llm.modules.PagedAttention.single_query_cached_kv_attention(
+            out,
+            query,
+            key_cache,
+            value_cache,
+            head_mapping,
+            scale,
+            block_tables,
+            context_lens,
+            block_size,
+            cfg.seq_len,
+            None,
+        )
+        return out
+
+    def ref_fn(query, key, value, key_cache, value_cache, out):
+        flat_shape = (-1, cfg.num_heads, cfg.head_dim)
+        key_cache.view(flat_shape)[slot_mapping] = key
+        value_cache.view(flat_shape)[slot_mapping] = value
+        gather_shape = (cfg.batch_size, -1, cfg.num_heads, cfg.head_dim)
+        keys = key_cache[block_tables.long()].view(gather_shape)[:, : cfg.seq_len]
+        values = value_cache[block_tables.long()].view(gather_shape)[:, : cfg.seq_len]
+        o = torch.nn.functional.scaled_dot_product_attention(
+            query.unsqueeze(2),
+            keys.transpose(1, 2),
+            values.transpose(1, 2),
+            scale=scale,
+        )
+        return o.squeeze(2)
+
+    return (query, key, value, key_cache, value_cache, out), ipex_fn, ref_fn
+
+
+def bench_indirect_access_kv_cache_attention(cfg):
+    # one decode step over a kv cache of seq_len tokens filled by a prefill
+    text_max_length = cfg.seq_len + 16
+    scale_attn = math.sqrt(cfg.head_dim)
+    shape = (cfg.batch_size, cfg.seq_len, cfg.num_heads, cfg.head_dim)
+    past_key, past_value = torch.randn(shape, dtype=cfg.dtype), torch.randn(
+        shape, dtype=cfg.dtype
+    )
+    with torch.no_grad():
+        _, _, layer_past = (
+            ipex.llm.modules.IndirectAccessKVCacheAttention.apply_function(
+                torch.randn(shape, dtype=cfg.dtype),
+                past_key,
+                past_value,
+                scale_attn,
+                None,
+                None,
+                torch.zeros(
+                    cfg.batch_size, 1, cfg.seq_len, cfg.seq_len, dtype=cfg.dtype
+                ),
+                text_max_length=text_max_length,
+            )
+        )
+    query, key, value = [
+        torch.randn(cfg.batch_size, 1, cfg.num_heads, cfg.head_dim, dtype=cfg.dtype)
+        for _ in range(3)
+    ]
+    attention_mask = torch.zeros(cfg.batch_size, 1, 1, cfg.seq_len + 1, dtype=cfg.dtype)
+
+    def ipex_fn(query, key, value):
+        # the decode step writes the same cache slot at every iteration
+        out, _, _ = ipex.llm.modules.IndirectAccessKVCacheAttention.apply_function(
+            query,
+            key,
+            value,
+            scale_attn,
+            layer_past,
+            None,
+            attention_mask,
+            text_max_length=text_max_length,
+        )
+        return out.reshape(cfg.batch_size, -1)
+
+    def ref_fn(query, key, value):
+        keys = torch.cat([past_key, key], dim=1).transpose(1, 2)
+        values = torch.cat([past_value, value], dim=1).transpose(1, 2)
+        out = torch.nn.functional.scaled_dot_product_attention(
+            query.transpose(1, 2), keys, values
+        )
+        return out.reshape(cfg.batch_size, -1)
+
+    return (query, key, value), ipex_fn, ref_fn
+
+
+def _optimized_linears(cfg, num_linears):
+    linears = torch.nn.Sequential(
+        *[
+            torch.nn.Linear(cfg.hidden_size, cfg.hidden_size).to(cfg.dtype)
+            for _ in range(num_linears)
+        ]
+    ).eval()
+    # the fused modules run on linears prepacked by ipex.optimize, as in
+    # ipex.llm.optimize, the reference runs on the original nn.Linear
+    optimized = ipex.optimize(linears, dtype=cfg.dtype)
+    return list(linears), list(optimized)
+
+
+def linear_fusion_bench(fused_cls, ref_cls, num_inputs, num_linears=1):
+    def bench(cfg):
+        ref_linears, linears = _optimized_linears(cfg, num_linears)
+        fused = fused_cls(*linears)
+        ref = ref_cls(*ref_linears)
+        inputs = tuple(
+            torch.randn(cfg.batch_size, cfg.seq_len, cfg.hidden_size, dtype=cfg.dtype)
+            for _ in range(num_inputs)
+        )
+        return inputs, fused, ref
+
+    return bench
+
+
+class _LinearSiluMulRef(torch.nn.Module):
+    def __init__(self, linear):
+        super().__init__()
+        self.linear = linear
+
+    def forward(self, x, y):
+        return torch.nn.functional.silu(self.linear(x)) * y
+
+
+BENCHMARKS = OrderedDict(
+    [
+        ("RotaryEmbedding", bench_rotary_embedding),
+        ("RMSNorm", bench_rmsnorm),
+        ("FastLayerNorm", bench_fast_layernorm),
+        ("VarlenAttention", bench_varlen_attention),
+        ("PagedAttention", bench_paged_attention),
+        (
+            "IndirectAccessKVCacheAttention",
+            bench_indirect_access_kv_cache_attention,
+        ),
+        (
+            "LinearSilu",
+            linear_fusion_bench(ipex.llm.modules.LinearSilu, _IPEXlinearSiluRef, 1),
+        ),
+        (
+            "LinearGelu",
+            linear_fusion_bench(ipex.llm.modules.LinearGelu, _IPEXlinearGeluRef, 1),
+        ),
+        (
+            "LinearNewGelu",
+            linear_fusion_bench(
+                ipex.llm.modules.LinearNewGelu, _IPEXlinearNewGeluRef, 1
+            ),
+        ),
+        (
+            "LinearRelu",
+            linear_fusion_bench(ipex.llm.modules.LinearRelu, _IPEXlinearReluRef, 1),
+        ),
+        (
+            "LinearMul",
+            linear_fusion_bench(ipex.llm.modules.LinearMul, _IPEXlinearMulRef, 2),
+        ),
+        (
+            "LinearAdd",
+            linear_fusion_bench(ipex.llm.modules.LinearAdd, _IPEXlinearAddRef, 2),
+        ),
+        (
+            "LinearAddAdd",
+            linear_fusion_bench(ipex.llm.modules.LinearAddAdd, _IPEXlinearAddAddRef, 3),
+        ),
+        (
+            "LinearSiluMul",
+            linear_fusion_bench(ipex.llm.modules.LinearSiluMul, _LinearSiluMulRef, 2),
+        ),
+        (
+            "Linear2SiluMul",
+            linear_fusion_bench(
+                ipex.llm.modules.Linear2SiluMul,
+                _IPEXlinearSiluMulRef,
+                1,
+                num_linears=2,
+            ),
+        ),
+    ]
+)
+
+
+def _clone(inputs):
+    return tuple(t.clone() if isinstance(t, torch.Tensor) else t for t in inputs)
+
+
+def time_fn(fn, inputs, warmup, iters):
+    # median latency in ms, robust to the noise of a shared machine
+    for _ in range(warmup):
+        fn(*inputs)
+    elapsed = []
+    for _ in range(iters):
+        start = time.perf_counter()
+        fn(*inputs)
+        elapsed.append((time.perf_counter() - start) * 1e3)
+    elapsed.sort()
+    return elapsed[len(elapsed) // 2]
+
+
+def run_benchmark(op, cfg, warmup, iters, with_ref=True):
+    with torch.no_grad():
+        inputs, ipex_fn, ref_fn = BENCHMARKS[op](cfg)
+        result = OrderedDict(
+            [
+                ("key", cfg.key(op)),
+                ("op", op),
+                ("batch_size", cfg.batch_size),
+                ("seq_len", cfg.seq_len),
+                ("num_heads", cfg.num_heads),
+                ("head_dim", cfg.head_dim),
+                ("dtype", str(cfg.dtype).split(".")[-1]),
+                ("ipex_ms", time_fn(ipex_fn, inputs, warmup, iters)),
+            ]
+        )
+        if with_ref:
+            result["ref_ms"] = time_fn(ref_fn, inputs, warmup, iters)
+            result["speedup"] = result["ref_ms"] / result["ipex_ms"]
+            out = ipex_fn(*_clone(inputs)).float()
+            ref_out = ref_fn(*_clone(inputs)).float()
+            result["max_abs_diff"] = (out - ref_out).abs().max().item()
+            result["match"] = result["max_abs_diff"] <= TOLERANCE[cfg.dtype]
+    return result
+
+
+def environment():
+    cpu = platform.processor()
+    if os.path.exists("/proc/cpuinfo"):
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    cpu = line.split(":", 1)[1].strip()
+                    break
+    return OrderedDict(
+        [
+            ("cpu", cpu),
+            ("num_threads", torch.get_num_threads()),
+            ("torch", torch.__version__),
+            ("ipex", ipex.__version__),
+            ("time", time.strftime("%Y-%m-%d %H:%M:%S")),
+        ]
+    )
+
+
+def compare(baseline, current, threshold):
+    r"""
+    Compare the ipex latency of the current results against a baseline.
+    A case regresses when it is slower than the baseline by more than
+    `threshold` (a ratio, 0.05 means 5%). Returns the list of
+    (key, baseline_ms, current_ms, ratio) of the regressed cases.
+    """
+    for name in ["cpu", "num_threads"]:
+        if baseline["env"].get(name) != current["env"].get(name):
+            print(
+                "Warning: {} differs from the baseline: {} vs {}".format(
+                    name, current["env"].get(name), baseline["env"].get(name)
+                )
+            )
+    base = {r["key"]: r for r in baseline["results"]}
+    regressions = []
+    for r in current["results"]:
+        if r["key"] not in base:
+            continue
+        base_ms = base[r["key"]]["ipex_ms"]
+        ratio = r["ipex_ms"] / base_ms
+        status = "ok"
+        if ratio > 1 + threshold:
+            status = "REGRESSION"
+            regressions.append((r["key"], base_ms, r["ipex_ms"], ratio))
+        elif ratio < 1 - threshold:
+            status = "improved"
+        print(
+            "{:<80} {:>10.4f} {:>10.4f} {:>8.3f}  {}".format(
+                r["key"], base_ms, r["ipex_ms"], ratio, status
+            )
+        )
+    missing = set(base) - set(r["key"] for r in current["results"])
+    if missing:
+        print("{} baseline cases were not run".format(len(missing)))
+    return regressions
+
+
+def run():
+    parser = argparse.ArgumentParser(
+        description="benchmark for ipex.llm.modules fused ops"
+    )
+    parser.add_argument(
+        "--ops",
+        type=str,
+        default="all",
+        help="comma separated ops to run, options: all, " + ", ".join(BENCHMARKS),
+    )
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[1, 4])
+    parser.add_argument(
+        "--seq-len",
+        type=int,
+        nargs="+",
+        default=[128, 1024],
+        help="sequence length, the kv cache length for decode ops "
+        + "(PagedAttention, IndirectAccessKVCacheAttention)",
+    )
+    parser.add_argument("--num-heads", type=int, nargs="+", default=[32])
+    parser.add_argument("--head-dim", type=int, default=128)
+    parser.add_argument("--dtype", type=str, nargs="+", default=["float32", "bfloat16"])
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--iters", type=int, default=50)
+    parser.add_argument(
+        "--no-ref",
+        action="store_true",
+        default=False,
+        help="do not run the reference implementations",
+    )
+    parser.add_argument("--output", type=str, default="", help="save results as JSON")
+    parser.add_argument(
+        "--baseline", type=str, default="", help="JSON baseline to compare with"
+    )
+    parser.add_argument(
+        "--compare",
+        type=str,
+        default="",
+        help="compare this JSON result with --baseline without running",
+    )
+    parser.add_argument("--threshold", type=float, default=0.05)
+    args = parser.parse_args()
+
+    if args.compare:
+        assert args.baseline, "--compare needs a --baseline"
+        with open(args.compare) as f:
+            current = json.load(f)
+    else:
+        ops = list(BENCHMARKS) if args.ops == "all" else args.ops.split(",")
+        for op in ops:
+            assert op in BENCHMARKS, "unknown op {}".format(op)
+        current = {"env": environment(), "results": []}
+        for op, batch_size, seq_len, num_heads, dtype in itertools.product(
+            ops, args.batch_size, args.seq_len, args.num_heads, args.dtype
+        ):
+            cfg = Config(batch_size, seq_len, num_heads, args.head_dim, DTYPES[dtype])
+            result = run_benchmark(
+                op, cfg, args.warmup, args.iters, with_ref=not args.no_ref
+            )
+            current["results"].append(result)
+            line = "{:<80} ipex {:>10.4f} ms".format(result["key"], result["ipex_ms"])
+            if not args.no_ref:
+                line += (
+                    "  ref {:>10.4f} ms  speedup {:>6.2f}x  max_abs_diff {:.2e}".format(
+                        result["ref_ms"], result["speedup"], result["max_abs_diff"]
+                    )
+                )
+                if not result["match"]:
+                    line += "  MISMATCH"
+            print(line)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(current, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        if regressions:
+            print(
+                "{} cases regressed by more than {:.1%}".format(
+                    len(regressions), args.threshold
+                )
+            )
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    run()
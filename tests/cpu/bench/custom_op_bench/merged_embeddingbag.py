@@ -11,6 +11,7 @@ r"""
 a = torch.ones(256 * 1024 * 1024 // 4, dtype=torch.float)
 b = torch.ones(256 * 1024 * 1024 // 4, dtype=torch.float)
 NUM_TABLE = 26
+HIT_PATTERNS = ["uniform", "normal", "zipf"]
 
 
 def cache_flush():
@@ -31,13 +32,14 @@ class EmbeddingBagList(torch.nn.Module):
         include_last_offset=False,
         sparse=False,
         mode="sum",
+        num_embeddings=1000,
     ):
         super(EmbeddingBagList, self).__init__()
         self.list = torch.nn.ModuleList()
         for _ in range(ntables):
             self.list.append(
                 torch.nn.EmbeddingBag(
-                    1000,
+                    num_embeddings,
                     num_dim,
                     dtype=dtype,
                     mode=mode,
@@ -75,6 +77,41 @@ class MergedEmbCatDense(torch.nn.Module):
         return self.merged_emb(indices, offsets, dense)
 
 
+class EmbeddingBagListInteraction(torch.nn.Module):
+    def __init__(self, emb_list, top_mlp=None):
+        super(EmbeddingBagListInteraction, self).__init__()
+        self.emb_list = emb_list
+        self.top_mlp = top_mlp
+
+    def forward(self, indices, offsets, dense):
+        z = ipex.nn.functional.interaction(dense, *self.emb_list(indices, offsets))
+        return z if self.top_mlp is None else self.top_mlp(z)
+
+
+class MergedEmbInteraction(torch.nn.Module):
+    def __init__(self, emblist, top_mlp=None):
+        super(MergedEmbInteraction, self).__init__()
+        self.merged_emb = (
+            ipex.nn.modules.MergedEmbeddingBagWithInteraction.from_embeddingbag_list(
+                emblist.list, top_mlp=top_mlp
+            )
+        )
+
+    def forward(self, indices, offsets, dense):
+        return self.merged_emb(indices, offsets, dense)
+
+
+def dlrm_top_mlp(num_table, num_dim, layers=(1024, 1024, 512, 256, 1)):
+    # the top MLP of DLRM on Criteo Terabyte
+    in_features = num_dim + (num_table + 1) * num_table // 2
+    modules = []
+    for i, out_features in enumerate(layers):
+        modules.append(torch.nn.Linear(in_features, out_features))
+        modules.append(torch.nn.ReLU() if i != len(layers) - 1 else torch.nn.Sigmoid())
+        in_features = out_features
+    return torch.nn.Sequential(*modules)
+
+
 class MergedEmb(torch.nn.Module):
     def __init__(self, emblist):
         super(MergedEmb, self).__init__()
@@ -145,8 +182,9 @@ def run_bench(bench_name, module, input_data, optimizer=None, training=False):
                 optimizer.zero_grad(set_to_none=True)
 
     end = time.time()
-    avg_elapsed = end - start - exclude_time
+    avg_elapsed = (end - start - exclude_time) * 1000 / iters
     print("Took {} ms on average to run {} benchmark".format(avg_elapsed, bench_name))
+    return avg_elapsed
 
 
 def inference_bench(dataset, emb_list, merged_emb):
@@ -190,6 +228,36 @@ def merged_emb_cat_bench(args, input):
             )
 
 
+def merged_emb_interaction_bench(args, input):
+    assert args.inference
+    indices, offsets = input
+    for dtype in [torch.float32, torch.bfloat16, torch.int8]:
+        value_dtype = torch.float32 if dtype == torch.int8 else dtype
+        emblist = EmbeddingBagList(NUM_TABLE, args.vector_size, value_dtype)
+        top_mlp = dlrm_top_mlp(NUM_TABLE, args.vector_size).eval()
+        top_mlp = ipex.optimize(
+            top_mlp,
+            dtype=torch.bfloat16 if dtype == torch.bfloat16 else None,
+            inplace=True,
+        )
+        ref_m = EmbeddingBagListInteraction(emblist, top_mlp)
+        m = MergedEmbInteraction(emblist, top_mlp)
+        if dtype == torch.int8:
+            m.merged_emb.to_int8()
+        dense = torch.randn(args.batch_size, args.vector_size, dtype=value_dtype)
+        with torch.no_grad():
+            run_bench(
+                f"MergedEmbeddingBagWithInteraction+TopMLP: table_dtype:{dtype}",
+                m,
+                (indices, offsets, dense),
+            )
+            run_bench(
+                f"EmbeddingBagList+Interaction+TopMLP: value_dtype:{value_dtype}",
+                ref_m,
+                (indices, offsets, dense),
+            )
+
+
 def merged_emb_with_sgd(args, input):
     for dtype in [torch.float32, torch.bfloat16]:
         if dtype == torch.bfloat16:
@@ -272,7 +340,48 @@ def merged_emb_with_adagrad(args, input):
             )
 
 
-def get_data(batch_size):
+def index_dedup_bench(args):
+    for hit_pattern in HIT_PATTERNS:
+        indices, offsets = get_data(args.batch_size, hit_pattern, args.num_embeddings)
+        unique = sum(index.unique().numel() for index in indices)
+        total = sum(index.numel() for index in indices)
+        print(
+            "hit pattern {}: {} unique rows in {} lookups, {:.1%} duplicates".format(
+                hit_pattern, unique, total, 1 - unique / total
+            )
+        )
+        emblist = EmbeddingBagList(
+            NUM_TABLE,
+            args.vector_size,
+            torch.float32,
+            num_embeddings=args.num_embeddings,
+        )
+        if args.inference:
+            m = MergedEmb(emblist)
+        elif args.optimizer == "sgd":
+            m = MergedEmbSGD(emblist, lr=0.1)
+        else:
+            m = MergedEmbAdaGrad(emblist, lr=0.1)
+        elapsed = []
+        for index_dedup in [False, True]:
+            m.merged_emb.index_dedup = index_dedup
+            with torch.set_grad_enabled(not args.inference):
+                elapsed.append(
+                    run_bench(
+                        f"{type(m.merged_emb).__name__}: hit_pattern:{hit_pattern} index_dedup:{index_dedup}",
+                        m,
+                        (indices, offsets),
+                        training=not args.inference,
+                    )
+                )
+        print(
+            "hit pattern {}: {:.3f} ms without dedup, {:.3f} ms with dedup, {:.2f}x".format(
+                hit_pattern, elapsed[0], elapsed[1], elapsed[0] / elapsed[1]
+            )
+        )
+
+
+def get_data(batch_size, hit_pattern="normal", num_embeddings=1000):
     indices = []
     offsets = []
     multi_hot = [
@@ -311,7 +420,21 @@ def get_data(batch_size):
         a = a.floor().int()
         return a
 
-    indices = [unbalance_indices(i) for i in range(26)]
+    def uniform_indices(i):
+        return torch.randint(num_embeddings, (batch_size * multi_hot[i],)).int()
+
+    def zipf_indices(i):
+        # power law hits over the rows, the hot rows are scattered over the table
+        probs = 1.0 / torch.arange(1, num_embeddings + 1, dtype=torch.float).pow(1.05)
+        rows = torch.multinomial(probs, batch_size * multi_hot[i], replacement=True)
+        return torch.randperm(num_embeddings)[rows].int()
+
+    gen_indices = {
+        "normal": unbalance_indices,
+        "uniform": uniform_indices,
+        "zipf": zipf_indices,
+    }[hit_pattern]
+    indices = [gen_indices(i) for i in range(26)]
     offsets = [
         torch.arange(0, batch_size * multi_hot[i], multi_hot[i]).int()
         for i in range(26)
@@ -328,6 +451,17 @@ def run():
     parser.add_argument("--batch-size", type=int, default=7168)
     parser.add_argument("--vector-size", type=int, default=128)
     parser.add_argument("--with-cat", action="store_true", default=False)
+    parser.add_argument("--with-interaction", action="store_true", default=False)
+    parser.add_argument("--index-dedup", action="store_true", default=False)
+    # rows of the tables of the index dedup benchmark, more rows give less
+    # duplicates in a batch
+    parser.add_argument("--num-embeddings", type=int, default=1000)
+    parser.add_argument(
+        "--hit-pattern",
+        type=str,
+        default="normal",
+        choices=HIT_PATTERNS,
+    )
     parser.add_argument(
         "--optimizer",
         type=str,
@@ -335,11 +469,18 @@ def run():
         choices=["sgd", "adagrad"],
     )
     args = parser.parse_args()
-    input_data = get_data(args.batch_size)
+    if args.index_dedup:
+        index_dedup_bench(args)
+        exit()
+    input_data = get_data(args.batch_size, args.hit_pattern)
     if args.with_cat:
         assert args.inference
         merged_emb_cat_bench(args, input_data)
         exit()
+    if args.with_interaction:
+        assert args.inference
+        merged_emb_interaction_bench(args, input_data)
+        exit()
 
     if args.optimizer == "sgd":
         merged_emb_with_sgd(args, input_data)
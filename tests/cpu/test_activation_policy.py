@@ -0,0 +1,165 @@
+import copy
+import tempfile
+import unittest
+
+import torch
+import intel_extension_for_pytorch as ipex
+from intel_extension_for_pytorch.llm.activation_policy import ActivationPolicy
+from common_utils import TestCase
+
+try:
+    import transformers
+
+    HAS_TRANSFORMERS = True
+except ImportError:
+    HAS_TRANSFORMERS = False
+
+
+class DecoderLayer(torch.nn.Module):
+    def __init__(self, hidden_size):
+        super().__init__()
+        self.norm = torch.nn.LayerNorm(hidden_size)
+        self.up = torch.nn.Linear(hidden_size, 4 * hidden_size)
+        self.down = torch.nn.Linear(4 * hidden_size, hidden_size)
+
+    def forward(self, hidden_states):
+        return hidden_states + self.down(
+            torch.nn.functional.gelu(self.up(self.norm(hidden_states)))
+        )
+
+
+class Decoder(torch.nn.Module):
+    def __init__(self, hidden_size=64, num_layers=4):
+        super().__init__()
+        self.layers = torch.nn.ModuleList(
+            [DecoderLayer(hidden_size) for _ in range(num_layers)]
+        )
+
+    def forward(self, hidden_states, policy=None):
+        for layer in self.layers:
+            if policy is None:
+                hidden_states = layer(hidden_states)
+            else:
+                hidden_states = policy(layer.__call__, hidden_states)
+        return hidden_states
+
+
+class MLP(torch.nn.Module):
+    def __init__(self, hidden_size):
+        super().__init__()
+        self.fc1 = torch.nn.Linear(hidden_size, hidden_size)
+        self.fc2 = torch.nn.Linear(hidden_size, hidden_size)
+
+    def forward(self, x):
+        # the output of fc1 is freed once packed, the output of fc2 of the
+        # same shape may be allocated at its address
+        return torch.sin(self.fc2(torch.sin(self.fc1(x))))
+
+
+class TestActivationPolicy(TestCase):
+    def _grads(self, model, x, policy=None):
+        model.zero_grad()
+        model(x, policy).square().mean().backward()
+        return [p.grad.clone() for p in model.parameters()]
+
+    def test_layer_modes(self):
+        torch.manual_seed(0)
+        model = Decoder()
+        x = torch.randn(8, 128, 64)
+        ref_grads = self._grads(model, x)
+        modes = ["keep", "bf16", "fp8", "offload", "recompute"]
+        with tempfile.TemporaryDirectory() as offload_dir:
+            for mode in modes:
+                policy = ActivationPolicy(
+                    layer_modes=[mode] * 4,
+                    offload_dir=offload_dir,
+                    min_tensor_bytes=0,
+                )
+                tol = {
+                    "bf16": {"rtol": 2e-2, "atol": 2e-3},
+                    "fp8": {"rtol": 2e-1, "atol": 2e-2},
+                }.get(mode, {})
+                for _ in range(2):
+                    grads = self._grads(model, x, policy)
+                    for grad, ref_grad in zip(grads, ref_grads):
+                        torch.testing.assert_close(grad, ref_grad, **tol)
+                policy.close()
+
+    def test_same_shaped_intermediates(self):
+        torch.manual_seed(0)
+        with tempfile.TemporaryDirectory() as offload_dir:
+            for hidden_size in [32, 64, 256]:
+                for batch_size in [8, 128]:
+                    model = MLP(hidden_size)
+                    x = torch.randn(batch_size, hidden_size)
+                    grads = []
+                    for mode in ["keep", "offload"]:
+                        policy = ActivationPolicy(
+                            layer_modes=[mode],
+                            offload_dir=offload_dir,
+                            min_tensor_bytes=0,
+                        )
+                        model.zero_grad()
+                        policy(model.__call__, x).square().mean().backward()
+                        grads.append([p.grad.clone() for p in model.parameters()])
+                        policy.close()
+                    for grad, ref_grad in zip(*grads):
+                        torch.testing.assert_close(grad, ref_grad)
+
+    def test_memory_budget(self):
+        torch.manual_seed(0)
+        model = Decoder()
+        x = torch.randn(8, 128, 64)
+        ref_grads = self._grads(model, x)
+        policy = ActivationPolicy(memory_budget_mb=8, min_tensor_bytes=0)
+        # the first step profiles the layers with their activations kept
+        self._grads(model, x, policy)
+        self.assertIsNone(policy.layer_modes)
+        grads = self._grads(model, x, policy)
+        # each layer saves 2.5MB of float32 activations
+        self.assertEqual(policy.layer_modes, ["bf16", "bf16", "keep", "keep"])
+        for grad, ref_grad in zip(grads, ref_grads):
+            torch.testing.assert_close(grad, ref_grad, rtol=2e-2, atol=2e-3)
+
+        policy = ActivationPolicy(
+            memory_budget_mb=3.2, min_tensor_bytes=0, escalation=("bf16", "recompute")
+        )
+        for _ in range(2):
+            self._grads(model, x, policy)
+        self.assertEqual(policy.layer_modes[:2], ["recompute", "recompute"])
+        self.assertEqual(policy.layer_modes[2:], ["bf16", "bf16"])
+
+    @unittest.skipIf(not HAS_TRANSFORMERS, "transformers is not installed")
+    def test_gradient_checkpointing_enable(self):
+        import intel_extension_for_pytorch.llm  # noqa: F401
+
+        config = transformers.LlamaConfig(
+            hidden_size=64,
+            intermediate_size=128,
+            num_hidden_layers=2,
+            num_attention_heads=4,
+            vocab_size=100,
+        )
+        torch.manual_seed(0)
+        model = transformers.LlamaForCausalLM(config)
+        model.train()
+        ref_model = copy.deepcopy(model)
+        policy = ipex.llm.ActivationPolicy(
+            layer_modes=["offload", "recompute"], min_tensor_bytes=0
+        )
+        model.gradient_checkpointing_enable(
+            gradient_checkpointing_kwargs={
+                "activation_policy": policy,
+                "use_reentrant": False,
+            }
+        )
+        input_ids = torch.randint(0, 100, (2, 16))
+        for m in [model, ref_model]:
+            m(input_ids=input_ids, labels=input_ids).loss.backward()
+        for p, ref_p in zip(model.parameters(), ref_model.parameters()):
+            torch.testing.assert_close(p.grad, ref_p.grad)
+        policy.close()
+
+
+if __name__ == "__main__":
+    test = unittest.main()
@@ -18,6 +18,30 @@ except (ImportError, RuntimeError):
 skipIfNoTORCHCCL = unittest.skipIf(not HAS_TORCHCCL, "torch-ccl is no installed")
 
 
+def env2int(env_list, default=-1):
+    for e in env_list:
+        val = int(os.environ.get(e, -1))
+        if val >= 0:
+            return val
+    return default
+
+
+def init_process_group():
+    import torch.distributed as dist
+
+    rank = env2int(
+        ["PMI_RANK", "OMPI_COMM_WORLD_RANK", "MV2_COMM_WORLD_RANK", "RANK"], 0
+    )
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = "29500"
+    # This is a workwaround, we use "W_SIZE" to config "WORLD_SIZE"
+    # because while using IPEX launcher, the cannot find the "WORLD_SIZE"
+    # even we have set them
+    world_size = env2int(["W_SIZE"])
+    os.environ["WORLD_SIZE"] = os.environ["W_SIZE"]
+    dist.init_process_group("ccl", world_size=world_size, rank=rank)
+
+
 class DistMergedEmbeddingTester(TestCase):
     multi_hot = [
         3,
@@ -52,26 +76,9 @@ class DistMergedEmbeddingTester(TestCase):
     def test_training(self):
         import torch.distributed as dist
 
-        def env2int(env_list, default=-1):
-            for e in env_list:
-                val = int(os.environ.get(e, -1))
-                if val >= 0:
-                    return val
-            return default
-
-        rank = env2int(
-            ["PMI_RANK", "OMPI_COMM_WORLD_RANK", "MV2_COMM_WORLD_RANK", "RANK"], 0
-        )
-        os.environ["MASTER_ADDR"] = "127.0.0.1"
-        os.environ["MASTER_PORT"] = "29500"
         NUM_TABLE = 26
         B = 1024  # B % world_size == 0
-        # This is a workwaround, we use "W_SIZE" to config "WORLD_SIZE"
-        # because while using IPEX launcher, the cannot find the "WORLD_SIZE"
-        # even we have set them
-        world_size = env2int(os.environ["W_SIZE"])
-        os.environ["WORLD_SIZE"] = os.environ["W_SIZE"]
-        dist.init_process_group("ccl", world_size=world_size, rank=rank)
+        init_process_group()
         my_rank = dist.get_rank()
         my_size = dist.get_world_size()
         for index_type in [torch.int64, torch.int32]:
@@ -148,6 +155,83 @@ class DistMergedEmbeddingTester(TestCase):
                         )
         dist.destroy_process_group()
 
+    @skipIfNoTORCHCCL
+    def test_training_with_sharding_plan(self):
+        import torch.distributed as dist
+
+        NUM_DIM = 64
+        B = 1024  # B % world_size == 0
+        lr = 0.1
+        init_process_group()
+        my_rank = dist.get_rank()
+        my_size = dist.get_world_size()
+        local_bs = B // my_size
+        # a few large tables spread over the ranks and many small ones kept
+        # on one rank
+        num_embeddings = [20000, 5000] + [100 * (i + 1) for i in range(24)]
+        torch.manual_seed(0)
+        indices = [
+            torch.randint(n, (B * hot,))
+            for n, hot in zip(num_embeddings, self.multi_hot)
+        ]
+        offsets = [torch.arange(0, B * hot, hot) for hot in self.multi_hot]
+        plan = ipex.nn.modules.EmbeddingShardingPlanner(my_size, NUM_DIM, B).plan(
+            num_embeddings, self.multi_hot
+        )
+        self.assertIn("table", plan.strategies)
+        local_rows = plan.local_rows(my_rank)
+        for dtype in [torch.float32, torch.bfloat16]:
+            # the reference runs the global batch on each rank with fp32
+            # weights, as the bf16 training keeps fp32 master weights
+            ref_list = torch.nn.ModuleList(
+                [torch.nn.EmbeddingBag(n, NUM_DIM, mode="sum") for n in num_embeddings]
+            )
+            for emb in ref_list:
+                torch.nn.init.uniform_(emb.weight, -0.1, 0.1)
+                emb.weight.data = emb.weight.data.to(dtype).float()
+            ref_optimizer = torch.optim.Adagrad(ref_list.parameters(), lr=lr)
+            emb_list = copy.deepcopy(ref_list).to(dtype)
+            distributed_emb = (
+                ipex.nn.modules.DistMergeEmbeddingBagWithAdaGrad.from_embeddingbag_list(
+                    emb_list, lr=lr, sharding_plan=plan
+                )
+            )
+            tol = {"atol": 0.2, "rtol": 0.2} if dtype == torch.bfloat16 else {}
+            for _ in range(2):
+                out = distributed_emb(indices, offsets)
+                ref_out = torch.stack(
+                    [
+                        emb(index, offset)
+                        for emb, index, offset in zip(ref_list, indices, offsets)
+                    ],
+                    dim=1,
+                )
+                self.assertEqual(
+                    out.float(),
+                    ref_out[my_rank * local_bs : (my_rank + 1) * local_bs],
+                    **tol,
+                )
+                out.backward(torch.ones_like(out))
+                ref_optimizer.zero_grad()
+                ref_out.backward(torch.ones_like(ref_out))
+                ref_optimizer.step()
+                # the rank keeps the rows of the plan in their local order
+                ref_weight = torch.cat([emb.weight.data for emb in ref_list])[
+                    local_rows
+                ]
+                ref_hessian = torch.cat(
+                    [ref_optimizer.state[emb.weight]["sum"] for emb in ref_list]
+                )[local_rows]
+                self.assertEqual(
+                    distributed_emb.weights[0].float(),
+                    ref_weight,
+                    **({"atol": 1e-2, "rtol": 1e-2} if dtype == torch.bfloat16 else {}),
+                )
+                self.assertEqual(
+                    distributed_emb.adagrad_args.hessian[0], ref_hessian, **tol
+                )
+        dist.destroy_process_group()
+
 
 if __name__ == "__main__":
     test = unittest.main()
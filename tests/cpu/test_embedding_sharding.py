@@ -0,0 +1,162 @@
+import unittest
+
+import torch
+from intel_extension_for_pytorch.nn.modules import (
+    EmbeddingShardingPlanner,
+    ShardingPlan,
+    simulate_sharding,
+)
+from common_utils import TestCase
+
+
+def get_batches(num_embeddings, pooling_factors, batch_size, num_batches, zipf=None):
+    batches = []
+    for _ in range(num_batches):
+        indices = []
+        offsets = []
+        for n, h in zip(num_embeddings, pooling_factors):
+            if zipf is None:
+                index = torch.randint(n, (batch_size * h,))
+            else:
+                prob = 1.0 / torch.arange(1, n + 1).double().pow(zipf)
+                index = torch.multinomial(prob, batch_size * h, replacement=True)
+            indices.append(index)
+            offsets.append(torch.arange(0, batch_size * h, h))
+        batches.append((indices, offsets))
+    return batches
+
+
+class TestEmbeddingSharding(TestCase):
+    world_size = 4
+    embedding_dim = 128
+    batch_size = 256
+
+    def _planner(self, **kwargs):
+        return EmbeddingShardingPlanner(
+            self.world_size, self.embedding_dim, self.batch_size, **kwargs
+        )
+
+    def _check_positions(self, plan):
+        # the kernels look up the row at position p on rank p % world_size
+        # at its local row p // world_size
+        ws = plan.world_size
+        for rank in range(ws):
+            rows = plan.local_rows(rank)
+            self.assertTrue((plan.row_ranks[rows] == rank).all())
+            self.assertEqual(
+                plan.row_positions[rows], torch.arange(rows.numel()) * ws + rank
+            )
+
+    def test_round_robin(self):
+        num_embeddings = [10, 7, 3]
+        plan = ShardingPlan.round_robin(num_embeddings, self.world_size)
+        self.assertEqual(plan.row_positions, torch.arange(20))
+        self._check_positions(plan)
+        self.assertEqual(plan.local_rows(1), torch.arange(20)[1 :: self.world_size])
+
+    def test_plan(self):
+        num_embeddings = [4000] + [100] * 8
+        pooling_factors = [2] * 9
+        planner = self._planner()
+
+        plan = planner.plan(num_embeddings, pooling_factors, strategy="table")
+        self._check_positions(plan)
+        self.assertEqual(plan.strategies, ["table"] * len(num_embeddings))
+        for t in range(len(num_embeddings)):
+            self.assertIsNotNone(plan.table_rank(t))
+
+        plan = planner.plan(num_embeddings, pooling_factors)
+        self._check_positions(plan)
+        # only the largest table is too large to be kept on one rank
+        self.assertEqual(plan.strategies[0], "row")
+        self.assertEqual(plan.strategies[1:], ["table"] * (len(num_embeddings) - 1))
+        estimate = planner.estimate(plan, pooling_factors)
+        memory = estimate["memory_bytes"]
+        self.assertLessEqual(max(memory), 1.1 * sum(memory) / self.world_size)
+
+        # a table with many lookups per sample is spread as well
+        plan = planner.plan([100] * 9, [40] + [1] * 8)
+        self.assertEqual(plan.strategies, ["row"] + ["table"] * 8)
+        lookups = planner.estimate(plan, [40] + [1] * 8)["lookups"]
+        self.assertEqual(lookups, [self.batch_size * 12] * self.world_size)
+
+        row_wise = planner.plan(num_embeddings, pooling_factors, strategy="row")
+        self.assertLess(
+            estimate["all_to_all_bytes"],
+            planner.estimate(row_wise, pooling_factors)["all_to_all_bytes"],
+        )
+
+        # a budget below the mean memory is not reachable, all tables end
+        # up row-wise
+        plan = self._planner(memory_budget=1).plan(num_embeddings, pooling_factors)
+        self.assertEqual(plan.strategies, ["row"] * len(num_embeddings))
+
+        plan = ShardingPlan.from_state_dict(plan.state_dict())
+        self._check_positions(plan)
+
+    def test_row_frequencies(self):
+        num_embeddings = [1000]
+        freq = 1.0 / torch.arange(1, 1001).double().pow(0.8)
+        freq = freq[torch.randperm(1000)]
+        planner = self._planner()
+        plan = planner.plan(num_embeddings, [8], row_frequencies=[freq])
+        self.assertEqual(plan.strategies, ["row"])
+        self._check_positions(plan)
+        shares = plan.lookup_shares(0, freq)
+        round_robin = ShardingPlan.round_robin(num_embeddings, self.world_size)
+        # the hot rows are spread over the ranks
+        self.assertLess(
+            shares.max() - shares.min(),
+            0.05,
+        )
+        self.assertLessEqual(
+            shares.max(), round_robin.lookup_shares(0, freq).max() + 1e-6
+        )
+
+    def test_simulate(self):
+        torch.manual_seed(0)
+        num_embeddings = [1000, 50, 200, 30]
+        pooling_factors = [4, 1, 2, 1]
+        planner = self._planner()
+        batches = get_batches(num_embeddings, pooling_factors, self.batch_size, 4)
+        for strategy in ["auto", "table", "row"]:
+            plan = planner.plan(num_embeddings, pooling_factors, strategy=strategy)
+            estimate = planner.estimate(plan, pooling_factors)
+            simulated = simulate_sharding(plan, batches, self.embedding_dim)
+            self.assertEqual(simulated["memory_bytes"], estimate["memory_bytes"])
+            self.assertEqual(
+                sum(simulated["sent_bytes"]), sum(simulated["received_bytes"])
+            )
+            self.assertEqual(
+                sum(simulated["lookups"]),
+                self.batch_size * sum(pooling_factors),
+            )
+            torch.testing.assert_close(
+                simulated["all_to_all_bytes"],
+                estimate["all_to_all_bytes"],
+                rtol=0.05,
+                atol=0,
+            )
+
+        # all lookups of a table-wise plan of one table land on one rank,
+        # which sends a partial for every sample of the other ranks
+        plan = planner.plan([100], strategy="table")
+        batches = get_batches([100], [3], self.batch_size, 1)
+        simulated = simulate_sharding(plan, batches, self.embedding_dim)
+        rank = plan.table_rank(0)
+        partial_bytes = self.embedding_dim * 4 + 8
+        local_batch = self.batch_size // self.world_size
+        self.assertEqual(simulated["lookups"][rank], self.batch_size * 3)
+        self.assertEqual(
+            simulated["sent_bytes"][rank],
+            (self.batch_size - local_batch) * partial_bytes,
+        )
+        for r in range(self.world_size):
+            if r != rank:
+                self.assertEqual(
+                    simulated["received_bytes"][r], local_batch * partial_bytes
+                )
+
+
+if __name__ == "__main__":
+    test = unittest.main()
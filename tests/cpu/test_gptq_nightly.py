@@ -124,6 +124,76 @@ class GPTQLLMTester(TestCase):
                     # the optimized model is ipex_m.trace_graph
                     model(*example_inputs)
 
+    def test_gptq_quantize_parallel_resume_offload(self):
+        dataloader = [torch.randint(0, 100, [1, 128]) for _ in range(4)]
+        curpath = os.path.abspath(os.path.dirname(__file__))
+        config = AutoConfig.from_pretrained(
+            f"{curpath}/hf_configs/gptj", return_dict=False
+        )
+        config.n_layer = 2
+        config.n_embd = 256
+        gptj = transformers.models.gptj.modeling_gptj.GPTJForCausalLM(config).eval()
+        gptq_args = {
+            "dataloader": dataloader,
+            "wbits": 4,
+            "group_size": 128,
+            "nsamples": 4,
+        }
+        with tempfile.TemporaryDirectory() as work_dir:
+            ref_model = ipex.quantization.gptq(
+                copy.deepcopy(gptj), save_dir=work_dir, **gptq_args
+            )
+            checkpoint_dir = os.path.join(work_dir, "blocks")
+            ipex.quantization.gptq(
+                copy.deepcopy(gptj),
+                save_dir=work_dir,
+                checkpoint_dir=checkpoint_dir,
+                **gptq_args,
+            )
+            self.assertEqual(
+                sorted(os.listdir(checkpoint_dir)),
+                ["gptq_block_0.pt", "gptq_block_1.pt"],
+            )
+            # resume from the first block, quantize the second one concurrently
+            os.remove(os.path.join(checkpoint_dir, "gptq_block_1.pt"))
+            compressed_model = ipex.quantization.gptq(
+                copy.deepcopy(gptj),
+                save_dir=work_dir,
+                checkpoint_dir=checkpoint_dir,
+                cpu_pools=[
+                    ipex.cpu.runtime.CPUPool(core_ids=[0]),
+                    ipex.cpu.runtime.CPUPool(core_ids=[0]),
+                ],
+                **gptq_args,
+            )
+            self.assertEqual(ref_model.state_dict(), compressed_model.state_dict())
+
+            # calibration activations spilled to disk
+            offload_dir = os.path.join(work_dir, "activations")
+            compressed_model = ipex.quantization.gptq(
+                copy.deepcopy(gptj),
+                save_dir=work_dir,
+                offload_dir=offload_dir,
+                **gptq_args,
+            )
+            self.assertEqual(ref_model.state_dict(), compressed_model.state_dict())
+            self.assertEqual(os.listdir(offload_dir), [])
+
+            # and removed when the quantization fails
+            def fail(module, inputs, outputs):
+                raise RuntimeError("block failed")
+
+            failing_model = copy.deepcopy(gptj)
+            failing_model.transformer.h[1].register_forward_hook(fail)
+            with self.assertRaisesRegex(RuntimeError, "block failed"):
+                ipex.quantization.gptq(
+                    failing_model,
+                    save_dir=work_dir,
+                    offload_dir=offload_dir,
+                    **gptq_args,
+                )
+            self.assertEqual(os.listdir(offload_dir), [])
+
 
 if __name__ == "__main__":
     test = unittest.main()
@@ -0,0 +1,116 @@
+import copy
+import os
+import unittest
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import intel_extension_for_pytorch as ipex
+from common_utils import TestCase
+
+WORLD_SIZE = 2
+
+
+class Model(torch.nn.Module):
+    def __init__(self):
+        super(Model, self).__init__()
+        self.layers = torch.nn.Sequential(
+            torch.nn.Linear(16, 32),
+            torch.nn.ReLU(),
+            torch.nn.Linear(32, 32),
+            torch.nn.ReLU(),
+            torch.nn.Linear(32, 4),
+        )
+        self.extra = torch.nn.Linear(16, 4)
+
+    def forward(self, x, use_extra=True):
+        y = self.layers(x)
+        return y + self.extra(x) if use_extra else y
+
+
+def _run_rank(rank, port, compression, fused):
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(port)
+    dist.init_process_group("gloo", rank=rank, world_size=WORLD_SIZE)
+    try:
+        torch.manual_seed(0)
+        model = Model()
+        ref_model = copy.deepcopy(model)
+        ref_optimizer = torch.optim.SGD(ref_model.parameters(), lr=0.01, momentum=0.9)
+        optimizer = torch.optim.SGD(model.parameters(), lr=0.01, momentum=0.9)
+        if fused:
+            model, optimizer = ipex.optimize(
+                model, optimizer=optimizer, weights_prepack=False
+            )
+        # a small bucket size to get several buckets
+        reducer = ipex.cpu.comm.GradBucketReducer(
+            model,
+            optimizer,
+            bucket_size_mb=0.004,
+            compression=compression,
+            process_group=dist.group.WORLD,
+        )
+        assert len(reducer.buckets) > 1
+        # bf16 keeps 8 bits of mantissa of the reduced gradients
+        rtol, atol = (1e-2, 5e-2) if compression is not None else (1e-3, 1e-5)
+        torch.manual_seed(rank)
+        # the extra layer is only used by rank 0, the other ranks still get
+        # its averaged grad and update it
+        use_extra = rank == 0
+        for _ in range(3):
+            x = torch.randn(8, 16)
+            optimizer.zero_grad()
+            model(x, use_extra).mean().backward()
+            optimizer.step()
+
+            ref_optimizer.zero_grad()
+            ref_model(x, use_extra).mean().backward()
+            for p in ref_model.parameters():
+                if p.grad is None:
+                    p.grad = torch.zeros_like(p)
+                dist.all_reduce(p.grad)
+                p.grad.div_(WORLD_SIZE)
+            ref_optimizer.step()
+            for p, ref_p in zip(model.parameters(), ref_model.parameters()):
+                torch.testing.assert_close(p, ref_p, rtol=rtol, atol=atol)
+
+        # gradients are accumulated locally in no_sync and reduced afterwards
+        x = torch.randn(8, 16)
+        optimizer.zero_grad()
+        with reducer.no_sync():
+            model(x).mean().backward()
+        local_grads = [p.grad.clone() for p in model.parameters()]
+        model(x).mean().backward()
+        reducer.wait()
+        for p, local_grad in zip(model.parameters(), local_grads):
+            expected = local_grad * 2
+            dist.all_reduce(expected)
+            torch.testing.assert_close(
+                p.grad, expected / WORLD_SIZE, rtol=rtol, atol=atol
+            )
+        reducer.remove()
+    finally:
+        dist.destroy_process_group()
+
+
+class TestGradBucketReducer(TestCase):
+    def _test(self, port, compression, fused):
+        mp.spawn(
+            _run_rank, args=(port, compression, fused), nprocs=WORLD_SIZE, join=True
+        )
+
+    @unittest.skipIf(not dist.is_gloo_available(), "gloo is not available")
+    def test_grad_bucketing(self):
+        self._test(29511, None, False)
+
+    @unittest.skipIf(not dist.is_gloo_available(), "gloo is not available")
+    def test_grad_bucketing_fused_step(self):
+        self._test(29512, None, True)
+
+    @unittest.skipIf(not dist.is_gloo_available(), "gloo is not available")
+    def test_grad_bucketing_bf16_compression(self):
+        self._test(29513, torch.bfloat16, True)
+
+
+if __name__ == "__main__":
+    test = unittest.main()
@@ -0,0 +1,135 @@
+import os
+import tempfile
+import unittest
+
+import torch
+import yaml
+import intel_extension_for_pytorch as ipex
+from intel_extension_for_pytorch.cpu import hypertune
+from common_utils import TestCase
+
+
+class ConvNet(torch.nn.Module):
+    def __init__(self):
+        super(ConvNet, self).__init__()
+        self.conv = torch.nn.Conv2d(3, 8, 3)
+        self.linear = torch.nn.Linear(8, 4)
+
+    def forward(self, x):
+        return self.linear(self.conv(x).mean(dim=(2, 3)))
+
+
+class TestInProcessTune(TestCase):
+    def _conf(self, output_dir, hyperparams):
+        return {"hyperparams": hyperparams, "output_dir": output_dir}
+
+    def test_tune(self):
+        model = ConvNet().eval()
+        trials = []
+
+        def latency(optimized):
+            # a bfloat16 model is the fastest one, a fake latency keeps the
+            # result independent of the machine
+            dtype = optimized.linear.weight.dtype
+            trials.append(dtype)
+            return 1.0 if dtype == torch.bfloat16 else 2.0
+
+        with tempfile.TemporaryDirectory() as tmp:
+            conf = self._conf(
+                tmp,
+                {
+                    "optimize": {
+                        "hp": ["dtype", "weights_prepack"],
+                        "dtype": ["float32", "bfloat16"],
+                        "weights_prepack": [False],
+                    }
+                },
+            )
+            recipe = hypertune.tune(
+                model, latency, conf, [{"name": "latency"}], recipe_file="best.yaml"
+            )
+            # the options not tuned keep their default values
+            self.assertEqual(
+                recipe,
+                {
+                    "optimize": {
+                        "dtype": "bfloat16",
+                        "level": "O1",
+                        "weights_prepack": False,
+                        "auto_kernel_selection": None,
+                        "concat_linear": None,
+                        "graph_mode": None,
+                    }
+                },
+            )
+            self.assertEqual(trials, [torch.float32, torch.bfloat16])
+            # every trial optimizes a copy, the model itself is untouched
+            self.assertEqual(model.linear.weight.dtype, torch.float32)
+
+            with open(os.path.join(tmp, "best.yaml"), "r") as f:
+                saved = yaml.safe_load(f)
+            self.assertEqual(saved["recipe"], recipe)
+            self.assertEqual(saved["objectives"], {"latency": 1.0})
+            optimized = hypertune.load_recipe(model, os.path.join(tmp, "best.yaml"))
+            self.assertEqual(optimized.linear.weight.dtype, torch.bfloat16)
+
+    def test_apply_recipe(self):
+        model = ConvNet().eval()
+        recipe = {
+            "optimize": {"dtype": "bfloat16", "level": "O1", "weights_prepack": False}
+        }
+        optimized = hypertune.apply_recipe(model, recipe)
+        self.assertEqual(optimized.conv.weight.dtype, torch.bfloat16)
+        self.assertEqual(optimized.linear.weight.dtype, torch.bfloat16)
+        self.assertTrue(
+            optimized.conv.weight.is_contiguous(memory_format=torch.channels_last)
+        )
+        self.assertEqual(model.conv.weight.dtype, torch.float32)
+        self.assertIsInstance(hypertune.recipe_autocast(recipe), torch.cpu.amp.autocast)
+
+        optimized = hypertune.apply_recipe(
+            model, {"optimize": {"dtype": "float32", "level": "O0"}}
+        )
+        self.assertEqual(optimized.conv.weight.dtype, torch.float32)
+
+    @unittest.skipIf(
+        not ipex.cpu.runtime.is_runtime_ext_enabled(),
+        "Skip when IPEX Runtime extension is not enabled",
+    )
+    def test_apply_recipe_num_streams(self):
+        model = ConvNet().eval()
+        optimized = hypertune.apply_recipe(model, {"runtime": {"num_streams": 1}})
+        self.assertIs(optimized, model)
+        optimized = hypertune.apply_recipe(model, {"runtime": {"num_streams": 2}})
+        self.assertIsInstance(optimized, ipex.cpu.runtime.MultiStreamModule)
+        self.assertEqual(
+            optimized.num_streams, min(2, len(optimized.cpu_pool.core_ids))
+        )
+
+    def test_load_recipe(self):
+        model = ConvNet().eval()
+        recipe = {
+            "optimize": {"dtype": "bfloat16", "weights_prepack": False},
+            "runtime": {"num_streams": 1},
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            recipe_file = os.path.join(tmp, "recipe.yaml")
+            with open(recipe_file, "w") as f:
+                yaml.safe_dump({"recipe": recipe}, f)
+            with open(recipe_file, "r") as f:
+                self.assertEqual(yaml.safe_load(f)["recipe"], recipe)
+            optimized = hypertune.load_recipe(model, recipe_file)
+            self.assertEqual(optimized.linear.weight.dtype, torch.bfloat16)
+
+            for unknown in [
+                {"optimize": {"dtpye": "bfloat16"}},
+                {"launcher": {"ncores_per_instance": 4}},
+            ]:
+                with open(recipe_file, "w") as f:
+                    yaml.safe_dump({"recipe": unknown}, f)
+                with self.assertRaisesRegex(AssertionError, "Unknown hyperparameter"):
+                    hypertune.load_recipe(model, recipe_file)
+
+
+if __name__ == "__main__":
+    test = unittest.main()
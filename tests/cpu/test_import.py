@@ -1,5 +1,19 @@
 import unittest
 import subprocess
+import sys
+
+# seconds `import intel_extension_for_pytorch` may take on top of `import torch`
+IMPORT_TIME_BUDGET = 1.0
+# modules `import intel_extension_for_pytorch` must not pull in, they are
+# imported on first access
+LAZY_MODULES = [
+    "transformers",
+    "torch._dynamo",
+    "intel_extension_for_pytorch.llm",
+    "intel_extension_for_pytorch.nn",
+    "intel_extension_for_pytorch.quantization",
+    "intel_extension_for_pytorch.transformers",
+]
 
 
 class TestImport(unittest.TestCase):
@@ -12,6 +26,56 @@ class TestImport(unittest.TestCase):
             print(out)
             assert "warn" not in out
 
+    def test_lazy_import(self):
+        code = (
+            "import sys\n"
+            "import intel_extension_for_pytorch\n"
+            f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))\n"
+        )
+        out = subprocess.check_output([sys.executable, "-c", code]).decode()
+        self.assertEqual(out.strip(), "", "subsystems imported eagerly")
+
+    def test_import_time(self):
+        code = (
+            "import time\n"
+            "import torch\n"
+            "start = time.time()\n"
+            "import intel_extension_for_pytorch\n"
+            "print(time.time() - start)\n"
+        )
+        # best of 3 runs, the first one may pay for cold file system caches
+        elapsed = min(
+            float(subprocess.check_output([sys.executable, "-c", code]).decode())
+            for _ in range(3)
+        )
+        print(f"import intel_extension_for_pytorch took {elapsed:.3f}s")
+        self.assertLess(elapsed, IMPORT_TIME_BUDGET)
+
+    def test_eager_registrations(self):
+        code = (
+            "import sys, torch\n"
+            "import intel_extension_for_pytorch\n"
+            "from intel_extension_for_pytorch._tensor_method import _numpy\n"
+            "assert torch.Tensor.numpy is _numpy\n"
+            "assert torch.ones(2, dtype=torch.bfloat16).numpy().tolist() == [1.0, 1.0]\n"
+            "assert f'{torch.tensor(0.5):.2f}' == '0.50'\n"
+            "assert hasattr(torch.ops.myops, 'longrope')\n"
+            "assert 'intel_extension_for_pytorch.transformers' not in sys.modules\n"
+        )
+        subprocess.check_call([sys.executable, "-c", code])
+
+    def test_lazy_attributes(self):
+        import intel_extension_for_pytorch as ipex
+
+        self.assertTrue(callable(ipex.optimize))
+        self.assertTrue(callable(ipex.llm.optimize))
+        self.assertTrue(callable(ipex.quantization.prepare))
+        self.assertTrue(hasattr(ipex.nn, "modules"))
+        self.assertTrue(hasattr(ipex.cpu.runtime, "CPUPool"))
+        self.assertTrue("optimize" in dir(ipex))
+        with self.assertRaises(AttributeError):
+            ipex.not_an_attribute
+
 
 if __name__ == "__main__":
     unittest.main()
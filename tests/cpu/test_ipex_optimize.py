@@ -24,6 +24,7 @@ import copy
 from common_utils import TestModule, _empty_weight_bias_parameter_names
 from intel_extension_for_pytorch.optim._lamb import Lamb
 import os
+import tempfile
 
 try:
     import transformers
@@ -243,6 +244,61 @@ class TestOptimizeCases(TestCase):
                 self.assertEqual(param.dtype, torch.bfloat16)
                 break
 
+    @skipIfNoTransformers
+    def test_optimize_unpad_bert(self):
+        from transformers.models import bert
+        from intel_extension_for_pytorch.nn.utils._varlen_encoder import (
+            _IPEXVarlenEncoder,
+        )
+
+        config = transformers.BertConfig(
+            hidden_size=64,
+            num_hidden_layers=2,
+            num_attention_heads=4,
+            intermediate_size=128,
+            vocab_size=100,
+        )
+        model = bert.modeling_bert.BertModel(config).eval()
+        input_ids = torch.randint(0, 100, (3, 10))
+        attention_mask = torch.ones(3, 10, dtype=torch.long)
+        attention_mask[0, 6:] = 0
+        attention_mask[1, 3:] = 0
+        valid = attention_mask.bool()
+        for dtype in [torch.float32, torch.bfloat16]:
+            opt_model = ipex.optimize(model, dtype=dtype, unpad=True)
+            self.assertTrue(isinstance(opt_model.encoder, _IPEXVarlenEncoder))
+            with torch.no_grad(), torch.cpu.amp.autocast(
+                enabled=dtype is torch.bfloat16
+            ):
+                ref_out = model(input_ids, attention_mask=attention_mask)
+                out = opt_model(input_ids, attention_mask=attention_mask)
+                # output_attentions needs the padded path
+                padded_out = opt_model(
+                    input_ids, attention_mask=attention_mask, output_attentions=True
+                )
+            atol = 0.1 if dtype is torch.bfloat16 else 1e-5
+            self.assertEqual(
+                ref_out.last_hidden_state[valid],
+                out.last_hidden_state[valid],
+                rtol=1e-2,
+                atol=atol,
+                exact_dtype=False,
+            )
+            self.assertEqual(
+                padded_out.last_hidden_state[valid],
+                out.last_hidden_state[valid],
+                rtol=1e-2,
+                atol=atol,
+                exact_dtype=False,
+            )
+            self.assertEqual(
+                ref_out.pooler_output,
+                out.pooler_output,
+                rtol=1e-2,
+                atol=atol,
+                exact_dtype=False,
+            )
+
     def test_optimize_pretrain_model(self):
         optimizer_options = [
             Lamb,
@@ -556,6 +612,43 @@ class TestOptimizeCases(TestCase):
                     origin_model_state[var_name], ipex_model_state[var_name]
                 )
 
+    def test_optimize_auto_level(self):
+        from intel_extension_for_pytorch.nn.utils._auto_kernel_tuning import (
+            _kernel_decision_table,
+        )
+
+        _kernel_decision_table.clear()
+        for module in [ConvBatchNormLinearBatchNorm, OneLayerMLP]:
+            M = module().eval()
+            input = M.input1
+            opt_M = ipex.optimize(M, level="auto", sample_input=input)
+            with torch.no_grad():
+                self.assertEqual(M(input), opt_M(input), rtol=1e-4, atol=1e-4)
+        self.assertEqual(len(_kernel_decision_table), 3)
+        for decision in _kernel_decision_table.values():
+            self.assertEqual(
+                decision["latency_us"][decision["candidate"]],
+                min(decision["latency_us"].values()),
+            )
+
+        # decisions loaded from file are reused without benchmarking
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "kernels.json")
+            ipex.save_kernel_decision_table(path)
+            saved = copy.deepcopy(_kernel_decision_table)
+            _kernel_decision_table.clear()
+            ipex.load_kernel_decision_table(path)
+            self.assertEqual(_kernel_decision_table, saved)
+        M = OneLayerMLP().eval()
+        opt_M = ipex.optimize(M, level="auto", sample_input=M.input1)
+        self.assertEqual(_kernel_decision_table, saved)
+
+        # without sample_input, auto falls back to O1
+        M = OneLayerMLP().eval()
+        opt_M = ipex.optimize(M, level="auto")
+        with torch.no_grad():
+            self.assertEqual(M(M.input1), opt_M(M.input1))
+
     def test_partial_model_update(self):
         class M(torch.nn.Module):
             def __init__(self):
@@ -445,6 +445,35 @@ class OptimizeTransformersTester(TestCase):
                 ref_res = ref_m.generate(input_ids, **generate_kwargs)
                 self.assertEqual(ipex_res, ref_res)
 
+    def test_chunked_prefill(self):
+        config = AutoConfig.from_pretrained(
+            f"{curpath}/hf_configs/gptj", return_dict=False
+        )
+        m = transformers.models.gptj.modeling_gptj.GPTJForCausalLM(config).eval()
+        ipex_m = ipex.llm.optimize(
+            m, dtype=torch.float, deployment_mode=True, inplace=True
+        )
+        input_ids = torch.randint(0, 1000, (2, 70))
+        attention_mask = torch.ones_like(input_ids)
+        attention_mask[1, :5] = 0
+        for do_sample in [False, True]:
+            generate_kwargs = dict(
+                do_sample=do_sample,
+                temperature=0.01,
+                max_new_tokens=4,
+                min_new_tokens=4,
+                attention_mask=attention_mask,
+            )
+            with torch.inference_mode(), torch.no_grad():
+                torch.manual_seed(0)
+                ref_res = ipex_m.generate(input_ids, **generate_kwargs)
+                for chunk_size in [16, 32]:
+                    ipex_m.config.prefill_chunk_size = chunk_size
+                    torch.manual_seed(0)
+                    res = ipex_m.generate(input_ids, **generate_kwargs)
+                    self.assertEqual(res, ref_res)
+                del ipex_m.config.prefill_chunk_size
+
 
 if __name__ == "__main__":
     test = unittest.main()
@@ -5,6 +5,8 @@ import sys
 import subprocess
 import os
 import copy
+from contextlib import contextmanager
+from unittest import mock
 from intel_extension_for_pytorch.transformers import (
     shard_mha_weights,
     shard_mlp_weights,
@@ -13,6 +15,7 @@ from intel_extension_for_pytorch.transformers import (
     TensorParallelRowLinear,
     TensorParallelLMhead,
     TensorParallelConv2d,
+    infer_sharding_plan,
 )
 from intel_extension_for_pytorch.cpu import comm as ipex_comm
 
@@ -208,5 +211,115 @@ class TensorParallelTester(TestCase):
         self.tensor_parallel_with_optimize_transformers(model)
 
 
+class ShardingPlanTester(TestCase):
+    def _llama(self, device="cpu"):
+        config = AutoConfig.from_pretrained(
+            f"{curpath}/hf_configs/llama", return_dict=False
+        )
+        config.hidden_size = 256
+        config.intermediate_size = 512
+        config.num_attention_heads = 8
+        config.num_key_value_heads = 4
+        config.vocab_size = 1024
+        with torch.device(device):
+            model = transformers.models.llama.modeling_llama.LlamaForCausalLM(config)
+        return model.eval()
+
+    def test_infer_sharding_plan_llama(self):
+        model = self._llama("meta")
+        plan = infer_sharding_plan(model, 0, 2)
+        plan.validate(model)
+        attn = "model.layers.0.self_attn."
+        mlp = "model.layers.0.mlp."
+        for name in ["q_proj", "k_proj", "v_proj"]:
+            self.assertEqual(plan.specs[attn + name].style.value, "column")
+            self.assertTrue(plan.specs[attn + name].by_head)
+        self.assertEqual(plan.specs[attn + "o_proj"].style.value, "row")
+        self.assertEqual(plan.specs[mlp + "gate_proj"].style.value, "column")
+        self.assertEqual(plan.specs[mlp + "down_proj"].style.value, "row")
+        self.assertFalse(plan.specs[mlp + "down_proj"].by_head)
+        self.assertTrue(plan.specs["lm_head"].lm_head)
+
+    def test_sharding_plan_validate(self):
+        model = self._llama("meta")
+        num_kv_heads = model.config.num_key_value_heads
+        plan = infer_sharding_plan(model, 0, num_kv_heads + 1)
+        with self.assertRaises(ValueError):
+            plan.validate(model)
+
+    def test_sharding_plan_load_checkpoint(self):
+        model = self._llama()
+        checkpoint_file = os.path.join(curpath, "sharding_plan_test.bin")
+        torch.save(model.state_dict(), checkpoint_file)
+        try:
+            world_size = 2
+            for rank in range(world_size):
+                plan = infer_sharding_plan(model, rank, world_size)
+                ref_m = plan.apply(copy.deepcopy(model))
+                meta_m = self._llama("meta")
+                plan.validate(meta_m)
+                plan.apply(meta_m)
+                plan.load_checkpoint(meta_m, checkpoint_file, strict=True)
+                ref_state = ref_m.state_dict()
+                meta_state = meta_m.state_dict()
+                self.assertEqual(set(ref_state.keys()), set(meta_state.keys()))
+                for key, value in ref_state.items():
+                    self.assertEqual(value, meta_state[key])
+                self.assertTrue(
+                    isinstance(
+                        meta_m.model.layers[0].self_attn.o_proj,
+                        TensorParallelRowLinear,
+                    )
+                )
+                self.assertTrue(isinstance(meta_m.lm_head, TensorParallelLMhead))
+        finally:
+            os.remove(checkpoint_file)
+
+    @contextmanager
+    def _mock_world_size(self, world_size):
+        # rank 0 of `world_size` ranks, the partial outputs are not summed
+        optimize_module = sys.modules[
+            "intel_extension_for_pytorch.transformers.optimize"
+        ]
+        with mock.patch.object(
+            ipex_comm, "get_world_size", return_value=world_size, create=True
+        ), mock.patch.object(
+            ipex_comm, "get_rank", return_value=0, create=True
+        ), mock.patch.object(
+            ipex_comm, "allreduce_add", lambda tensor: tensor, create=True
+        ), mock.patch.object(
+            optimize_module, "distributed", False
+        ):
+            yield
+
+    def test_optimize_with_inferred_plan(self):
+        # OPT has no dedicated sharding recipe, it is sharded by an inferred plan
+        config = AutoConfig.from_pretrained(
+            f"{curpath}/hf_configs/opt", return_dict=False
+        )
+        model = transformers.models.opt.modeling_opt.OPTForCausalLM(config).eval()
+        input_ids = torch.ones(1, 10).to(torch.long)
+        with torch.no_grad():
+            ref_out = model(input_ids=input_ids)[0]
+        for world_size in [2, config.num_attention_heads + 1]:
+            with self._mock_world_size(world_size):
+                ipex_m = ipex.llm.optimize(
+                    copy.deepcopy(model), dtype=torch.float, deployment_mode=False
+                )
+                with torch.no_grad():
+                    out = ipex_m(input_ids=input_ids)[0]
+            self.assertEqual(out.shape, ref_out.shape)
+            attn = ipex_m.model.decoder.layers[0].self_attn
+            out_proj = getattr(attn, "out_proj", None)
+            if world_size == 2:
+                self.assertTrue(isinstance(out_proj, TensorParallelRowLinear))
+                self.assertEqual(attn.num_heads, config.num_attention_heads // 2)
+                self.assertEqual(attn.embed_dim, config.hidden_size // 2)
+            else:
+                # more ranks than heads, the model is not sharded
+                self.assertFalse(isinstance(out_proj, TensorParallelRowLinear))
+                self.assertEqual(out, ref_out, prec=0.1)
+
+
 if __name__ == "__main__":
     test = unittest.main()
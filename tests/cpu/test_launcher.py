@@ -1,12 +1,14 @@
 import unittest
 from common_utils import TestCase
-from utils.cpuinfo import construct_numa_config
+from utils.cpuinfo import construct_numa_config, construct_sysfs_tree
 from intel_extension_for_pytorch.cpu.launch import (
     CPUPoolList,
     Launcher,
     DistributedTrainingLauncher,
 )
+from intel_extension_for_pytorch.cpu.launch.cpu_info import read_sysfs_topology
 import os
+import tempfile
 from os.path import expanduser
 import glob
 import subprocess
@@ -740,6 +742,104 @@ class TestLauncher(TestCase):
         }
         self.verify_affinity(cpuinfo.pools_ondemand, ground_truth)
 
+    def test_cpuinfo_from_sysfs(self):
+        num_nodes = 2
+        n_phycores_per_node = 28
+        lscpu_txt = construct_numa_config(
+            num_nodes, n_phycores_per_node, enable_ht=True, numa_mode=1
+        )
+        cpuinfo_lscpu = CPUPoolList(lscpu_txt=lscpu_txt)
+        with tempfile.TemporaryDirectory() as sysfs_root:
+            construct_sysfs_tree(
+                sysfs_root, num_nodes, n_phycores_per_node, n_l3_per_node=2
+            )
+            cpuinfo = CPUPoolList(sysfs_root=sysfs_root)
+            # memoized per process
+            self.assertIs(
+                read_sysfs_topology(sysfs_root), read_sysfs_topology(sysfs_root)
+            )
+        for c, c_ref in zip(cpuinfo.pool_all, cpuinfo_lscpu.pool_all):
+            self.assertEqual(
+                (c.cpu, c.core, c.socket, c.node, c.is_physical_core, c.is_p_core),
+                (
+                    c_ref.cpu,
+                    c_ref.core,
+                    c_ref.socket,
+                    c_ref.node,
+                    c_ref.is_physical_core,
+                    c_ref.is_p_core,
+                ),
+            )
+            self.assertEqual(c.maxmhz, 5000.0)
+            self.assertEqual(c.l2, c.core)
+            self.assertEqual(c.l3, c.core // 14)
+            self.assertEqual(c.l2_size, 2048)
+            self.assertEqual(c.l3_size, 30 * 1024)
+        cpuinfo.gen_pools_ondemand(ninstances=2, use_logical_cores=True)
+        ground_truth = {
+            "ninstances": 2,
+            "ncores_per_instance": 56,
+            "num_cores_sum": 112,
+            "num_nodes_sum": 2,
+            "num_cores": [56, 56],
+            "num_nodes": [1, 1],
+            "pools_cores": ["0-27,56-83", "28-55,84-111"],
+            "pools_nodes": ["0", "1"],
+        }
+        self.verify_affinity(cpuinfo.pools_ondemand, ground_truth)
+
+    def test_cpuinfo_sysfs_fallback_to_lscpu(self):
+        with tempfile.TemporaryDirectory() as sysfs_root:
+            self.assertIsNone(read_sysfs_topology(sysfs_root))
+            lscpu_txt = construct_numa_config(2, 4, enable_ht=True, numa_mode=0)
+            # an injected lscpu_txt always takes precedence over sysfs
+            cpuinfo = CPUPoolList(lscpu_txt=lscpu_txt, sysfs_root=sysfs_root)
+            self.assertEqual(len(cpuinfo.pool_all), 16)
+
+    def test_core_affinity_locality_aware(self):
+        # 2 nodes, each with 2 L3 domains of 4 cores
+        with tempfile.TemporaryDirectory() as sysfs_root:
+            construct_sysfs_tree(sysfs_root, 2, 8, enable_ht=True, n_l3_per_node=2)
+            cpuinfo = CPUPoolList(sysfs_root=sysfs_root)
+        cpuinfo.gen_pools_ondemand(ninstances=4, ncores_per_instance=3)
+        self.assertEqual(
+            [p.get_pool_txt()["cores"] for p in cpuinfo.pools_ondemand],
+            ["0-2", "3-5", "6-8", "9-11"],
+        )
+        self.assertEqual(
+            [p.get_locality()["score"] for p in cpuinfo.pools_ondemand],
+            [1.0, 2 / 3, 2 / 3, 1.0],
+        )
+        cpuinfo.gen_pools_ondemand(
+            ninstances=4, ncores_per_instance=3, locality_aware=True
+        )
+        ground_truth = {
+            "ninstances": 4,
+            "ncores_per_instance": 3,
+            "num_cores_sum": 12,
+            "num_nodes_sum": 2,
+            "num_cores": [3, 3, 3, 3],
+            "num_nodes": [1, 1, 1, 1],
+            "pools_cores": ["0-2", "4-6", "8-10", "12-14"],
+            "pools_nodes": ["0", "0", "1", "1"],
+        }
+        self.verify_affinity(cpuinfo.pools_ondemand, ground_truth)
+        for p in cpuinfo.pools_ondemand:
+            self.assertEqual(
+                p.get_locality(), {"nodes": 1, "l3_domains": 1, "score": 1.0}
+            )
+        # instances larger than an L3 domain stay within a node
+        cpuinfo.gen_pools_ondemand(
+            ninstances=2, ncores_per_instance=6, locality_aware=True
+        )
+        self.assertEqual(
+            [p.get_pool_txt()["cores"] for p in cpuinfo.pools_ondemand],
+            ["0-5", "8-13"],
+        )
+        self.assertEqual(
+            [p.get_locality()["l3_domains"] for p in cpuinfo.pools_ondemand], [2, 2]
+        )
+
 
 if __name__ == "__main__":
     test = unittest.main()
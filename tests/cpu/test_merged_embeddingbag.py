@@ -6,6 +6,9 @@ from bench.custom_op_bench.merged_embeddingbag import (
     MergedEmb,
     EmbeddingBagListCatDense,
     MergedEmbCatDense,
+    EmbeddingBagListInteraction,
+    MergedEmbInteraction,
+    dlrm_top_mlp,
     MergedEmbSGD,
     MergedEmbAdaGrad,
 )
@@ -160,6 +163,148 @@ class TestMergedEmbedding(TestCase):
                             dense = torch.randn(B, NUM_DIM, dtype=dtype)
                             self._test_inference(m, ref_m, (indices, offsets, dense))
 
+    def test_interaction(self):
+        B = 1029
+        NUM_TABLE = 26
+        NUM_DIM = 128
+        indices = [
+            torch.randint(1000, (B * self.multi_hot[i],)) for i in range(NUM_TABLE)
+        ]
+        offsets = [
+            torch.arange(0, B * self.multi_hot[i], self.multi_hot[i])
+            for i in range(NUM_TABLE)
+        ]
+        for mode in ["mean", "sum"]:
+            for dtype in [torch.float32, torch.bfloat16, torch.int8]:
+                value_dtype = torch.float32 if dtype == torch.int8 else dtype
+                emb_list = EmbeddingBagList(NUM_TABLE, NUM_DIM, value_dtype, mode=mode)
+                for weight in emb_list.parameters():
+                    torch.nn.init.uniform_(weight, -0.1, 0.1)
+                top_mlp = dlrm_top_mlp(NUM_TABLE, NUM_DIM).to(value_dtype)
+                m = MergedEmbInteraction(emb_list, top_mlp)
+                if dtype == torch.int8:
+                    m.merged_emb.to_int8()
+                    self.assertEqual(m.merged_emb.weights[0].dtype, torch.uint8)
+                ref_m = EmbeddingBagListInteraction(emb_list, top_mlp)
+                dense = torch.randn(B, NUM_DIM, dtype=value_dtype)
+                tol = {
+                    torch.bfloat16: {"rtol": 2e-2, "atol": 2e-2},
+                    torch.int8: {"rtol": 2e-2, "atol": 0.2},
+                }.get(dtype, {})
+                with torch.no_grad():
+                    ref_out = ref_m(indices, offsets, dense)
+                    self.assertEqual(m(indices, offsets, dense), ref_out, **tol)
+                    # the interaction buffers are reused by the next call
+                    m.merged_emb.top_mlp = None
+                    ref_m.top_mlp = None
+                    ref_out = ref_m(indices, offsets, dense)
+                    out = m(indices, offsets, dense)
+                    self.assertEqual(out, ref_out, **tol)
+                    data_ptr = out.data_ptr()
+                    out = m(indices, offsets, dense)
+                    self.assertEqual(out.data_ptr(), data_ptr)
+                    self.assertEqual(out, ref_out, **tol)
+                    # a smaller batch reallocates the buffers
+                    ref_out = ref_m(
+                        [
+                            index[: self.multi_hot[i] * 8]
+                            for i, index in enumerate(indices)
+                        ],
+                        [offset[:8] for offset in offsets],
+                        dense[:8],
+                    )
+                    out = m(
+                        [
+                            index[: self.multi_hot[i] * 8]
+                            for i, index in enumerate(indices)
+                        ],
+                        [offset[:8] for offset in offsets],
+                        dense[:8],
+                    )
+                    self.assertEqual(out, ref_out, **tol)
+        with self.assertRaisesRegex(RuntimeError, "torch.no_grad"):
+            m(indices, offsets, dense)
+        with torch.inference_mode():
+            ref_out = ref_m(indices, offsets, dense)
+            self.assertEqual(m(indices, offsets, dense), ref_out, **tol)
+
+    def test_index_dedup(self):
+        B = 256
+        NUM_TABLE = 26
+        NUM_DIM = 128
+        for include_last_offset, index_type in [
+            (True, torch.int64),
+            (False, torch.int64),
+            (False, torch.int32),
+        ]:
+            n_offset = B + 1 if include_last_offset else B
+            # few rows to have many repeated indices in a batch
+            indices = [
+                torch.randint(50, (B * self.multi_hot[i],)).to(index_type)
+                for i in range(NUM_TABLE)
+            ]
+            offsets = [
+                torch.arange(0, n_offset * self.multi_hot[i], self.multi_hot[i]).to(
+                    index_type
+                )
+                for i in range(NUM_TABLE)
+            ]
+            for dtype in [torch.float32, torch.bfloat16]:
+                emb_list = EmbeddingBagList(
+                    NUM_TABLE,
+                    NUM_DIM,
+                    torch.float32,
+                    include_last_offset=include_last_offset,
+                )
+                for m in [
+                    MergedEmb(copy.deepcopy(emb_list)),
+                    MergedEmbSGD(copy.deepcopy(emb_list), lr=0.1, weight_decay=0.01),
+                    MergedEmbAdaGrad(copy.deepcopy(emb_list), lr=0.1),
+                ]:
+                    if dtype == torch.bfloat16:
+                        if isinstance(m, MergedEmb):
+                            continue
+                        m.merged_emb.to_bfloat16_train()
+                    dedup_m = copy.deepcopy(m)
+                    dedup_m.merged_emb.index_dedup = True
+                    with torch.no_grad():
+                        self.assertEqual(dedup_m(indices, offsets), m(indices, offsets))
+                    for _ in range(2):
+                        out = m(indices, offsets)
+                        dedup_out = dedup_m(indices, offsets)
+                        self.assertEqual(dedup_out, out)
+                        sum(out).sum().backward()
+                        sum(dedup_out).sum().backward()
+                    for weight, dedup_weight in zip(
+                        m.merged_emb.weights, dedup_m.merged_emb.weights
+                    ):
+                        self.assertEqual(dedup_weight, weight)
+                        self.assertEqual(dedup_weight.grad, weight.grad)
+                    if isinstance(m, MergedEmb):
+                        continue
+                    args = "sgd_args" if isinstance(m, MergedEmbSGD) else "adagrad_args"
+                    ref_args = getattr(m.merged_emb, args)
+                    dedup_args = getattr(dedup_m.merged_emb, args)
+                    self.assertEqual(dedup_args.bf16_trail, ref_args.bf16_trail)
+                    if isinstance(m, MergedEmbAdaGrad):
+                        self.assertEqual(dedup_args.hessian, ref_args.hessian)
+
+        # the tables with fewer rows than indices mark their hit rows instead
+        # of sorting the indices
+        indices = [torch.randint(50, (B,)), torch.randint(50, (B,)).int()]
+        rows, remapped = ipex.nn.modules.merged_embeddingbag.dedup_indices(indices)
+        for num_embeddings in [[50, 50], [B, 2 * B]]:
+            self.assertEqual(
+                ipex.nn.modules.merged_embeddingbag.dedup_indices(
+                    indices, num_embeddings
+                ),
+                (rows, remapped),
+            )
+        for index, unique, remapped_index in zip(indices, rows, remapped):
+            self.assertEqual(unique.dtype, torch.int64)
+            self.assertEqual(remapped_index.dtype, index.dtype)
+            self.assertEqual(unique[remapped_index], index, exact_dtype=False)
+
     def test_training(self):
         B = 1029
         NUM_TABLE = 26
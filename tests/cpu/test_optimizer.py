@@ -313,6 +313,197 @@ class TestOptimizers(TestCase):
                 M, adam, dtype, split_master_weight_for_bf16, set_to_none, fused
             )
 
+    def test_flat_buffer_update(self):
+        options = itertools.product(
+            [
+                (torch.optim.SGD, {"lr": 0.01, "momentum": 0.9, "weight_decay": 0.1}),
+                (torch.optim.Adagrad, {"lr": 0.01, "weight_decay": 0.1}),
+                (torch.optim.Adam, {"lr": 0.01, "amsgrad": True}),
+                (ipex.optim._lamb.Lamb, {"lr": 0.01, "weight_decay": 0.1}),
+                (ipex.optim._lars.Lars, {"lr": 0.01, "momentum": 0.9}),
+            ],
+            [torch.float, torch.bfloat16],
+            [True, False],
+            [True, False],
+        )
+        for (
+            (optimizer_cls, kwargs),
+            dtype,
+            split_master_weight_for_bf16,
+            weights_prepack,
+        ) in options:
+            M = TestModule()
+            models, optimizers = [], []
+            for flat_buffer_update in [False, True]:
+                model = copy.deepcopy(M)
+                model, optimizer = ipex.optimize(
+                    model,
+                    dtype=dtype,
+                    optimizer=optimizer_cls(model.parameters(), **kwargs),
+                    split_master_weight_for_bf16=split_master_weight_for_bf16,
+                    weights_prepack=weights_prepack,
+                    flat_buffer_update=flat_buffer_update,
+                )
+                for _ in range(3):
+                    with torch.cpu.amp.autocast(enabled=True, dtype=dtype):
+                        y = model(*model.input).sum()
+                    optimizer.zero_grad()
+                    y.backward()
+                    optimizer.step()
+                models.append(model)
+                optimizers.append(optimizer)
+            self.assertTrue(hasattr(optimizers[1], "_flat_groups"))
+            self.assertEqual(models[0].state_dict(), models[1].state_dict())
+            ref_state, flat_state = (o.state_dict() for o in optimizers)
+            self.assertEqual(ref_state["state"], flat_state["state"])
+
+            # resume the flat buffer optimizer from the per param states
+            optimizers[1].load_state_dict(ref_state)
+            for model, optimizer in zip(models, optimizers):
+                with torch.cpu.amp.autocast(enabled=True, dtype=dtype):
+                    y = model(*model.input).sum()
+                optimizer.zero_grad()
+                y.backward()
+                optimizer.step()
+            self.assertEqual(models[0].state_dict(), models[1].state_dict())
+
+    def test_flat_buffer_update_without_grad(self):
+        class Model(torch.nn.Module):
+            def __init__(self):
+                super(Model, self).__init__()
+                self.linear1 = torch.nn.Linear(8, 8)
+                self.linear2 = torch.nn.Linear(8, 8)
+                self.head = torch.nn.Linear(8, 4)
+                self.unused = torch.nn.Linear(8, 4)
+
+            def forward(self, x, use_linear2):
+                x = self.linear1(x)
+                if use_linear2:
+                    x = self.linear2(x)
+                return self.head(x)
+
+        for optimizer_cls, kwargs in [
+            (torch.optim.SGD, {"lr": 0.01, "momentum": 0.9, "weight_decay": 0.1}),
+            (torch.optim.Adagrad, {"lr": 0.01, "weight_decay": 0.1}),
+            (torch.optim.Adam, {"lr": 0.01, "weight_decay": 0.1}),
+            (ipex.optim._lamb.Lamb, {"lr": 0.01, "weight_decay": 0.1}),
+            (ipex.optim._lars.Lars, {"lr": 0.01, "momentum": 0.9}),
+        ]:
+            M = Model()
+            models = []
+            for flat_buffer_update in [False, True]:
+                model = copy.deepcopy(M)
+                model, optimizer = ipex.optimize(
+                    model,
+                    optimizer=optimizer_cls(model.parameters(), **kwargs),
+                    weights_prepack=False,
+                    flat_buffer_update=flat_buffer_update,
+                )
+                torch.manual_seed(0)
+                for i in range(4):
+                    optimizer.zero_grad()
+                    model(torch.randn(2, 8), use_linear2=i % 2 == 0).sum().backward()
+                    optimizer.step()
+                models.append(model)
+            # params without grad are not updated, e.g. by the weight decay
+            self.assertEqual(models[1].unused.weight, M.unused.weight)
+            self.assertEqual(models[1].unused.bias, M.unused.bias)
+            self.assertEqual(models[0].state_dict(), models[1].state_dict())
+
+    def _fit_regression(self, model, optimizer, dtype, steps=200):
+        torch.manual_seed(1)
+        x = torch.randn(256, 64)
+        y = x @ torch.randn(64, 8)
+        for _ in range(steps):
+            with torch.cpu.amp.autocast(
+                enabled=dtype == torch.bfloat16, dtype=torch.bfloat16
+            ):
+                loss = torch.nn.functional.mse_loss(model(x).float(), y)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+        return loss.item()
+
+    def test_low_precision_state(self):
+        options = itertools.product(
+            [
+                (torch.optim.Adam, {"lr": 0.01}),
+                (torch.optim.Adam, {"lr": 0.01, "amsgrad": True}),
+                (ipex.optim._lamb.Lamb, {"lr": 0.01}),
+            ],
+            [torch.float, torch.bfloat16],
+        )
+        for (optimizer_cls, kwargs), dtype in options:
+            losses = {}
+            for state_dtype in [None, torch.bfloat16, torch.int8]:
+                torch.manual_seed(0)
+                model = torch.nn.Linear(64, 8)
+                model, optimizer = ipex.optimize(
+                    model,
+                    dtype=dtype,
+                    optimizer=optimizer_cls(model.parameters(), **kwargs),
+                    optimizer_state_dtype=state_dtype,
+                )
+                losses[state_dtype] = self._fit_regression(model, optimizer, dtype)
+                if state_dtype is None:
+                    continue
+                for state in optimizer.state_dict()["state"].values():
+                    if state_dtype == torch.int8:
+                        self.assertEqual(state["exp_avg"].dtype, torch.int8)
+                        self.assertEqual(state["exp_avg_sq"].dtype, torch.uint8)
+                        self.assertTrue("exp_avg_absmax" in state)
+                    else:
+                        self.assertEqual(state["exp_avg"].dtype, torch.bfloat16)
+                        self.assertEqual(state["exp_avg_sq"].dtype, torch.bfloat16)
+
+                # resume from the low precision states
+                optimizer.load_state_dict(optimizer.state_dict())
+                self._fit_regression(model, optimizer, dtype, steps=1)
+            # converges as with float states
+            for state_dtype in [torch.bfloat16, torch.int8]:
+                self.assertLess(losses[state_dtype], 1.1 * losses[None])
+
+    def test_low_precision_state_quantization(self):
+        from intel_extension_for_pytorch.optim._low_precision_state import (
+            dequantize_8bit,
+            quantize_8bit,
+        )
+
+        torch.manual_seed(0)
+        # moments of several orders of magnitude in a block
+        value = torch.randn(1000) * torch.logspace(-3, 0, 1000)
+        for signed, x in [(True, value), (False, value.square())]:
+            quantized, absmax = quantize_8bit(x, signed)
+            self.assertEqual(quantized.dtype, torch.int8 if signed else torch.uint8)
+            self.assertEqual(quantized.numel(), x.numel())
+            self.assertEqual(absmax.numel(), 4)
+            dequantized = dequantize_8bit(quantized, absmax)
+            block_max = absmax.repeat_interleave(256)[: x.numel()]
+            self.assertTrue(((dequantized - x).abs() <= 0.05 * block_max).all())
+            # the stochastic rounding is unbiased in average
+            average = torch.stack(
+                [dequantize_8bit(*quantize_8bit(x, signed)) for _ in range(200)]
+            ).mean(0)
+            self.assertTrue(((average - x).abs() <= 0.01 * block_max).all())
+
+    @unittest.skipIf(
+        not hasattr(core, "tpp_fused_adamw"), "TPP optimizers are not built"
+    )
+    def test_tpp_low_precision_state(self):
+        for optimizer_cls in [ipex.cpu.tpp.optim.AdamW, ipex.cpu.tpp.optim.Lamb]:
+            losses = {}
+            for state_dtype in [None, torch.bfloat16, torch.int8]:
+                torch.manual_seed(0)
+                model = torch.nn.Linear(64, 8)
+                optimizer = optimizer_cls(
+                    model.parameters(), lr=0.01, state_dtype=state_dtype
+                )
+                losses[state_dtype] = self._fit_regression(
+                    model, optimizer, torch.float
+                )
+            for state_dtype in [torch.bfloat16, torch.int8]:
+                self.assertLess(losses[state_dtype], 1.1 * losses[None])
+
     def test_grad_scaling_unscale(self):
         inv_scale = torch.full((1,), 0.25, dtype=torch.float)
         found_inf = torch.full((1,), 0.0, dtype=torch.float)
@@ -1,7 +1,11 @@
 import unittest
 from common_utils import TestCase
 import os
+import json
 import subprocess
+import tempfile
+import torch
+import intel_extension_for_pytorch as ipex
 
 
 class TestProfiler(TestCase):
@@ -21,6 +25,83 @@ class TestProfiler(TestCase):
                     num = num + 1
         assert num == 2, "IPEX op profiling info not found."
 
+    def test_module_profiler(self):
+        class _IPEXBlock(torch.nn.Module):
+            def __init__(self):
+                super().__init__()
+                self.fc1 = torch.nn.Linear(64, 128)
+                self.fc2 = torch.nn.Linear(128, 64)
+
+            def forward(self, x):
+                return self.fc2(torch.relu(self.fc1(x)))
+
+        class M(torch.nn.Module):
+            def __init__(self):
+                super().__init__()
+                self.block = _IPEXBlock()
+                self.head = torch.nn.Linear(64, 8)
+
+            def forward(self, x):
+                return self.head(self.block(x) + x)
+
+        model = M().eval()
+        x = torch.randn(4, 8, 64)
+        with torch.no_grad(), ipex.profiler.profile(model) as prof:
+            model(x)
+
+        modules = {s["name"]: s for s in prof.key_averages("module")}
+        self.assertEqual(modules["block.fc1"]["gemm"], {(32, 64, 128)})
+        self.assertEqual(modules["block.fc2"]["gemm"], {(32, 128, 64)})
+        self.assertEqual(modules["head"]["gemm"], {(32, 64, 8)})
+        self.assertTrue(modules["head"]["gflops"] > 0)
+        # the self time of the block excludes its linear layers
+        self.assertLess(modules["block"]["self_us"], modules["block"]["total_us"])
+        self.assertLessEqual(
+            modules["block"]["self_us"],
+            modules["block"]["total_us"]
+            - modules["block.fc1"]["total_us"]
+            - modules["block.fc2"]["total_us"]
+            + 1e-3,
+        )
+        types = [s["name"] for s in prof.key_averages("module_type")]
+        self.assertTrue("_IPEXBlock" in types and "Linear" in types)
+        # ops run inside the annotated block are attributed to it
+        ops = [s["name"] for s in prof.key_averages("op_block")]
+        self.assertTrue("aten::relu [block]" in ops)
+        # the bandwidth of ops comes from their input shapes and dtypes
+        op_stats = {s["name"]: s for s in prof.key_averages("op")}
+        self.assertEqual(
+            op_stats["aten::relu"]["bytes"],
+            32 * 128 * 4 * op_stats["aten::relu"]["calls"],
+        )
+        self.assertTrue(op_stats["aten::addmm"]["gbps"] > 0)
+        self.assertTrue("Total ms" in prof.table("op"))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "trace.json")
+            prof.export_chrome_trace(path)
+            with open(path) as f:
+                events = json.load(f)["traceEvents"]
+        self.assertTrue(
+            any(e["cat"] == "module" and e["name"] == "block.fc1" for e in events)
+        )
+        self.assertTrue(any(e["cat"] == "op" for e in events))
+
+    def test_module_profiler_without_shapes(self):
+        model = torch.nn.Sequential(torch.nn.Linear(16, 32), torch.nn.ReLU()).eval()
+        x = torch.randn(4, 16)
+        with torch.no_grad(), ipex.profiler.profile(model, record_shapes=False) as prof:
+            model(x)
+        ops = {s["name"]: s for s in prof.key_averages("op")}
+        # GEMM shapes, FLOPs and op bytes need the recorded shapes
+        self.assertEqual(ops["aten::addmm"]["gemm"], set())
+        self.assertEqual(ops["aten::addmm"]["flops"], 0)
+        self.assertEqual(ops["aten::addmm"]["bytes"], 0)
+        modules = {s["name"]: s for s in prof.key_averages("module")}
+        # the modules are measured by their hooks
+        self.assertEqual(modules["0"]["gemm"], {(4, 16, 32)})
+        self.assertTrue("Self ms" in prof.table("module"))
+
 
 if __name__ == "__main__":
     test = unittest.main()
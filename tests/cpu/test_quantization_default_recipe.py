@@ -525,6 +525,144 @@ class TestDefaultRecipe(JitLlgaTestCase):
                 for n in graph.nodes():
                     assert n.kind() != "aten::mul"
 
+    def test_merge_observer_state(self):
+        class Mod(nn.Module):
+            def __init__(self):
+                super().__init__()
+                self.dense = nn.Linear(4, 4)
+                self.relu = nn.ReLU()
+                self.dense2 = nn.Linear(4, 4)
+
+            def forward(self, x):
+                return self.dense2(self.relu(self.dense(x)))
+
+        m = Mod().eval()
+        x = torch.rand(1, 4)
+        calib_dataset = [torch.rand(1, 4) for _ in range(6)]
+        # min/max statistics merge exactly, histograms only approximately
+        static_qconfig = QConfig(
+            activation=MinMaxObserver.with_args(
+                qscheme=torch.per_tensor_affine, dtype=torch.quint8
+            ),
+            weight=PerChannelMinMaxObserver.with_args(
+                dtype=torch.qint8, qscheme=torch.per_channel_symmetric
+            ),
+        )
+        for qconfig_mapping in [
+            QConfigMapping().set_global(static_qconfig),
+            ipex.quantization.get_smooth_quant_qconfig_mapping(
+                act_observer=torch.ao.quantization.MinMaxObserver
+            ),
+        ]:
+            ref_model, *shards, merged_model = [
+                prepare(m, qconfig_mapping, example_inputs=x, inplace=False)
+                for _ in range(4)
+            ]
+            for i, data in enumerate(calib_dataset):
+                ref_model(data)
+                shards[i % 2](data)
+            for shard in shards:
+                with tempfile.NamedTemporaryFile() as fp:
+                    torch.save(ipex.quantization.get_observer_state(shard), fp.name)
+                    ipex.quantization.merge_observer_state(merged_model, fp.name)
+            parallel_model = prepare(
+                m, qconfig_mapping, example_inputs=x, inplace=False
+            )
+            ipex.quantization.calibrate_in_parallel(
+                parallel_model,
+                calib_dataset,
+                cpu_pools=[
+                    ipex.cpu.runtime.CPUPool(core_ids=[0]),
+                    ipex.cpu.runtime.CPUPool(core_ids=[0]),
+                ],
+            )
+
+            for model in [merged_model, parallel_model]:
+                with tempfile.NamedTemporaryFile() as ref_fp, tempfile.NamedTemporaryFile() as fp:
+                    ref_model.save_qconf_summary(qconf_summary=ref_fp.name)
+                    model.save_qconf_summary(qconf_summary=fp.name)
+                    self.assertEqual(ref_fp.read(), fp.read())
+
+    def test_calibrate_in_parallel_default_pools(self):
+        from utils.cpuinfo import construct_sysfs_tree
+        from intel_extension_for_pytorch.cpu.launch import CPUPoolList
+        from intel_extension_for_pytorch.quantization._calibration import (
+            _numa_node_core_ids,
+        )
+
+        # 2 sockets with 2 sub-NUMA clusters each, one worker per node
+        with tempfile.TemporaryDirectory() as sysfs_root:
+            construct_sysfs_tree(sysfs_root, 4, 4, n_nodes_per_socket=2)
+            cpuinfo = CPUPoolList(sysfs_root=sysfs_root)
+        self.assertEqual(len(set(c.socket for c in cpuinfo.pool_all)), 2)
+        self.assertEqual(
+            _numa_node_core_ids(cpuinfo),
+            [list(range(n * 4, (n + 1) * 4)) for n in range(4)],
+        )
+
+    def test_tune_smooth_quant_alpha(self):
+        class Mod(nn.Module):
+            def __init__(self):
+                super().__init__()
+                self.q_proj = nn.Linear(8, 8)
+                self.k_proj = nn.Linear(8, 8)
+                self.dense = nn.Linear(8, 8)
+
+            def forward(self, x):
+                x = x * torch.tensor([20.0] + [1.0] * 7)
+                return self.dense(self.q_proj(x) + self.k_proj(x))
+
+        m = Mod().eval()
+        x = torch.rand(2, 8)
+        calib_dataset = [torch.rand(2, 8) for _ in range(4)]
+        qconfig_mapping = ipex.quantization.get_smooth_quant_qconfig_mapping()
+        prepared_model = prepare(m, qconfig_mapping, example_inputs=x, inplace=False)
+        for data in calib_dataset:
+            prepared_model(data)
+        with tempfile.NamedTemporaryFile() as fp:
+            torch.save(ipex.quantization.get_observer_state(prepared_model), fp.name)
+            prepared_model = prepare(
+                m, qconfig_mapping, example_inputs=x, inplace=False
+            )
+            alphas = [0.3, 0.5, 0.7]
+            result = ipex.quantization.tune_smooth_quant_alpha(
+                prepared_model, calib_dataset[:2], alphas=alphas, statistics=fp.name
+            )
+        # q_proj and k_proj share the activation, so the alpha
+        self.assertEqual(len(result["layer_alpha"]), 2)
+        self.assertEqual(result["alpha"], result["layer_alpha"])
+        self.assertEqual(list(result["proxy_loss"].keys()), alphas)
+        self.assertEqual(
+            result["global_alpha"],
+            min(alphas, key=lambda alpha: result["proxy_loss"][alpha]),
+        )
+        quant_state = prepared_model._fqn_to_auto_quant_state_map[" "]
+        for obs in quant_state.weight_tensor_id_to_observer.values():
+            self.assertTrue(obs.alpha in alphas)
+
+        # proxy_inputs do not change the activation statistics
+        state = ipex.quantization.get_observer_state(prepared_model)
+        result = ipex.quantization.tune_smooth_quant_alpha(
+            prepared_model,
+            calib_dataset[:2],
+            alphas=alphas,
+            per_layer=False,
+            eval_func=lambda model: 0.0,
+            top_k=2,
+        )
+        self.assertTrue(result["alpha"] in alphas)
+        self.assertTrue(result["global_alpha"] in alphas)
+        for key, obs_state in ipex.quantization.get_observer_state(
+            prepared_model
+        ).items():
+            if key[1] == "act":
+                self.assertEqual(obs_state["state_dict"], state[key]["state_dict"])
+        converted_model = convert(prepared_model)
+        with torch.no_grad():
+            traced_model = torch.jit.trace(converted_model, x)
+            traced_model = torch.jit.freeze(traced_model)
+            traced_model(x)
+
     def test_smooth_quant_share_weight_observers(self):
         class Mod(nn.Module):
             def __init__(self):
@@ -641,6 +641,50 @@ class TestModuleMultiStreamModuleHint(TestCase):
         self.assertEqual(y_ref, y_runtime_res)
 
 
+class TestServingAdapter(TestCase):
+    @unittest.skipIf(
+        not ipex.cpu.runtime.is_runtime_ext_enabled(),
+        "Skip when IPEX Runtime extension is not enabled",
+    )
+    @runtime_thread_affinity_test_env
+    def test_serving_adapter(self):
+        model = SimpleNet()
+        model.eval()
+        cpu_pool = ipex.cpu.runtime.CPUPool(node_id=0)
+        adapter = ipex.cpu.runtime.ServingAdapter(
+            model,
+            {"x": ((64, 3, 3), torch.float32)},
+            max_batch_size=8,
+            num_streams=2,
+            cpu_pool=cpu_pool,
+        )
+        batch_sizes = [1, 3, 2]
+        xs = [torch.rand(bs, 64, 3, 3) for bs in batch_sizes]
+        requests = [
+            {"x": xs[0]},
+            {"x": torch.utils.dlpack.to_dlpack(xs[1])},
+            {"x": xs[2].numpy()},
+        ]
+        y = model(torch.cat(xs))
+        for _ in range(3):
+            # the buffer slots are reused across calls
+            ys = adapter(requests[:1] + [{"x": xs[1]}] + requests[2:])
+            self.assertEqual(torch.cat(ys), y)
+        ys = adapter(requests)
+        self.assertEqual([y.shape[0] for y in ys], batch_sizes)
+        self.assertEqual(torch.cat(ys), y)
+
+        # a single contiguous request is not copied
+        ys = adapter([{"x": xs[1]}])
+        self.assertEqual(ys[0], model(xs[1]))
+
+        timing = adapter.get_timing()
+        self.assertEqual(set(timing.keys()), {"gather", "compute", "scatter"})
+        self.assertEqual(timing["compute"]["count"], 5)
+        adapter.reset_timing()
+        self.assertEqual(adapter.get_timing(), {})
+
+
 def is_numactl_available():
     numactl_available = False
     cmd = ["numactl", "-C", "0", "-m", "0", "ls"]
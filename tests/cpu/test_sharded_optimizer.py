@@ -0,0 +1,145 @@
+import os
+import tempfile
+import unittest
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import intel_extension_for_pytorch as ipex
+from common_utils import TestCase
+
+WORLD_SIZE = 2
+
+
+class Model(torch.nn.Module):
+    def __init__(self):
+        super(Model, self).__init__()
+        self.linear1 = torch.nn.Linear(16, 33)
+        self.linear2 = torch.nn.Linear(33, 4)
+        # gets no grad, so is not updated
+        self.unused = torch.nn.Linear(4, 4)
+        # not contiguous, so it cannot be sharded
+        self.transposed = torch.nn.Parameter(torch.randn(4, 4).t())
+
+    def forward(self, x, use_transposed=True):
+        y = self.linear2(torch.relu(self.linear1(x)))
+        return torch.mm(y, self.transposed.to(y.dtype)) if use_transposed else y
+
+
+def _make(optimizer_cls, dtype, split):
+    kwargs = {"momentum": 0.9} if optimizer_cls is torch.optim.SGD else {}
+    torch.manual_seed(0)
+    model = Model()
+    optimizer = optimizer_cls(model.parameters(), lr=0.01, weight_decay=0.01, **kwargs)
+    return ipex.optimize(
+        model,
+        dtype=dtype,
+        optimizer=optimizer,
+        weights_prepack=False,
+        split_master_weight_for_bf16=split,
+    )
+
+
+def _train_step(model, optimizer, x, reduce_grads=False, use_transposed=None):
+    optimizer.zero_grad()
+    if use_transposed is None:
+        # the param which cannot be sharded only gets a grad on rank 0
+        use_transposed = dist.get_rank() == 0
+    model(x, use_transposed).float().mean().backward()
+    if reduce_grads:
+        for p in model.parameters():
+            # the ranks without grad contribute zeros, a param without grad
+            # on all ranks is not updated
+            has_grad = torch.tensor([p.grad is not None], dtype=torch.int32)
+            dist.all_reduce(has_grad)
+            if has_grad.item():
+                if p.grad is None:
+                    p.grad = torch.zeros_like(p)
+                dist.all_reduce(p.grad)
+                p.grad.div_(WORLD_SIZE)
+    optimizer.step()
+
+
+def _run_rank(rank, port, optimizer_cls, dtype, split, checkpoint_dir):
+    os.environ["MASTER_ADDR"] = "127.0.0.1"
+    os.environ["MASTER_PORT"] = str(port)
+    dist.init_process_group("gloo", rank=rank, world_size=WORLD_SIZE)
+    try:
+        model, optimizer = _make(optimizer_cls, dtype, split)
+        ipex.cpu.comm.shard_optimizer_states(optimizer)
+        if dtype == torch.float:
+            # the bf16 weights may be made contiguous by ipex.optimize
+            assert any(others for _, others in optimizer._shard_groups)
+        ref_model, ref_optimizer = _make(optimizer_cls, dtype, split)
+        # the norms of Lamb are summed over the shards in another order
+        tol = {"rtol": 1e-5, "atol": 1e-6} if dtype == torch.float else {}
+        torch.manual_seed(rank)
+        for _ in range(3):
+            x = torch.randn(8, 16, dtype=dtype)
+            _train_step(model, optimizer, x)
+            _train_step(ref_model, ref_optimizer, x, reduce_grads=True)
+            for p, ref_p in zip(model.parameters(), ref_model.parameters()):
+                torch.testing.assert_close(p, ref_p, **tol)
+        with ipex.cpu.comm.gather_master_weights(optimizer):
+            state_dict = model.state_dict()
+        for key, value in ref_model.state_dict().items():
+            torch.testing.assert_close(state_dict[key], value, **tol)
+        torch.manual_seed(0)
+        torch.testing.assert_close(state_dict["unused.weight"], Model().unused.weight)
+
+        # resume from the shards of the optimizer states
+        path = os.path.join(checkpoint_dir, f"optimizer_rank{rank}.pt")
+        torch.save(optimizer.state_dict(), path)
+        resumed_model, resumed_optimizer = _make(optimizer_cls, dtype, split)
+        ipex.cpu.comm.shard_optimizer_states(resumed_optimizer)
+        resumed_optimizer.load_state_dict(torch.load(path))
+        # the weight of the param which cannot be sharded is not in the
+        # shards, it is restored with the model state dict
+        x = torch.randn(8, 16, dtype=dtype)
+        _train_step(resumed_model, resumed_optimizer, x, use_transposed=False)
+        _train_step(
+            ref_model, ref_optimizer, x, reduce_grads=True, use_transposed=False
+        )
+        ref_params = dict(ref_model.named_parameters())
+        for name, p in resumed_model.named_parameters():
+            if name != "transposed":
+                torch.testing.assert_close(p, ref_params[name], **tol)
+    finally:
+        dist.destroy_process_group()
+
+
+class TestShardedOptimizer(TestCase):
+    def _test(self, port, optimizer_cls, dtype, split):
+        with tempfile.TemporaryDirectory() as checkpoint_dir:
+            mp.spawn(
+                _run_rank,
+                args=(port, optimizer_cls, dtype, split, checkpoint_dir),
+                nprocs=WORLD_SIZE,
+                join=True,
+            )
+
+    @unittest.skipIf(not dist.is_gloo_available(), "gloo is not available")
+    def test_sharded_adam(self):
+        self._test(29521, torch.optim.Adam, torch.float, False)
+        self._test(29522, torch.optim.Adam, torch.bfloat16, True)
+        self._test(29523, torch.optim.Adam, torch.bfloat16, False)
+
+    @unittest.skipIf(not dist.is_gloo_available(), "gloo is not available")
+    def test_sharded_lamb(self):
+        from intel_extension_for_pytorch.optim._lamb import Lamb
+
+        self._test(29524, Lamb, torch.float, False)
+        self._test(29525, Lamb, torch.bfloat16, True)
+
+    @unittest.skipIf(not dist.is_gloo_available(), "gloo is not available")
+    def test_sharded_adagrad(self):
+        self._test(29527, torch.optim.Adagrad, torch.float, False)
+        self._test(29528, torch.optim.Adagrad, torch.bfloat16, True)
+
+    @unittest.skipIf(not dist.is_gloo_available(), "gloo is not available")
+    def test_sharded_sgd(self):
+        self._test(29526, torch.optim.SGD, torch.bfloat16, True)
+
+
+if __name__ == "__main__":
+    test = unittest.main()
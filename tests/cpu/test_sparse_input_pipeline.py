@@ -0,0 +1,221 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import numpy as np
+import torch
+import intel_extension_for_pytorch as ipex
+from intel_extension_for_pytorch.nn.modules import SparseInputPipeline
+from common_utils import TestCase
+
+
+class SlowSamples(object):
+    # an iterable dataset recording the threads reading it
+    def __init__(self, samples, delay=0.0):
+        self.samples = samples
+        self.delay = delay
+        self.threads = set()
+
+    def __iter__(self):
+        for sample in self.samples:
+            self.threads.add(threading.get_ident())
+            time.sleep(self.delay)
+            yield sample
+
+
+class TestSparseInputPipeline(TestCase):
+    num_embeddings = [10, 100, 1000]
+
+    def _samples(self, num_samples, multi_hot=False):
+        samples = []
+        for s in range(num_samples):
+            sample = []
+            for table in range(len(self.num_embeddings)):
+                if multi_hot:
+                    # a ragged number of ids per sample, including empty bags
+                    sample.append(list(range(s, s + (s + table) % 4)))
+                else:
+                    sample.append(s * 37 + table)
+            samples.append(sample)
+        return samples
+
+    def _reference(self, samples, include_last_offset):
+        indices = []
+        offsets = []
+        for table, num_embeddings in enumerate(self.num_embeddings):
+            ids = [
+                [sample[table]] if isinstance(sample[table], int) else sample[table]
+                for sample in samples
+            ]
+            lengths = torch.tensor([0] + [len(i) for i in ids])
+            offset = lengths.cumsum(0)
+            if not include_last_offset:
+                offset = offset[:-1]
+            indices.append(torch.tensor(sum(ids, []), dtype=torch.int64))
+            indices[-1] = indices[-1] % num_embeddings
+            offsets.append(offset)
+        return indices, offsets
+
+    def test_iterable(self):
+        for multi_hot in [False, True]:
+            for include_last_offset in [False, True]:
+                for num_workers in [1, 3]:
+                    samples = self._samples(50, multi_hot)
+                    dataset = SlowSamples(samples)
+                    pipeline = SparseInputPipeline(
+                        dataset,
+                        self.num_embeddings,
+                        batch_size=8,
+                        include_last_offset=include_last_offset,
+                        num_workers=num_workers,
+                        num_buffers=4,
+                    )
+                    batches = [
+                        ([i.clone() for i in indices], [o.clone() for o in offsets])
+                        for indices, offsets in pipeline
+                    ]
+                    # the last batch is smaller
+                    self.assertEqual(len(batches), 7)
+                    self.assertNotIn(threading.get_ident(), dataset.threads)
+                    for b, (indices, offsets) in enumerate(batches):
+                        ref_indices, ref_offsets = self._reference(
+                            samples[b * 8 : (b + 1) * 8], include_last_offset
+                        )
+                        self.assertEqual(indices, ref_indices)
+                        self.assertEqual(offsets, ref_offsets)
+
+                    pipeline.drop_last = True
+                    self.assertEqual(len(list(iter(pipeline))), 6)
+
+    def test_binary(self):
+        multi_hot = [1, 3, 2]
+        rows = np.random.randint(0, 1 << 30, (37, sum(multi_hot))).astype(np.int32)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "sparse.bin")
+            rows.tofile(path)
+            for hashing in ["modulo", "hash", None]:
+                for index_dtype in [torch.int32, torch.int64]:
+                    pipeline = SparseInputPipeline(
+                        path,
+                        self.num_embeddings,
+                        batch_size=10,
+                        multi_hot=multi_hot,
+                        hashing=hashing,
+                        index_dtype=index_dtype,
+                        num_workers=2,
+                    )
+                    self.assertEqual(len(pipeline), 4)
+                    n_batches = 0
+                    for b, (indices, offsets) in enumerate(pipeline):
+                        batch = torch.from_numpy(rows[b * 10 : (b + 1) * 10])
+                        column = 0
+                        for table, hot in enumerate(multi_hot):
+                            index = indices[table]
+                            self.assertEqual(index.dtype, index_dtype)
+                            self.assertEqual(offsets[table].dtype, index_dtype)
+                            self.assertEqual(
+                                offsets[table].long(),
+                                torch.arange(0, batch.shape[0] * hot, hot),
+                            )
+                            ids = batch[:, column : column + hot].reshape(-1)
+                            column += hot
+                            if hashing is None:
+                                self.assertEqual(index.long(), ids.long())
+                                continue
+                            self.assertTrue(
+                                (index >= 0).all()
+                                and (index < self.num_embeddings[table]).all()
+                            )
+                            if hashing == "modulo":
+                                self.assertEqual(
+                                    index.long(),
+                                    ids.long() % self.num_embeddings[table],
+                                )
+                        n_batches += 1
+                    self.assertEqual(n_batches, 4)
+            del pipeline
+
+    def test_double_buffering(self):
+        samples = self._samples(40)
+        pipeline = SparseInputPipeline(
+            SlowSamples(samples, delay=0.001), self.num_embeddings, batch_size=4
+        )
+        data_ptrs = []
+        it = iter(pipeline)
+        for b, (indices, offsets) in enumerate(it):
+            # the next batch is prepared while this one is used
+            time.sleep(0.01)
+            self.assertLessEqual(len(it.producer.ready), 1)
+            ref_indices, _ = self._reference(samples[b * 4 : (b + 1) * 4], False)
+            self.assertEqual(indices, ref_indices)
+            data_ptrs.append(indices[0].data_ptr())
+        # the buffers of the 2 slots are reused
+        self.assertEqual(len(set(data_ptrs)), 2)
+        self.assertEqual(data_ptrs[0::2], [data_ptrs[0]] * 5)
+
+    def test_error(self):
+        def samples():
+            yield from self._samples(10)
+            raise RuntimeError("broken sample")
+
+        pipeline = SparseInputPipeline(samples(), self.num_embeddings, batch_size=4)
+        it = iter(pipeline)
+        # the batches read before the failure are still yielded
+        next(it)
+        next(it)
+        with self.assertRaisesRegex(RuntimeError, "broken sample"):
+            next(it)
+
+    def test_error_of_later_batch(self):
+        class SlowSample(list):
+            def __getitem__(self, table):
+                time.sleep(0.01)
+                return super(SlowSample, self).__getitem__(table)
+
+        class BrokenSample(list):
+            def __getitem__(self, table):
+                raise RuntimeError("broken sample")
+
+        samples = [SlowSample(sample) for sample in self._samples(4)] + [
+            BrokenSample(sample) for sample in self._samples(4)
+        ]
+        pipeline = SparseInputPipeline(
+            samples, self.num_embeddings, batch_size=4, num_workers=2
+        )
+        it = iter(pipeline)
+        # a worker fails on the second batch while the other one still builds
+        # the first, which is yielded before the error is raised
+        indices, offsets = next(it)
+        self.assertEqual((indices, offsets), self._reference(self._samples(4), False))
+        with self.assertRaisesRegex(RuntimeError, "broken sample"):
+            next(it)
+
+    def test_merged_embeddingbag(self):
+        samples = self._samples(64, multi_hot=True)
+        emb_list = torch.nn.ModuleList(
+            [
+                torch.nn.EmbeddingBag(n, 16, mode="sum", include_last_offset=True)
+                for n in self.num_embeddings
+            ]
+        )
+        merged_emb = ipex.nn.modules.MergedEmbeddingBag.from_embeddingbag_list(emb_list)
+        pipeline = SparseInputPipeline(
+            samples,
+            self.num_embeddings,
+            batch_size=16,
+            include_last_offset=True,
+            num_workers=2,
+        )
+        with torch.no_grad():
+            for indices, offsets in pipeline:
+                outputs = merged_emb(indices, offsets)
+                for emb, index, offset, output in zip(
+                    emb_list, indices, offsets, outputs
+                ):
+                    self.assertEqual(output, emb(index, offset))
+
+
+if __name__ == "__main__":
+    test = unittest.main()
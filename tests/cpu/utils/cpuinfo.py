@@ -1,3 +1,5 @@
+import os
+
 # examples
 # mode 0
 # 0 p0 0 | 4 p4 1
@@ -127,6 +129,78 @@ def construct_numa_config(
     return "\n".join(ret)
 
 
+def construct_sysfs_tree(
+    root,
+    n_nodes,
+    n_phycores_per_node,
+    enable_ht=True,
+    n_l3_per_node=1,
+    maxmhz=5000.0,
+    l2_size="2048K",
+    l3_size="30M",
+    n_nodes_per_socket=1,
+):
+    # Fake /sys/devices/system tree, cpus are numbered like numa_mode 0 with
+    # all physical cores first. Each node has n_l3_per_node L3 domains of
+    # contiguous cores, each core has a private L2. A socket has
+    # n_nodes_per_socket nodes (sub-NUMA clustering).
+    n_threads = 2 if enable_ht else 1
+    n_phycores = n_nodes * n_phycores_per_node
+    n_cpus = n_phycores * n_threads
+    cores_per_l3 = n_phycores_per_node // n_l3_per_node
+
+    def write(path, txt):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(f"{txt}\n")
+
+    def cpus_of(cores):
+        return ",".join(
+            str(core + t * n_phycores) for t in range(n_threads) for core in cores
+        )
+
+    write(os.path.join(root, "cpu", "online"), f"0-{n_cpus - 1}")
+    for node in range(n_nodes):
+        cores = range(node * n_phycores_per_node, (node + 1) * n_phycores_per_node)
+        write(os.path.join(root, "node", f"node{node}", "cpulist"), cpus_of(cores))
+    for cpu in range(n_cpus):
+        core = cpu % n_phycores
+        node = core // n_phycores_per_node
+        l3 = core // cores_per_l3
+        cpu_dir = os.path.join(root, "cpu", f"cpu{cpu}")
+        write(
+            os.path.join(cpu_dir, "topology", "physical_package_id"),
+            node // n_nodes_per_socket,
+        )
+        write(
+            os.path.join(cpu_dir, "topology", "core_id"),
+            core % (n_phycores_per_node * n_nodes_per_socket),
+        )
+        write(
+            os.path.join(cpu_dir, "topology", "thread_siblings_list"), cpus_of([core])
+        )
+        write(os.path.join(cpu_dir, "cpufreq", "cpuinfo_max_freq"), int(maxmhz * 1000))
+        caches = [
+            (1, "Data", core, [core], "48K"),
+            (1, "Instruction", core, [core], "32K"),
+            (2, "Unified", core, [core], l2_size),
+            (
+                3,
+                "Unified",
+                l3,
+                range(l3 * cores_per_l3, (l3 + 1) * cores_per_l3),
+                l3_size,
+            ),
+        ]
+        for i, (level, cache_type, cache_id, shared, size) in enumerate(caches):
+            cache_dir = os.path.join(cpu_dir, "cache", f"index{i}")
+            write(os.path.join(cache_dir, "level"), level)
+            write(os.path.join(cache_dir, "type"), cache_type)
+            write(os.path.join(cache_dir, "id"), cache_id)
+            write(os.path.join(cache_dir, "shared_cpu_list"), cpus_of(shared))
+            write(os.path.join(cache_dir, "size"), size)
+
+
 if __name__ == "__main__":
     lscpu_txt = construct_numa_config(
         n_nodes=1,